@@ -0,0 +1 @@
+Add a `caches.max_cache_memory_usage` option to bound the total memory used by Synapse's caches.
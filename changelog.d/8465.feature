@@ -0,0 +1 @@
+Add a `caches.expiry_time` option to evict cache entries which have not been used for a while.
@@ -0,0 +1 @@
+Add an experimental `state_resolution.incremental` option to resolve state incrementally from a previous resolution.
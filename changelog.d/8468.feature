@@ -0,0 +1 @@
+Add a `state_resolution.processes` option to run v2 state resolution in a pool of worker processes.
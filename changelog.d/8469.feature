@@ -0,0 +1 @@
+Add an experimental `persist_events_batch_size` option to persist queued events for several rooms together.
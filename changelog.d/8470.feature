@@ -0,0 +1 @@
+Add an experimental `event_cache_json` option to hold events in the event cache as JSON, to reduce memory usage.
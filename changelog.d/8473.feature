@@ -0,0 +1 @@
+Add an experimental `stream_initial_sync_responses` option to stream initial `/sync` responses room by room.
@@ -0,0 +1 @@
+Add an `initial_sync_snapshots` option to reuse parts of users' previous initial syncs for rooms which have not changed.
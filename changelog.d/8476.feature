@@ -0,0 +1 @@
+Add a `notifier_wakeups` option to filter and coalesce the wakeups of clients waiting on `/sync` and `/events`.
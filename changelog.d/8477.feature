@@ -0,0 +1 @@
+Add a `sync_instances` option to shard sync workers by user ID with consistent hashing.
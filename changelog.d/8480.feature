@@ -0,0 +1 @@
+Add an experimental `push.defer_actions` option to compute push actions after events are persisted.
@@ -228,6 +228,27 @@ class FilterCollection:
     def filter_room_account_data(self, events):
         return self._room_account_data.filter(self._room_filter.filter(events))
 
+    def might_include_room_event(self, event, changes_unread_counts=False):
+        """Returns whether a new room event might change the response of an
+        incremental sync using this filter, judging by the event alone.
+
+        Args:
+            event (EventBase): The new event.
+            changes_unread_counts (bool): Whether the event changes the unread
+                counts sent for its room, even if it appears in neither the
+                timeline nor the state.
+
+        Returns:
+            bool
+        """
+        if not self._room_filter.check(event):
+            return False
+        if changes_unread_counts or self._room_timeline_filter.check(event):
+            return True
+        # State events filtered out of the timeline can still be sent as part of
+        # the state.
+        return event.is_state() and self._room_state_filter.check(event)
+
     def blocks_all_presence(self):
         return (
             self._presence_filter.filters_all_types()
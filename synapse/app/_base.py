@@ -33,6 +33,7 @@ from synapse.config.server import ListenerConfig
 from synapse.crypto import context_factory
 from synapse.logging.context import PreserveLoggingContext
 from synapse.util.async_helpers import Linearizer
+from synapse.util.caches.lrucache import setup_expire_lru_cache_entries
 from synapse.util.daemonize import daemonize_process
 from synapse.util.rlimit import change_resource_limit
 from synapse.util.versionstring import get_version_string
@@ -272,6 +273,9 @@ def start(hs: "synapse.server.HomeServer", listeners: Iterable[ListenerConfig]):
         hs.get_datastore().db_pool.start_profiling()
         hs.get_pusherpool().start()
 
+        # Periodically remove cache entries which have expired.
+        setup_expire_lru_cache_entries(hs)
+
         # Log when we start the shut down process.
         hs.get_reactor().addSystemEventTrigger(
             "before", "shutdown", logger.info, "Shutting down..."
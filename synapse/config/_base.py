@@ -128,7 +128,7 @@ class Config:
     def parse_size(value):
         if isinstance(value, int):
             return value
-        sizes = {"K": 1024, "M": 1024 * 1024}
+        sizes = {"K": 1024, "M": 1024 * 1024, "G": 1024 * 1024 * 1024}
         size = 1
         suffix = value[-1]
         if suffix in sizes:
@@ -869,4 +869,33 @@ class ShardedWorkerHandlingConfig:
         return self.instances[remainder]
 
 
-__all__ = ["Config", "RootConfig", "ShardedWorkerHandlingConfig"]
+@attr.s
+class ConsistentShardedWorkerHandlingConfig(ShardedWorkerHandlingConfig):
+    """Like `ShardedWorkerHandlingConfig`, but uses rendezvous hashing, so that
+    adding or removing an instance only moves the keys handled by that instance.
+
+    This suits work which builds up in-memory state for each key, such as the
+    notifier's streams for each user.
+    """
+
+    def get_instance(self, key: str) -> str:
+        if not self.instances:
+            return "master"
+
+        if len(self.instances) == 1:
+            return self.instances[0]
+
+        # Each instance gets a weight for the key, and the key goes to the
+        # instance with the highest weight.
+        def weight(instance: str) -> bytes:
+            return sha256(("%s\x00%s" % (instance, key)).encode("utf8")).digest()
+
+        return max(self.instances, key=weight)
+
+
+__all__ = [
+    "Config",
+    "RootConfig",
+    "ShardedWorkerHandlingConfig",
+    "ConsistentShardedWorkerHandlingConfig",
+]
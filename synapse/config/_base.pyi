@@ -26,6 +26,7 @@ from synapse.config import (
     server_notices_config,
     spam_checker,
     sso,
+    state_res,
     stats,
     third_party_event_rules,
     tls,
@@ -72,6 +73,7 @@ class RootConfig:
     userdirectory: user_directory.UserDirectoryConfig
     consent: consent_config.ConsentConfig
     stats: stats.StatsConfig
+    state_resolution: state_res.StateResolutionConfig
     servernotices: server_notices_config.ServerNoticesConfig
     roomdirectory: room_directory.RoomDirectoryConfig
     thirdpartyrules: third_party_event_rules.ThirdPartyRulesConfig
@@ -143,3 +145,6 @@ class ShardedWorkerHandlingConfig:
     def __init__(self, instances: List[str]) -> None: ...
     def should_handle(self, instance_name: str, key: str) -> bool: ...
     def get_instance(self, key: str) -> str: ...
+
+class ConsistentShardedWorkerHandlingConfig(ShardedWorkerHandlingConfig):
+    def get_instance(self, key: str) -> str: ...
@@ -16,7 +16,7 @@
 import os
 import re
 import threading
-from typing import Callable, Dict
+from typing import Callable, Dict, Optional
 
 from ._base import Config, ConfigError
 
@@ -41,6 +41,15 @@ class CacheProperties:
         )
         self.resize_all_caches_func = None
 
+        # The approximate number of bytes that the caches may use in total, or
+        # None if the caches are only limited by their number of entries.
+        self.max_cache_memory_usage = None  # type: Optional[int]
+
+        # How long, in milliseconds, cache entries may go unused before they are
+        # removed, for caches which don't set their own expiry time. None
+        # means entries never expire.
+        self.expiry_time_msec = None  # type: Optional[int]
+
 
 properties = CacheProperties()
 
@@ -94,6 +103,8 @@ class CacheConfig(Config):
             os.environ.get(_CACHE_PREFIX, _DEFAULT_FACTOR_SIZE)
         )
         properties.resize_all_caches_func = None
+        properties.max_cache_memory_usage = None
+        properties.expiry_time_msec = None
         with _CACHES_LOCK:
             _CACHES.clear()
 
@@ -112,6 +123,14 @@ class CacheConfig(Config):
         #
         #event_cache_size: 10K
 
+        # Whether to hold the events in the event cache as JSON rather than as
+        # event objects. This uses several times less memory per event, so
+        # allows a much larger event_cache_size for the same memory, at the
+        # cost of some CPU each time an event is read from the cache.
+        # Defaults to false.
+        #
+        #event_cache_json: true
+
         caches:
            # Controls the global cache factor, which is the default cache factor
            # for all caches if a specific factor for that cache is not otherwise
@@ -142,12 +161,32 @@ class CacheConfig(Config):
            #
            per_cache_factors:
              #get_users_who_share_room_with_user: 2.0
+
+           # The approximate amount of memory that the caches may use in
+           # total. Once this is exceeded, the least recently used entries
+           # across all caches are evicted until the caches are back under
+           # the limit, regardless of each cache's maximum number of entries.
+           #
+           # The size of each entry is estimated when it is added to a cache,
+           # which adds some CPU overhead, and so this is disabled by default.
+           #
+           #max_cache_memory_usage: 1024M
+
+           # Controls how long an entry can be in a cache without having been
+           # accessed before being evicted. Some caches set their own expiry
+           # time, which takes priority over this.
+           #
+           # Defaults to no expiry, in which case entries are only evicted
+           # once a cache is full.
+           #
+           #expiry_time: 30m
         """
 
     def read_config(self, config, **kwargs):
         self.event_cache_size = self.parse_size(
             config.get("event_cache_size", _DEFAULT_EVENT_CACHE_SIZE)
         )
+        self.event_cache_json = config.get("event_cache_json", False)
         self.cache_factors = {}  # type: Dict[str, float]
 
         cache_config = config.get("caches") or {}
@@ -188,6 +227,26 @@ class CacheConfig(Config):
                 )
             self.cache_factors[cache] = factor
 
+        max_cache_memory_usage = cache_config.get("max_cache_memory_usage")
+        if max_cache_memory_usage is not None:
+            try:
+                max_cache_memory_usage = self.parse_size(max_cache_memory_usage)
+            except ValueError:
+                raise ConfigError(
+                    "caches.max_cache_memory_usage must be a size, e.g. 1024M"
+                )
+        self.max_cache_memory_usage = max_cache_memory_usage
+        properties.max_cache_memory_usage = max_cache_memory_usage
+
+        expiry_time = cache_config.get("expiry_time")
+        if expiry_time is not None:
+            try:
+                expiry_time = self.parse_duration(expiry_time)
+            except ValueError:
+                raise ConfigError("caches.expiry_time must be a duration, e.g. 30m")
+        self.expiry_time_msec = expiry_time
+        properties.expiry_time_msec = expiry_time
+
         # Resize all caches (if necessary) with the new factors we've loaded
         self.resize_all_caches()
 
@@ -68,6 +68,17 @@ database:
   name: sqlite3
   args:
     database: %(database_path)s
+
+# Events for different rooms which are waiting to be written to the database
+# can be persisted together, which greatly reduces the overhead of persisting
+# events for many small rooms at once (for example when catching up over
+# federation). When enabled, the events are persisted one batch at a time
+# rather than concurrently for each room. This is the maximum number of events
+# to persist together.
+#
+# Defaults to 0, which persists the events for each room separately.
+#
+#persist_events_batch_size: 100
 """
 
 
@@ -130,6 +141,14 @@ class DatabaseConfig(Config):
         #           data_stores: ["state"]
         #           args: {}
 
+        self.persist_events_batch_size = config.get("persist_events_batch_size", 0)
+        if not isinstance(self.persist_events_batch_size, int) or (
+            self.persist_events_batch_size < 0
+        ):
+            raise ConfigError(
+                "persist_events_batch_size must be a non-negative integer"
+            )
+
         multi_database_config = config.get("databases")
         database_config = config.get("database")
         database_path = config.get("database_path")
@@ -44,6 +44,7 @@ from .server import ServerConfig
 from .server_notices_config import ServerNoticesConfig
 from .spam_checker import SpamCheckerConfig
 from .sso import SSOConfig
+from .state_res import StateResolutionConfig
 from .stats import StatsConfig
 from .third_party_event_rules import ThirdPartyRulesConfig
 from .tls import TlsConfig
@@ -60,6 +61,7 @@ class HomeServerConfig(RootConfig):
         TlsConfig,
         FederationConfig,
         CacheConfig,
+        StateResolutionConfig,
         DatabaseConfig,
         LoggingConfig,
         RatelimitConfig,
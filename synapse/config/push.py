@@ -23,6 +23,7 @@ class PushConfig(Config):
     def read_config(self, config, **kwargs):
         push_config = config.get("push", {})
         self.push_include_content = push_config.get("include_content", True)
+        self.push_defer_actions = push_config.get("defer_actions", False)
 
         pusher_instances = config.get("pusher_instances") or []
         self.pusher_shard_config = ShardedWorkerHandlingConfig(pusher_instances)
@@ -61,6 +62,19 @@ class PushConfig(Config):
         # because it is loaded by the app. iPhone, however will send a
         # notification saying only that a message arrived and who it came from.
         #
+        # If `defer_actions` is enabled, working out which users should be
+        # notified about a new event happens after the event has been
+        # persisted, in the background, rather than before. This stops events
+        # in large rooms taking a long time to send, but means that unread
+        # counts and push notifications may lag slightly behind new events.
+        # Syncs handled by the main process only include new events once this
+        # has been worked out, but unread counts in syncs handled by workers
+        # may briefly be out of date. Events which are still to be handled when
+        # Synapse is stopped are handled when it next starts. This requires
+        # that the pushers run on the main process, and that there are no event
+        # persister workers. Defaults to 'false'.
+        #
         #push:
         #  include_content: true
+        #  defer_actions: true
         """
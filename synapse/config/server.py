@@ -208,6 +208,32 @@ class ServerConfig(Config):
 
         self.filter_timeline_limit = config.get("filter_timeline_limit", 100)
 
+        # Whether to write the responses to initial syncs as each room is
+        # computed, rather than building the whole response first.
+        self.stream_initial_sync_responses = config.get(
+            "stream_initial_sync_responses", False
+        )
+
+        # Snapshots of the rooms in users' initial syncs, used to speed up their
+        # next initial sync.
+        initial_sync_snapshots = config.get("initial_sync_snapshots") or {}
+        self.initial_sync_snapshots_enabled = initial_sync_snapshots.get(
+            "enabled", False
+        )
+        self.initial_sync_snapshots_min_rooms = initial_sync_snapshots.get(
+            "min_rooms", 100
+        )
+        self.initial_sync_snapshots_lifetime = self.parse_duration(
+            initial_sync_snapshots.get("lifetime", "7d")
+        )
+
+        # Options for waking up long-polling requests when there are new events
+        notifier_wakeups = config.get("notifier_wakeups") or {}
+        self.notifier_filter_wakeups = notifier_wakeups.get("filter_events", False)
+        self.notifier_wakeup_coalesce_ms = self.parse_duration(
+            notifier_wakeups.get("coalesce_window", 0)
+        )
+
         # Whether we should block invites sent to users on this server
         # (other than those sent by local server admins)
         self.block_non_admin_invites = config.get("block_non_admin_invites", False)
@@ -740,6 +766,53 @@ class ServerConfig(Config):
         #
         #filter_timeline_limit: 5000
 
+        # Whether to send the response to an initial /sync (one without a
+        # 'since' token) to the client room by room, as each room is worked
+        # out, rather than building up the whole response in memory first.
+        # This bounds the memory used by initial syncs of users in many rooms,
+        # but concurrent identical initial syncs are no longer deduplicated.
+        # The default is False.
+        #
+        #stream_initial_sync_responses: true
+
+        # Initial syncs of users in many rooms can be sped up by keeping a
+        # snapshot of the rooms in each user's last initial sync (for each
+        # filter), and reusing the entries for rooms which haven't had any new
+        # events since then. Other parts of the response, such as unread counts
+        # and ephemeral events, are always worked out afresh.
+        #
+        initial_sync_snapshots:
+          # Whether to keep snapshots. Defaults to false.
+          #
+          #enabled: true
+
+          # Only keep snapshots for users in at least this many rooms. Defaults
+          # to 100.
+          #
+          #min_rooms: 50
+
+          # How long snapshots are kept for. Defaults to 7d.
+          #
+          #lifetime: 1d
+
+        # Long-polling /sync requests are normally woken up by every new event
+        # in the user's rooms, and by other updates such as typing
+        # notifications. These options can reduce the number of wakeups in
+        # busy rooms.
+        #
+        notifier_wakeups:
+          # Whether to skip waking up /sync requests for new room events
+          # which their filter excludes, judging by the rooms, event types and
+          # senders in the filter. Defaults to false.
+          #
+          #filter_events: true
+
+          # Wake up requests at most once in this window, so that a burst of
+          # updates leads to a single response. Requests are woken up
+          # immediately if this is 0. Defaults to 0.
+          #
+          #coalesce_window: 50
+
         # Whether room invites to users on this server should be blocked
         # (except those sent by local server admins). The default is False.
         #
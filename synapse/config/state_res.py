@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from ._base import Config, ConfigError
+
+
+class StateResolutionConfig(Config):
+    """State Resolution Configuration
+    Configuration for how synapse resolves the state of rooms
+    """
+
+    section = "state_resolution"
+
+    def read_config(self, config, **kwargs):
+        state_res_config = config.get("state_resolution") or {}
+
+        self.incremental_state_resolution = state_res_config.get("incremental", False)
+
+        self.state_resolution_processes = state_res_config.get("processes", 0)
+        if not isinstance(self.state_resolution_processes, int) or (
+            self.state_resolution_processes < 0
+        ):
+            raise ConfigError(
+                "state_resolution.processes must be a non-negative integer"
+            )
+
+    def generate_config_section(self, **kwargs):
+        return """\
+        ## State Resolution ##
+
+        # Settings for how the state of rooms is resolved when they have more
+        # than one forward extremity.
+        #
+        state_resolution:
+          # When resolving the state at a set of state groups, start from a
+          # previously resolved subset of those groups (e.g. {A, B} when
+          # resolving {A, B, C}), rather than resolving every group from
+          # scratch.
+          #
+          # This makes resolution much cheaper in rooms which always have a
+          # few forward extremities. However, it is not guaranteed to give
+          # exactly the same result as a full resolution, so may cause this
+          # server's view of a room's state to differ from other servers'.
+          # Defaults to false.
+          #
+          #incremental: true
+
+          # The number of processes to run the CPU-heavy parts of resolving large
+          # state conflicts in, so that they don't block the rest of the
+          # process. Each is a separate Python interpreter, so uses a little
+          # extra memory. Defaults to 0, which resolves all state in the main
+          # process.
+          #
+          #processes: 2
+        """
@@ -17,7 +17,12 @@ from typing import List, Union
 
 import attr
 
-from ._base import Config, ConfigError, ShardedWorkerHandlingConfig
+from ._base import (
+    Config,
+    ConfigError,
+    ConsistentShardedWorkerHandlingConfig,
+    ShardedWorkerHandlingConfig,
+)
 from .server import ListenerConfig, parse_listener_def
 
 
@@ -109,6 +114,10 @@ class WorkerConfig(Config):
             federation_sender_instances
         )
 
+        # The workers which handle /sync, each for a share of the users.
+        sync_instances = config.get("sync_instances") or []
+        self.sync_shard_config = ConsistentShardedWorkerHandlingConfig(sync_instances)
+
         # A map from instance name to host/port of their HTTP replication endpoint.
         instance_map = config.get("instance_map") or {}
         self.instance_map = {
@@ -132,6 +141,19 @@ class WorkerConfig(Config):
 
         self.events_shard_config = ShardedWorkerHandlingConfig(self.writers.events)
 
+        # Deferred push actions are computed on the instance which persisted the
+        # event, and must be ready before the pushers are told about them.
+        if self.root.push.push_defer_actions:
+            if self.writers.events != ["master"]:
+                raise ConfigError(
+                    "push.defer_actions cannot be used with event persister workers"
+                )
+            if not self.root.server.start_pushers:
+                raise ConfigError(
+                    "push.defer_actions requires the pushers to run on the main "
+                    "process"
+                )
+
         # Whether this worker should run background tasks or not.
         #
         # As a note for developers, the background tasks guarded by this should
@@ -165,6 +187,19 @@ class WorkerConfig(Config):
         #federation_sender_instances:
         #  - federation_sender1
 
+        # It is possible to shard /sync requests across multiple workers by user
+        # ID, in which case each worker only keeps track of the users it
+        # handles, and skips fetching new events which none of its users are
+        # listening for. Requests should be routed to the worker responsible
+        # for the user (see docs/workers.md), though requests for other users
+        # are still handled, less efficiently.
+        #
+        # This configuration must be shared between all sync workers.
+        #
+        #sync_instances:
+        #  - sync1
+        #  - sync2
+
         # When using workers this should be a map from `worker_name` to the
         # HTTP replication listener of the worker, if configured.
         #
@@ -17,6 +17,7 @@
 
 import abc
 import os
+import re
 from distutils.util import strtobool
 from typing import Dict, Optional, Tuple, Type
 
@@ -24,8 +25,10 @@ from unpaddedbase64 import encode_base64
 
 from synapse.api.room_versions import EventFormatVersions, RoomVersion, RoomVersions
 from synapse.types import JsonDict, RoomStreamToken
+from synapse.util import json_decoder
 from synapse.util.caches import intern_dict
-from synapse.util.frozenutils import freeze
+from synapse.util.frozenutils import ImmutableDict
+from synapse.util.stringutils import random_string
 
 # Whether we should use frozen_dict in FrozenEvent. Using frozen_dicts prevents
 # bugs where we accidentally share e.g. signature dicts. However, converting a
@@ -223,13 +226,34 @@ class EventBase(metaclass=abc.ABCMeta):
         self.unsigned = unsigned
         self.rejected_reason = rejected_reason
 
+        # The JSON of the content of the event, if it has been left out of
+        # `_dict` to be decoded when it is first accessed.
+        self._pending_content = None  # type: Optional[str]
+
+        if USE_FROZEN_DICTS:
+            event_dict = ImmutableDict(event_dict)
+
         self._dict = event_dict
 
         self.internal_metadata = _EventInternalMetadata(internal_metadata_dict)
 
+    def _load_content(self) -> None:
+        """Adds the content back into `_dict`, if it has been put off."""
+        content = self._pending_content
+        if content is None:
+            return
+
+        content = json_decoder.decode(content)
+
+        if isinstance(self._dict, ImmutableDict):
+            self._dict = ImmutableDict(self._dict.copy(), content=content)
+        else:
+            self._dict["content"] = content
+
+        self._pending_content = None
+
     auth_events = DictProperty("auth_events")
     depth = DictProperty("depth")
-    content = DictProperty("content")
     hashes = DictProperty("hashes")
     origin = DictProperty("origin")
     origin_server_ts = DictProperty("origin_server_ts")
@@ -245,6 +269,12 @@ class EventBase(metaclass=abc.ABCMeta):
     def event_id(self) -> str:
         raise NotImplementedError()
 
+    @property
+    def content(self) -> JsonDict:
+        if self._pending_content is not None:
+            self._load_content()
+        return self._dict["content"]
+
     @property
     def membership(self):
         return self.content["membership"]
@@ -253,12 +283,15 @@ class EventBase(metaclass=abc.ABCMeta):
         return hasattr(self, "state_key") and self.state_key is not None
 
     def get_dict(self) -> JsonDict:
-        d = dict(self._dict)
+        self._load_content()
+        d = self._dict.copy()
         d.update({"signatures": self.signatures, "unsigned": dict(self.unsigned)})
 
         return d
 
     def get(self, key, default=None):
+        if key == "content":
+            self._load_content()
         return self._dict.get(key, default)
 
     def get_internal_metadata_dict(self):
@@ -281,15 +314,21 @@ class EventBase(metaclass=abc.ABCMeta):
         raise AttributeError("Unrecognized attribute %s" % (instance,))
 
     def __getitem__(self, field):
+        if field == "content":
+            self._load_content()
         return self._dict[field]
 
     def __contains__(self, field):
+        if field == "content" and self._pending_content is not None:
+            return True
         return field in self._dict
 
     def items(self):
+        self._load_content()
         return list(self._dict.items())
 
     def keys(self):
+        self._load_content()
         return self._dict.keys()
 
     def prev_event_ids(self):
@@ -336,15 +375,10 @@ class FrozenEvent(EventBase):
         # caching).
         event_dict = intern_dict(event_dict)
 
-        if USE_FROZEN_DICTS:
-            frozen_dict = freeze(event_dict)
-        else:
-            frozen_dict = event_dict
-
         self._event_id = event_dict["event_id"]
 
         super().__init__(
-            frozen_dict,
+            event_dict,
             room_version=room_version,
             signatures=signatures,
             unsigned=unsigned,
@@ -394,15 +428,10 @@ class FrozenEventV2(EventBase):
         # caching).
         event_dict = intern_dict(event_dict)
 
-        if USE_FROZEN_DICTS:
-            frozen_dict = freeze(event_dict)
-        else:
-            frozen_dict = event_dict
-
         self._event_id = None
 
         super().__init__(
-            frozen_dict,
+            event_dict,
             room_version=room_version,
             signatures=signatures,
             unsigned=unsigned,
@@ -501,3 +530,126 @@ def make_event_from_dict(
     """Construct an EventBase from the given event dict"""
     event_type = _event_type_from_format_version(room_version.event_format)
     return event_type(event_dict, room_version, internal_metadata_dict, rejected_reason)
+
+
+def make_event_with_lazy_content(
+    event_id: str,
+    event_dict: JsonDict,
+    content_json: Optional[str],
+    room_version: RoomVersion,
+    internal_metadata_dict: JsonDict = {},
+    rejected_reason: Optional[str] = None,
+) -> EventBase:
+    """Construct an EventBase from the given event dict, without its content,
+    and the JSON of its content, which is only decoded when first accessed.
+
+    Args:
+        event_id: The ID of the event. For room versions where this is
+            calculated from the event this must be the correct value, as it
+            is trusted rather than recalculated (which would require the
+            content).
+        event_dict: The event, except for "content".
+        content_json: The JSON of the content, or None if it is in
+            `event_dict`.
+        room_version
+        internal_metadata_dict
+        rejected_reason
+    """
+    event = make_event_from_dict(
+        event_dict, room_version, internal_metadata_dict, rejected_reason
+    )
+
+    if isinstance(event, FrozenEventV2):
+        event._event_id = event_id
+
+    event._pending_content = content_json
+
+    return event
+
+
+# A value which can't appear in events, which the content of an event is
+# replaced with while decoding the rest of it.
+_CONTENT_PLACEHOLDER = random_string(24)
+
+_CONTENT_KEY_RE = re.compile(r'"content"[ \t\n\r]*:[ \t\n\r]*(?={)')
+_JSON_STRUCTURE_RE = re.compile(r'[{}\[\]"]')
+
+
+def _skip_json_object(s: str, idx: int) -> int:
+    """Finds the end of the JSON object starting at `idx` without decoding it,
+    by matching up its brackets.
+
+    Returns:
+        The index just after the object.
+
+    Raises:
+        ValueError if the object isn't terminated.
+    """
+    search = _JSON_STRUCTURE_RE.search
+    find = s.find
+
+    depth = 0
+    while True:
+        m = search(s, idx)
+        if not m:
+            raise ValueError("Unterminated JSON object")
+        idx = m.end()
+
+        c = m.group()
+        if c == '"':
+            # Find the closing quote, which is the first one that isn't
+            # escaped by an odd number of backslashes.
+            while True:
+                end = find('"', idx)
+                if end < 0:
+                    raise ValueError("Unterminated JSON string")
+                idx = end + 1
+
+                backslash = end
+                while s[backslash - 1] == "\\":
+                    backslash -= 1
+                if (end - backslash) % 2 == 0:
+                    break
+        elif c in "{[":
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return idx
+
+
+def decode_event_json(event_json: str) -> Tuple[JsonDict, Optional[str]]:
+    """Decodes the JSON of an event as stored in the database, leaving its
+    content as JSON if it looks expensive to decode, to be passed to
+    `make_event_with_lazy_content`.
+
+    Finding the content is slower than decoding a small event outright, so it
+    is only done for events which are long or have many escaped characters,
+    and have few strings to skip over.
+
+    Returns:
+        The event dict, and the JSON of its content (or None if the content
+        has been decoded and left in the dict).
+
+    Raises:
+        ValueError if the JSON is invalid. Errors in the content are only
+        raised once it's decoded.
+    """
+    cost = len(event_json) + 16 * event_json.count("\\")
+    if cost >= 8192 and event_json.count('"') * 128 < cost:
+        m = _CONTENT_KEY_RE.search(event_json)
+        if m:
+            start = m.end()
+            end = _skip_json_object(event_json, start)
+            event_dict = json_decoder.decode(
+                '%s"%s"%s'
+                % (event_json[:start], _CONTENT_PLACEHOLDER, event_json[end:])
+            )
+
+            # The key we found may not have been at the top level of the event,
+            # in which case we just decode the whole event.
+            if event_dict.get("content") == _CONTENT_PLACEHOLDER:
+                del event_dict["content"]
+                return event_dict, event_json[start:end]
+
+    return json_decoder.decode(event_json), None
@@ -22,6 +22,7 @@ from synapse.api.constants import EventTypes, RelationTypes
 from synapse.api.errors import Codes, SynapseError
 from synapse.api.room_versions import RoomVersion
 from synapse.util.async_helpers import yieldable_gather_results
+from synapse.util.frozenutils import ImmutableDict
 
 from . import EventBase
 
@@ -153,7 +154,11 @@ def _copy_field(src, dst, field):
     key_to_move = field.pop(-1)
     sub_dict = src
     for sub_field in field:  # e.g. sub_field => "content"
-        if sub_field in sub_dict and type(sub_dict[sub_field]) in [dict, frozendict]:
+        if sub_field in sub_dict and type(sub_dict[sub_field]) in [
+            dict,
+            frozendict,
+            ImmutableDict,
+        ]:
             sub_dict = sub_dict[sub_field]
         else:
             return
@@ -22,6 +22,8 @@ from twisted.internet import defer
 
 import synapse
 import synapse.metrics
+from synapse.api.constants import EventTypes, Membership
+from synapse.api.errors import SynapseError
 from synapse.api.presence import UserPresenceState
 from synapse.events import EventBase
 from synapse.federation.sender.per_destination_queue import PerDestinationQueue
@@ -40,7 +42,8 @@ from synapse.metrics import (
     events_processed_counter,
 )
 from synapse.metrics.background_process_metrics import run_as_background_process
-from synapse.types import ReadReceipt
+from synapse.types import ReadReceipt, get_domain_from_id
+from synapse.util.caches.lrucache import LruCache
 from synapse.util.metrics import Measure, measure_func
 
 logger = logging.getLogger(__name__)
@@ -55,13 +58,19 @@ sent_pdus_destination_dist_total = Counter(
     "Total number of PDUs queued for sending across all destinations",
 )
 
+skipped_rooms_counter = Counter(
+    "synapse_federation_sender_skipped_rooms",
+    "Number of times new events in a room were skipped because no server that "
+    "this federation sender sends to has ever been in the room",
+)
+
 # Time (in s) after Synapse's startup that we will begin to wake up destinations
 # that have catch-up outstanding.
 CATCH_UP_STARTUP_DELAY_SEC = 15
 
-# Time (in s) to wait in between waking up each destination, i.e. one destination
-# will be woken up every <x> seconds after Synapse's startup until we have woken
-# every destination has outstanding catch-up.
+# Time (in s) to wait in between waking up each batch of destinations, i.e. up
+# to 25 destinations will be woken up every <x> seconds after Synapse's startup
+# until we have woken every destination that has outstanding catch-up.
 CATCH_UP_STARTUP_INTERVAL_SEC = 5
 
 
@@ -120,6 +129,24 @@ class FederationSender:
         self._is_processing = False
         self._last_poked_id = -1
 
+        # The position in the events stream we have sent out events up to, or
+        # None if we haven't started yet.
+        self._last_processed_id = None  # type: Optional[int]
+
+        LaterGauge(
+            "synapse_federation_sender_events_backlog",
+            "Number of positions in the events stream that this federation sender "
+            "has yet to process",
+            ["instance_name"],
+            self._get_events_backlog,
+        )
+
+        # Map from room ID to the destinations that this instance sends to that
+        # have ever been in the room. When processing new events, rooms where
+        # this is empty are skipped without working out which servers were in
+        # the room at each event.
+        self._room_destinations_cache = LruCache(10000)  # type: LruCache
+
         self._processing_pending_presence = False
 
         # map from room_id to a set of PerDestinationQueues which we believe are
@@ -235,11 +262,17 @@ class FederationSender:
                             "federation_sender"
                         ).observe((now - ts) / 1000)
 
-                async def handle_room_events(events: Iterable[EventBase]) -> None:
+                async def handle_room_events(events: List[EventBase]) -> None:
                     with Measure(self.clock, "handle_room_events"):
+                        if not await self._get_room_destinations(events[0].room_id):
+                            skipped_rooms_counter.inc()
+                            return
+
                         for event in events:
                             await handle_event(event)
 
+                self._update_room_destinations(events)
+
                 events_by_room = {}  # type: Dict[str, List[EventBase]]
                 for event in events:
                     events_by_room.setdefault(event.room_id, []).append(event)
@@ -255,6 +288,7 @@ class FederationSender:
                 )
 
                 await self.store.update_federation_out_pos("events", next_token)
+                self._last_processed_id = next_token
 
                 if events:
                     now = self.clock.time_msec()
@@ -282,6 +316,57 @@ class FederationSender:
         finally:
             self._is_processing = False
 
+    def _get_events_backlog(self) -> Dict[Tuple[str, ...], float]:
+        if self._last_processed_id is None:
+            return {}
+        backlog = max(0, self._last_poked_id - self._last_processed_id)
+        return {(self._instance_name,): backlog}
+
+    async def _get_room_destinations(self, room_id: str) -> Set[str]:
+        """Get the destinations that this instance sends to that have ever been
+        in the room.
+        """
+        destinations = self._room_destinations_cache.get(room_id)
+        if destinations is None:
+            hosts = await self.store.get_hosts_ever_joined_to_room(room_id)
+            destinations = {host for host in hosts if self._is_our_destination(host)}
+            self._room_destinations_cache[room_id] = destinations
+
+        return destinations
+
+    def _update_room_destinations(self, events: Iterable[EventBase]) -> None:
+        """Adds the servers of any users that have joined rooms in the given
+        events to the cached destinations of the rooms.
+
+        This must be called for each batch of events from the events stream
+        before the rooms in it are checked with `_get_room_destinations`. Any
+        entry that is missing will be loaded from the database, which already
+        has the events.
+        """
+        for event in events:
+            if event.type != EventTypes.Member or not event.is_state():
+                continue
+            if event.membership != Membership.JOIN:
+                continue
+
+            destinations = self._room_destinations_cache.get(event.room_id)
+            if destinations is None:
+                continue
+
+            try:
+                host = get_domain_from_id(event.state_key)
+            except SynapseError:
+                continue
+
+            if self._is_our_destination(host):
+                destinations.add(host)
+
+    def _is_our_destination(self, host: str) -> bool:
+        """Whether this instance is responsible for sending to the server."""
+        return host != self.server_name and self._federation_shard_config.should_handle(
+            self._instance_name, host
+        )
+
     async def _send_pdu(self, pdu: EventBase, destinations: Iterable[str]) -> None:
         # We loop through all destinations to see whether we already have
         # a transaction in progress. If we do, stick it in the pending_pdus
@@ -583,10 +668,12 @@ class FederationSender:
         Wakes up destinations that need catch-up and are not currently being
         backed off from.
 
-        In order to reduce load spikes, adds a delay between each destination.
+        In order to reduce load spikes, the destinations are woken in batches,
+        with a delay between each batch.
         """
 
         last_processed = None  # type: Optional[str]
+        woken_count = 0
 
         while True:
             destinations_to_wake = await self.store.get_catch_up_outstanding_destinations(
@@ -598,16 +685,57 @@ class FederationSender:
                 self._catchup_after_startup_timer = None
                 break
 
+            last_processed = destinations_to_wake[-1]
+
             destinations_to_wake = [
                 d
                 for d in destinations_to_wake
-                if self._federation_shard_config.should_handle(self._instance_name, d)
+                if d != self.server_name
+                and self._federation_shard_config.should_handle(self._instance_name, d)
             ]
+            if not destinations_to_wake:
+                continue
 
-            for last_processed in destinations_to_wake:
-                logger.info(
-                    "Destination %s has outstanding catch-up, waking up.",
-                    last_processed,
-                )
-                self.wake_destination(last_processed)
-                await self.clock.sleep(CATCH_UP_STARTUP_INTERVAL_SEC)
+            await self._wake_destinations_for_catch_up(destinations_to_wake)
+
+            woken_count += len(destinations_to_wake)
+            logger.info(
+                "Woken up %d destinations with outstanding catch-up so far",
+                woken_count,
+            )
+
+            await self.clock.sleep(CATCH_UP_STARTUP_INTERVAL_SEC)
+
+    async def _wake_destinations_for_catch_up(self, destinations: List[str]) -> None:
+        """
+        Wakes up destinations that need catch-up, fetching the first batch of
+        PDUs for all of them at once.
+        """
+        catch_up = await self.store.get_catch_up_room_event_ids_for_destinations(
+            destinations
+        )
+
+        # The destinations are likely to share a lot of rooms, so we load each
+        # event once for all of them.
+        event_ids = {
+            event_id
+            for _, room_event_ids in catch_up.values()
+            for event_id in room_event_ids
+        }
+        events = await self.store.get_events(event_ids)
+
+        for destination in destinations:
+            logger.info(
+                "Destination %s has outstanding catch-up, waking up.", destination
+            )
+
+            if destination in catch_up:
+                last_successful_stream_ordering, room_event_ids = catch_up[destination]
+                pdus = [events[e] for e in room_event_ids if e in events]
+                if pdus or not room_event_ids:
+                    self._get_per_destination_queue(destination).wake_for_catch_up(
+                        last_successful_stream_ordering, pdus
+                    )
+                    continue
+
+            self.wake_destination(destination)
@@ -28,9 +28,11 @@ from synapse.api.presence import UserPresenceState
 from synapse.events import EventBase
 from synapse.federation.units import Edu
 from synapse.handlers.presence import format_user_presence_state
+from synapse.logging.context import make_deferred_yieldable, run_in_background
 from synapse.metrics import sent_transactions_counter
 from synapse.metrics.background_process_metrics import run_as_background_process
 from synapse.types import ReadReceipt
+from synapse.util.async_helpers import ObservableDeferred
 from synapse.util.retryutils import NotRetryingDestination, get_retry_limiter
 
 if TYPE_CHECKING:
@@ -107,6 +109,11 @@ class PerDestinationQueue:
         # destination (we are the only updater so this is safe)
         self._last_successful_stream_ordering = None  # type: Optional[int]
 
+        # The first batch of PDUs to catch up on and the stream ordering they
+        # follow, if they were fetched by the federation sender along with
+        # those of other destinations. See `wake_for_catch_up`.
+        self._prefetched_catch_up = None  # type: Optional[Tuple[int, List[EventBase]]]
+
         # a list of pending PDUs
         self._pending_pdus = []  # type: List[EventBase]
 
@@ -229,6 +236,22 @@ class PerDestinationQueue:
             self._transaction_transmission_loop,
         )
 
+    def wake_for_catch_up(
+        self, last_successful_stream_ordering: int, pdus: List[EventBase]
+    ) -> None:
+        """Try to start a new transaction to this destination, catching up on
+        the given PDUs first if it still needs to catch up.
+
+        Args:
+            last_successful_stream_ordering: The stream ordering of the most
+                recent PDU the destination received, as stored in the database.
+            pdus: The first batch of PDUs to catch up on after that.
+        """
+        if self._catching_up and not self.transmission_loop_running:
+            self._prefetched_catch_up = (last_successful_stream_ordering, pdus)
+
+        self.attempt_new_transaction()
+
     async def _transaction_transmission_loop(self) -> None:
         pending_pdus = []  # type: List[EventBase]
         try:
@@ -434,13 +457,20 @@ class PerDestinationQueue:
             self.transmission_loop_running = False
 
     async def _catch_up_transmission_loop(self) -> None:
+        prefetched = self._prefetched_catch_up
+        self._prefetched_catch_up = None
+
         first_catch_up_check = self._last_successful_stream_ordering is None
 
         if first_catch_up_check:
-            # first catchup so get last_successful_stream_ordering from database
-            self._last_successful_stream_ordering = await self._store.get_destination_last_successful_stream_ordering(
-                self._destination
-            )
+            if prefetched is not None:
+                # the federation sender got it from the database for us
+                self._last_successful_stream_ordering = prefetched[0]
+            else:
+                # first catchup so get last_successful_stream_ordering from database
+                self._last_successful_stream_ordering = await self._store.get_destination_last_successful_stream_ordering(
+                    self._destination
+                )
 
         if self._last_successful_stream_ordering is None:
             # if it's still None, then this means we don't have the information
@@ -452,13 +482,32 @@ class PerDestinationQueue:
             self._catching_up = False
             return
 
+        # The first batch of catch-up PDUs, if it has already been fetched.
+        first_batch = None  # type: Optional[List[EventBase]]
+        if prefetched is not None:
+            prefetched_stream_ordering, first_batch = prefetched
+            if prefetched_stream_ordering != self._last_successful_stream_ordering:
+                first_batch = None
+
+        # The next batch of catch-up PDUs, which is fetched while the previous
+        # batch is being sent.
+        next_batch = None  # type: Optional[ObservableDeferred]
+
+        sent_pdu_count = 0
+
         # get at most 50 catchup room/PDUs
         while True:
-            event_ids = await self._store.get_catch_up_room_event_ids(
-                self._destination, self._last_successful_stream_ordering,
-            )
+            if first_batch is not None:
+                catchup_pdus, first_batch = first_batch, None
+            elif next_batch is not None:
+                catchup_pdus = await make_deferred_yieldable(next_batch.observe())
+                next_batch = None
+            else:
+                catchup_pdus = await self._get_catch_up_pdus(
+                    self._last_successful_stream_ordering
+                )
 
-            if not event_ids:
+            if not catchup_pdus:
                 # No more events to catch up on, but we can't ignore the chance
                 # of a race condition, so we check that no new events have been
                 # skipped due to us being in catch-up mode
@@ -469,6 +518,12 @@ class PerDestinationQueue:
 
                 # we are done catching up!
                 self._catching_up = False
+                if sent_pdu_count:
+                    logger.info(
+                        "Caught up %s after sending %d PDUs",
+                        self._destination,
+                        sent_pdu_count,
+                    )
                 break
 
             if first_catch_up_check:
@@ -477,22 +532,22 @@ class PerDestinationQueue:
                 # clear those out now.
                 self._start_catching_up()
 
-            # fetch the relevant events from the event store
-            # - redacted behaviour of REDACT is fine, since we only send metadata
-            #   of redacted events to the destination.
-            # - don't need to worry about rejected events as we do not actively
-            #   forward received events over federation.
-            catchup_pdus = await self._store.get_events_as_list(event_ids)
-            if not catchup_pdus:
-                raise AssertionError(
-                    "No events retrieved when we asked for %r. "
-                    "This should not happen." % event_ids
-                )
-
             if logger.isEnabledFor(logging.INFO):
                 rooms = [p.room_id for p in catchup_pdus]
                 logger.info("Catching up rooms to %s: %r", self._destination, rooms)
 
+            final_stream_ordering = cast(
+                int, catchup_pdus[-1].internal_metadata.stream_ordering
+            )
+
+            # Start fetching the next batch, so that it is ready as soon as the
+            # destination has accepted this one. If we fail to send this batch,
+            # the next one is thrown away (along with any error fetching it).
+            next_batch = ObservableDeferred(
+                run_in_background(self._get_catch_up_pdus, final_stream_ordering),
+                consumeErrors=True,
+            )
+
             success = await self._transaction_manager.send_new_transaction(
                 self._destination, catchup_pdus, []
             )
@@ -501,14 +556,42 @@ class PerDestinationQueue:
                 return
 
             sent_transactions_counter.inc()
-            final_pdu = catchup_pdus[-1]
-            self._last_successful_stream_ordering = cast(
-                int, final_pdu.internal_metadata.stream_ordering
-            )
+            sent_pdu_count += len(catchup_pdus)
+            self._last_successful_stream_ordering = final_stream_ordering
             await self._store.set_destination_last_successful_stream_ordering(
                 self._destination, self._last_successful_stream_ordering
             )
 
+    async def _get_catch_up_pdus(
+        self, last_successful_stream_ordering: int
+    ) -> List[EventBase]:
+        """Fetches the oldest PDUs which have not yet been sent to the
+        destination, at most one per room and 50 in total.
+
+        Args:
+            last_successful_stream_ordering: The stream ordering of the most
+                recent PDU that the destination has received (or is being sent).
+        """
+        event_ids = await self._store.get_catch_up_room_event_ids(
+            self._destination, last_successful_stream_ordering,
+        )
+        if not event_ids:
+            return []
+
+        # fetch the relevant events from the event store
+        # - redacted behaviour of REDACT is fine, since we only send metadata
+        #   of redacted events to the destination.
+        # - don't need to worry about rejected events as we do not actively
+        #   forward received events over federation.
+        catchup_pdus = await self._store.get_events_as_list(event_ids)
+        if not catchup_pdus:
+            raise AssertionError(
+                "No events retrieved when we asked for %r. "
+                "This should not happen." % event_ids
+            )
+
+        return catchup_pdus
+
     def _get_rr_edus(self, force_flush: bool) -> Iterable[Edu]:
         if not self._pending_rrs:
             return
@@ -132,6 +132,9 @@ class DeactivateAccountHandler(BaseHandler):
         if self._account_validity_enabled:
             await self.store.delete_account_validity_for_user(user_id)
 
+        # Throw away the snapshots of the user's initial syncs.
+        await self.store.delete_initial_sync_snapshots_for_user(user_id)
+
         # Mark the user as deactivated.
         await self.store.set_user_deactivated_status(user_id, True)
 
@@ -1138,9 +1138,14 @@ class EventCreationHandler:
             if prev_state_ids:
                 raise AuthError(403, "Changing the room create event is forbidden")
 
-        event_pos, max_stream_token = await self.storage.persistence.persist_event(
-            event, context=context
-        )
+        with self.action_generator.persisting_events():
+            event_pos, max_stream_token = await self.storage.persistence.persist_event(
+                event, context=context
+            )
+
+            self.action_generator.handle_push_actions_for_persisted_events(
+                [(event, context)]
+            )
 
         if self._ephemeral_events_enabled:
             # If there's an expiry timestamp on the event, schedule its expiry.
@@ -911,10 +911,10 @@ class PresenceHandler(BasePresenceHandler):
             hosts = await self.state.get_current_hosts_in_room(room_id)
 
             # Filter out ourselves.
-            hosts = {host for host in hosts if host != self.server_name}
+            destinations = {host for host in hosts if host != self.server_name}
 
             self.federation.send_presence_to_destinations(
-                states=[state], destinations=hosts
+                states=[state], destinations=destinations
             )
         else:
             # A remote user has joined the room, so we need to:
@@ -14,17 +14,34 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
 import itertools
 import logging
-from typing import TYPE_CHECKING, Any, Dict, FrozenSet, List, Optional, Set, Tuple
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    FrozenSet,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
 import attr
+from canonicaljson import encode_canonical_json
 from prometheus_client import Counter
 
 from synapse.api.constants import AccountDataTypes, EventTypes, Membership
 from synapse.api.filtering import FilterCollection
 from synapse.events import EventBase
 from synapse.logging.context import current_context
+from synapse.metrics.background_process_metrics import run_as_background_process
+from synapse.push.bulk_push_rule_evaluator import event_counts_as_unread
 from synapse.push.clientformat import format_push_rules_for_user
 from synapse.storage.roommember import MemberSummary
 from synapse.storage.state import StateFilter
@@ -41,6 +58,7 @@ from synapse.util.async_helpers import concurrently_execute
 from synapse.util.caches.expiringcache import ExpiringCache
 from synapse.util.caches.lrucache import LruCache
 from synapse.util.caches.response_cache import ResponseCache
+from synapse.util.iterutils import batch_iter
 from synapse.util.metrics import Measure, measure_func
 from synapse.visibility import filter_events_for_client
 
@@ -73,6 +91,10 @@ LAZY_LOADED_MEMBERS_CACHE_MAX_AGE = 30 * 60 * 1000
 # avoiding redundantly sending the same lazy-loaded members to the client
 LAZY_LOADED_MEMBERS_CACHE_MAX_SIZE = 100
 
+# The number of rooms whose entries are generated together in a sync, fetching
+# the state for them in bulk.
+ROOM_ENTRY_BATCH_SIZE = 100
+
 
 @attr.s(slots=True, frozen=True)
 class SyncConfig:
@@ -140,6 +162,13 @@ class ArchivedSyncResult:
         return bool(self.timeline or self.state or self.account_data)
 
 
+# Called with each joined or archived room entry as soon as it is generated,
+# when streaming a sync response.
+RoomEntryCallback = Callable[
+    [Union[JoinedSyncResult, ArchivedSyncResult]], Awaitable[None]
+]
+
+
 @attr.s(slots=True, frozen=True)
 class InvitedSyncResult:
     room_id = attr.ib(type=str)
@@ -246,6 +275,17 @@ class SyncHandler:
         self.storage = hs.get_storage()
         self.state_store = self.storage.state
 
+        # If push actions are computed after events are persisted by this
+        # process, we hold back events whose push actions aren't stored yet.
+        self._action_generator = None
+        if hs.config.push_defer_actions and hs.config.worker.worker_app is None:
+            self._action_generator = hs.get_action_generator()
+
+        self._initial_sync_snapshots_enabled = hs.config.initial_sync_snapshots_enabled
+        self._initial_sync_snapshots_min_rooms = (
+            hs.config.initial_sync_snapshots_min_rooms
+        )
+
         # ExpiringCache((User, Device)) -> LruCache(state_key => event_id)
         self.lazy_loaded_members_cache = ExpiringCache(
             "lazy_loaded_members_cache",
@@ -308,14 +348,29 @@ class SyncHandler:
             )
         else:
 
+            user_id = sync_config.user.to_string()
+
             def current_sync_callback(before_token, after_token):
                 return self.current_sync_for_user(sync_config, since_token)
 
+            def might_include_event(event):
+                # Changes to the user's own membership add or remove rooms from
+                # the sync, whatever the filter.
+                if event.type == EventTypes.Member and event.state_key == user_id:
+                    return True
+                return sync_config.filter_collection.might_include_room_event(
+                    event,
+                    changes_unread_counts=(
+                        event.sender != user_id and event_counts_as_unread(event)
+                    ),
+                )
+
             result = await self.notifier.wait_for_events(
-                sync_config.user.to_string(),
+                user_id,
                 timeout,
                 current_sync_callback,
                 from_token=since_token,
+                event_filter=might_include_event,
             )
 
         if result:
@@ -327,6 +382,27 @@ class SyncHandler:
 
         return result
 
+    async def stream_initial_sync_for_user(
+        self, sync_config: SyncConfig, room_entry_callback: RoomEntryCallback
+    ) -> SyncResult:
+        """Generates an initial sync for a user, passing each joined and archived
+        room entry to `room_entry_callback` as soon as it has been generated,
+        rather than including it in the returned `SyncResult`.
+
+        Unlike `wait_for_sync_for_user`, identical concurrent requests aren't
+        deduplicated, as the room entries aren't kept.
+        """
+        user_id = sync_config.user.to_string()
+        await self.auth.check_auth_blocking(user_id)
+
+        context = current_context()
+        if context:
+            context.tag = "initial_sync"
+
+        return await self.generate_sync_result(
+            sync_config, room_entry_callback=room_entry_callback
+        )
+
     async def current_sync_for_user(
         self,
         sync_config: SyncConfig,
@@ -560,16 +636,9 @@ class SyncHandler:
             stream_position: point at which to get state
             state_filter: The state filter used to fetch state from the database.
         """
-        # FIXME this claims to get the state at a stream position, but
-        # get_recent_events_for_room operates by topo ordering. This therefore
-        # does not reliably give you the state at the given stream position.
-        # (https://github.com/matrix-org/synapse/issues/3305)
-        last_events, _ = await self.store.get_recent_events_for_room(
-            room_id, end_token=stream_position.room_key, limit=1
-        )
+        last_event = await self._get_last_event_at(room_id, stream_position)
 
-        if last_events:
-            last_event = last_events[-1]
+        if last_event:
             state = await self.get_state_after_event(
                 last_event, state_filter=state_filter
             )
@@ -579,6 +648,23 @@ class SyncHandler:
             state = {}
         return state
 
+    async def _get_last_event_at(
+        self, room_id: str, stream_position: StreamToken
+    ) -> Optional[EventBase]:
+        """Get the last event in a room at a particular stream position, if any.
+        """
+        # FIXME this claims to get the state at a stream position, but
+        # get_recent_events_for_room operates by topo ordering. This therefore
+        # does not reliably give you the state at the given stream position.
+        # (https://github.com/matrix-org/synapse/issues/3305)
+        last_events, _ = await self.store.get_recent_events_for_room(
+            room_id, end_token=stream_position.room_key, limit=1
+        )
+
+        if last_events:
+            return last_events[-1]
+        return None
+
     async def compute_summary(
         self,
         room_id: str,
@@ -743,127 +829,151 @@ class SyncHandler:
             now_token: Token of the end of the current batch.
             full_state: Whether to force returning the full state.
         """
+        state_by_room = await self.compute_state_deltas(
+            sync_config, now_token, [(room_id, batch, since_token, full_state)]
+        )
+        return state_by_room[room_id]
+
+    async def compute_state_deltas(
+        self,
+        sync_config: SyncConfig,
+        now_token: StreamToken,
+        rooms: List[Tuple[str, TimelineBatch, Optional[StreamToken], bool]],
+    ) -> Dict[str, MutableStateMap[EventBase]]:
+        """ Works out the difference in state between the start of the timeline
+        and the previous sync for several rooms at once, so that the state is
+        fetched in as few database transactions as possible.
+
+        Args:
+            sync_config:
+            now_token: Token of the end of the current batch.
+            rooms: List of the room ID, the timeline batch for the room that
+                will be sent to the user, the token of the end of the previous
+                batch (which may be None), and whether to force returning the
+                full state, for each room.
+
+        Returns:
+            Map from room ID to the state delta for the room.
+        """
         # TODO(mjark) Check if the state events were received by the server
         # after the previous sync, since we need to include those state
         # updates even if they occured logically before the previous event.
         # TODO(mjark) Check for new redactions in the state events.
 
-        with Measure(self.clock, "compute_state_delta"):
-
-            members_to_fetch = None
+        with Measure(self.clock, "compute_state_deltas"):
 
             lazy_load_members = sync_config.filter_collection.lazy_load_members()
             include_redundant_members = (
                 sync_config.filter_collection.include_redundant_members()
             )
 
-            if lazy_load_members:
-                # We only request state for the members needed to display the
-                # timeline:
+            # First we work out what state we need for each room. Each lookup
+            # is for the state at an event in the timeline or at a stream
+            # position, and has a name so we can find the state map below.
+            lookups = (
+                []
+            )  # type: List[Tuple[str, str, Union[str, StreamToken], StateFilter]]
 
-                members_to_fetch = {
-                    event.sender  # FIXME: we also care about invite targets etc.
-                    for event in batch.events
-                }
+            for room_id, batch, since_token, full_state in rooms:
+                members_to_fetch = None
 
-                if full_state:
-                    # always make sure we LL ourselves so we know we're in the room
-                    # (if we are) to fix https://github.com/vector-im/riot-web/issues/7209
-                    # We only need apply this on full state syncs given we disabled
-                    # LL for incr syncs in #3840.
-                    members_to_fetch.add(sync_config.user.to_string())
+                if lazy_load_members:
+                    # We only request state for the members needed to display the
+                    # timeline:
 
-                state_filter = StateFilter.from_lazy_load_member_list(members_to_fetch)
-            else:
-                state_filter = StateFilter.all()
+                    members_to_fetch = {
+                        event.sender  # FIXME: we also care about invite targets etc.
+                        for event in batch.events
+                    }
 
-            timeline_state = {
-                (event.type, event.state_key): event.event_id
-                for event in batch.events
-                if event.is_state()
-            }
+                    if full_state:
+                        # always make sure we LL ourselves so we know we're in the room
+                        # (if we are) to fix https://github.com/vector-im/riot-web/issues/7209
+                        # We only need apply this on full state syncs given we disabled
+                        # LL for incr syncs in #3840.
+                        members_to_fetch.add(sync_config.user.to_string())
 
-            if full_state:
-                if batch:
-                    current_state_ids = await self.state_store.get_state_ids_for_event(
-                        batch.events[-1].event_id, state_filter=state_filter
+                    state_filter = StateFilter.from_lazy_load_member_list(
+                        members_to_fetch
                     )
-
-                    state_ids = await self.state_store.get_state_ids_for_event(
-                        batch.events[0].event_id, state_filter=state_filter
-                    )
-
                 else:
-                    current_state_ids = await self.get_state_at(
-                        room_id, stream_position=now_token, state_filter=state_filter
-                    )
-
-                    state_ids = current_state_ids
+                    state_filter = StateFilter.all()
 
-                state_ids = _calculate_state(
-                    timeline_contains=timeline_state,
-                    timeline_start=state_ids,
-                    previous={},
-                    current=current_state_ids,
-                    lazy_load_members=lazy_load_members,
-                )
-            elif batch.limited:
-                if batch:
-                    state_at_timeline_start = await self.state_store.get_state_ids_for_event(
-                        batch.events[0].event_id, state_filter=state_filter
-                    )
-                else:
-                    # We can get here if the user has ignored the senders of all
-                    # the recent events.
-                    state_at_timeline_start = await self.get_state_at(
-                        room_id, stream_position=now_token, state_filter=state_filter
-                    )
-
-                # for now, we disable LL for gappy syncs - see
-                # https://github.com/vector-im/riot-web/issues/7211#issuecomment-419976346
-                # N.B. this slows down incr syncs as we are now processing way
-                # more state in the server than if we were LLing.
-                #
-                # We still have to filter timeline_start to LL entries (above) in order
-                # for _calculate_state's LL logic to work, as we have to include LL
-                # members for timeline senders in case they weren't loaded in the initial
-                # sync.  We do this by (counterintuitively) by filtering timeline_start
-                # members to just be ones which were timeline senders, which then ensures
-                # all of the rest get included in the state block (if we need to know
-                # about them).
-                state_filter = StateFilter.all()
-
-                # If this is an initial sync then full_state should be set, and
-                # that case is handled above. We assert here to ensure that this
-                # is indeed the case.
-                assert since_token is not None
-                state_at_previous_sync = await self.get_state_at(
-                    room_id, stream_position=since_token, state_filter=state_filter
-                )
-
-                if batch:
-                    current_state_ids = await self.state_store.get_state_ids_for_event(
-                        batch.events[-1].event_id, state_filter=state_filter
-                    )
-                else:
-                    # Its not clear how we get here, but empirically we do
-                    # (#5407). Logging has been added elsewhere to try and
-                    # figure out where this state comes from.
-                    current_state_ids = await self.get_state_at(
-                        room_id, stream_position=now_token, state_filter=state_filter
-                    )
+                if full_state:
+                    if batch:
+                        lookups.append(
+                            (
+                                room_id,
+                                "current",
+                                batch.events[-1].event_id,
+                                state_filter,
+                            )
+                        )
+                        lookups.append(
+                            (
+                                room_id,
+                                "timeline_start",
+                                batch.events[0].event_id,
+                                state_filter,
+                            )
+                        )
+                    else:
+                        lookups.append((room_id, "current", now_token, state_filter))
+                        lookups.append(
+                            (room_id, "timeline_start", now_token, state_filter)
+                        )
+                elif batch.limited:
+                    if batch:
+                        lookups.append(
+                            (
+                                room_id,
+                                "timeline_start",
+                                batch.events[0].event_id,
+                                state_filter,
+                            )
+                        )
+                    else:
+                        # We can get here if the user has ignored the senders of all
+                        # the recent events.
+                        lookups.append(
+                            (room_id, "timeline_start", now_token, state_filter)
+                        )
 
-                state_ids = _calculate_state(
-                    timeline_contains=timeline_state,
-                    timeline_start=state_at_timeline_start,
-                    previous=state_at_previous_sync,
-                    current=current_state_ids,
-                    # we have to include LL members in case LL initial sync missed them
-                    lazy_load_members=lazy_load_members,
-                )
-            else:
-                state_ids = {}
-                if lazy_load_members:
+                    # for now, we disable LL for gappy syncs - see
+                    # https://github.com/vector-im/riot-web/issues/7211#issuecomment-419976346
+                    # N.B. this slows down incr syncs as we are now processing way
+                    # more state in the server than if we were LLing.
+                    #
+                    # We still have to filter timeline_start to LL entries (above) in order
+                    # for _calculate_state's LL logic to work, as we have to include LL
+                    # members for timeline senders in case they weren't loaded in the initial
+                    # sync.  We do this by (counterintuitively) by filtering timeline_start
+                    # members to just be ones which were timeline senders, which then ensures
+                    # all of the rest get included in the state block (if we need to know
+                    # about them).
+                    state_filter = StateFilter.all()
+
+                    # If this is an initial sync then full_state should be set, and
+                    # that case is handled above. We assert here to ensure that this
+                    # is indeed the case.
+                    assert since_token is not None
+                    lookups.append((room_id, "previous", since_token, state_filter))
+
+                    if batch:
+                        lookups.append(
+                            (
+                                room_id,
+                                "current",
+                                batch.events[-1].event_id,
+                                state_filter,
+                            )
+                        )
+                    else:
+                        # Its not clear how we get here, but empirically we do
+                        # (#5407). Logging has been added elsewhere to try and
+                        # figure out where this state comes from.
+                        lookups.append((room_id, "current", now_token, state_filter))
+                elif lazy_load_members:
                     if members_to_fetch and batch.events:
                         # We're returning an incremental sync, with no
                         # "gap" since the previous sync, so normally there would be
@@ -872,55 +982,161 @@ class SyncHandler:
                         # member events to understand the events in this timeline.
                         # So we fish out all the member events corresponding to the
                         # timeline here, and then dedupe any redundant ones below.
+                        lookups.append(
+                            (
+                                room_id,
+                                "timeline_start",
+                                batch.events[0].event_id,
+                                # we only want members!
+                                StateFilter.from_types(
+                                    (EventTypes.Member, member)
+                                    for member in members_to_fetch
+                                ),
+                            )
+                        )
 
-                        state_ids = await self.state_store.get_state_ids_for_event(
-                            batch.events[0].event_id,
-                            # we only want members!
-                            state_filter=StateFilter.from_types(
-                                (EventTypes.Member, member)
-                                for member in members_to_fetch
-                            ),
+            # The state at a stream position is the state after the last event
+            # in the room at that position, so we look those events up first.
+            positions = {
+                (room_id, at)
+                for room_id, _, at, _ in lookups
+                if isinstance(at, StreamToken)
+            }
+            last_events = {}  # type: Dict[Tuple[str, StreamToken], Optional[EventBase]]
+
+            async def get_last_event(position: Tuple[str, StreamToken]) -> None:
+                last_events[position] = await self._get_last_event_at(*position)
+
+            await concurrently_execute(get_last_event, positions, 10)
+
+            # Then we fetch the state for all the rooms together.
+            state_maps = {
+                room_id: {} for room_id, _, _, _ in rooms
+            }  # type: Dict[str, Dict[str, StateMap[str]]]
+            to_fetch = (
+                []
+            )  # type: List[Tuple[str, str, str, StateFilter, Optional[EventBase]]]
+
+            for room_id, name, at, state_filter in lookups:
+                if isinstance(at, StreamToken):
+                    last_event = last_events[(room_id, at)]
+                    if last_event is None:
+                        # no events in this room - so presumably no state
+                        state_maps[room_id][name] = {}
+                    else:
+                        to_fetch.append(
+                            (
+                                room_id,
+                                name,
+                                last_event.event_id,
+                                state_filter,
+                                last_event,
+                            )
                         )
+                else:
+                    to_fetch.append((room_id, name, at, state_filter, None))
 
-            if lazy_load_members and not include_redundant_members:
-                cache_key = (sync_config.user.to_string(), sync_config.device_id)
-                cache = self.get_lazy_loaded_members_cache(cache_key)
+            fetched_state_ids = await self.state_store.get_state_ids_for_events_bulk(
+                [
+                    (event_id, state_filter)
+                    for _, _, event_id, state_filter, _ in to_fetch
+                ]
+            )
 
-                # if it's a new sync sequence, then assume the client has had
-                # amnesia and doesn't want any recent lazy-loaded members
-                # de-duplicated.
-                if since_token is None:
-                    logger.debug("clearing LruCache for %r", cache_key)
-                    cache.clear()
-                else:
-                    # only send members which aren't in our LruCache (either
-                    # because they're new to this client or have been pushed out
-                    # of the cache)
-                    logger.debug("filtering state from %r...", state_ids)
-                    state_ids = {
-                        t: event_id
-                        for t, event_id in state_ids.items()
-                        if cache.get(t[1]) != event_id
-                    }
-                    logger.debug("...to %r", state_ids)
+            for (room_id, name, _, _, last_event), state_ids in zip(
+                to_fetch, fetched_state_ids
+            ):
+                # The state at a stream position includes the last event itself.
+                if last_event is not None and last_event.is_state():
+                    state_ids = dict(state_ids)
+                    state_ids[
+                        (last_event.type, last_event.state_key)
+                    ] = last_event.event_id
+                state_maps[room_id][name] = state_ids
+
+            state_ids_by_room = {}  # type: Dict[str, StateMap[str]]
+            for room_id, batch, since_token, full_state in rooms:
+                room_state_maps = state_maps[room_id]
+
+                timeline_state = {
+                    (event.type, event.state_key): event.event_id
+                    for event in batch.events
+                    if event.is_state()
+                }
 
-                # add any member IDs we are about to send into our LruCache
-                for t, event_id in itertools.chain(
-                    state_ids.items(), timeline_state.items()
-                ):
-                    if t[0] == EventTypes.Member:
-                        cache.set(t[1], event_id)
+                if full_state:
+                    state_ids = _calculate_state(
+                        timeline_contains=timeline_state,
+                        timeline_start=room_state_maps["timeline_start"],
+                        previous={},
+                        current=room_state_maps["current"],
+                        lazy_load_members=lazy_load_members,
+                    )
+                elif batch.limited:
+                    state_ids = _calculate_state(
+                        timeline_contains=timeline_state,
+                        timeline_start=room_state_maps["timeline_start"],
+                        previous=room_state_maps["previous"],
+                        current=room_state_maps["current"],
+                        # we have to include LL members in case LL initial sync missed them
+                        lazy_load_members=lazy_load_members,
+                    )
+                else:
+                    state_ids = room_state_maps.get("timeline_start", {})
+
+                if lazy_load_members and not include_redundant_members:
+                    cache_key = (sync_config.user.to_string(), sync_config.device_id)
+                    cache = self.get_lazy_loaded_members_cache(cache_key)
+
+                    # if it's a new sync sequence, then assume the client has had
+                    # amnesia and doesn't want any recent lazy-loaded members
+                    # de-duplicated.
+                    if since_token is None:
+                        logger.debug("clearing LruCache for %r", cache_key)
+                        cache.clear()
+                    else:
+                        # only send members which aren't in our LruCache (either
+                        # because they're new to this client or have been pushed out
+                        # of the cache)
+                        logger.debug("filtering state from %r...", state_ids)
+                        state_ids = {
+                            t: event_id
+                            for t, event_id in state_ids.items()
+                            if cache.get(t[1]) != event_id
+                        }
+                        logger.debug("...to %r", state_ids)
+
+                    # add any member IDs we are about to send into our LruCache
+                    for t, event_id in itertools.chain(
+                        state_ids.items(), timeline_state.items()
+                    ):
+                        if t[0] == EventTypes.Member:
+                            cache.set(t[1], event_id)
+
+                state_ids_by_room[room_id] = state_ids
 
         state = {}  # type: Dict[str, EventBase]
-        if state_ids:
-            state = await self.store.get_events(list(state_ids.values()))
+        state_event_ids = {
+            event_id
+            for state_ids in state_ids_by_room.values()
+            for event_id in state_ids.values()
+        }
+        if state_event_ids:
+            state = await self.store.get_events(list(state_event_ids))
 
         return {
-            (e.type, e.state_key): e
-            for e in sync_config.filter_collection.filter_room_state(
-                list(state.values())
-            )
-            if e.type != EventTypes.Aliases  # until MSC2261 or alternative solution
+            room_id: {
+                (e.type, e.state_key): e
+                for e in sync_config.filter_collection.filter_room_state(
+                    [
+                        state[event_id]
+                        for event_id in state_ids.values()
+                        if event_id in state
+                    ]
+                )
+                if e.type != EventTypes.Aliases  # until MSC2261 or alternative solution
+            }
+            for room_id, state_ids in state_ids_by_room.items()
         }
 
     async def unread_notifs_for_room_id(
@@ -938,13 +1154,38 @@ class SyncHandler:
             )
             return notifs
 
+    async def unread_notifs_for_room_ids(
+        self, room_ids: List[str], sync_config: SyncConfig
+    ) -> Dict[str, Dict[str, int]]:
+        """Bulk version of `unread_notifs_for_room_id`."""
+        with Measure(self.clock, "unread_notifs_for_room_ids"):
+            user_id = sync_config.user.to_string()
+
+            last_unread_event_ids = await self.store.get_last_receipt_event_ids_for_user(
+                user_id=user_id, room_ids=room_ids, receipt_type="m.read",
+            )
+
+            return await self.store.get_unread_event_push_actions_for_rooms(
+                user_id,
+                {room_id: last_unread_event_ids.get(room_id) for room_id in room_ids},
+            )
+
     async def generate_sync_result(
         self,
         sync_config: SyncConfig,
         since_token: Optional[StreamToken] = None,
         full_state: bool = False,
+        room_entry_callback: Optional[RoomEntryCallback] = None,
     ) -> SyncResult:
         """Generates a sync result.
+
+        Args:
+            sync_config
+            since_token
+            full_state
+            room_entry_callback: If given, each joined and archived room entry
+                is passed to this as soon as it is generated, instead of being
+                included in the result.
         """
         # NB: The now_token gets changed by some of the generate_sync_* methods,
         # this is due to some of the underlying streams not supporting the ability
@@ -952,6 +1193,18 @@ class SyncHandler:
         # Always use the `now_token` in `SyncResultBuilder`
         now_token = self.event_sources.get_current_token()
 
+        if self._action_generator:
+            # Only send events whose push actions have been stored, so that the
+            # unread counts are right. The action generator wakes up the
+            # syncing clients once they are.
+            position = self._action_generator.get_deferred_actions_position()
+            if position is not None and since_token:
+                position = max(position, since_token.room_key.stream)
+            if position is not None and position < now_token.room_key.stream:
+                now_token = now_token.copy_and_replace(
+                    "room_key", RoomStreamToken(None, position)
+                )
+
         logger.debug(
             "Calculating sync response for %r between %s and %s",
             sync_config.user,
@@ -975,6 +1228,7 @@ class SyncHandler:
             since_token=since_token,
             now_token=now_token,
             joined_room_ids=joined_room_ids,
+            room_entry_callback=room_entry_callback,
         )
 
         logger.debug("Fetching account data")
@@ -1401,26 +1655,48 @@ class SyncHandler:
 
             tags_by_room = await self.store.get_tags_for_user(user_id)
 
+            if self._initial_sync_snapshots_enabled:
+                await self._load_initial_sync_snapshot(
+                    sync_result_builder, ignored_users, room_changes.room_entries
+                )
+
         room_entries = room_changes.room_entries
         invited = room_changes.invited
         newly_joined_rooms = room_changes.newly_joined_rooms
         newly_left_rooms = room_changes.newly_left_rooms
 
-        async def handle_room_entries(room_entry):
-            logger.debug("Generating room entry for %s", room_entry.room_id)
-            res = await self._generate_room_entry(
-                sync_result_builder,
-                ignored_users,
-                room_entry,
-                ephemeral=ephemeral_by_room.get(room_entry.room_id, []),
-                tags=tags_by_room.get(room_entry.room_id),
-                account_data=account_data_by_room.get(room_entry.room_id, {}),
-                always_include=sync_result_builder.full_state,
+        # We generate the room entries in batches, so that the state for the
+        # rooms in each batch can be fetched together.
+        generated_room_entries = []  # type: List[_RoomEntry]
+        for room_entries_batch in batch_iter(room_entries, ROOM_ENTRY_BATCH_SIZE):
+            generated_room_entries.extend(
+                await self._generate_room_entries(
+                    sync_result_builder,
+                    ignored_users,
+                    room_entries_batch,
+                    ephemeral_by_room=ephemeral_by_room,
+                    tags_by_room=tags_by_room,
+                    account_data_by_room=account_data_by_room,
+                )
+            )
+
+        if sync_result_builder.snapshot_rooms:
+            self._cache_lazy_loaded_snapshot_members(
+                sync_result_builder.sync_config, generated_room_entries
             )
-            logger.debug("Generated room entry for %s", room_entry.room_id)
-            return res
 
-        await concurrently_execute(handle_room_entries, room_entries, 10)
+        if sync_result_builder.new_snapshot_rooms is not None:
+            # Write the snapshot in the background, rather than holding up the
+            # response.
+            run_as_background_process(
+                "store_initial_sync_snapshot",
+                self.store.store_initial_sync_snapshot,
+                user_id,
+                _get_filter_key(sync_result_builder.sync_config.filter_collection),
+                await sync_result_builder.now_token.to_string(self.store),
+                sorted(ignored_users),
+                sync_result_builder.new_snapshot_rooms,
+            )
 
         sync_result_builder.invited.extend(invited)
 
@@ -1454,6 +1730,122 @@ class SyncHandler:
             newly_left_users,
         )
 
+    async def _load_initial_sync_snapshot(
+        self,
+        sync_result_builder: "SyncResultBuilder",
+        ignored_users: FrozenSet[str],
+        room_entries: List["RoomSyncResultBuilder"],
+    ) -> None:
+        """Finds the room entries in the snapshot of the user's last initial sync
+        which can be reused, as there have been no new events in the room since,
+        and arranges for a new snapshot to be taken.
+
+        Args:
+            sync_result_builder
+            ignored_users: Set of users ignored by user.
+            room_entries: The rooms to be included in the initial sync.
+        """
+        if len(room_entries) < self._initial_sync_snapshots_min_rooms:
+            return
+
+        sync_result_builder.new_snapshot_rooms = {}
+
+        res = await self.store.get_initial_sync_snapshot(
+            sync_result_builder.sync_config.user.to_string(),
+            _get_filter_key(sync_result_builder.sync_config.filter_collection),
+        )
+        if res is None:
+            return
+
+        token, snapshot_ignored_users, snapshot_room_ids = res
+
+        # Ignoring users changes which events are in the timelines.
+        if snapshot_ignored_users != sorted(ignored_users):
+            return
+
+        snapshot_token = await StreamToken.from_string(self.store, token)
+
+        room_ids = [
+            room_entry.room_id
+            for room_entry in room_entries
+            if room_entry.room_id in snapshot_room_ids
+        ]
+        changed_room_ids = await self.store.get_rooms_with_events_since(
+            room_ids, snapshot_token.room_key
+        )
+
+        # Only load the entries for the rooms which can be reused.
+        snapshot_rooms = await self.store.get_initial_sync_snapshot_rooms(
+            sync_result_builder.sync_config.user.to_string(),
+            _get_filter_key(sync_result_builder.sync_config.filter_collection),
+            [room_id for room_id in room_ids if room_id not in changed_room_ids],
+        )
+
+        for room_entry in room_entries:
+            room_id = room_entry.room_id
+            snapshot_room = snapshot_rooms.get(room_id)
+            if (
+                snapshot_room is not None
+                and snapshot_room["rtype"] == room_entry.rtype
+                and room_id not in changed_room_ids
+            ):
+                sync_result_builder.snapshot_rooms[room_id] = snapshot_room
+
+        logger.debug(
+            "Reusing %d of %d rooms from initial sync snapshot",
+            len(sync_result_builder.snapshot_rooms),
+            len(room_entries),
+        )
+
+    async def _load_room_entry_from_snapshot(
+        self, sync_config: SyncConfig, room_id: str, snapshot_room: JsonDict
+    ) -> Optional[Tuple[TimelineBatch, StateMap[EventBase], Optional[JsonDict]]]:
+        """Loads the timeline, state and summary of a room entry in an initial
+        sync snapshot.
+
+        Returns:
+            None if any of the events are no longer available, or the user may
+            no longer see any of the timeline events.
+        """
+        timeline_ids = snapshot_room["timeline"]
+        state_ids = snapshot_room["state"]
+
+        events = await self.store.get_events(timeline_ids + state_ids)
+        if len(events) != len(timeline_ids) + len(state_ids):
+            return None
+
+        # Which events the user may see (and whether they are pruned) can change
+        # without any new events in the room, e.g. if a sender is erased, so we
+        # filter the timeline again, as `_load_filtered_recents` does.
+        recents = [events[event_id] for event_id in timeline_ids]
+        current_state_ids = frozenset()  # type: FrozenSet[str]
+        if any(e.is_state() for e in recents):
+            current_state_ids_map = await self.state.get_current_state_ids(room_id)
+            current_state_ids = frozenset(current_state_ids_map.values())
+
+        filtered_recents = await filter_events_for_client(
+            self.storage,
+            sync_config.user.to_string(),
+            recents,
+            always_include_ids=current_state_ids,
+        )
+        if len(filtered_recents) != len(recents):
+            return None
+
+        batch = TimelineBatch(
+            prev_batch=await StreamToken.from_string(
+                self.store, snapshot_room["prev_batch"]
+            ),
+            events=filtered_recents,
+            limited=snapshot_room["limited"],
+        )
+        state = {
+            (event.type, event.state_key): event
+            for event in (events[event_id] for event_id in state_ids)
+        }
+
+        return batch, state, snapshot_room["summary"]
+
     async def _have_rooms_changed(
         self, sync_result_builder: "SyncResultBuilder"
     ) -> bool:
@@ -1764,7 +2156,131 @@ class SyncHandler:
 
         return _RoomChanges(room_entries, invited, [], [])
 
-    async def _generate_room_entry(
+    async def _generate_room_entries(
+        self,
+        sync_result_builder: "SyncResultBuilder",
+        ignored_users: FrozenSet[str],
+        room_builders: Iterable["RoomSyncResultBuilder"],
+        ephemeral_by_room: Dict[str, List[JsonDict]],
+        tags_by_room: Dict[str, Dict[str, Dict[str, Any]]],
+        account_data_by_room: Dict[str, Dict[str, JsonDict]],
+    ) -> "List[_RoomEntry]":
+        """Populates the `joined` and `archived` section of `sync_result_builder`
+        based on the `room_builders`, computing the state for all the rooms
+        together.
+
+        Args:
+            sync_result_builder
+            ignored_users: Set of users ignored by user.
+            room_builders
+            ephemeral_by_room: Map from room ID to list of new ephemeral events
+                for the room.
+            tags_by_room: Map from room ID to *all* tags for the room, for rooms
+                where the tags have changed.
+            account_data_by_room: Map from room ID to new account data for the
+                room.
+
+        Returns:
+            The entries for the rooms included in the sync response.
+        """
+        room_entries = []  # type: List[_RoomEntry]
+
+        async def prepare_room_entry(room_builder: "RoomSyncResultBuilder"):
+            logger.debug("Generating room entry for %s", room_builder.room_id)
+            room_entry = await self._prepare_room_entry(
+                sync_result_builder,
+                ignored_users,
+                room_builder,
+                ephemeral=ephemeral_by_room.get(room_builder.room_id, []),
+                tags=tags_by_room.get(room_builder.room_id),
+                account_data=account_data_by_room.get(room_builder.room_id, {}),
+                always_include=sync_result_builder.full_state,
+            )
+            if room_entry is not None:
+                room_entries.append(room_entry)
+
+        await concurrently_execute(prepare_room_entry, room_builders, 10)
+
+        state_by_room = await self.compute_state_deltas(
+            sync_result_builder.sync_config,
+            sync_result_builder.now_token,
+            [
+                (
+                    room_entry.room_builder.room_id,
+                    room_entry.batch,
+                    room_entry.room_builder.since_token,
+                    room_entry.full_state,
+                )
+                for room_entry in room_entries
+                if room_entry.snapshot_entry is None
+            ],
+        )
+
+        # Get the notification counts for all the joined rooms at once.
+        notifs_by_room = await self.unread_notifs_for_room_ids(
+            [
+                room_entry.room_builder.room_id
+                for room_entry in room_entries
+                if room_entry.room_builder.rtype == "joined"
+            ],
+            sync_result_builder.sync_config,
+        )
+
+        async def finish_room_entry(room_entry: _RoomEntry):
+            room_id = room_entry.room_builder.room_id
+            await self._finish_room_entry(
+                sync_result_builder,
+                room_entry,
+                state_by_room.get(room_id),
+                notifs_by_room.get(room_id),
+            )
+            logger.debug("Generated room entry for %s", room_id)
+
+        await concurrently_execute(finish_room_entry, room_entries, 10)
+
+        return room_entries
+
+    def _cache_lazy_loaded_snapshot_members(
+        self, sync_config: SyncConfig, room_entries: List["_RoomEntry"]
+    ) -> None:
+        """Adds the members sent in the rooms served from an initial sync
+        snapshot to the lazy-loaded members cache, as `compute_state_deltas`
+        does for the other rooms.
+
+        Args:
+            sync_config
+            room_entries: The entries for all the rooms in the sync response,
+                some of which may have been loaded from a snapshot.
+        """
+        snapshot_entries = [
+            room_entry.snapshot_entry
+            for room_entry in room_entries
+            if room_entry.snapshot_entry is not None
+        ]
+        if not snapshot_entries:
+            return
+
+        if not sync_config.filter_collection.lazy_load_members():
+            return
+        if sync_config.filter_collection.include_redundant_members():
+            return
+
+        cache_key = (sync_config.user.to_string(), sync_config.device_id)
+        cache = self.get_lazy_loaded_members_cache(cache_key)
+
+        # Snapshots are only used for initial syncs, for which the cache is
+        # cleared. `compute_state_deltas` has already done so if any rooms
+        # were recomputed, in which case the members it sent must be kept.
+        if len(snapshot_entries) == len(room_entries):
+            logger.debug("clearing LruCache for %r", cache_key)
+            cache.clear()
+
+        for batch, state, _ in snapshot_entries:
+            for event in itertools.chain(state.values(), batch.events):
+                if event.type == EventTypes.Member:
+                    cache.set(event.state_key, event.event_id)
+
+    async def _prepare_room_entry(
         self,
         sync_result_builder: "SyncResultBuilder",
         ignored_users: FrozenSet[str],
@@ -1773,9 +2289,9 @@ class SyncHandler:
         tags: Optional[Dict[str, Dict[str, Any]]],
         account_data: Dict[str, JsonDict],
         always_include: bool = False,
-    ):
-        """Populates the `joined` and `archived` section of `sync_result_builder`
-        based on the `room_builder`.
+    ) -> "Optional[_RoomEntry]":
+        """Loads the timeline and other parts of a room entry which don't depend
+        on the state of the room.
 
         Args:
             sync_result_builder
@@ -1787,6 +2303,9 @@ class SyncHandler:
             account_data: List of new account data for room
             always_include: Always include this room in the sync response,
                 even if empty.
+
+        Returns:
+            None if the room should not be included in the sync response.
         """
         newly_joined = room_builder.newly_joined
         full_state = (
@@ -1797,23 +2316,32 @@ class SyncHandler:
         # We want to shortcut out as early as possible.
         if not (always_include or account_data or ephemeral or full_state):
             if events == [] and tags is None:
-                return
+                return None
 
-        now_token = sync_result_builder.now_token
         sync_config = sync_result_builder.sync_config
 
         room_id = room_builder.room_id
         since_token = room_builder.since_token
         upto_token = room_builder.upto_token
 
-        batch = await self._load_filtered_recents(
-            room_id,
-            sync_config,
-            now_token=upto_token,
-            since_token=since_token,
-            potential_recents=events,
-            newly_joined_room=newly_joined,
-        )
+        snapshot_room = sync_result_builder.snapshot_rooms.get(room_id)
+        snapshot_entry = None
+        if snapshot_room is not None:
+            snapshot_entry = await self._load_room_entry_from_snapshot(
+                sync_config, room_id, snapshot_room
+            )
+
+        if snapshot_entry is not None:
+            batch = snapshot_entry[0]
+        else:
+            batch = await self._load_filtered_recents(
+                room_id,
+                sync_config,
+                now_token=upto_token,
+                since_token=since_token,
+                potential_recents=events,
+                newly_joined_room=newly_joined,
+            )
 
         # Note: `batch` can be both empty and limited here in the case where
         # `_load_filtered_recents` can't find any events the user should see
@@ -1856,73 +2384,134 @@ class SyncHandler:
         if not (
             always_include or batch or account_data_events or ephemeral or full_state
         ):
-            return
+            return None
 
-        state = await self.compute_state_delta(
-            room_id, batch, sync_config, since_token, now_token, full_state=full_state
+        return _RoomEntry(
+            room_builder=room_builder,
+            full_state=full_state,
+            always_include=always_include,
+            batch=batch,
+            ephemeral=ephemeral,
+            account_data_events=account_data_events,
+            snapshot_entry=snapshot_entry,
         )
 
+    async def _finish_room_entry(
+        self,
+        sync_result_builder: "SyncResultBuilder",
+        room_entry: "_RoomEntry",
+        state: Optional[MutableStateMap[EventBase]],
+        notifs: Optional[Dict[str, int]] = None,
+    ):
+        """Populates the `joined` and `archived` section of `sync_result_builder`
+        based on the `room_entry`.
+
+        Args:
+            sync_result_builder
+            room_entry
+            state: The state delta for the room, unless it is being loaded from
+                an initial sync snapshot.
+            notifs: The unread notification counts for the room, if they have
+                already been fetched.
+        """
+        room_builder = room_entry.room_builder
+        batch = room_entry.batch
+        always_include = room_entry.always_include
+
+        now_token = sync_result_builder.now_token
+        sync_config = sync_result_builder.sync_config
+
+        room_id = room_builder.room_id
+        since_token = room_builder.since_token
+
         summary = {}  # type: Optional[JsonDict]
+        if room_entry.snapshot_entry is not None:
+            _, room_state, summary = room_entry.snapshot_entry
+        else:
+            assert state is not None
+            room_state = state
+
+            # we include a summary in room responses when we're lazy loading
+            # members (as the client otherwise doesn't have enough info to form
+            # the name itself).
+            if sync_config.filter_collection.lazy_load_members() and (
+                # we recalulate the summary:
+                #   if there are membership changes in the timeline, or
+                #   if membership has changed during a gappy sync, or
+                #   if this is an initial sync.
+                any(ev.type == EventTypes.Member for ev in batch.events)
+                or (
+                    # XXX: this may include false positives in the form of LL
+                    # members which have snuck into state
+                    batch.limited
+                    and any(t == EventTypes.Member for (t, k) in state)
+                )
+                or since_token is None
+            ):
+                summary = await self.compute_summary(
+                    room_id, sync_config, batch, state, now_token
+                )
 
-        # we include a summary in room responses when we're lazy loading
-        # members (as the client otherwise doesn't have enough info to form
-        # the name itself).
-        if sync_config.filter_collection.lazy_load_members() and (
-            # we recalulate the summary:
-            #   if there are membership changes in the timeline, or
-            #   if membership has changed during a gappy sync, or
-            #   if this is an initial sync.
-            any(ev.type == EventTypes.Member for ev in batch.events)
-            or (
-                # XXX: this may include false positives in the form of LL
-                # members which have snuck into state
-                batch.limited
-                and any(t == EventTypes.Member for (t, k) in state)
-            )
-            or since_token is None
-        ):
-            summary = await self.compute_summary(
-                room_id, sync_config, batch, state, now_token
-            )
+        if sync_result_builder.new_snapshot_rooms is not None:
+            if room_entry.snapshot_entry is not None:
+                # The room's entry in the snapshot is kept as is.
+                new_snapshot_room = None  # type: Optional[JsonDict]
+            else:
+                new_snapshot_room = {
+                    "rtype": room_builder.rtype,
+                    "timeline": [event.event_id for event in batch.events],
+                    "prev_batch": await batch.prev_batch.to_string(self.store),
+                    "limited": batch.limited,
+                    "state": [event.event_id for event in room_state.values()],
+                    "summary": summary,
+                }
+            sync_result_builder.new_snapshot_rooms[room_id] = new_snapshot_room
 
         if room_builder.rtype == "joined":
             unread_notifications = {}  # type: Dict[str, int]
             room_sync = JoinedSyncResult(
                 room_id=room_id,
                 timeline=batch,
-                state=state,
-                ephemeral=ephemeral,
-                account_data=account_data_events,
+                state=room_state,
+                ephemeral=room_entry.ephemeral,
+                account_data=room_entry.account_data_events,
                 unread_notifications=unread_notifications,
                 summary=summary,
                 unread_count=0,
             )
 
             if room_sync or always_include:
-                notifs = await self.unread_notifs_for_room_id(room_id, sync_config)
+                if notifs is None:
+                    notifs = await self.unread_notifs_for_room_id(room_id, sync_config)
 
                 unread_notifications["notification_count"] = notifs["notify_count"]
                 unread_notifications["highlight_count"] = notifs["highlight_count"]
 
                 room_sync.unread_count = notifs["unread_count"]
 
-                sync_result_builder.joined.append(room_sync)
+                if sync_result_builder.room_entry_callback:
+                    await sync_result_builder.room_entry_callback(room_sync)
+                else:
+                    sync_result_builder.joined.append(room_sync)
 
             if batch.limited and since_token:
                 user_id = sync_result_builder.sync_config.user.to_string()
                 logger.debug(
                     "Incremental gappy sync of %s for user %s with %d state events"
-                    % (room_id, user_id, len(state))
+                    % (room_id, user_id, len(room_state))
                 )
         elif room_builder.rtype == "archived":
             archived_room_sync = ArchivedSyncResult(
                 room_id=room_id,
                 timeline=batch,
-                state=state,
-                account_data=account_data_events,
+                state=room_state,
+                account_data=room_entry.account_data_events,
             )
             if archived_room_sync or always_include:
-                sync_result_builder.archived.append(archived_room_sync)
+                if sync_result_builder.room_entry_callback:
+                    await sync_result_builder.room_entry_callback(archived_room_sync)
+                else:
+                    sync_result_builder.archived.append(archived_room_sync)
         else:
             raise Exception("Unrecognized rtype: %r", room_builder.rtype)
 
@@ -1970,6 +2559,12 @@ class SyncHandler:
         return frozenset(joined_room_ids)
 
 
+def _get_filter_key(filter_collection: FilterCollection) -> str:
+    """Returns the key for the initial sync snapshots taken with the filter."""
+    filter_json = encode_canonical_json(filter_collection.get_filter_json())
+    return hashlib.sha256(filter_json).hexdigest()
+
+
 def _action_has_highlight(actions: List[JsonDict]) -> bool:
     for action in actions:
         try:
@@ -2045,6 +2640,13 @@ class SyncResultBuilder:
         since_token: The token supplied by user, or None.
         now_token: The token to sync up to.
         joined_room_ids: List of rooms the user is joined to
+        room_entry_callback: If set, joined and archived room entries are passed
+            to this rather than being added to `joined` and `archived`.
+        snapshot_rooms: The room entries in the snapshot of the user's last
+            initial sync which can be reused.
+        new_snapshot_rooms: If set, the room entries for a new initial sync
+            snapshot are added to this, with None for the rooms whose entries
+            in the existing snapshot are reused.
 
         # The following mirror the fields in a sync response
         presence (list)
@@ -2061,6 +2663,7 @@ class SyncResultBuilder:
     since_token = attr.ib(type=Optional[StreamToken])
     now_token = attr.ib(type=StreamToken)
     joined_room_ids = attr.ib(type=FrozenSet[str])
+    room_entry_callback = attr.ib(type=Optional[RoomEntryCallback], default=None)
 
     presence = attr.ib(type=List[JsonDict], default=attr.Factory(list))
     account_data = attr.ib(type=List[JsonDict], default=attr.Factory(list))
@@ -2070,6 +2673,11 @@ class SyncResultBuilder:
     groups = attr.ib(type=Optional[GroupsSyncResult], default=None)
     to_device = attr.ib(type=List[JsonDict], default=attr.Factory(list))
 
+    snapshot_rooms = attr.ib(type=Dict[str, JsonDict], default=attr.Factory(dict))
+    new_snapshot_rooms = attr.ib(
+        type=Optional[Dict[str, Optional[JsonDict]]], default=None
+    )
+
 
 @attr.s(slots=True)
 class RoomSyncResultBuilder:
@@ -2094,3 +2702,30 @@ class RoomSyncResultBuilder:
     full_state = attr.ib(type=bool)
     since_token = attr.ib(type=Optional[StreamToken])
     upto_token = attr.ib(type=StreamToken)
+
+
+@attr.s(slots=True)
+class _RoomEntry:
+    """The parts of a room entry which are worked out before the state of the
+    room.
+
+    Attributes:
+        room_builder
+        full_state: Whether the full state should be sent in result
+        always_include: Whether to include the room even if it's empty
+        batch: The timeline batch for the room
+        ephemeral: List of new ephemeral events for the room
+        account_data_events: List of account data events for the room
+        snapshot_entry: The timeline, state and summary loaded from the room's
+            entry in the initial sync snapshot, if it can be reused.
+    """
+
+    room_builder = attr.ib(type=RoomSyncResultBuilder)
+    full_state = attr.ib(type=bool)
+    always_include = attr.ib(type=bool)
+    batch = attr.ib(type=TimelineBatch)
+    ephemeral = attr.ib(type=List[JsonDict])
+    account_data_events = attr.ib(type=List[JsonDict])
+    snapshot_entry = attr.ib(
+        type=Optional[Tuple[TimelineBatch, StateMap[EventBase], Optional[JsonDict]]]
+    )
@@ -22,7 +22,7 @@ import types
 import urllib
 from http import HTTPStatus
 from io import BytesIO
-from typing import Any, Callable, Dict, Iterator, List, Tuple, Union
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
 
 import jinja2
 from canonicaljson import iterencode_canonical_json, iterencode_pretty_printed_json
@@ -35,8 +35,6 @@ from twisted.web.server import NOT_DONE_YET, Request
 from twisted.web.static import File, NoRangeStaticProducer
 from twisted.web.util import redirectTo
 
-import synapse.events
-import synapse.metrics
 from synapse.api.errors import (
     CodeMessageException,
     Codes,
@@ -45,7 +43,7 @@ from synapse.api.errors import (
     UnrecognizedRequestError,
 )
 from synapse.http.site import SynapseRequest
-from synapse.logging.context import preserve_fn
+from synapse.logging.context import make_deferred_yieldable, preserve_fn
 from synapse.logging.opentracing import trace_servlet
 from synapse.util import json_encoder
 from synapse.util.caches import intern_dict
@@ -576,6 +574,98 @@ class _ByteProducer:
         self._request = None
 
 
+class JsonStreamWriter:
+    """
+    Writes a JSON response to the request piece by piece, as it is generated.
+
+    The caller is responsible for writing valid JSON.
+
+    `write` waits while there is backpressure from the client, so a caller
+    which awaits each `write` before generating more of the response only
+    holds on to the part of the response which is being generated.
+
+    Args:
+        request: The http request to respond to.
+        code: The HTTP response code.
+        send_cors: Whether to send Cross-Origin Resource Sharing headers
+            https://fetch.spec.whatwg.org/#http-cors-protocol
+    """
+
+    def __init__(self, request: Request, code: int, send_cors: bool = False):
+        self._request = request  # type: Optional[Request]
+        self._paused = False
+
+        # Deferreds for the calls to `write` waiting for us to be resumed.
+        self._waiting = []  # type: List[defer.Deferred]
+
+        request.setResponseCode(code)
+        request.setHeader(b"Content-Type", b"application/json")
+        request.setHeader(b"Cache-Control", b"no-cache, no-store, must-revalidate")
+
+        if send_cors:
+            set_cors_headers(request)
+
+        request.registerProducer(self, True)
+
+    async def write(self, data: bytes) -> None:
+        """Writes some of the response, and waits until the client is ready
+        for more.
+
+        Does nothing if the client has disconnected.
+        """
+        if not self._request or self._request._disconnected:
+            return
+
+        self._request.write(data)
+
+        if self._paused:
+            d = defer.Deferred()  # type: defer.Deferred[None]
+            self._waiting.append(d)
+            await make_deferred_yieldable(d)
+
+    def finish(self) -> None:
+        """Finishes the response."""
+        if not self._request:
+            return
+
+        self._request.unregisterProducer()
+        if not self._request._disconnected:
+            self._request.finish()
+        self.stopProducing()
+
+    def abort(self) -> None:
+        """Aborts the response by closing the connection, for when something
+        goes wrong after part of the response has been written, so that an
+        error can no longer be sent.
+        """
+        if not self._request:
+            return
+
+        self._request.unregisterProducer()
+        if self._request.transport:
+            try:
+                self._request.transport.abortConnection()
+            except Exception:
+                # abortConnection throws if the connection is already closed
+                pass
+        self.stopProducing()
+
+    def pauseProducing(self) -> None:
+        self._paused = True
+
+    def resumeProducing(self) -> None:
+        self._paused = False
+
+        waiting, self._waiting = self._waiting, []
+        for d in waiting:
+            d.callback(None)
+
+    def stopProducing(self) -> None:
+        # Clear a circular reference, and don't leave any writers waiting.
+        self._request = None
+        self.resumeProducing()
+
+
 def _encode_json_bytes(json_object: Any) -> Iterator[bytes]:
     """
     Encode an object into JSON. Returns an iterator of bytes.
@@ -620,7 +710,7 @@ def respond_with_json(
     if pretty_print:
         encoder = iterencode_pretty_printed_json
     else:
-        if canonical_json or synapse.events.USE_FROZEN_DICTS:
+        if canonical_json:
             encoder = iterencode_canonical_json
         else:
             encoder = _encode_json_bytes
@@ -28,7 +28,7 @@ from typing import (
     Union,
 )
 
-from prometheus_client import Counter
+from prometheus_client import Counter, Histogram
 
 from twisted.internet import defer
 
@@ -61,6 +61,23 @@ users_woken_by_stream_counter = Counter(
     "synapse_notifier_users_woken_by_stream", "", ["stream"]
 )
 
+notifier_fanout_histogram = Histogram(
+    "synapse_notifier_fanout",
+    "Number of listeners woken up by each batch of notifications",
+    buckets=(0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000),
+)
+
+skipped_wakeups_counter = Counter(
+    "synapse_notifier_skipped_wakeups",
+    "Number of times a listener wasn't woken up as its filter excluded the new "
+    "room events",
+)
+
+wake_to_response_histogram = Histogram(
+    "synapse_notifier_wake_to_response_seconds",
+    "Time from a listener being woken up to it having a response",
+)
+
 T = TypeVar("T")
 
 
@@ -118,27 +135,75 @@ class _NotifierUserStream:
         with PreserveLoggingContext():
             self.notify_deferred = ObservableDeferred(defer.Deferred())
 
+        # The listeners which are only woken up for room events which pass
+        # their filter, mapped to the filter.
+        self.filtered_listeners = (
+            {}
+        )  # type: Dict[defer.Deferred, Callable[[EventBase], bool]]
+
+        # Whether any of the notifications since the listeners were last woken
+        # up should wake all of them, and the room events in the others.
+        self.pending_wake_all = False
+        self.pending_events = []  # type: List[EventBase]
+
     def notify(
-        self, stream_key: str, stream_id: Union[int, RoomStreamToken], time_now_ms: int,
+        self,
+        stream_key: str,
+        stream_id: Union[int, RoomStreamToken],
+        time_now_ms: int,
+        events: Optional[List[EventBase]] = None,
     ):
-        """Notify any listeners for this user of a new event from an
-        event source.
+        """Notify this user of a new event from an event source. The listeners
+        are woken up by calling `wake`.
+
         Args:
             stream_key: The stream the event came from.
             stream_id: The new id for the stream the event came from.
             time_now_ms: The current time in milliseconds.
+            events: The new room events, if listeners with a filter should only
+                be woken up for these. If None, all listeners are woken up.
         """
         self.current_token = self.current_token.copy_and_advance(stream_key, stream_id)
         self.last_notified_token = self.current_token
         self.last_notified_ms = time_now_ms
-        noify_deferred = self.notify_deferred
+
+        if events is None:
+            self.pending_wake_all = True
+        else:
+            self.pending_events.extend(events)
 
         users_woken_by_stream_counter.labels(stream_key).inc()
 
+    def wake(self) -> int:
+        """Wake up the listeners which are interested in the notifications
+        since they were last woken up.
+
+        Returns:
+            The number of listeners woken up.
+        """
+        wake_all = self.pending_wake_all
+        events = self.pending_events
+        self.pending_wake_all = False
+        self.pending_events = []
+
+        woken = len(self.notify_deferred.observers())
+        noify_deferred = self.notify_deferred
+
         with PreserveLoggingContext():
             self.notify_deferred = ObservableDeferred(defer.Deferred())
             noify_deferred.callback(self.current_token)
 
+        for d, event_filter in list(self.filtered_listeners.items()):
+            if wake_all or any(event_filter(event) for event in events):
+                del self.filtered_listeners[d]
+                woken += 1
+                with PreserveLoggingContext():
+                    d.callback(self.current_token)
+            else:
+                skipped_wakeups_counter.inc()
+
+        return woken
+
     def remove(self, notifier: "Notifier"):
         """ Remove this listener from all the indexes in the Notifier
         it knows about.
@@ -151,22 +216,32 @@ class _NotifierUserStream:
         notifier.user_to_user_stream.pop(self.user_id)
 
     def count_listeners(self) -> int:
-        return len(self.notify_deferred.observers())
+        return len(self.notify_deferred.observers()) + len(self.filtered_listeners)
 
-    def new_listener(self, token: StreamToken) -> _NotificationListener:
+    def new_listener(
+        self,
+        token: StreamToken,
+        event_filter: Optional[Callable[[EventBase], bool]] = None,
+    ) -> _NotificationListener:
         """Returns a deferred that is resolved when there is a new token
         greater than the given token.
 
         Args:
             token: The token from which we are streaming from, i.e. we shouldn't
                 notify for things that happened before this.
+            event_filter: If given, the deferred is only resolved for new room
+                events which pass the filter.
         """
         # Immediately wake up stream if something has already since happened
         # since their last token.
         if self.last_notified_token != token:
             return _NotificationListener(defer.succeed(self.current_token))
-        else:
+        elif event_filter is None:
             return _NotificationListener(self.notify_deferred.observe())
+        else:
+            d = defer.Deferred(canceller=lambda d: self.filtered_listeners.pop(d, None))
+            self.filtered_listeners[d] = event_filter
+            return _NotificationListener(d)
 
 
 class EventStreamResult(namedtuple("EventStreamResult", ("events", "tokens"))):
@@ -203,6 +278,19 @@ class Notifier:
         self.remote_server_up_callbacks = []  # type: List[Callable[[str], None]]
 
         self.clock = hs.get_clock()
+
+        self._instance_name = hs.get_instance_name()
+        self._defer_push_actions = hs.config.push_defer_actions
+        self._sync_shard_config = hs.config.worker.sync_shard_config
+
+        self._filter_wakeups = hs.config.notifier_filter_wakeups
+        self._wakeup_coalesce_ms = hs.config.notifier_wakeup_coalesce_ms
+
+        # The user streams which have been notified but not yet woken up, when
+        # wakeups are coalesced.
+        self._pending_wakeups = set()  # type: Set[_NotifierUserStream]
+        self._wakeup_call = None
+
         self.appservice_handler = hs.get_application_service_handler()
         self._pusher_pool = hs.get_pusherpool()
 
@@ -272,6 +360,15 @@ class Notifier:
 
         self.notify_replication()
 
+    def on_skipped_room_event(self, max_room_stream_token: RoomStreamToken):
+        """Used instead of `on_new_room_event` for a new room event which wasn't
+        fetched as no user streams are listening for it.
+
+        This still notifies the events which were queued waiting for it to be
+        persisted.
+        """
+        self._notify_pending_new_room_events(max_room_stream_token)
+
     def _notify_pending_new_room_events(self, max_room_stream_token: RoomStreamToken):
         """Notify for the room events that were queued waiting for a previous
         event to be persisted.
@@ -285,6 +382,11 @@ class Notifier:
         users = set()  # type: Set[UserID]
         rooms = set()  # type: Set[str]
 
+        # We only need the events themselves if we're filtering wakeups.
+        events_by_room = (
+            {} if self._filter_wakeups else None
+        )  # type: Optional[Dict[str, List[EventBase]]]
+
         for event_pos, event, extra_users in pending:
             if event_pos.persisted_after(max_room_stream_token):
                 self.pending_new_room_events.append((event_pos, event, extra_users))
@@ -297,10 +399,16 @@ class Notifier:
 
                 users.update(extra_users)
                 rooms.add(event.room_id)
+                if events_by_room is not None:
+                    events_by_room.setdefault(event.room_id, []).append(event)
 
         if users or rooms:
             self.on_new_event(
-                "room_key", max_room_stream_token, users=users, rooms=rooms,
+                "room_key",
+                max_room_stream_token,
+                users=users,
+                rooms=rooms,
+                events_by_room=events_by_room,
             )
             self._on_updated_room_token(max_room_stream_token)
 
@@ -314,9 +422,12 @@ class Notifier:
             "_notify_app_services", self._notify_app_services, max_room_stream_token
         )
 
-        run_as_background_process(
-            "_notify_pusher_pool", self._notify_pusher_pool, max_room_stream_token
-        )
+        # If push actions are deferred, the pushers are told about new events
+        # once their push actions have been computed instead.
+        if not self._defer_push_actions:
+            run_as_background_process(
+                "_notify_pusher_pool", self._notify_pusher_pool, max_room_stream_token
+            )
 
         if self.federation_sender:
             self.federation_sender.notify_new_events(max_room_stream_token.stream)
@@ -341,32 +452,92 @@ class Notifier:
         new_token: Union[int, RoomStreamToken],
         users: Collection[UserID] = [],
         rooms: Collection[str] = [],
+        events_by_room: Optional[Dict[str, List[EventBase]]] = None,
     ):
         """ Used to inform listeners that something has happened event wise.
 
         Will wake up all listeners for the given users and rooms.
+
+        Args:
+            stream_key: The stream the event came from.
+            new_token: The new id for the stream the event came from.
+            users: The users whose listeners to wake up.
+            rooms: The rooms whose listeners to wake up.
+            events_by_room: The new events in each of `rooms`, if listeners with
+                a filter should only be woken up for these.
         """
         with PreserveLoggingContext():
             with Measure(self.clock, "on_new_event"):
-                user_streams = set()
+                # Map from the user streams to notify to the new room events for
+                # them, or None if all their listeners should be woken up.
+                user_streams = (
+                    {}
+                )  # type: Dict[_NotifierUserStream, Optional[List[EventBase]]]
 
                 for user in users:
                     user_stream = self.user_to_user_stream.get(str(user))
                     if user_stream is not None:
-                        user_streams.add(user_stream)
+                        user_streams[user_stream] = None
 
                 for room in rooms:
-                    user_streams |= self.room_to_user_streams.get(room, set())
+                    room_events = None
+                    if events_by_room is not None:
+                        room_events = events_by_room.get(room)
+
+                    for user_stream in self.room_to_user_streams.get(room, ()):
+                        if room_events is None:
+                            user_streams[user_stream] = None
+                        elif user_stream not in user_streams:
+                            user_streams[user_stream] = list(room_events)
+                        else:
+                            stream_events = user_streams[user_stream]
+                            if stream_events is not None:
+                                stream_events.extend(room_events)
 
                 time_now_ms = self.clock.time_msec()
-                for user_stream in user_streams:
+                for user_stream, stream_events in user_streams.items():
                     try:
-                        user_stream.notify(stream_key, new_token, time_now_ms)
+                        user_stream.notify(
+                            stream_key, new_token, time_now_ms, stream_events
+                        )
                     except Exception:
                         logger.exception("Failed to notify listener")
 
+                if self._wakeup_coalesce_ms:
+                    self._pending_wakeups.update(user_streams)
+                    if self._wakeup_call is None:
+                        self._wakeup_call = self.clock.call_later(
+                            self._wakeup_coalesce_ms / 1000.0,
+                            self._wake_pending_user_streams,
+                        )
+                else:
+                    self._wake_user_streams(user_streams)
+
                 self.notify_replication()
 
+    def _wake_user_streams(self, user_streams: Iterable[_NotifierUserStream]):
+        """Wakes up the listeners for the given user streams."""
+        woken = 0
+        for user_stream in user_streams:
+            try:
+                woken += user_stream.wake()
+            except Exception:
+                logger.exception("Failed to notify listener")
+
+        notifier_fanout_histogram.observe(woken)
+
+    def _wake_pending_user_streams(self):
+        """Wakes up the listeners for the user streams notified since the last
+        time, when wakeups are coalesced.
+        """
+        self._wakeup_call = None
+
+        user_streams = self._pending_wakeups
+        self._pending_wakeups = set()
+
+        with PreserveLoggingContext():
+            self._wake_user_streams(user_streams)
+
     def on_new_replication_data(self) -> None:
         """Used to inform replication listeners that something has happend
         without waking up any of the normal user event streams"""
@@ -379,10 +550,17 @@ class Notifier:
         callback: Callable[[StreamToken, StreamToken], Awaitable[T]],
         room_ids=None,
         from_token=StreamToken.START,
+        event_filter: Optional[Callable[[EventBase], bool]] = None,
     ) -> T:
         """Wait until the callback returns a non empty response or the
         timeout fires.
+
+        If `event_filter` is given and wakeups are being filtered, we don't
+        wake up for new room events which don't pass it.
         """
+        if not self._filter_wakeups:
+            event_filter = None
+
         user_stream = self.user_to_user_stream.get(user_id)
         if user_stream is None:
             current_token = self.event_sources.get_current_token()
@@ -409,7 +587,7 @@ class Notifier:
 
                     # Now we wait for the _NotifierUserStream to be told there
                     # is a new token.
-                    listener = user_stream.new_listener(prev_token)
+                    listener = user_stream.new_listener(prev_token, event_filter)
                     listener.deferred = timeout_deferred(
                         listener.deferred,
                         (end_time - now) / 1000.0,
@@ -418,10 +596,12 @@ class Notifier:
                     with PreserveLoggingContext():
                         await listener.deferred
 
+                    woken_at = self.clock.time()
                     current_token = user_stream.current_token
 
                     result = await callback(prev_token, current_token)
                     if result:
+                        wake_to_response_histogram.observe(self.clock.time() - woken_at)
                         break
 
                     # Update the prev_token to the current_token since nothing
@@ -438,6 +618,15 @@ class Notifier:
             current_token = user_stream.current_token
             result = await callback(prev_token, current_token)
 
+        # If another worker is responsible for this user, we stop keeping track
+        # of them as soon as nothing is waiting for their events.
+        if (
+            not user_stream.count_listeners()
+            and self.user_to_user_stream.get(user_id) is user_stream
+            and not self._sync_shard_config.should_handle(self._instance_name, user_id)
+        ):
+            user_stream.remove(self)
+
         return result
 
     async def get_events_for(
@@ -560,6 +749,22 @@ class Notifier:
         else:
             return False
 
+    def is_listening_for_room_event(
+        self, room_id: str, event_type: str, state_key: Optional[str]
+    ) -> bool:
+        """Whether there are any user streams which a new room event with the
+        given properties would notify.
+        """
+        if self.room_to_user_streams.get(room_id):
+            return True
+
+        # A membership event also notifies the user whose membership changed.
+        return (
+            event_type == EventTypes.Member
+            and state_key is not None
+            and state_key in self.user_to_user_stream
+        )
+
     @log_function
     def remove_expired_streams(self) -> None:
         time_now_ms = self.clock.time_msec()
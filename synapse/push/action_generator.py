@@ -13,20 +13,47 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import heapq
 import logging
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Iterable, Iterator, List, Optional, Tuple
 
+from prometheus_client import Histogram
+
+from twisted.internet import defer
+
+from synapse.events import EventBase
+from synapse.events.snapshot import EventContext
+from synapse.logging.context import make_deferred_yieldable, run_in_background
+from synapse.metrics import LaterGauge
+from synapse.metrics.background_process_metrics import run_as_background_process
+from synapse.types import RoomStreamToken
 from synapse.util.metrics import Measure
 
 from .bulk_push_rule_evaluator import BulkPushRuleEvaluator
 
+if TYPE_CHECKING:
+    from synapse.server import HomeServer
+
 logger = logging.getLogger(__name__)
 
+# The number of deferred events whose push actions we compute at once.
+DEFERRED_ACTIONS_BATCH_SIZE = 10
+
+deferred_push_actions_lag = Histogram(
+    "synapse_push_deferred_actions_lag_seconds",
+    "Time between an event being persisted and its deferred push actions being "
+    "stored",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+
 
 class ActionGenerator:
-    def __init__(self, hs):
+    def __init__(self, hs: "HomeServer"):
         self.hs = hs
         self.clock = hs.get_clock()
         self.store = hs.get_datastore()
+        self.storage = hs.get_storage()
         self.bulk_evaluator = BulkPushRuleEvaluator(hs)
         # really we want to get all user ids and all profile tags too,
         # since we want the actions for each profile tag for every user and
@@ -35,6 +62,334 @@ class ActionGenerator:
         # event stream, so we just run the rules for a client with no profile
         # tag (ie. we just need all the users).
 
+        self._defer_actions = hs.config.push_defer_actions
+
+        # The persisted events whose push actions are still to be computed, as
+        # a heap of (stream ordering, event ID, event, context, persisted time)
+        self._deferred_events = (
+            []
+        )  # type: List[Tuple[int, str, EventBase, EventContext, int]]
+        self._processing_deferred_events = False
+        self._replaying_deferred_events = False
+
+        # The stream ordering of the first event in the batch whose push
+        # actions are being computed, if any.
+        self._deferred_batch_start = None  # type: Optional[int]
+
+        # The stream orderings which the events being persisted come after,
+        # for the events which are yet to be passed to
+        # `handle_push_actions_for_persisted_events` (see `persisting_events`).
+        self._persisting_after = []  # type: List[int]
+
+        # The events whose push actions have been stored, but which the pushers
+        # and the clients syncing are yet to be told about, as a heap of
+        # (stream ordering, room ID).
+        self._unnotified_events = []  # type: List[Tuple[int, str]]
+
+        # The stream ordering up to which the push actions for every event have
+        # been stored.
+        self._deferred_actions_position = 0
+
+        LaterGauge(
+            "synapse_push_deferred_actions_pending",
+            "Number of persisted events whose push actions are still to be computed",
+            [],
+            lambda: len(self._deferred_events),
+        )
+
+        # The main process persists the events (see `PushConfig`), so computes
+        # the push actions for any events which were still queued up when it
+        # was last stopped.
+        if hs.config.worker.worker_app is None:
+            max_stream_ordering = self.store.get_room_max_stream_ordering()
+            self._deferred_actions_position = max_stream_ordering
+
+            # Nothing is processed until we've caught up.
+            self._processing_deferred_events = True
+            self._replaying_deferred_events = True
+            run_as_background_process(
+                "replay_deferred_push_actions",
+                self._replay_deferred_events,
+                max_stream_ordering,
+            )
+
+    def get_deferred_actions_position(self) -> Optional[int]:
+        """Returns the stream ordering up to which the push actions for every
+        persisted event have been stored, or None if there are no events whose
+        push actions are still to be computed.
+        """
+        if (
+            self._deferred_events
+            or self._deferred_batch_start is not None
+            or self._persisting_after
+            or self._replaying_deferred_events
+        ):
+            return self._get_stored_actions_upto()
+        return None
+
+    def _get_stored_actions_upto(self) -> int:
+        """Works out the stream ordering up to which the push actions for every
+        persisted event have been stored.
+        """
+        if self._replaying_deferred_events:
+            return self._deferred_actions_position
+
+        # Events are only persisted up to the current position...
+        position = self.store.get_room_max_stream_ordering()
+
+        # ... but those which are persisted may not have been queued up yet...
+        if self._persisting_after:
+            position = min(position, min(self._persisting_after))
+
+        # ... or still be waiting for their push actions.
+        if self._deferred_events:
+            position = min(position, self._deferred_events[0][0] - 1)
+        if self._deferred_batch_start is not None:
+            position = min(position, self._deferred_batch_start - 1)
+
+        return position
+
+    @contextmanager
+    def persisting_events(self, backfilled: bool = False) -> Iterator[None]:
+        """Marks that events are being persisted, until they are passed to
+        `handle_push_actions_for_persisted_events`, so that the position up to
+        which push actions are stored doesn't move past them in the meantime.
+
+        Args:
+            backfilled: Whether the events are backfilled, in which case their
+                push actions aren't computed.
+        """
+        if not self._defer_actions or backfilled:
+            yield
+            return
+
+        # The events will come after every event persisted so far.
+        position = self.store.get_room_max_stream_ordering()
+        self._persisting_after.append(position)
+        try:
+            yield
+        finally:
+            self._persisting_after.remove(position)
+
+            # The events in other rooms which were held back behind these ones
+            # can now be notified.
+            if self._unnotified_events and not self._processing_deferred_events:
+                run_as_background_process(
+                    "deferred_push_actions", self._process_deferred_events
+                )
+
     async def handle_push_actions_for_event(self, event, context):
+        if self._defer_actions:
+            # We'll compute the actions once the event has been persisted, in
+            # `handle_push_actions_for_persisted_events`.
+            return
+
         with Measure(self.clock, "action_for_event_by_user"):
             await self.bulk_evaluator.action_for_event_by_user(event, context)
+
+    def handle_push_actions_for_persisted_events(
+        self, events_and_contexts: Iterable[Tuple[EventBase, EventContext]]
+    ) -> None:
+        """Called when new events have been persisted, which should not be
+        backfilled events, within `persisting_events`.
+
+        If push actions are deferred, this queues up computing the push actions
+        for the events in the background, after which the pushers are told
+        about them.
+        """
+        if not self._defer_actions:
+            return
+
+        now = self.clock.time_msec()
+        for event, context in events_and_contexts:
+            if event.internal_metadata.is_outlier() or context.rejected:
+                continue
+
+            stream_ordering = event.internal_metadata.stream_ordering
+            heapq.heappush(
+                self._deferred_events,
+                (stream_ordering, event.event_id, event, context, now),
+            )
+
+        if self._deferred_events and not self._processing_deferred_events:
+            run_as_background_process(
+                "deferred_push_actions", self._process_deferred_events
+            )
+
+    async def _process_deferred_events(self) -> None:
+        if self._processing_deferred_events:
+            return
+
+        self._processing_deferred_events = True
+        try:
+            while self._deferred_events or self._can_notify_events():
+                batch = [
+                    heapq.heappop(self._deferred_events)
+                    for _ in range(
+                        min(len(self._deferred_events), DEFERRED_ACTIONS_BATCH_SIZE)
+                    )
+                ]
+
+                if batch:
+                    self._deferred_batch_start = batch[0][0]
+                    try:
+                        await make_deferred_yieldable(
+                            defer.gatherResults(
+                                [
+                                    run_in_background(
+                                        self._handle_deferred_event, event, context, ts
+                                    )
+                                    for _, _, event, context, ts in batch
+                                ],
+                                consumeErrors=True,
+                            )
+                        )
+                    finally:
+                        self._deferred_batch_start = None
+
+                    for stream_ordering, _, event, _, _ in batch:
+                        heapq.heappush(
+                            self._unnotified_events, (stream_ordering, event.room_id)
+                        )
+
+                await self._advance_deferred_actions_position(
+                    self._get_stored_actions_upto()
+                )
+        finally:
+            self._processing_deferred_events = False
+
+    def _can_notify_events(self) -> bool:
+        """Whether any of the events whose push actions have been stored can be
+        notified.
+        """
+        return bool(self._unnotified_events) and (
+            self._unnotified_events[0][0]
+            <= max(self._get_stored_actions_upto(), self._deferred_actions_position)
+        )
+
+    async def _advance_deferred_actions_position(self, position: int) -> None:
+        """Records that the push actions for every event up to `position` have
+        been stored, and tells the pushers and the clients syncing about the
+        events up to the position whose push actions were stored.
+
+        Args:
+            position: The stream ordering up to which push actions are stored.
+        """
+        if position > self._deferred_actions_position:
+            self._deferred_actions_position = position
+            await self.store.set_deferred_push_actions_position(position)
+
+        # We never move the position back, but may still have to notify
+        # events before it.
+        position = self._deferred_actions_position
+
+        room_ids = set()
+        while self._unnotified_events and self._unnotified_events[0][0] <= position:
+            _, room_id = heapq.heappop(self._unnotified_events)
+            room_ids.add(room_id)
+
+        if not room_ids:
+            return
+
+        await self.hs.get_pusherpool().on_new_notifications(position)
+
+        # Syncs don't include events until their push actions are stored, so
+        # that the unread counts are right (see `SyncHandler`).
+        self.hs.get_notifier().on_new_event(
+            "room_key", RoomStreamToken(None, position), rooms=room_ids
+        )
+
+    async def _replay_deferred_events(self, max_stream_ordering: int) -> None:
+        """Computes the push actions for the events which were persisted before
+        we started, but whose push actions were not stored.
+
+        Args:
+            max_stream_ordering: The stream ordering up to which events had
+                been persisted when we started.
+        """
+        try:
+            position = await self.store.get_deferred_push_actions_position()
+            if position is not None and position < max_stream_ordering:
+                logger.info(
+                    "Computing push actions for events between %d and %d",
+                    position,
+                    max_stream_ordering,
+                )
+                self._deferred_actions_position = position
+
+            while position is not None and position < max_stream_ordering:
+                (
+                    position,
+                    event_ids,
+                ) = await self.store.get_events_for_deferred_push_actions(
+                    position, max_stream_ordering, DEFERRED_ACTIONS_BATCH_SIZE
+                )
+                events = await self.store.get_events_as_list(event_ids)
+
+                await make_deferred_yieldable(
+                    defer.gatherResults(
+                        [
+                            run_in_background(self._handle_replayed_event, event)
+                            for event in events
+                        ],
+                        consumeErrors=True,
+                    )
+                )
+
+                for event in events:
+                    heapq.heappush(
+                        self._unnotified_events,
+                        (event.internal_metadata.stream_ordering, event.room_id),
+                    )
+
+                await self._advance_deferred_actions_position(position)
+
+            # If push actions are no longer deferred, they will be stored when
+            # each event is persisted from now on.
+            await self.store.set_deferred_push_actions_position(
+                max_stream_ordering if self._defer_actions else None
+            )
+        finally:
+            self._processing_deferred_events = False
+            self._replaying_deferred_events = False
+
+        if self._deferred_events or self._unnotified_events:
+            await self._process_deferred_events()
+
+    async def _handle_replayed_event(self, event: EventBase) -> None:
+        """Computes the push actions for an event which was persisted before we
+        started, working out its context from the stored state.
+        """
+        state_ids = await self.storage.state.get_state_ids_for_event(event.event_id)
+
+        prev_state_ids = dict(state_ids)
+        if event.is_state():
+            replaces_state = event.unsigned.get("replaces_state")
+            if replaces_state:
+                prev_state_ids[(event.type, event.state_key)] = replaces_state
+            else:
+                prev_state_ids.pop((event.type, event.state_key), None)
+
+        context = EventContext.with_state(
+            state_group=None,
+            state_group_before_event=None,
+            current_state_ids=state_ids,
+            prev_state_ids=prev_state_ids,
+        )
+
+        await self._handle_deferred_event(event, context, self.clock.time_msec())
+
+    async def _handle_deferred_event(
+        self, event: EventBase, context: EventContext, persisted_ts: int
+    ) -> None:
+        try:
+            with Measure(self.clock, "action_for_persisted_event_by_user"):
+                await self.bulk_evaluator.action_for_persisted_event_by_user(
+                    event, context
+                )
+        except Exception:
+            logger.exception("Failed to compute push actions for %s", event.event_id)
+
+        deferred_push_actions_lag.observe(
+            (self.clock.time_msec() - persisted_ts) / 1000
+        )
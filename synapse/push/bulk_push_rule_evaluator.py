@@ -16,6 +16,7 @@
 
 import logging
 from collections import namedtuple
+from typing import Dict, List, Tuple, Union
 
 from prometheus_client import Counter
 
@@ -66,6 +67,13 @@ def _should_count_as_unread(event: EventBase, context: EventContext) -> bool:
     if context.rejected or event.internal_metadata.is_soft_failed():
         return False
 
+    return event_counts_as_unread(event)
+
+
+def event_counts_as_unread(event: EventBase) -> bool:
+    """Returns whether an accepted event counts towards the unread counts of the
+    users in its room, judging by the event alone.
+    """
     # Exclude notices.
     if (
         not event.is_state()
@@ -181,10 +189,44 @@ class BulkPushRuleEvaluator:
         should increment the unread count, and insert the results into the
         event_push_actions_staging table.
         """
+        actions_by_user, count_as_unread = await self._get_actions_by_user(
+            event, context
+        )
+
+        # Mark in the DB staging area the push actions for users who should be
+        # notified for this event. (This will then get handled when we persist
+        # the event)
+        await self.store.add_push_actions_to_staging(
+            event.event_id, actions_by_user, count_as_unread,
+        )
+
+    async def action_for_persisted_event_by_user(self, event, context) -> None:
+        """Like `action_for_event_by_user`, but for an event which has already
+        been persisted, so the results are inserted straight into the
+        event_push_actions table.
+        """
+        actions_by_user, count_as_unread = await self._get_actions_by_user(
+            event, context
+        )
+
+        await self.store.add_push_actions_for_persisted_event(
+            event, actions_by_user, count_as_unread
+        )
+
+    async def _get_actions_by_user(
+        self, event: EventBase, context: EventContext
+    ) -> Tuple[Dict[str, List[Union[dict, str]]], bool]:
+        """Evaluates the push rules of the users in the room for the event.
+
+        Returns:
+            A map from user ID to the actions for the user, which includes every
+            user for whom the event counts as unread, and whether the event
+            counts as unread.
+        """
         count_as_unread = _should_count_as_unread(event, context)
 
         rules_by_user = await self._get_rules_for_event(event, context)
-        actions_by_user = {}
+        actions_by_user = {}  # type: Dict[str, List[Union[dict, str]]]
 
         room_members = await self.store.get_joined_users_from_context(event, context)
 
@@ -197,8 +239,6 @@ class BulkPushRuleEvaluator:
             event, len(room_members), sender_power_level, power_levels
         )
 
-        condition_cache = {}
-
         for uid, rules in rules_by_user.items():
             if event.sender == uid:
                 continue
@@ -231,7 +271,7 @@ class BulkPushRuleEvaluator:
                     continue
 
                 matches = _condition_checker(
-                    evaluator, rule["conditions"], uid, display_name, condition_cache
+                    evaluator, rule["conditions"], uid, display_name
                 )
                 if matches:
                     actions = [x for x in rule["actions"] if x != "dont_notify"]
@@ -240,29 +280,12 @@ class BulkPushRuleEvaluator:
                         actions_by_user[uid] = actions
                     break
 
-        # Mark in the DB staging area the push actions for users who should be
-        # notified for this event. (This will then get handled when we persist
-        # the event)
-        await self.store.add_push_actions_to_staging(
-            event.event_id, actions_by_user, count_as_unread,
-        )
+        return actions_by_user, count_as_unread
 
 
-def _condition_checker(evaluator, conditions, uid, display_name, cache):
+def _condition_checker(evaluator, conditions, uid, display_name):
     for cond in conditions:
-        _id = cond.get("_id", None)
-        if _id:
-            res = cache.get(_id, None)
-            if res is False:
-                return False
-            elif res is True:
-                continue
-
-        res = evaluator.matches(cond, uid, display_name)
-        if _id:
-            cache[_id] = bool(res)
-
-        if not res:
+        if not evaluator.matches(cond, uid, display_name):
             return False
 
     return True
@@ -16,7 +16,7 @@
 
 import logging
 import re
-from typing import Any, Dict, List, Optional, Pattern, Union
+from typing import Any, Dict, List, Optional, Pattern, Set, Tuple, Union
 
 from synapse.events import EventBase
 from synapse.types import UserID
@@ -29,6 +29,7 @@ logger = logging.getLogger(__name__)
 GLOB_REGEX = re.compile(r"\\\[(\\\!|)(.*)\\\]")
 IS_GLOB = re.compile(r"[\?\*\[\]]")
 INEQUALITY_EXPR = re.compile("^([=<>]*)([0-9]*)$")
+NON_WORD = re.compile(r"\W")
 
 
 def _room_member_count(ev, condition, room_member_count):
@@ -121,7 +122,27 @@ class PushRuleEvaluatorForEvent:
         # Maps strings of e.g. 'content.body' -> event["content"]["body"]
         self._value_cache = _flatten_dict(event)
 
+        # Maps the keys returned by `_condition_cache_key` to whether the
+        # condition matches. Most conditions are shared by many users in the
+        # room, so this means we only test them once per event.
+        self._condition_cache = {}  # type: Dict[Tuple[Optional[str], ...], bool]
+
+        # The words in the body of the event, which is built the first time a
+        # condition needs to look for a word in it.
+        self._body_words = None  # type: Optional[_WordMatcher]
+
     def matches(self, condition: dict, user_id: str, display_name: str) -> bool:
+        key = _condition_cache_key(condition, user_id, display_name)
+        if key is None:
+            return bool(self._matches(condition, user_id, display_name))
+
+        res = self._condition_cache.get(key)
+        if res is None:
+            res = bool(self._matches(condition, user_id, display_name))
+            self._condition_cache[key] = res
+        return res
+
+    def _matches(self, condition: dict, user_id: str, display_name: str) -> bool:
         if condition["kind"] == "event_match":
             return self._event_match(condition, user_id)
         elif condition["kind"] == "contains_display_name":
@@ -149,12 +170,16 @@ class PushRuleEvaluatorForEvent:
             logger.warning("event_match condition with no pattern")
             return False
 
-        # XXX: optimisation: cache our pattern regexps
         if condition["key"] == "content.body":
             body = self._event.content.get("body", None)
             if not body or not isinstance(body, str):
                 return False
 
+            if not IS_GLOB.search(pattern):
+                res = self._get_body_words(body).contains(pattern)
+                if res is not None:
+                    return res
+
             return _glob_matches(pattern, body, word_boundary=True)
         else:
             haystack = self._get_value(condition["key"])
@@ -171,6 +196,10 @@ class PushRuleEvaluatorForEvent:
         if not body or not isinstance(body, str):
             return False
 
+        res = self._get_body_words(body).contains(display_name)
+        if res is not None:
+            return res
+
         # Similar to _glob_matches, but do not treat display_name as a glob.
         r = regex_cache.get((display_name, False, True), None)
         if not r:
@@ -179,11 +208,111 @@ class PushRuleEvaluatorForEvent:
             r = re.compile(r, flags=re.IGNORECASE)
             regex_cache[(display_name, False, True)] = r
 
-        return r.search(body)
+        return bool(r.search(body))
 
     def _get_value(self, dotted_key: str) -> Optional[str]:
         return self._value_cache.get(dotted_key, None)
 
+    def _get_body_words(self, body: str) -> "_WordMatcher":
+        if self._body_words is None:
+            self._body_words = _WordMatcher(body)
+        return self._body_words
+
+
+class _WordMatcher:
+    """Tests whether strings appear in a piece of text as whole words, ignoring
+    case, as the regexes built by `_re_word_boundary` do.
+
+    Rather than searching the text for each string, the substrings of the text
+    which start and end on word boundaries are collected the first time a
+    string of each length is asked about. Testing whether each of the display
+    names and user names of the thousands of members of a room appear in a
+    message is then a set lookup per name.
+    """
+
+    def __init__(self, text: str):
+        self._text = _fold_case(text)
+
+        # Case folding may change the length of the text (e.g. "ß" becomes
+        # "ss"), in which case positions in the folded text don't line up with
+        # the word boundaries in the original.
+        self._usable = len(self._text) == len(text)
+
+        # The positions at which words can start and end.
+        non_word = [m.start() for m in NON_WORD.finditer(text)]
+        self._starts = [0] + [i + 1 for i in non_word]
+        self._ends = set(non_word)
+        self._ends.add(len(text))
+
+        # Maps a length to the substrings of that length which are words.
+        self._words_by_length = {}  # type: Dict[int, Set[str]]
+
+    def contains(self, word: str) -> Optional[bool]:
+        """Returns whether `word` appears in the text as a whole word, or None
+        if that can't be worked out and a regex should be used instead.
+        """
+        folded = _fold_case(word)
+        if not self._usable or not folded or len(folded) != len(word):
+            return None
+
+        length = len(folded)
+        words = self._words_by_length.get(length)
+        if words is None:
+            words = {
+                self._text[start : start + length]
+                for start in self._starts
+                if start + length in self._ends
+            }
+            self._words_by_length[length] = words
+
+        return folded in words
+
+
+def _fold_case(s: str) -> str:
+    """Folds the case of a string for case-insensitive comparisons which agree
+    with those made by `re.IGNORECASE`.
+    """
+    # Unlike `re`, casefold doesn't treat dotless i as a lower case I.
+    return s.casefold().replace("\u0131", "i")
+
+
+def _condition_cache_key(
+    condition: dict, user_id: str, display_name: Optional[str]
+) -> Optional[Tuple[Optional[str], ...]]:
+    """Returns a key which is the same for any two conditions which are
+    guaranteed to have the same result for an event, even for different users,
+    or None if the result shouldn't be cached.
+    """
+    kind = condition.get("kind")
+    if kind == "event_match":
+        pattern = condition.get("pattern")
+        if not pattern:
+            pattern_type = condition.get("pattern_type")
+            if pattern_type == "user_id":
+                pattern = user_id
+            elif pattern_type == "user_localpart":
+                pattern = UserID.from_string(user_id).localpart
+        key = (
+            "event_match",
+            condition.get("key"),
+            pattern,
+        )  # type: Tuple[Optional[str], ...]
+    elif kind == "contains_display_name":
+        key = ("contains_display_name", display_name)
+    elif kind == "room_member_count":
+        key = ("room_member_count", condition.get("is"))
+    elif kind == "sender_notification_permission":
+        key = ("sender_notification_permission", condition.get("key"))
+    else:
+        key = (kind,)
+
+    # The conditions come from clients, so may contain values we can't use
+    # as a key.
+    if not all(part is None or isinstance(part, str) for part in key):
+        return None
+
+    return key
+
 
 # Caches (string, is_glob, word_boundary) -> regex for push. See _glob_matches
 regex_cache = LruCache(50000)
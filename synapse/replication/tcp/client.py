@@ -17,6 +17,8 @@
 import logging
 from typing import TYPE_CHECKING, Dict, List, Tuple
 
+from prometheus_client import Counter
+
 from twisted.internet.defer import Deferred
 from twisted.internet.protocol import ReconnectingClientFactory
 
@@ -43,6 +45,12 @@ logger = logging.getLogger(__name__)
 # How long we allow callers to wait for replication updates before timing out.
 _WAIT_FOR_REPLICATION_TIMEOUT_SECONDS = 30
 
+skipped_unwatched_events_counter = Counter(
+    "synapse_replication_tcp_client_skipped_unwatched_events",
+    "Number of new events from replication which weren't fetched as no user "
+    "streams were interested in them",
+)
+
 
 class DirectTcpReplicationClientFactory(ReconnectingClientFactory):
     """Factory for building connections to the master. Will reconnect if the
@@ -106,6 +114,16 @@ class ReplicationDataHandler:
         self._instance_name = hs.get_instance_name()
         self._typing_handler = hs.get_typing_handler()
 
+        # If this is one of several sync workers, we don't bother fetching new
+        # events which none of our user streams are interested in, unless we
+        # need them for something else.
+        self._skip_unwatched_events = (
+            self._instance_name in hs.config.worker.sync_shard_config.instances
+            and not hs.config.start_pushers
+            and not hs.config.notify_appservices
+            and not hs.should_send_federation()
+        )
+
         # Map from stream to list of deferreds waiting for the stream to
         # arrive at a particular position. The lists are sorted by stream position.
         self._streams_to_waiters = (
@@ -142,6 +160,16 @@ class ReplicationDataHandler:
                     continue
                 assert isinstance(row, EventsStreamRow)
 
+                if (
+                    self._skip_unwatched_events
+                    and not self.notifier.is_listening_for_room_event(
+                        row.data.room_id, row.data.type, row.data.state_key
+                    )
+                ):
+                    skipped_unwatched_events_counter.inc()
+                    self.notifier.on_skipped_room_event(self.store.get_room_max_token())
+                    continue
+
                 event = await self.store.get_event(
                     row.data.event_id, allow_rejected=True
                 )
@@ -15,6 +15,7 @@
 
 import itertools
 import logging
+from typing import List, Optional
 
 from synapse.api.constants import PresenceState
 from synapse.api.errors import Codes, StoreError, SynapseError
@@ -24,10 +25,11 @@ from synapse.events.utils import (
     format_event_raw,
 )
 from synapse.handlers.presence import format_user_presence_state
-from synapse.handlers.sync import SyncConfig
+from synapse.handlers.sync import JoinedSyncResult, SyncConfig
+from synapse.http.server import JsonStreamWriter
 from synapse.http.servlet import RestServlet, parse_boolean, parse_integer, parse_string
 from synapse.types import StreamToken
-from synapse.util import json_decoder
+from synapse.util import json_decoder, json_encoder
 
 from ._base import client_patterns, set_timeline_upper_limit
 
@@ -84,6 +86,7 @@ class SyncRestServlet(RestServlet):
         self.presence_handler = hs.get_presence_handler()
         self._server_notices_sender = hs.get_server_notices_sender()
         self._event_serializer = hs.get_event_client_serializer()
+        self._stream_initial_sync_responses = hs.config.stream_initial_sync_responses
 
     async def on_GET(self, request):
         if b"from" in request.args:
@@ -169,6 +172,13 @@ class SyncRestServlet(RestServlet):
         context = await self.presence_handler.user_syncing(
             user.to_string(), affect_presence=affect_presence
         )
+        if since_token is None and self._stream_initial_sync_responses:
+            with context:
+                await self._stream_initial_sync(
+                    request, sync_config, requester.access_token_id, filter_collection
+                )
+            return None
+
         with context:
             sync_result = await self.sync_handler.wait_for_sync_for_user(
                 sync_config,
@@ -191,15 +201,106 @@ class SyncRestServlet(RestServlet):
         logger.debug("Event formatting complete")
         return 200, response_content
 
-    async def encode_response(self, time_now, sync_result, access_token_id, filter):
-        logger.debug("Formatting events in sync response")
+    async def _stream_initial_sync(self, request, sync_config, access_token_id, filter):
+        """Generates an initial sync and sends it to the client, writing each
+        joined room as soon as it has been generated.
+
+        Archived rooms are written after the joined rooms, and the rest of the
+        response after that.
+        """
+        time_now = self.clock.time_msec()
+        event_formatter = self._get_event_formatter(filter)
+
+        # Nothing is written until the first joined room is ready, so that any
+        # errors before then are sent to the client as usual.
+        writer = None  # type: Optional[JsonStreamWriter]
+        encoded_archived_rooms = []  # type: List[str]
+
+        async def write_room_entry(room):
+            nonlocal writer
+
+            # the client may have disconnected by now; don't bother to serialize
+            # the room if so.
+            if request._disconnected:
+                return
+
+            joined = isinstance(room, JoinedSyncResult)
+            encoded_room = await self.encode_room(
+                room,
+                time_now,
+                access_token_id,
+                joined=joined,
+                only_fields=filter.event_fields,
+                event_formatter=event_formatter,
+            )
+            entry = "%s:%s" % (
+                json_encoder.encode(room.room_id),
+                json_encoder.encode(encoded_room),
+            )
+
+            if not joined:
+                encoded_archived_rooms.append(entry)
+                return
+
+            if writer is None:
+                writer = JsonStreamWriter(request, 200, send_cors=True)
+                entry = '{"rooms":{"join":{' + entry
+            else:
+                entry = "," + entry
+
+            await writer.write(entry.encode("utf-8"))
+
+        try:
+            sync_result = await self.sync_handler.stream_initial_sync_for_user(
+                sync_config, write_room_entry
+            )
+
+            # The joined and archived rooms have already been dealt with, so
+            # aren't in the response.
+            response_content = await self.encode_response(
+                time_now, sync_result, access_token_id, filter
+            )
+            rooms = response_content.pop("rooms")
+
+            if writer is None:
+                writer = JsonStreamWriter(request, 200, send_cors=True)
+                end = '{"rooms":{"join":{'
+            else:
+                end = ""
+
+            end += '},"invite":%s,"leave":{%s}},%s' % (
+                json_encoder.encode(rooms["invite"]),
+                ",".join(encoded_archived_rooms),
+                # Drop the opening brace, as we are already in the object.
+                json_encoder.encode(response_content)[1:],
+            )
+            await writer.write(end.encode("utf-8"))
+        except Exception:
+            if writer is None:
+                # Nothing has been sent yet, so the error is sent as usual.
+                raise
+
+            # We've already sent part of the response, so all we can do is
+            # close the connection.
+            logger.exception("Failed to stream initial sync for %s", sync_config.user)
+            writer.abort()
+            return
+
+        writer.finish()
+
+    @staticmethod
+    def _get_event_formatter(filter):
         if filter.event_format == "client":
-            event_formatter = format_event_for_client_v2_without_room_id
+            return format_event_for_client_v2_without_room_id
         elif filter.event_format == "federation":
-            event_formatter = format_event_raw
+            return format_event_raw
         else:
             raise Exception("Unknown event format %s" % (filter.event_format,))
 
+    async def encode_response(self, time_now, sync_result, access_token_id, filter):
+        logger.debug("Formatting events in sync response")
+        event_formatter = self._get_event_formatter(filter)
+
         joined = await self.encode_joined(
             sync_result.joined,
             time_now,
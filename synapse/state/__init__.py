@@ -22,6 +22,7 @@ from typing import (
     Callable,
     DefaultDict,
     Dict,
+    FrozenSet,
     Iterable,
     List,
     Optional,
@@ -44,9 +45,10 @@ from synapse.events.snapshot import EventContext
 from synapse.logging.context import ContextResourceUsage
 from synapse.logging.utils import log_function
 from synapse.state import v1, v2
+from synapse.state.pool import StateResolutionPool
 from synapse.storage.databases.main.events_worker import EventRedactBehaviour
 from synapse.storage.roommember import ProfileInfo
-from synapse.types import Collection, StateMap
+from synapse.types import Collection, FrozenStateMap, StateMap
 from synapse.util.async_helpers import Linearizer
 from synapse.util.caches.expiringcache import ExpiringCache
 from synapse.util.metrics import Measure, measure_func
@@ -61,6 +63,13 @@ state_groups_histogram = Histogram(
     buckets=(1, 2, 3, 5, 7, 10, 15, 20, 50, 100, 200, 500, "+Inf"),
 )
 
+# Metrics for how many resolutions started from a previous resolution.
+incremental_state_res_counter = Counter(
+    "synapse_state_incremental_resolutions",
+    "Number of state resolutions which started from the result of a previous "
+    "resolution of a subset of the state groups",
+)
+
 
 KeyStateTuple = namedtuple("KeyStateTuple", ("context", "type", "state_key"))
 
@@ -91,7 +100,7 @@ class _StateCacheEntry:
         delta_ids: Optional[StateMap[str]] = None,
     ):
         # A map from (type, state_key) to event_id.
-        self.state = frozendict(state)
+        self.state = FrozenStateMap(state)
 
         # the ID of a state group if one and only one is involved.
         # otherwise, None otherwise?
@@ -231,9 +240,8 @@ class StateHandler:
         entry = await self.resolve_state_groups_for_events(room_id, latest_event_ids)
         return await self.store.get_joined_users_from_state(room_id, entry)
 
-    async def get_current_hosts_in_room(self, room_id: str) -> Set[str]:
-        event_ids = await self.store.get_latest_event_ids_in_room(room_id)
-        return await self.get_hosts_in_room_at_events(room_id, event_ids)
+    async def get_current_hosts_in_room(self, room_id: str) -> FrozenSet[str]:
+        return await self.store.get_current_hosts_in_room(room_id)
 
     async def get_hosts_in_room_at_events(
         self, room_id: str, event_ids: List[str]
@@ -304,9 +312,9 @@ class StateHandler:
 
         if old_state:
             # if we're given the state before the event, then we use that
-            state_ids_before_event = {
-                (s.type, s.state_key): s.event_id for s in old_state
-            }  # type: StateMap[str]
+            state_ids_before_event = FrozenStateMap(
+                {(s.type, s.state_key): s.event_id for s in old_state}
+            )
             state_group_before_event = None
             state_group_before_event_prev_group = None
             deltas_to_state_group_before_event = None
@@ -368,9 +376,8 @@ class StateHandler:
             if replaces != event.event_id:
                 event.unsigned["replaces_state"] = replaces
 
-        state_ids_after_event = dict(state_ids_before_event)
-        state_ids_after_event[key] = event.event_id
         delta_ids = {key: event.event_id}
+        state_ids_after_event = state_ids_before_event.evolve(delta_ids)
 
         state_group_after_event = await self.state_store.store_state_group(
             event.event_id,
@@ -502,6 +509,14 @@ class StateResolutionHandler:
 
         self.resolve_linearizer = Linearizer(name="state_resolve_lock")
 
+        self._incremental_state_res = hs.config.incremental_state_resolution
+
+        self._pool = None  # type: Optional[StateResolutionPool]
+        if hs.config.state_resolution_processes:
+            self._pool = StateResolutionPool(
+                hs.get_reactor(), hs.config.state_resolution_processes
+            )
+
         # dict of set of event_ids -> _StateCacheEntry.
         self._state_cache = ExpiringCache(
             cache_name="state_cache",
@@ -570,10 +585,25 @@ class StateResolutionHandler:
 
             state_groups_histogram.observe(len(state_groups_ids))
 
+            state_sets = list(state_groups_ids.values())  # type: List[StateMap[str]]
+            if self._incremental_state_res:
+                resolved_groups, resolved = self._get_resolved_subset(group_names)
+                if resolved:
+                    logger.debug(
+                        "Resolving from the previous resolution of %s",
+                        list(resolved_groups),
+                    )
+                    incremental_state_res_counter.inc()
+                    state_sets = [resolved.state]
+                    state_sets.extend(
+                        state_groups_ids[group]
+                        for group in group_names - resolved_groups
+                    )
+
             new_state = await self.resolve_events_with_store(
                 room_id,
                 room_version,
-                list(state_groups_ids.values()),
+                state_sets,
                 event_map=event_map,
                 state_res_store=state_res_store,
             )
@@ -590,6 +620,27 @@ class StateResolutionHandler:
 
             return cache
 
+    def _get_resolved_subset(
+        self, group_names: FrozenSet[int]
+    ) -> Tuple[FrozenSet[int], Optional[_StateCacheEntry]]:
+        """Look for a cached resolution of all but one of the given state
+        groups.
+
+        Returns:
+            The state groups of the cached resolution and its result, or an
+            empty set and None if there isn't one.
+        """
+        if len(group_names) < 3:
+            # Resolving a subset of a single group is a no-op.
+            return frozenset(), None
+
+        for group in sorted(group_names):
+            subset = group_names - {group}
+            if subset in self._state_cache:
+                return subset, self._state_cache[subset]
+
+        return frozenset(), None
+
     async def resolve_events_with_store(
         self,
         room_id: str,
@@ -635,6 +686,7 @@ class StateResolutionHandler:
                         state_sets,
                         event_map,
                         state_res_store,
+                        pool=self._pool,
                     )
         finally:
             self._record_state_res_metrics(room_id, m.get_resource_usage())
@@ -783,7 +835,7 @@ class StateResolutionStore:
         )
 
     def get_auth_chain_difference(
-        self, state_sets: List[Set[str]]
+        self, room_id: str, state_sets: List[Set[str]]
     ) -> Awaitable[Set[str]]:
         """Given sets of state events figure out the auth chain difference (as
         per state res v2 algorithm).
@@ -792,8 +844,12 @@ class StateResolutionStore:
         and returning the events that don't appear in each and every auth
         chain.
 
+        Args:
+            room_id: The room the events are in.
+            state_sets: The sets of state event IDs to compare.
+
         Returns:
             An awaitable that resolves to a set of event IDs.
         """
 
-        return self.store.get_auth_chain_difference(state_sets)
+        return self.store.get_auth_chain_difference(room_id, state_sets)
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Support for running the CPU-heavy phases of v2 state resolution in a pool of
+processes, so that they don't block the reactor.
+
+The events needed are fetched on the reactor via the `StateResolutionStore` as
+usual, and are then serialized once and sent to a worker process, which runs
+`v2.resolve_conflicted_state` against an in-memory store.
+"""
+
+import logging
+import multiprocessing
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from prometheus_client import Counter
+
+from twisted.internet import defer
+
+import synapse.state
+from synapse.api.room_versions import KNOWN_ROOM_VERSIONS
+from synapse.events import EventBase, make_event_from_dict
+from synapse.logging.context import make_deferred_yieldable
+from synapse.state import v2
+from synapse.types import JsonDict, StateMap
+
+logger = logging.getLogger(__name__)
+
+# The minimum size of the full conflicted set for a resolution to be run in the
+# pool, below which it's cheaper to just do it on the reactor.
+MIN_CONFLICTED_EVENTS = 100
+
+state_res_pool_counter = Counter(
+    "synapse_state_res_pool_resolutions",
+    "Number of state resolutions handed to the state resolution process pool",
+    ["outcome"],
+)
+
+# An event serialized for sending to a worker process:
+# (event_id, pdu_json, internal_metadata, rejected_reason)
+_SerializedEvent = Tuple[str, JsonDict, JsonDict, Optional[str]]
+
+
+class StateResolutionPool:
+    """A pool of processes which run the sorting and auth check phases of v2
+    state resolution.
+
+    The processes are started the first time the pool is used.
+
+    Args:
+        reactor
+        processes: The number of processes in the pool.
+        min_conflicted_events: The minimum size of the full conflicted set for a
+            resolution to be run in the pool.
+    """
+
+    def __init__(
+        self,
+        reactor,
+        processes: int,
+        min_conflicted_events: int = MIN_CONFLICTED_EVENTS,
+    ):
+        self._reactor = reactor
+        self._processes = processes
+        self.min_conflicted_events = min_conflicted_events
+
+        self._pool = None  # type: Optional[multiprocessing.pool.Pool]
+
+    def _get_pool(self) -> "multiprocessing.pool.Pool":
+        if self._pool is None:
+            # We don't want to fork the whole homeserver, so we start fresh
+            # interpreters instead.
+            context = multiprocessing.get_context("spawn")
+            self._pool = context.Pool(processes=self._processes)
+            self._reactor.addSystemEventTrigger("before", "shutdown", self.close)
+        return self._pool
+
+    def close(self) -> None:
+        """Stops the processes in the pool."""
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+
+    async def resolve_conflicted_state(
+        self,
+        room_id: str,
+        room_version: str,
+        unconflicted_state: StateMap[str],
+        full_conflicted_set: Set[str],
+        event_map: Dict[str, EventBase],
+        state_res_store: "synapse.state.StateResolutionStore",
+    ) -> Optional[StateMap[str]]:
+        """Runs `v2.resolve_conflicted_state` in one of the processes in the pool.
+
+        Args:
+            room_id: the room we are working in
+            room_version: The room version
+            unconflicted_state
+            full_conflicted_set: Must all be in `event_map`.
+            event_map: a dict from event_id to event, which will be updated with
+                any events fetched from `state_res_store`.
+            state_res_store
+
+        Returns:
+            A map from (type, state_key) to event_id, or None if the resolution
+            needed an event which we didn't send to the worker, in which case
+            the caller should resolve the state itself.
+        """
+        needed, missing = await v2.fetch_events_for_conflicted_state(
+            room_id, unconflicted_state, full_conflicted_set, event_map, state_res_store
+        )
+
+        # We only send the events which may be needed: if we've missed one, the
+        # worker asks for a fallback rather than getting it wrong.
+        events = []  # type: List[_SerializedEvent]
+        for event_id in needed:
+            event = event_map[event_id]
+            events.append(
+                (
+                    event_id,
+                    event.get_pdu_json(),
+                    event.internal_metadata.get_dict(),
+                    event.rejected_reason,
+                )
+            )
+
+        d = defer.Deferred()  # type: defer.Deferred[Optional[StateMap[str]]]
+        self._get_pool().apply_async(
+            _resolve_conflicted_state_in_process,
+            (
+                room_id,
+                room_version,
+                dict(unconflicted_state),
+                full_conflicted_set,
+                events,
+                missing,
+            ),
+            callback=lambda res: self._reactor.callFromThread(d.callback, res),
+            error_callback=lambda e: self._reactor.callFromThread(d.errback, e),
+        )
+        resolved_state = await make_deferred_yieldable(d)
+
+        if resolved_state is None:
+            logger.info(
+                "State resolution for %s needed events that weren't prefetched; "
+                "resolving on the reactor",
+                room_id,
+            )
+            state_res_pool_counter.labels("fallback").inc()
+        else:
+            state_res_pool_counter.labels("resolved").inc()
+
+        return resolved_state
+
+
+class _EventNotPrefetched(Exception):
+    """Raised in the worker processes when state resolution needs something
+    which wasn't sent to them, so the resolution has to be done on the reactor.
+    """
+
+
+class _PrefetchedStateResolutionStore:
+    """A `StateResolutionStore` for use in the worker processes, which only
+    knows about events which weren't found when prefetching.
+    """
+
+    def __init__(self, missing: Set[str]):
+        self._missing = missing
+
+    async def get_events(
+        self, event_ids: Iterable[str], allow_rejected: bool = False
+    ) -> Dict[str, EventBase]:
+        for event_id in event_ids:
+            if event_id not in self._missing:
+                raise _EventNotPrefetched(event_id)
+        return {}
+
+    async def get_auth_chain_difference(
+        self, room_id: str, state_sets: List[Set[str]]
+    ) -> Set[str]:
+        # This is only used before the events are sent to the pool, but if
+        # that changes we need the database.
+        raise _EventNotPrefetched("auth chain difference")
+
+
+class _WorkerClock:
+    """Stands in for the clock in the worker processes, where there is no
+    reactor to yield to.
+    """
+
+    async def sleep(self, seconds: float) -> None:
+        pass
+
+
+def _resolve_conflicted_state_in_process(
+    room_id: str,
+    room_version: str,
+    unconflicted_state: StateMap[str],
+    full_conflicted_set: Set[str],
+    events: List[_SerializedEvent],
+    missing: Set[str],
+) -> Optional[StateMap[str]]:
+    """The entry point for the worker processes.
+
+    Returns:
+        The resolved state, or None if an event which wasn't sent was needed.
+    """
+    room_version_obj = KNOWN_ROOM_VERSIONS[room_version]
+    event_map = {
+        event_id: make_event_from_dict(
+            pdu_json,
+            room_version_obj,
+            internal_metadata_dict=internal_metadata,
+            rejected_reason=rejected_reason,
+        )
+        for event_id, pdu_json, internal_metadata, rejected_reason in events
+    }
+
+    coro = v2.resolve_conflicted_state(
+        _WorkerClock(),  # type: ignore[arg-type]
+        room_id,
+        room_version,
+        unconflicted_state,
+        full_conflicted_set,
+        event_map,
+        _PrefetchedStateResolutionStore(missing),  # type: ignore[arg-type]
+    )
+
+    # Nothing the coroutine awaits ever blocks, so it runs to completion the
+    # first time it is resumed.
+    try:
+        coro.send(None)
+    except StopIteration as e:
+        return e.value
+    except _EventNotPrefetched:
+        return None
+    finally:
+        coro.close()
+
+    raise RuntimeError("State resolution did not complete")
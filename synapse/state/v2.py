@@ -17,6 +17,7 @@ import heapq
 import itertools
 import logging
 from typing import (
+    TYPE_CHECKING,
     Any,
     Callable,
     Dict,
@@ -41,6 +42,9 @@ from synapse.events import EventBase
 from synapse.types import MutableStateMap, StateMap
 from synapse.util import Clock
 
+if TYPE_CHECKING:
+    from synapse.state.pool import StateResolutionPool
+
 logger = logging.getLogger(__name__)
 
 
@@ -57,6 +61,7 @@ async def resolve_events_with_store(
     state_sets: Sequence[StateMap[str]],
     event_map: Optional[Dict[str, EventBase]],
     state_res_store: "synapse.state.StateResolutionStore",
+    pool: Optional["StateResolutionPool"] = None,
 ) -> StateMap[str]:
     """Resolves the state using the v2 state resolution algorithm
 
@@ -76,6 +81,9 @@ async def resolve_events_with_store(
 
         state_res_store:
 
+        pool: if given, large resolutions will have their sorting and auth
+            check phases run in this pool of processes.
+
     Returns:
         A map from (type, state_key) to event_id.
     """
@@ -97,7 +105,9 @@ async def resolve_events_with_store(
 
     # Also fetch all auth events that appear in only some of the state sets'
     # auth chains.
-    auth_diff = await _get_auth_chain_difference(state_sets, event_map, state_res_store)
+    auth_diff = await _get_auth_chain_difference(
+        room_id, state_sets, event_map, state_res_store
+    )
 
     full_conflicted_set = set(
         itertools.chain(
@@ -123,6 +133,56 @@ async def resolve_events_with_store(
 
     logger.debug("%d full_conflicted_set entries", len(full_conflicted_set))
 
+    if pool is not None and len(full_conflicted_set) >= pool.min_conflicted_events:
+        resolved_state = await pool.resolve_conflicted_state(
+            room_id,
+            room_version,
+            unconflicted_state,
+            full_conflicted_set,
+            event_map,
+            state_res_store,
+        )
+        if resolved_state is not None:
+            return resolved_state
+
+    return await resolve_conflicted_state(
+        clock,
+        room_id,
+        room_version,
+        unconflicted_state,
+        full_conflicted_set,
+        event_map,
+        state_res_store,
+    )
+
+
+async def resolve_conflicted_state(
+    clock: Clock,
+    room_id: str,
+    room_version: str,
+    unconflicted_state: StateMap[str],
+    full_conflicted_set: Set[str],
+    event_map: Dict[str, EventBase],
+    state_res_store: "synapse.state.StateResolutionStore",
+) -> StateMap[str]:
+    """Runs the sorting and auth check phases of the v2 state resolution
+    algorithm, which are the CPU-heavy part of state resolution.
+
+    Args:
+        clock
+        room_id: the room we are working in
+        room_version: The room version
+        unconflicted_state: The state which is the same in all the state sets.
+        full_conflicted_set: The conflicted state events plus the auth chain
+            difference of the state sets. Must all be in `event_map`.
+        event_map: a dict from event_id to event, which will also be used as a
+            cache for any events fetched from `state_res_store`.
+        state_res_store
+
+    Returns:
+        A map from (type, state_key) to event_id.
+    """
+
     # Get and sort all the power events (kicks/bans/etc)
     power_events = (
         eid for eid in full_conflicted_set if _is_power_event(event_map[eid])
@@ -184,6 +244,96 @@ async def resolve_events_with_store(
     return resolved_state
 
 
+async def fetch_events_for_conflicted_state(
+    room_id: str,
+    unconflicted_state: StateMap[str],
+    full_conflicted_set: Set[str],
+    event_map: Dict[str, EventBase],
+    state_res_store: "synapse.state.StateResolutionStore",
+) -> Tuple[Set[str], Set[str]]:
+    """Fetches every event that `resolve_conflicted_state` may need into
+    `event_map`, so that it can be run without access to the database.
+
+    That is: the auth events of the conflicted events, the unconflicted state
+    events they may be auth checked against, and the chains of power level
+    events used for the mainline sort.
+
+    Args:
+        room_id: the room we are working in
+        unconflicted_state
+        full_conflicted_set: Must all be in `event_map`.
+        event_map: updated with the fetched events.
+        state_res_store
+
+    Returns:
+        A tuple of the IDs of the events in `event_map` which may be needed
+        (including `full_conflicted_set`), and the IDs of events which were
+        looked up but are not in the store.
+    """
+    needed = set(full_conflicted_set)
+    missing = set()  # type: Set[str]
+
+    async def fetch(event_ids: Iterable[str]) -> None:
+        event_ids = set(event_ids)
+        needed.update(event_ids)
+
+        to_fetch = {
+            eid for eid in event_ids if eid not in event_map and eid not in missing
+        }
+        if not to_fetch:
+            return
+
+        events = await state_res_store.get_events(to_fetch, allow_rejected=True)
+        event_map.update(events)
+        missing.update(to_fetch.difference(events))
+
+    # The auth events are used to build the graph of power events, to find the
+    # power level of the senders and when auth checking. We also need whatever
+    # the events may be auth checked against from the unconflicted state.
+    event_ids = set()
+    for eid in full_conflicted_set:
+        event = event_map[eid]
+        event_ids.update(event.auth_event_ids())
+        for key in event_auth.auth_types_for_event(event):
+            if key in unconflicted_state:
+                event_ids.add(unconflicted_state[key])
+
+    pl_id = unconflicted_state.get((EventTypes.PowerLevels, ""))
+    if pl_id is not None:
+        event_ids.add(pl_id)
+
+    await fetch(event_ids)
+
+    # Now walk back through the power level events' auth events, as the
+    # mainline sort follows the chains of power levels back to the start of
+    # the room.
+    seen_pl_ids = set()  # type: Set[str]
+    pl_events = [
+        event_map[eid]
+        for eid in needed
+        if eid in event_map and _is_power_levels_event(event_map[eid])
+    ]
+    while pl_events:
+        seen_pl_ids.update(event.event_id for event in pl_events)
+
+        event_ids = set(
+            itertools.chain.from_iterable(event.auth_event_ids() for event in pl_events)
+        )
+        await fetch(event_ids)
+
+        pl_events = []
+        for eid in event_ids:
+            pl_event = event_map.get(eid)
+            if (
+                pl_event is not None
+                and _is_power_levels_event(pl_event)
+                and eid not in seen_pl_ids
+            ):
+                pl_events.append(pl_event)
+
+    return needed.intersection(event_map), missing
+
+
 async def _get_power_level_for_sender(
     room_id: str,
     event_id: str,
@@ -236,6 +386,7 @@ async def _get_power_level_for_sender(
 
 
 async def _get_auth_chain_difference(
+    room_id: str,
     state_sets: Sequence[StateMap[str]],
     event_map: Dict[str, EventBase],
     state_res_store: "synapse.state.StateResolutionStore",
@@ -244,6 +395,7 @@ async def _get_auth_chain_difference(
     that only appear in some but not all of the auth chains.
 
     Args:
+        room_id
         state_sets
         event_map
         state_res_store
@@ -253,7 +405,7 @@ async def _get_auth_chain_difference(
     """
 
     difference = await state_res_store.get_auth_chain_difference(
-        [set(state_set.values()) for state_set in state_sets]
+        room_id, [set(state_set.values()) for state_set in state_sets]
     )
 
     return difference
@@ -289,6 +441,13 @@ def _seperate(
     return unconflicted_state, conflicted_state  # type: ignore
 
 
+def _is_power_levels_event(event: EventBase) -> bool:
+    return event.is_state() and (event.type, event.state_key) == (
+        EventTypes.PowerLevels,
+        "",
+    )
+
+
 def _is_power_event(event: EventBase) -> bool:
     """Return whether or not the event is a "power event", as defined by the
     v2 state resolution algorithm
@@ -59,6 +59,7 @@ class SQLBaseStore(metaclass=ABCMeta):
             self._attempt_to_invalidate_cache("is_host_joined", (room_id, host))
 
         self._attempt_to_invalidate_cache("get_users_in_room", (room_id,))
+        self._attempt_to_invalidate_cache("get_current_hosts_in_room", (room_id,))
         self._attempt_to_invalidate_cache("get_room_summary", (room_id,))
         self._attempt_to_invalidate_cache("get_current_state_ids", (room_id,))
 
@@ -71,15 +72,20 @@ class SQLBaseStore(metaclass=ABCMeta):
 
         Args:
             cache_name
-            key: Entry to invalidate. If None then invalidates the entire
-                cache.
+            key: Entry to invalidate, or a prefix of the keys of a tree cache.
+                If None then invalidates the entire cache.
         """
 
         try:
+            cache_func = getattr(self, cache_name)
             if key is None:
-                getattr(self, cache_name).invalidate_all()
+                cache_func.invalidate_all()
+            elif len(key) < getattr(cache_func, "num_args", len(key)):
+                # A prefix of the keys of a tree cache, so invalidate all the
+                # entries under it.
+                cache_func.invalidate_many(tuple(key))
             else:
-                getattr(self, cache_name).invalidate(tuple(key))
+                cache_func.invalidate(tuple(key))
         except AttributeError:
             # We probably haven't pulled in the cache in this worker,
             # which is fine.
@@ -66,6 +66,7 @@ from .signatures import SignatureStore
 from .state import StateStore
 from .stats import StatsStore
 from .stream import StreamStore
+from .sync_snapshots import SyncSnapshotStore
 from .tags import TagsStore
 from .transactions import TransactionStore
 from .ui_auth import UIAuthStore
@@ -116,6 +117,7 @@ class DataStore(
     RelationsStore,
     CensorEventsStore,
     UIAuthStore,
+    SyncSnapshotStore,
     CacheInvalidationWorkerStore,
     ServerMetricsStore,
 ):
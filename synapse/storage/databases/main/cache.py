@@ -182,6 +182,9 @@ class CacheInvalidationWorkerStore(SQLBaseStore):
 
         if etype == EventTypes.Member:
             self._membership_stream_cache.entity_has_changed(state_key, stream_ordering)
+            self._membership_change_cache.membership_has_changed(
+                state_key, stream_ordering, event_id
+            )
             self.get_invited_rooms_for_local_user.invalidate((state_key,))
 
         if relates_to:
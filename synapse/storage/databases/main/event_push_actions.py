@@ -15,14 +15,18 @@
 # limitations under the License.
 
 import logging
-from typing import Dict, List, Optional, Tuple, Union
+from typing import Collection, Dict, Iterable, List, Optional, Tuple, Union
 
 import attr
 
+from twisted.internet import defer
+
+from synapse.events import EventBase
 from synapse.metrics.background_process_metrics import run_as_background_process
-from synapse.storage._base import SQLBaseStore, db_to_json
+from synapse.storage._base import SQLBaseStore, db_to_json, make_in_list_sql_clause
 from synapse.storage.database import DatabasePool
 from synapse.util import json_encoder
+from synapse.util.async_helpers import ObservableDeferred
 from synapse.util.caches.descriptors import cached
 
 logger = logging.getLogger(__name__)
@@ -114,9 +118,170 @@ class EventPushActionsWorkerStore(SQLBaseStore):
             last_read_event_id,
         )
 
+    async def get_unread_event_push_actions_for_rooms(
+        self, user_id: str, last_read_event_ids: Dict[str, Optional[str]]
+    ) -> Dict[str, Dict[str, int]]:
+        """Bulk version of `get_unread_event_push_actions_by_room_for_user`,
+        which gets the counts for many rooms in one go and adds them to its
+        cache.
+
+        Args:
+            user_id: The user to retrieve the counts for.
+            last_read_event_ids: Map from the ID of each room to retrieve the
+                counts in to the event of the user's latest read receipt in
+                the room, or None if they have no receipt there.
+
+        Returns:
+            A map from room ID to the counts for the room.
+        """
+        cache = self.get_unread_event_push_actions_by_room_for_user.cache
+
+        results = {}  # type: Dict[str, Dict[str, int]]
+        missing = {}  # type: Dict[str, Optional[str]]
+        for room_id, last_read_event_id in last_read_event_ids.items():
+            counts = cache.get((room_id, user_id, last_read_event_id), None)
+            if isinstance(counts, ObservableDeferred):
+                counts = counts.get_result() if counts.has_succeeded() else None
+
+            if counts is None:
+                missing[room_id] = last_read_event_id
+            else:
+                results[room_id] = counts
+
+        if not missing:
+            return results
+
+        # Add entries for the missing rooms to the cache before we start, so
+        # that they get dropped if they're invalidated while we're looking
+        # them up.
+        deferreds = {}  # type: Dict[str, defer.Deferred]
+        for room_id, last_read_event_id in missing.items():
+            deferreds[room_id] = defer.Deferred()
+            cache.set((room_id, user_id, last_read_event_id), deferreds[room_id])
+
+        try:
+            counts_by_room = await self.db_pool.runInteraction(
+                "get_unread_event_push_actions_for_rooms",
+                self._get_unread_counts_for_rooms_txn,
+                user_id,
+                missing,
+            )
+        except Exception:
+            for room_id, last_read_event_id in missing.items():
+                cache.invalidate((room_id, user_id, last_read_event_id))
+                deferreds[room_id].errback()
+            raise
+
+        for room_id, d in deferreds.items():
+            d.callback(counts_by_room[room_id])
+
+        results.update(counts_by_room)
+        return results
+
+    def _get_unread_counts_for_rooms_txn(
+        self, txn, user_id: str, last_read_event_ids: Dict[str, Optional[str]]
+    ) -> Dict[str, Dict[str, int]]:
+        """Bulk version of `_get_unread_counts_by_receipt_txn`.
+
+        Returns:
+            A map from room ID to the counts for the room.
+        """
+        rows = self.db_pool.simple_select_many_txn(
+            txn,
+            table="events",
+            column="event_id",
+            iterable=[e for e in last_read_event_ids.values() if e is not None],
+            keyvalues={},
+            retcols=("event_id", "stream_ordering"),
+        )
+        event_stream_orderings = {
+            row["event_id"]: row["stream_ordering"] for row in rows
+        }
+
+        stream_orderings = {}  # type: Dict[str, int]
+        for room_id, last_read_event_id in last_read_event_ids.items():
+            stream_ordering = event_stream_orderings.get(last_read_event_id)
+            if stream_ordering is not None:
+                stream_orderings[room_id] = stream_ordering
+
+        # As in `_get_unread_counts_by_receipt_txn`, use the user's join for
+        # rooms where we don't know the event their receipt is for.
+        no_receipt_room_ids = [
+            room_id
+            for room_id in last_read_event_ids
+            if room_id not in stream_orderings
+        ]
+        if no_receipt_room_ids:
+            clause, args = make_in_list_sql_clause(
+                self.database_engine, "m.room_id", no_receipt_room_ids
+            )
+            txn.execute(
+                """
+                SELECT m.room_id, e.stream_ordering
+                FROM local_current_membership AS m
+                INNER JOIN events AS e USING (event_id)
+                WHERE m.user_id = ? AND %s
+                """
+                % (clause,),
+                [user_id] + list(args),
+            )
+            stream_orderings.update(txn)
+
+            for room_id in no_receipt_room_ids:
+                if room_id not in stream_orderings:
+                    # This raises the same error as the single room version.
+                    event_id = self.db_pool.simple_select_one_onecol_txn(
+                        txn=txn,
+                        table="local_current_membership",
+                        keyvalues={"room_id": room_id, "user_id": user_id},
+                        retcol="event_id",
+                    )
+                    stream_orderings[room_id] = self.get_stream_id_for_event_txn(
+                        txn, event_id
+                    )
+
+        rows = self.db_pool.simple_select_many_txn(
+            txn,
+            table="event_push_counts",
+            column="room_id",
+            iterable=list(stream_orderings),
+            keyvalues={"user_id": user_id},
+            retcols=(
+                "room_id",
+                "stream_ordering",
+                "notif_count",
+                "highlight_count",
+                "unread_count",
+            ),
+        )
+
+        counts_by_room = {}  # type: Dict[str, Dict[str, int]]
+        for row in rows:
+            room_id = row["room_id"]
+            if row["stream_ordering"] == stream_orderings[room_id]:
+                counts_by_room[room_id] = {
+                    "notify_count": row["notif_count"],
+                    "unread_count": row["unread_count"],
+                    "highlight_count": row["highlight_count"],
+                }
+
+        # Count the push actions in the rooms we don't have running counts from
+        # the right receipt for.
+        for room_id, stream_ordering in stream_orderings.items():
+            if room_id not in counts_by_room:
+                counts_by_room[room_id] = self._get_unread_counts_by_pos_txn(
+                    txn, room_id, user_id, stream_ordering
+                )
+
+        return counts_by_room
+
     def _get_unread_counts_by_receipt_txn(
         self, txn, room_id, user_id, last_read_event_id,
-    ):
+    ) -> Dict[str, int]:
+        """Get the unread counts for the user in the room after the given read
+        receipt, from the running counts in event_push_counts if they start
+        from it.
+        """
         stream_ordering = None
 
         if last_read_event_id is not None:
@@ -138,9 +303,169 @@ class EventPushActionsWorkerStore(SQLBaseStore):
 
             stream_ordering = self.get_stream_id_for_event_txn(txn, event_id)
 
-        return self._get_unread_counts_by_pos_txn(
-            txn, room_id, user_id, stream_ordering
+        row = self.db_pool.simple_select_one_txn(
+            txn,
+            table="event_push_counts",
+            keyvalues={"user_id": user_id, "room_id": room_id},
+            retcols=(
+                "stream_ordering",
+                "notif_count",
+                "highlight_count",
+                "unread_count",
+            ),
+            allow_none=True,
+        )
+
+        if row is None or row["stream_ordering"] != stream_ordering:
+            # The running counts are missing or from a different receipt than
+            # the one we've been asked about, so we have to count.
+            return self._get_unread_counts_by_pos_txn(
+                txn, room_id, user_id, stream_ordering
+            )
+
+        return {
+            "notify_count": row["notif_count"],
+            "unread_count": row["unread_count"],
+            "highlight_count": row["highlight_count"],
+        }
+
+    def _get_unread_counts_starts_txn(
+        self, txn, room_id: str, user_ids: Collection[str]
+    ) -> Dict[str, int]:
+        """Gets the stream orderings the unread counts of the given users in the
+        room start after: that of the event their read receipt is for, or of
+        their membership event if we don't have that event or they have no
+        receipt.
+
+        Users who have never been in the room are left out.
+        """
+        if not user_ids:
+            return {}
+
+        clause, args = make_in_list_sql_clause(
+            self.database_engine, "r.user_id", user_ids
         )
+        txn.execute(
+            """
+            SELECT r.user_id, e.stream_ordering
+            FROM receipts_linearized AS r
+            INNER JOIN events AS e USING (event_id)
+            WHERE r.room_id = ? AND r.receipt_type = 'm.read' AND %s
+            """
+            % (clause,),
+            [room_id] + list(args),
+        )
+        stream_orderings = dict(txn)  # type: Dict[str, int]
+
+        no_receipt_user_ids = [
+            user_id for user_id in user_ids if user_id not in stream_orderings
+        ]
+        if no_receipt_user_ids:
+            clause, args = make_in_list_sql_clause(
+                self.database_engine, "m.user_id", no_receipt_user_ids
+            )
+            txn.execute(
+                """
+                SELECT m.user_id, e.stream_ordering
+                FROM local_current_membership AS m
+                INNER JOIN events AS e USING (event_id)
+                WHERE m.room_id = ? AND %s
+                """
+                % (clause,),
+                [room_id] + list(args),
+            )
+            stream_orderings.update(txn)
+
+        return stream_orderings
+
+    def _update_unread_counts_txn(
+        self, txn, room_id: str, deltas: Iterable[Tuple[str, int, int, int, int]],
+    ) -> None:
+        """Updates the running unread counts of users for the push actions in a
+        room which have been added to or removed from event_push_actions in
+        this transaction.
+
+        This must be called once all the push actions in the room have been
+        changed, as the counts of users without running counts in the room are
+        counted from scratch, and so already include the changes.
+
+        Only the counts of users who haven't read an event are changed by its
+        push actions.
+
+        Args:
+            txn
+            room_id
+            deltas: (user_id, stream_ordering, notif, highlight, unread) to add
+                to each user's counts for the push action of the event with the
+                stream ordering.
+        """
+        deltas = list(deltas)
+        if not deltas:
+            return
+
+        max_stream_orderings = {}  # type: Dict[str, int]
+        for user_id, stream_ordering, _, _, _ in deltas:
+            max_stream_orderings[user_id] = max(
+                stream_ordering, max_stream_orderings.get(user_id, stream_ordering)
+            )
+
+        rows = self.db_pool.simple_select_many_txn(
+            txn,
+            table="event_push_counts",
+            column="user_id",
+            iterable=list(max_stream_orderings),
+            keyvalues={"room_id": room_id},
+            retcols=("user_id",),
+        )
+        counted_user_ids = {row["user_id"] for row in rows}
+
+        txn.executemany(
+            """
+            UPDATE event_push_counts SET
+                notif_count = notif_count + ?,
+                highlight_count = highlight_count + ?,
+                unread_count = unread_count + ?
+            WHERE user_id = ? AND room_id = ? AND stream_ordering < ?
+            """,
+            (
+                (notif, highlight, unread, user_id, room_id, stream_ordering)
+                for user_id, stream_ordering, notif, highlight, unread in deltas
+                if user_id in counted_user_ids
+            ),
+        )
+
+        # Start running counts for everyone else. Creating them here, rather
+        # than when they are read, means that any concurrent transaction which
+        # changes the push actions of the same user in the room either sees the
+        # row or conflicts with us inserting it, and so gets retried.
+        stream_orderings = self._get_unread_counts_starts_txn(
+            txn,
+            room_id,
+            [
+                user_id
+                for user_id in max_stream_orderings
+                if user_id not in counted_user_ids
+            ],
+        )
+        for user_id, start_stream_ordering in stream_orderings.items():
+            if start_stream_ordering >= max_stream_orderings[user_id]:
+                continue
+
+            counts = self._get_unread_counts_by_pos_txn(
+                txn, room_id, user_id, start_stream_ordering
+            )
+            self.db_pool.simple_upsert_txn(
+                txn,
+                table="event_push_counts",
+                keyvalues={"user_id": user_id, "room_id": room_id},
+                values={
+                    "stream_ordering": start_stream_ordering,
+                    "notif_count": counts["notify_count"],
+                    "highlight_count": counts["highlight_count"],
+                    "unread_count": counts["unread_count"],
+                },
+                lock=False,
+            )
 
     def _get_unread_counts_by_pos_txn(self, txn, room_id, user_id, stream_ordering):
         sql = (
@@ -726,12 +1051,157 @@ class EventPushActionsStore(EventPushActionsWorkerStore):
         )
         return result[0] or 0
 
+    async def add_push_actions_for_persisted_event(
+        self,
+        event: EventBase,
+        user_id_actions: Dict[str, List[Union[dict, str]]],
+        count_as_unread: bool,
+    ) -> None:
+        """Add the push actions for an event which has already been persisted.
+
+        This is used instead of `add_push_actions_to_staging` when push actions
+        are computed after the event has been persisted.
+
+        Args:
+            event: The persisted event the actions are for.
+            user_id_actions: A mapping of user_id to list of push actions, where
+                an action can either be a string or dict.
+            count_as_unread: Whether this event should increment unread counts.
+        """
+        if not user_id_actions:
+            return
+
+        def _add_push_actions_for_persisted_event_txn(txn):
+            sql = """
+                INSERT INTO event_push_actions (
+                    room_id, event_id, user_id, actions, stream_ordering,
+                    topological_ordering, notif, highlight, unread
+                )
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """
+
+            rows = []
+            for user_id, actions in user_id_actions.items():
+                is_highlight = 1 if _action_has_highlight(actions) else 0
+                rows.append(
+                    (
+                        event.room_id,
+                        event.event_id,
+                        user_id,
+                        _serialize_action(actions, is_highlight),
+                        event.internal_metadata.stream_ordering,
+                        event.depth,
+                        1 if "notify" in actions else 0,
+                        is_highlight,
+                        int(count_as_unread),
+                    )
+                )
+
+                txn.call_after(
+                    self.get_unread_event_push_actions_by_room_for_user.invalidate_many,
+                    (event.room_id, user_id),
+                )
+
+            txn.executemany(sql, rows)
+
+            stream_ordering = event.internal_metadata.stream_ordering
+            self._update_unread_counts_txn(
+                txn,
+                event.room_id,
+                (
+                    (user_id, stream_ordering, notif, highlight, unread)
+                    for _, _, user_id, _, _, _, notif, highlight, unread in rows
+                ),
+            )
+
+            # Workers will already have invalidated their caches for the room
+            # when they saw the event, so need telling again.
+            self._send_invalidation_to_replication(
+                txn,
+                self.get_unread_event_push_actions_by_room_for_user.__name__,
+                (event.room_id,),
+            )
+
+        await self.db_pool.runInteraction(
+            "add_push_actions_for_persisted_event",
+            _add_push_actions_for_persisted_event_txn,
+        )
+
+    async def get_deferred_push_actions_position(self) -> Optional[int]:
+        """Gets the stream ordering up to which the push actions for every event
+        have been stored, when they are computed after events are persisted.
+
+        Returns:
+            The stream ordering, or None if push actions have been computed
+            before events were persisted.
+        """
+        return await self.db_pool.simple_select_one_onecol(
+            table="deferred_push_actions_position",
+            keyvalues={},
+            retcol="stream_ordering",
+            desc="get_deferred_push_actions_position",
+        )
+
+    async def set_deferred_push_actions_position(
+        self, stream_ordering: Optional[int]
+    ) -> None:
+        """Sets the stream ordering up to which the push actions for every
+        event have been stored, or None if they are no longer computed after
+        events are persisted.
+        """
+        await self.db_pool.simple_update_one(
+            table="deferred_push_actions_position",
+            keyvalues={},
+            updatevalues={"stream_ordering": stream_ordering},
+            desc="set_deferred_push_actions_position",
+        )
+
+    async def get_events_for_deferred_push_actions(
+        self, from_stream_ordering: int, to_stream_ordering: int, limit: int
+    ) -> Tuple[int, List[str]]:
+        """Gets the events whose push actions are still to be computed after a
+        restart.
+
+        Args:
+            from_stream_ordering: The stream ordering up to which push actions
+                have been stored.
+            to_stream_ordering: The stream ordering up to which events had been
+                persisted.
+            limit: The maximum number of events to return.
+
+        Returns:
+            The stream ordering up to which events have been returned, and the
+            IDs of the events in stream order.
+        """
+
+        def get_events_for_deferred_push_actions_txn(txn):
+            sql = (
+                "SELECT stream_ordering, event_id FROM events"
+                " WHERE ? < stream_ordering AND stream_ordering <= ?"
+                " AND outlier = ?"
+                " ORDER BY stream_ordering ASC LIMIT ?"
+            )
+            txn.execute(sql, (from_stream_ordering, to_stream_ordering, False, limit))
+            rows = txn.fetchall()
+
+            upper_bound = to_stream_ordering
+            if len(rows) == limit:
+                upper_bound = rows[-1][0]
+
+            return upper_bound, [event_id for _, event_id in rows]
+
+        return await self.db_pool.runInteraction(
+            "get_events_for_deferred_push_actions",
+            get_events_for_deferred_push_actions_txn,
+        )
+
     def _remove_old_push_actions_before_txn(
         self, txn, room_id, user_id, stream_ordering
     ):
         """
         Purges old push actions for a user and room before a given
-        stream_ordering.
+        stream_ordering, and restarts the user's running unread counts for the
+        room from it.
 
         We however keep a months worth of highlighted notifications, so that
         users can still get a list of recent highlights.
@@ -772,6 +1242,33 @@ class EventPushActionsStore(EventPushActionsWorkerStore):
             (room_id, user_id, stream_ordering),
         )
 
+        # If we're keeping running counts for the user in the room, recount
+        # them from the new receipt. Concurrent updates to the row will cause
+        # one of the transactions to be retried.
+        current_stream_ordering = self.db_pool.simple_select_one_onecol_txn(
+            txn,
+            table="event_push_counts",
+            keyvalues={"user_id": user_id, "room_id": room_id},
+            retcol="stream_ordering",
+            allow_none=True,
+        )
+
+        if current_stream_ordering is not None:
+            counts = self._get_unread_counts_by_pos_txn(
+                txn, room_id, user_id, stream_ordering
+            )
+            self.db_pool.simple_update_txn(
+                txn,
+                table="event_push_counts",
+                keyvalues={"user_id": user_id, "room_id": room_id},
+                updatevalues={
+                    "stream_ordering": stream_ordering,
+                    "notif_count": counts["notify_count"],
+                    "highlight_count": counts["highlight_count"],
+                    "unread_count": counts["unread_count"],
+                },
+            )
+
     def _start_rotate_notifs(self):
         return run_as_background_process("rotate_notifs", self._rotate_notifs)
 
@@ -19,6 +19,7 @@ import threading
 from collections import namedtuple
 from typing import Dict, Iterable, List, Optional, Tuple, overload
 
+import attr
 from constantly import NamedConstant, Names
 from typing_extensions import Literal
 
@@ -29,9 +30,10 @@ from synapse.api.errors import NotFoundError, SynapseError
 from synapse.api.room_versions import (
     KNOWN_ROOM_VERSIONS,
     EventFormatVersions,
+    RoomVersion,
     RoomVersions,
 )
-from synapse.events import EventBase, make_event_from_dict
+from synapse.events import EventBase, decode_event_json, make_event_with_lazy_content
 from synapse.events.utils import prune_event
 from synapse.logging.context import PreserveLoggingContext, current_context
 from synapse.metrics.background_process_metrics import run_as_background_process
@@ -42,8 +44,9 @@ from synapse.storage._base import SQLBaseStore, db_to_json, make_in_list_sql_cla
 from synapse.storage.database import DatabasePool
 from synapse.storage.engines import PostgresEngine
 from synapse.storage.util.id_generators import MultiWriterIdGenerator, StreamIdGenerator
-from synapse.types import Collection, get_domain_from_id
+from synapse.types import Collection, JsonDict, get_domain_from_id
 from synapse.util.caches.descriptors import Cache, cached
+from synapse.util.frozenutils import frozendict_json_encoder
 from synapse.util.iterutils import batch_iter
 from synapse.util.metrics import Measure
 
@@ -63,6 +66,50 @@ EVENT_QUEUE_TIMEOUT_S = 0.1  # Timeout when waiting for requests for events
 _EventCacheEntry = namedtuple("_EventCacheEntry", ("event", "redacted_event"))
 
 
+@attr.s(slots=True, frozen=True)
+class _EventJsonCacheEntry:
+    """An entry in the event cache which holds the JSON of an event rather than
+    the event object, which takes much less memory. A new event object is built
+    each time the entry is read from the cache, with its content left as JSON
+    until it's used.
+
+    Only used for events which haven't been redacted.
+    """
+
+    event_id = attr.ib(type=str)
+    # The UTF-8 encoded JSON of the event, as stored in `event_json`.
+    json = attr.ib(type=bytes)
+    internal_metadata = attr.ib(type=JsonDict)
+    room_version = attr.ib(type=RoomVersion)
+    rejected_reason = attr.ib(type=Optional[str])
+
+    @classmethod
+    def from_event(cls, event: EventBase) -> "_EventJsonCacheEntry":
+        d = event.get_dict()
+        d.pop("redacted", None)
+        d.pop("redacted_because", None)
+
+        return cls(
+            event_id=event.event_id,
+            json=frozendict_json_encoder.encode(d).encode("utf-8"),
+            internal_metadata=event.internal_metadata.get_dict(),
+            room_version=event.room_version,
+            rejected_reason=event.rejected_reason,
+        )
+
+    def to_cache_entry(self) -> _EventCacheEntry:
+        event_dict, content_json = decode_event_json(self.json.decode("utf-8"))
+        event = make_event_with_lazy_content(
+            event_id=self.event_id,
+            event_dict=event_dict,
+            content_json=content_json,
+            room_version=self.room_version,
+            internal_metadata_dict=self.internal_metadata,
+            rejected_reason=self.rejected_reason,
+        )
+        return _EventCacheEntry(event=event, redacted_event=None)
+
+
 class EventRedactBehaviour(Names):
     """
     What to do when retrieving a redacted event from the database.
@@ -143,6 +190,7 @@ class EventsWorkerStore(SQLBaseStore):
             max_entries=hs.config.caches.event_cache_size,
             apply_cache_factor_from_config=False,
         )
+        self._event_cache_json = hs.config.caches.event_cache_json
 
         self._event_fetch_lock = threading.Condition()
         self._event_fetch_list = []
@@ -510,6 +558,12 @@ class EventsWorkerStore(SQLBaseStore):
             if not ret:
                 continue
 
+            if isinstance(ret, _EventJsonCacheEntry):
+                if not allow_rejected and ret.rejected_reason:
+                    event_map[event_id] = None
+                    continue
+                ret = ret.to_cache_entry()
+
             if allow_rejected or not ret.event.rejected_reason:
                 event_map[event_id] = ret
             else:
@@ -627,6 +681,8 @@ class EventsWorkerStore(SQLBaseStore):
 
         # build a map from event_id to EventBase
         event_map = {}
+        event_json_map = {}  # type: Dict[str, str]
+        internal_metadata_map = {}  # type: Dict[str, JsonDict]
         for event_id, row in fetched_events.items():
             if not row:
                 continue
@@ -637,10 +693,17 @@ class EventsWorkerStore(SQLBaseStore):
             if not allow_rejected and rejected_reason:
                 continue
 
+            event_json = row["json"]
+            if isinstance(event_json, memoryview):
+                event_json = event_json.tobytes()
+            if isinstance(event_json, bytes):
+                event_json = event_json.decode("utf-8")
+
             # If the event or metadata cannot be parsed, log the error and act
-            # as if the event is unknown.
+            # as if the event is unknown. The content is only decoded when it
+            # is used.
             try:
-                d = db_to_json(row["json"])
+                d, content_json = decode_event_json(event_json)
             except ValueError:
                 logger.error("Unable to parse json from event: %s", event_id)
                 continue
@@ -717,14 +780,18 @@ class EventsWorkerStore(SQLBaseStore):
                     )
                     continue
 
-            original_ev = make_event_from_dict(
+            original_ev = make_event_with_lazy_content(
+                event_id=event_id,
                 event_dict=d,
+                content_json=content_json,
                 room_version=room_version,
                 internal_metadata_dict=internal_metadata,
                 rejected_reason=rejected_reason,
             )
 
             event_map[event_id] = original_ev
+            event_json_map[event_id] = event_json
+            internal_metadata_map[event_id] = internal_metadata
 
         # finally, we can decide whether each one needs redacting, and build
         # the cache entries.
@@ -739,7 +806,19 @@ class EventsWorkerStore(SQLBaseStore):
                 event=original_ev, redacted_event=redacted_event
             )
 
-            self._get_event_cache.prefill((event_id,), cache_entry)
+            if self._event_cache_json and not redacted_event:
+                self._get_event_cache.prefill(
+                    (event_id,),
+                    _EventJsonCacheEntry(
+                        event_id=event_id,
+                        json=event_json_map[event_id].encode("utf-8"),
+                        internal_metadata=internal_metadata_map[event_id],
+                        room_version=original_ev.room_version,
+                        rejected_reason=original_ev.rejected_reason,
+                    ),
+                )
+            else:
+                self._get_event_cache.prefill((event_id,), cache_entry)
             result_map[event_id] = cache_entry
 
         return result_map
@@ -234,6 +234,10 @@ class PurgeEventsStore(StateGroupWorkerStore, SQLBaseStore):
                 (room_id,),
             )
 
+        # The running unread counts may include push actions we've just
+        # deleted, so throw them away. They'll be recounted when next needed.
+        txn.execute("DELETE FROM event_push_counts WHERE room_id = ?", (room_id,))
+
         # Mark all state and own events as outliers
         logger.info("[purge] marking remaining events as outliers")
         txn.execute(
@@ -313,6 +317,7 @@ class PurgeEventsStore(StateGroupWorkerStore, SQLBaseStore):
         # Now we delete tables which lack an index on room_id but have one on event_id
         for table in (
             "event_auth",
+            "event_auth_chains",
             "event_edges",
             "event_push_actions_staging",
             "event_reference_hashes",
@@ -338,18 +343,22 @@ class PurgeEventsStore(StateGroupWorkerStore, SQLBaseStore):
         for table in (
             "current_state_events",
             "destination_rooms",
+            "event_auth_chain_to_calculate",
             "event_backward_extremities",
             "event_forward_extremities",
             "event_json",
             "event_push_actions",
+            "event_push_counts",
             "event_search",
             "events",
             "group_rooms",
+            "initial_sync_snapshot_rooms",
             "public_room_list_stream",
             "receipts_graph",
             "receipts_linearized",
             "room_aliases",
             "room_depth",
+            "room_joined_hosts",
             "room_memberships",
             "room_stats_state",
             "room_stats_current",
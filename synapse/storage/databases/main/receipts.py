@@ -86,6 +86,31 @@ class ReceiptsWorkerStore(SQLBaseStore, metaclass=abc.ABCMeta):
             allow_none=True,
         )
 
+    @cachedList(
+        cached_method_name="get_last_receipt_event_id_for_user",
+        list_name="room_ids",
+        num_args=3,
+    )
+    async def get_last_receipt_event_ids_for_user(
+        self, user_id: str, room_ids: List[str], receipt_type: str
+    ) -> Dict[str, Optional[str]]:
+        """Bulk version of `get_last_receipt_event_id_for_user`.
+
+        Returns:
+            A map from room ID to the event the user's receipt in the room is
+            for, which is missing or None if they have no receipt there.
+        """
+        rows = await self.db_pool.simple_select_many_batch(
+            table="receipts_linearized",
+            column="room_id",
+            iterable=room_ids,
+            keyvalues={"user_id": user_id, "receipt_type": receipt_type},
+            retcols=("room_id", "event_id"),
+            desc="get_last_receipt_event_ids_for_user",
+        )
+
+        return {row["room_id"]: row["event_id"] for row in rows}
+
     @cached(num_args=2)
     async def get_receipts_for_user(self, user_id, receipt_type):
         rows = await self.db_pool.simple_select_list(
@@ -45,6 +45,7 @@ logger = logging.getLogger(__name__)
 
 _MEMBERSHIP_PROFILE_UPDATE_NAME = "room_membership_profile_update"
 _CURRENT_STATE_MEMBERSHIP_UPDATE_NAME = "current_state_events_membership"
+_ROOM_JOINED_HOSTS_UPDATE_NAME = "room_joined_hosts"
 
 
 class RoomMemberWorkerStore(EventsWorkerStore):
@@ -61,6 +62,14 @@ class RoomMemberWorkerStore(EventsWorkerStore):
         self._check_safe_current_state_events_membership_updated_txn(txn)
         txn.close()
 
+        # Has the room_joined_hosts table been filled in for existing rooms? Or
+        # is the background update still running?
+        self._room_joined_hosts_up_to_date = False
+
+        txn = db_conn.cursor(txn_name="_check_room_joined_hosts_populated")
+        self._check_room_joined_hosts_populated_txn(txn)
+        txn.close()
+
         if self.hs.config.metrics_flags.known_servers:
             self._known_servers_count = 1
             self.hs.get_clock().looping_call(
@@ -143,6 +152,32 @@ class RoomMemberWorkerStore(EventsWorkerStore):
                 self._check_safe_current_state_events_membership_updated_txn,
             )
 
+    def _check_room_joined_hosts_populated_txn(self, txn):
+        """Checks if the background update to fill in the room_joined_hosts
+        table has finished, and so whether it can be used.
+        """
+
+        pending_update = self.db_pool.simple_select_one_txn(
+            txn,
+            table="background_updates",
+            keyvalues={"update_name": _ROOM_JOINED_HOSTS_UPDATE_NAME},
+            retcols=["update_name"],
+            allow_none=True,
+        )
+
+        self._room_joined_hosts_up_to_date = not pending_update
+
+        # If the update is still running, reschedule to run.
+        if pending_update:
+            self._clock.call_later(
+                15.0,
+                run_as_background_process,
+                "_check_room_joined_hosts_populated",
+                self.db_pool.runInteraction,
+                "_check_room_joined_hosts_populated",
+                self._check_room_joined_hosts_populated_txn,
+            )
+
     @cached(max_entries=100000, iterable=True)
     async def get_users_in_room(self, room_id: str) -> List[str]:
         return await self.db_pool.runInteraction(
@@ -619,6 +654,29 @@ class RoomMemberWorkerStore(EventsWorkerStore):
             for row in rows
         }
 
+    @cached(max_entries=100000, iterable=True)
+    async def get_current_hosts_in_room(self, room_id: str) -> FrozenSet[str]:
+        """Get the servers which have joined members in the current state of
+        the room.
+
+        Args:
+            room_id: The room to get the servers of.
+
+        Returns:
+            Set of server names.
+        """
+        if not self._room_joined_hosts_up_to_date:
+            user_ids = await self.get_users_in_room(room_id)
+            return frozenset(get_domain_from_id(user_id) for user_id in user_ids)
+
+        hosts = await self.db_pool.simple_select_onecol(
+            table="room_joined_hosts",
+            keyvalues={"room_id": room_id},
+            retcol="host",
+            desc="get_current_hosts_in_room",
+        )
+        return frozenset(hosts)
+
     @cached(max_entries=10000)
     async def is_host_joined(self, room_id: str, host: str) -> bool:
         if "%" in host or "_" in host:
@@ -766,6 +824,31 @@ class RoomMemberWorkerStore(EventsWorkerStore):
 
         return set(room_ids)
 
+    async def get_hosts_ever_joined_to_room(self, room_id: str) -> Set[str]:
+        """Get the servers of all the users who have ever been in the room,
+        according to the membership events we have.
+
+        This is a superset of the servers in the room at any event in it.
+
+        Args:
+            room_id: The room to get the servers of.
+
+        Returns:
+            Set of server names.
+        """
+
+        def _get_hosts_ever_joined_to_room_txn(txn):
+            txn.execute(
+                "SELECT DISTINCT user_id FROM room_memberships"
+                " WHERE room_id = ? AND membership = ?",
+                (room_id, Membership.JOIN),
+            )
+            return {get_domain_from_id(user_id) for user_id, in txn}
+
+        return await self.db_pool.runInteraction(
+            "get_hosts_ever_joined_to_room", _get_hosts_ever_joined_to_room_txn
+        )
+
     async def get_membership_from_event_ids(
         self, member_event_ids: Iterable[str]
     ) -> List[dict]:
@@ -824,6 +907,9 @@ class RoomMemberBackgroundUpdateStore(SQLBaseStore):
             _CURRENT_STATE_MEMBERSHIP_UPDATE_NAME,
             self._background_current_state_membership,
         )
+        self.db_pool.updates.register_background_update_handler(
+            _ROOM_JOINED_HOSTS_UPDATE_NAME, self._background_room_joined_hosts,
+        )
         self.db_pool.updates.register_background_index_update(
             "room_membership_forgotten_idx",
             index_name="room_memberships_user_room_forgotten",
@@ -967,6 +1053,82 @@ class RoomMemberBackgroundUpdateStore(SQLBaseStore):
 
         return row_count
 
+    async def _background_room_joined_hosts(self, progress, batch_size):
+        """Fill in the room_joined_hosts table for existing rooms.
+
+        This works by iterating over all rooms in alphabetical order.
+        """
+
+        def _background_room_joined_hosts_txn(txn, last_processed_room):
+            # Rooms which are processed are otherwise only updated by the
+            # event persister, which doesn't lock the table. Lock it before
+            # reading the current state so that we don't miss changes to it.
+            self.database_engine.lock_table(txn, "room_joined_hosts")
+
+            processed = 0
+            while processed < batch_size:
+                txn.execute(
+                    "SELECT MIN(room_id) FROM current_state_events WHERE room_id > ?",
+                    (last_processed_room,),
+                )
+                row = txn.fetchone()
+                if not row or not row[0]:
+                    return processed, True
+
+                (next_room,) = row
+
+                txn.execute(
+                    """
+                    SELECT state_key FROM current_state_events
+                    WHERE type = ? AND room_id = ? AND membership = ?
+                    """,
+                    (EventTypes.Member, next_room, Membership.JOIN),
+                )
+                counts = {}  # type: Dict[str, int]
+                for (user_id,) in txn:
+                    host = get_domain_from_id(user_id)
+                    counts[host] = counts.get(host, 0) + 1
+
+                self.db_pool.simple_delete_txn(
+                    txn, table="room_joined_hosts", keyvalues={"room_id": next_room}
+                )
+                self.db_pool.simple_insert_many_txn(
+                    txn,
+                    table="room_joined_hosts",
+                    values=[
+                        {"room_id": next_room, "host": host, "member_count": count}
+                        for host, count in counts.items()
+                    ],
+                )
+
+                processed += len(counts) + 1
+                last_processed_room = next_room
+
+            self.db_pool.updates._background_update_progress_txn(
+                txn,
+                _ROOM_JOINED_HOSTS_UPDATE_NAME,
+                {"last_processed_room": last_processed_room},
+            )
+
+            return processed, False
+
+        # If we haven't got a last processed room then just use the empty
+        # string, which will compare before all room IDs correctly.
+        last_processed_room = progress.get("last_processed_room", "")
+
+        row_count, finished = await self.db_pool.runInteraction(
+            "_background_room_joined_hosts",
+            _background_room_joined_hosts_txn,
+            last_processed_room,
+        )
+
+        if finished:
+            await self.db_pool.updates._end_background_update(
+                _ROOM_JOINED_HOSTS_UPDATE_NAME
+            )
+
+        return row_count
+
 
 class RoomMemberStore(RoomMemberWorkerStore, RoomMemberBackgroundUpdateStore):
     def __init__(self, database: DatabasePool, db_conn, hs):
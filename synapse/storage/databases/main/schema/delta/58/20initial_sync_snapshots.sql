@@ -0,0 +1,41 @@
+/* Copyright 2020 The Matrix.org Foundation C.I.C
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *    http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+-- Snapshots of the rooms in users' most recent initial syncs, for each filter,
+-- used to speed up their next initial sync.
+CREATE TABLE IF NOT EXISTS initial_sync_snapshots (
+    user_id TEXT NOT NULL,
+    -- A hash of the filter used for the sync.
+    filter_key TEXT NOT NULL,
+    -- The stream token the snapshot was taken at.
+    stream_token TEXT NOT NULL,
+    ts BIGINT NOT NULL,
+    -- JSON list of the users the user had ignored.
+    ignored_users TEXT NOT NULL
+);
+
+CREATE UNIQUE INDEX initial_sync_snapshots_key ON initial_sync_snapshots(user_id, filter_key);
+CREATE INDEX initial_sync_snapshots_ts ON initial_sync_snapshots(ts);
+
+-- The entries for each room in the snapshots.
+CREATE TABLE IF NOT EXISTS initial_sync_snapshot_rooms (
+    user_id TEXT NOT NULL,
+    filter_key TEXT NOT NULL,
+    room_id TEXT NOT NULL,
+    -- JSON of the room's entry.
+    entry TEXT NOT NULL
+);
+
+CREATE UNIQUE INDEX initial_sync_snapshot_rooms_key ON initial_sync_snapshot_rooms(user_id, filter_key, room_id);
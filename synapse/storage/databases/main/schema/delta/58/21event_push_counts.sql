@@ -0,0 +1,31 @@
+/* Copyright 2020 The Matrix.org Foundation C.I.C
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *    http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+-- Running notification counts for each user in each room since their read
+-- receipt, kept up to date as push actions are added, so that the counts don't
+-- have to be recalculated from event_push_actions on every sync.
+CREATE TABLE IF NOT EXISTS event_push_counts (
+    user_id TEXT NOT NULL,
+    room_id TEXT NOT NULL,
+    -- The stream ordering of the event the counts start after, i.e. the event
+    -- the user's read receipt is for.
+    stream_ordering BIGINT NOT NULL,
+    notif_count BIGINT NOT NULL,
+    highlight_count BIGINT NOT NULL,
+    unread_count BIGINT NOT NULL
+);
+
+CREATE UNIQUE INDEX event_push_counts_user_room ON event_push_counts(user_id, room_id);
+CREATE INDEX event_push_counts_room_id ON event_push_counts(room_id);
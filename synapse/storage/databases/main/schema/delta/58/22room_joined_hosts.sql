@@ -0,0 +1,29 @@
+/* Copyright 2020 The Matrix.org Foundation C.I.C
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *    http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+-- The number of joined members each server has in the current state of each
+-- room, kept up to date as the current state changes. Servers without any
+-- joined members don't have a row.
+CREATE TABLE IF NOT EXISTS room_joined_hosts (
+    room_id TEXT NOT NULL,
+    host TEXT NOT NULL,
+    member_count BIGINT NOT NULL
+);
+
+CREATE UNIQUE INDEX room_joined_hosts_room_host ON room_joined_hosts(room_id, host);
+
+-- Fill in the table for existing rooms.
+INSERT INTO background_updates (update_name, progress_json) VALUES
+  ('room_joined_hosts', '{}');
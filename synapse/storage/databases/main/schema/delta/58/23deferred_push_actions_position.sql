@@ -0,0 +1,26 @@
+/* Copyright 2020 The Matrix.org Foundation C.I.C
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *    http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+-- The stream ordering up to which the push actions of every event have been
+-- stored, when push actions are computed after events are persisted (see the
+-- `push.defer_actions` option), so that the rest can be computed after a
+-- restart. NULL if push actions are computed before events are persisted.
+CREATE TABLE IF NOT EXISTS deferred_push_actions_position (
+    Lock CHAR(1) NOT NULL DEFAULT 'X' UNIQUE,  -- Makes sure this table only has one row.
+    stream_ordering BIGINT,
+    CHECK (Lock='X')
+);
+
+INSERT INTO deferred_push_actions_position (stream_ordering) VALUES (NULL);
@@ -27,7 +27,7 @@ from synapse.storage.database import DatabasePool
 from synapse.storage.databases.main.events_worker import EventsWorkerStore
 from synapse.storage.databases.main.roommember import RoomMemberWorkerStore
 from synapse.storage.state import StateFilter
-from synapse.types import StateMap
+from synapse.types import FrozenStateMap, StateMap
 from synapse.util.caches import intern_string
 from synapse.util.caches.descriptors import cached, cachedList
 
@@ -183,7 +183,7 @@ class StateGroupWorkerStore(EventsWorkerStore, SQLBaseStore):
                 (room_id,),
             )
 
-            return {(intern_string(r[0]), intern_string(r[1])): r[2] for r in txn}
+            return FrozenStateMap({(r[0], r[1]): r[2] for r in txn})
 
         return await self.db_pool.runInteraction(
             "get_current_state_ids", _get_current_state_ids_txn
@@ -449,6 +449,14 @@ class MainStateBackgroundUpdateStore(RoomMemberWorkerStore):
                 keyvalues={},
             )
 
+            self.db_pool.simple_delete_many_txn(
+                txn,
+                table="room_joined_hosts",
+                column="room_id",
+                iterable=to_delete,
+                keyvalues={},
+            )
+
             self.db_pool.simple_delete_many_txn(
                 txn,
                 table="event_forward_extremities",
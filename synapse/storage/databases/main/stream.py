@@ -54,7 +54,9 @@ from synapse.storage.database import (
 from synapse.storage.databases.main.events_worker import EventsWorkerStore
 from synapse.storage.engines import BaseDatabaseEngine, PostgresEngine
 from synapse.types import Collection, PersistedEventPosition, RoomStreamToken
+from synapse.util.caches.membership_change_cache import MembershipChangeCache
 from synapse.util.caches.stream_change_cache import StreamChangeCache
+from synapse.util.iterutils import batch_iter
 
 if TYPE_CHECKING:
     from synapse.server import HomeServer
@@ -293,6 +295,7 @@ class StreamWorkerStore(EventsWorkerStore, SQLBaseStore, metaclass=abc.ABCMeta):
         self._membership_stream_cache = StreamChangeCache(
             "MembershipStreamChangeCache", events_max
         )
+        self._membership_change_cache = MembershipChangeCache("MembershipChangeCache")
 
         self._stream_order_on_start = self.get_room_max_stream_ordering()
 
@@ -376,6 +379,36 @@ class StreamWorkerStore(EventsWorkerStore, SQLBaseStore, metaclass=abc.ABCMeta):
             if self._events_stream_cache.has_entity_changed(room_id, from_id)
         }
 
+    async def get_rooms_with_events_since(
+        self, room_ids: Collection[str], from_key: RoomStreamToken
+    ) -> Set[str]:
+        """Returns the rooms which have had events persisted since `from_key`.
+
+        Unlike `get_rooms_that_changed`, this checks the database for the rooms
+        that the stream change cache can't rule out, so works for old tokens.
+        """
+        maybe_changed = self.get_rooms_that_changed(room_ids, from_key)
+        if not maybe_changed:
+            return set()
+
+        def get_rooms_with_events_since_txn(txn):
+            changed = set()  # type: Set[str]
+            for batch in batch_iter(maybe_changed, 100):
+                clause, args = make_in_list_sql_clause(
+                    self.database_engine, "room_id", batch
+                )
+                sql = (
+                    "SELECT DISTINCT room_id FROM events"
+                    " WHERE stream_ordering > ? AND %s" % (clause,)
+                )
+                txn.execute(sql, [from_key.stream] + args)
+                changed.update(room_id for room_id, in txn)
+            return changed
+
+        return await self.db_pool.runInteraction(
+            "get_rooms_with_events_since", get_rooms_with_events_since_txn
+        )
+
     async def get_room_events_stream_for_room(
         self,
         room_id: str,
@@ -461,30 +494,63 @@ class StreamWorkerStore(EventsWorkerStore, SQLBaseStore, metaclass=abc.ABCMeta):
             if not has_changed:
                 return []
 
+        changes = self._membership_change_cache.get_changes(user_id, from_id, to_id)
+        if changes is None:
+            changes = await self._fill_membership_change_cache(user_id, from_id)
+            changes = [
+                (stream_ordering, event_id)
+                for stream_ordering, event_id in changes
+                if stream_ordering <= to_id
+            ]
+
+        rows = [
+            _EventDictReturn(event_id, None, stream_ordering)
+            for stream_ordering, event_id in changes
+        ]
+
+        ret = await self.get_events_as_list(
+            [r.event_id for r in rows], get_prev_content=True
+        )
+
+        self._set_before_and_after(ret, rows, topo_order=False)
+
+        return ret
+
+    async def _fill_membership_change_cache(
+        self, user_id: str, from_id: int
+    ) -> List[Tuple[int, str]]:
+        """Fetches all the membership changes of the user after the given
+        stream ordering, and adds them to `_membership_change_cache`.
+
+        Returns:
+            A list of (stream ordering, event ID) tuples in stream order.
+        """
+
         def f(txn):
             sql = (
-                "SELECT m.event_id, stream_ordering FROM events AS e,"
+                "SELECT e.stream_ordering, m.event_id FROM events AS e,"
                 " room_memberships AS m"
                 " WHERE e.event_id = m.event_id"
                 " AND m.user_id = ?"
-                " AND e.stream_ordering > ? AND e.stream_ordering <= ?"
+                " AND e.stream_ordering > ?"
                 " ORDER BY e.stream_ordering ASC"
             )
-            txn.execute(sql, (user_id, from_id, to_id))
+            txn.execute(sql, (user_id, from_id))
 
-            rows = [_EventDictReturn(row[0], None, row[1]) for row in txn]
+            return [(row[0], row[1]) for row in txn]
 
-            return rows
-
-        rows = await self.db_pool.runInteraction("get_membership_changes_for_user", f)
-
-        ret = await self.get_events_as_list(
-            [r.event_id for r in rows], get_prev_content=True
-        )
+        fill = self._membership_change_cache.start_fill(user_id, from_id)
+        try:
+            changes = await self.db_pool.runInteraction(
+                "get_membership_changes_for_user", f
+            )
+        except Exception:
+            self._membership_change_cache.abort_fill(user_id, fill)
+            raise
 
-        self._set_before_and_after(ret, rows, topo_order=False)
+        self._membership_change_cache.finish_fill(user_id, fill, changes)
 
-        return ret
+        return changes
 
     async def get_recent_events_for_room(
         self, room_id: str, limit: int, end_token: RoomStreamToken
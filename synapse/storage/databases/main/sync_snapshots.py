@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
+
+from synapse.metrics.background_process_metrics import wrap_as_background_process
+from synapse.storage._base import SQLBaseStore, db_to_json
+from synapse.storage.database import DatabasePool
+from synapse.types import Collection, JsonDict
+from synapse.util import json_encoder
+
+if TYPE_CHECKING:
+    from synapse.server import HomeServer
+
+
+class SyncSnapshotStore(SQLBaseStore):
+    """Stores snapshots of the rooms in users' initial syncs."""
+
+    def __init__(self, database: DatabasePool, db_conn, hs: "HomeServer"):
+        super().__init__(database, db_conn, hs)
+
+        self._snapshot_lifetime_ms = hs.config.initial_sync_snapshots_lifetime
+
+        if hs.config.initial_sync_snapshots_enabled and hs.config.run_background_tasks:
+            self._clock.looping_call(
+                self._delete_expired_initial_sync_snapshots, 60 * 60 * 1000
+            )
+
+    async def get_initial_sync_snapshot(
+        self, user_id: str, filter_key: str
+    ) -> Optional[Tuple[str, List[str], Set[str]]]:
+        """Gets the snapshot of the user's last initial sync with the given
+        filter, unless it has expired.
+
+        Returns:
+            The stream token the snapshot was taken at, the users the user had
+            ignored, and the rooms in the snapshot, if there is one. The room
+            entries are fetched with `get_initial_sync_snapshot_rooms`.
+        """
+
+        def get_initial_sync_snapshot_txn(txn):
+            row = self.db_pool.simple_select_one_txn(
+                txn,
+                table="initial_sync_snapshots",
+                keyvalues={"user_id": user_id, "filter_key": filter_key},
+                retcols=("stream_token", "ts", "ignored_users"),
+                allow_none=True,
+            )
+            if not row:
+                return None
+
+            if row["ts"] < self._clock.time_msec() - self._snapshot_lifetime_ms:
+                return None
+
+            room_ids = self.db_pool.simple_select_onecol_txn(
+                txn,
+                table="initial_sync_snapshot_rooms",
+                keyvalues={"user_id": user_id, "filter_key": filter_key},
+                retcol="room_id",
+            )
+
+            return (
+                row["stream_token"],
+                db_to_json(row["ignored_users"]),
+                set(room_ids),
+            )
+
+        return await self.db_pool.runInteraction(
+            "get_initial_sync_snapshot", get_initial_sync_snapshot_txn
+        )
+
+    async def get_initial_sync_snapshot_rooms(
+        self, user_id: str, filter_key: str, room_ids: Collection[str]
+    ) -> Dict[str, JsonDict]:
+        """Gets the entries for the given rooms in the snapshot of the user's
+        last initial sync with the given filter.
+
+        Returns:
+            Map from room ID to the room's entry, for the rooms in the snapshot.
+        """
+        rows = await self.db_pool.simple_select_many_batch(
+            table="initial_sync_snapshot_rooms",
+            column="room_id",
+            iterable=room_ids,
+            keyvalues={"user_id": user_id, "filter_key": filter_key},
+            retcols=("room_id", "entry"),
+            desc="get_initial_sync_snapshot_rooms",
+        )
+
+        return {row["room_id"]: db_to_json(row["entry"]) for row in rows}
+
+    async def store_initial_sync_snapshot(
+        self,
+        user_id: str,
+        filter_key: str,
+        stream_token: str,
+        ignored_users: List[str],
+        rooms: Dict[str, Optional[JsonDict]],
+    ) -> None:
+        """Replaces the snapshot of the user's last initial sync with the given
+        filter.
+
+        Args:
+            user_id
+            filter_key
+            stream_token: The stream token the snapshot was taken at.
+            ignored_users: The users the user had ignored.
+            rooms: The new entry for each room in the snapshot, or None to keep
+                the room's entry in the existing snapshot. Any other rooms are
+                removed from the snapshot.
+        """
+
+        def store_initial_sync_snapshot_txn(txn):
+            keyvalues = {"user_id": user_id, "filter_key": filter_key}
+
+            self.db_pool.simple_upsert_txn(
+                txn,
+                table="initial_sync_snapshots",
+                keyvalues=keyvalues,
+                values={
+                    "stream_token": stream_token,
+                    "ts": self._clock.time_msec(),
+                    "ignored_users": json_encoder.encode(ignored_users),
+                },
+            )
+
+            existing_room_ids = self.db_pool.simple_select_onecol_txn(
+                txn,
+                table="initial_sync_snapshot_rooms",
+                keyvalues=keyvalues,
+                retcol="room_id",
+            )
+            self.db_pool.simple_delete_many_txn(
+                txn,
+                table="initial_sync_snapshot_rooms",
+                column="room_id",
+                iterable=[
+                    room_id for room_id in existing_room_ids if room_id not in rooms
+                ],
+                keyvalues=keyvalues,
+            )
+
+            new_entries = [
+                (room_id, entry)
+                for room_id, entry in rooms.items()
+                if entry is not None
+            ]
+            self.db_pool.simple_upsert_many_txn(
+                txn,
+                table="initial_sync_snapshot_rooms",
+                key_names=("user_id", "filter_key", "room_id"),
+                key_values=[
+                    (user_id, filter_key, room_id) for room_id, _ in new_entries
+                ],
+                value_names=("entry",),
+                value_values=[
+                    (json_encoder.encode(entry),) for _, entry in new_entries
+                ],
+            )
+
+        await self.db_pool.runInteraction(
+            "store_initial_sync_snapshot", store_initial_sync_snapshot_txn
+        )
+
+    async def delete_initial_sync_snapshots_for_user(self, user_id: str) -> None:
+        """Deletes the snapshots of all the user's last initial syncs.
+
+        Args:
+            user_id
+        """
+
+        def delete_initial_sync_snapshots_for_user_txn(txn):
+            self.db_pool.simple_delete_txn(
+                txn, table="initial_sync_snapshot_rooms", keyvalues={"user_id": user_id}
+            )
+            self.db_pool.simple_delete_txn(
+                txn, table="initial_sync_snapshots", keyvalues={"user_id": user_id}
+            )
+
+        await self.db_pool.runInteraction(
+            "delete_initial_sync_snapshots_for_user",
+            delete_initial_sync_snapshots_for_user_txn,
+        )
+
+    @wrap_as_background_process("delete_expired_initial_sync_snapshots")
+    async def _delete_expired_initial_sync_snapshots(self) -> None:
+        def _delete_expired_initial_sync_snapshots_txn(txn):
+            expiry_ts = self._clock.time_msec() - self._snapshot_lifetime_ms
+
+            txn.execute(
+                "SELECT user_id, filter_key FROM initial_sync_snapshots"
+                " WHERE ts < ?",
+                (expiry_ts,),
+            )
+            txn.executemany(
+                "DELETE FROM initial_sync_snapshot_rooms"
+                " WHERE user_id = ? AND filter_key = ?",
+                txn.fetchall(),
+            )
+            txn.execute("DELETE FROM initial_sync_snapshots WHERE ts < ?", (expiry_ts,))
+
+        await self.db_pool.runInteraction(
+            "delete_expired_initial_sync_snapshots",
+            _delete_expired_initial_sync_snapshots_txn,
+        )
@@ -15,7 +15,7 @@
 
 import logging
 from collections import namedtuple
-from typing import Iterable, List, Optional, Tuple
+from typing import Collection, Dict, Iterable, List, Optional, Tuple
 
 from canonicaljson import encode_canonical_json
 
@@ -418,6 +418,81 @@ class TransactionStore(SQLBaseStore):
         event_ids = [row[0] for row in txn]
         return event_ids
 
+    async def get_catch_up_room_event_ids_for_destinations(
+        self, destinations: Collection[str]
+    ) -> Dict[str, Tuple[int, List[str]]]:
+        """
+        Bulk version of `get_catch_up_room_event_ids`, which gets the first
+        batch of events to catch up on for each of several destinations,
+        starting from their last_successful_stream_ordering.
+
+        Args:
+            destinations: the destinations in question
+
+        Returns:
+            dict mapping each destination which has a
+            last_successful_stream_ordering to that stream_ordering and the
+            list of up to 50 event IDs which would be returned by
+            `get_catch_up_room_event_ids`.
+        """
+        return await self.db_pool.runInteraction(
+            "get_catch_up_room_event_ids_for_destinations",
+            self._get_catch_up_room_event_ids_for_destinations_txn,
+            destinations,
+        )
+
+    def _get_catch_up_room_event_ids_for_destinations_txn(
+        self, txn: LoggingTransaction, destinations: Collection[str]
+    ) -> Dict[str, Tuple[int, List[str]]]:
+        rows = self.db_pool.simple_select_many_txn(
+            txn,
+            table="destinations",
+            column="destination",
+            iterable=destinations,
+            keyvalues={},
+            retcols=("destination", "last_successful_stream_ordering"),
+        )
+        positions = {
+            row["destination"]: row["last_successful_stream_ordering"]
+            for row in rows
+            if row["last_successful_stream_ordering"] is not None
+        }
+        if not positions:
+            return {}
+
+        # We want the first 50 events for each destination, which we get with
+        # one query by gluing together the query for each destination.
+        q = " UNION ALL ".join(
+            """
+            SELECT * FROM (
+                SELECT destination, stream_ordering, event_id
+                FROM destination_rooms
+                JOIN events USING (stream_ordering)
+                WHERE destination = ?
+                  AND stream_ordering > ?
+                ORDER BY stream_ordering
+                LIMIT 50
+            ) AS d
+            """
+            for _ in positions
+        )
+        args = []  # type: List[object]
+        for destination, stream_ordering in positions.items():
+            args.extend((destination, stream_ordering))
+        txn.execute(q, args)
+
+        event_ids = {}  # type: Dict[str, List[Tuple[int, str]]]
+        for destination, stream_ordering, event_id in txn:
+            event_ids.setdefault(destination, []).append((stream_ordering, event_id))
+
+        return {
+            destination: (
+                stream_ordering,
+                [event_id for _, event_id in sorted(event_ids.get(destination, []))],
+            )
+            for destination, stream_ordering in positions.items()
+        }
+
     async def get_catch_up_outstanding_destinations(
         self, after_destination: Optional[str]
     ) -> List[str]:
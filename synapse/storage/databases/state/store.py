@@ -24,9 +24,10 @@ from synapse.storage.databases.state.bg_updates import StateBackgroundUpdateStor
 from synapse.storage.state import StateFilter
 from synapse.storage.types import Cursor
 from synapse.storage.util.sequence import build_sequence_generator
-from synapse.types import MutableStateMap, StateMap
+from synapse.types import FrozenStateMap, MutableStateMap, StateMap
 from synapse.util.caches.descriptors import cached
 from synapse.util.caches.dictionary_cache import DictionaryCache
+from synapse.util.iterutils import batch_iter
 
 logger = logging.getLogger(__name__)
 
@@ -220,58 +221,137 @@ class StateGroupDataStore(StateBackgroundUpdateStore, SQLBaseStore):
         Returns:
             Dict of state group to state map.
         """
+        (state,) = await self._get_state_for_groups_bulk([(groups, state_filter)])
+        return state
 
-        member_filter, non_member_filter = state_filter.get_member_split()
+    async def _get_state_for_groups_bulk(
+        self, requests: List[Tuple[Iterable[int], StateFilter]]
+    ) -> List[Dict[int, MutableStateMap[str]]]:
+        """Gets the state at each of several lists of state groups, each with
+        its own filter. Any state which isn't in the caches is fetched from the
+        database in as few transactions as possible.
 
-        # Now we look them up in the member and non-member caches
-        (
-            non_member_state,
-            incomplete_groups_nm,
-        ) = self._get_state_for_groups_using_cache(
-            groups, self._state_group_cache, state_filter=non_member_filter
-        )
+        Args:
+            requests: list of the state groups for which we want to get the
+                state, and the state filter to use for them.
+        Returns:
+            Dict of state group to state map for each request.
+        """
+        results = []  # type: List[Dict[int, MutableStateMap[str]]]
+
+        # The requests which need to go to the database, as a list of the index
+        # of the request, the incomplete groups, and the filter to fetch with.
+        incomplete = []  # type: List[Tuple[int, List[int], StateFilter]]
+
+        for groups, state_filter in requests:
+            groups = list(groups)
+            member_filter, non_member_filter = state_filter.get_member_split()
+
+            # Now we look them up in the member and non-member caches
+            (
+                non_member_state,
+                incomplete_groups_nm,
+            ) = self._get_state_for_groups_using_cache(
+                groups, self._state_group_cache, state_filter=non_member_filter
+            )
 
-        (member_state, incomplete_groups_m,) = self._get_state_for_groups_using_cache(
-            groups, self._state_group_members_cache, state_filter=member_filter
-        )
+            (
+                member_state,
+                incomplete_groups_m,
+            ) = self._get_state_for_groups_using_cache(
+                groups, self._state_group_members_cache, state_filter=member_filter
+            )
 
-        state = dict(non_member_state)
-        for group in groups:
-            state[group].update(member_state[group])
+            state = dict(non_member_state)
+            for group in groups:
+                state[group].update(member_state[group])
 
-        # Now fetch any missing groups from the database
+            results.append(state)
 
-        incomplete_groups = incomplete_groups_m | incomplete_groups_nm
+            incomplete_groups = incomplete_groups_m | incomplete_groups_nm
+            if incomplete_groups:
+                # Help the cache hit ratio by expanding the filter a bit
+                incomplete.append(
+                    (
+                        len(results) - 1,
+                        list(incomplete_groups),
+                        state_filter.return_expanded(),
+                    )
+                )
 
-        if not incomplete_groups:
-            return state
+        if not incomplete:
+            return results
 
         cache_sequence_nm = self._state_group_cache.sequence
         cache_sequence_m = self._state_group_members_cache.sequence
 
-        # Help the cache hit ratio by expanding the filter a bit
-        db_state_filter = state_filter.return_expanded()
-
-        group_to_state_dict = await self._get_state_groups_from_groups(
-            list(incomplete_groups), state_filter=db_state_filter
+        # Now fetch any missing groups from the database
+        fetched = await self._get_state_groups_from_groups_bulk(
+            [(groups, db_state_filter) for _, groups, db_state_filter in incomplete]
         )
 
-        # Now lets update the caches
-        self._insert_into_cache(
-            group_to_state_dict,
-            db_state_filter,
-            cache_seq_num_members=cache_sequence_m,
-            cache_seq_num_non_members=cache_sequence_nm,
-        )
+        for (idx, _, db_state_filter), group_to_state_dict in zip(incomplete, fetched):
+            # Now lets update the caches
+            self._insert_into_cache(
+                group_to_state_dict,
+                db_state_filter,
+                cache_seq_num_members=cache_sequence_m,
+                cache_seq_num_non_members=cache_sequence_nm,
+            )
 
-        # And finally update the result dict, by filtering out any extra
-        # stuff we pulled out of the database.
-        for group, group_state_dict in group_to_state_dict.items():
-            # We just replace any existing entries, as we will have loaded
-            # everything we need from the database anyway.
-            state[group] = state_filter.filter_state(group_state_dict)
+            # And finally update the result dict, by filtering out any extra
+            # stuff we pulled out of the database.
+            state_filter = requests[idx][1]
+            for group, group_state_dict in group_to_state_dict.items():
+                # We just replace any existing entries, as we will have loaded
+                # everything we need from the database anyway.
+                results[idx][group] = state_filter.filter_state(group_state_dict)
 
-        return state
+        return results
+
+    async def _get_state_groups_from_groups_bulk(
+        self, requests: List[Tuple[List[int], StateFilter]]
+    ) -> List[Dict[int, StateMap[str]]]:
+        """Returns the state groups for each of several lists of groups from the
+        database, each filtered with its own filter.
+
+        As with `_get_state_groups_from_groups`, up to 100 groups are fetched in
+        each transaction, but groups from different lists share transactions.
+
+        Args:
+            requests: list of the state group IDs to query, and the state filter
+                used to fetch their state from the database.
+        Returns:
+            Dict of state group to state map for each request.
+        """
+
+        def _get_state_groups_from_groups_bulk_txn(txn, chunk):
+            groups_by_request = {}  # type: Dict[int, List[int]]
+            for idx, group in chunk:
+                groups_by_request.setdefault(idx, []).append(group)
+
+            return {
+                idx: self._get_state_groups_from_groups_txn(
+                    txn, groups, requests[idx][1]
+                )
+                for idx, groups in groups_by_request.items()
+            }
+
+        to_fetch = [
+            (idx, group) for idx, (groups, _) in enumerate(requests) for group in groups
+        ]
+
+        results = [{} for _ in requests]  # type: List[Dict[int, StateMap[str]]]
+        for chunk in batch_iter(to_fetch, 100):
+            res = await self.db_pool.runInteraction(
+                "_get_state_groups_from_groups",
+                _get_state_groups_from_groups_bulk_txn,
+                chunk,
+            )
+            for idx, group_to_state_dict in res.items():
+                results[idx].update(group_to_state_dict)
+
+        return results
 
     def _get_state_for_groups_using_cache(
         self, groups: Iterable[int], cache: DictionaryCache, state_filter: StateFilter
@@ -354,6 +434,12 @@ class StateGroupDataStore(StateBackgroundUpdateStore, SQLBaseStore):
                 else:
                     state_dict_non_members[k] = v
 
+            # Complete entries never change, so we store them compactly.
+            if member_types is None:
+                state_dict_members = FrozenStateMap(state_dict_members)
+            if non_member_types is None:
+                state_dict_non_members = FrozenStateMap(state_dict_non_members)
+
             self._state_group_members_cache.update(
                 cache_seq_num_members,
                 key=group,
@@ -386,12 +472,18 @@ class StateGroupDataStore(StateBackgroundUpdateStore, SQLBaseStore):
         Returns:
             The state group ID
         """
+        if current_state_ids is None:
+            # AFAIK, this can never happen
+            raise Exception("current_state_ids cannot be None")
+
+        # Split the state for the member and non-member caches up front, so that
+        # we don't redo it if the transaction is retried.
+        frozen_state_ids = FrozenStateMap(current_state_ids)
+        member_state_ids, non_member_state_ids = frozen_state_ids.split_type(
+            EventTypes.Member
+        )
 
         def _store_state_group_txn(txn):
-            if current_state_ids is None:
-                # AFAIK, this can never happen
-                raise Exception("current_state_ids cannot be None")
-
             state_group = self._state_group_seq_gen.get_next_id_txn(txn)
 
             self.db_pool.simple_insert_txn(
@@ -459,28 +551,18 @@ class StateGroupDataStore(StateBackgroundUpdateStore, SQLBaseStore):
             # is immutable. (If the map wasn't immutable then this prefill could
             # race with another update)
 
-            current_member_state_ids = {
-                s: ev
-                for (s, ev) in current_state_ids.items()
-                if s[0] == EventTypes.Member
-            }
             txn.call_after(
                 self._state_group_members_cache.update,
                 self._state_group_members_cache.sequence,
                 key=state_group,
-                value=dict(current_member_state_ids),
+                value=member_state_ids,
             )
 
-            current_non_member_state_ids = {
-                s: ev
-                for (s, ev) in current_state_ids.items()
-                if s[0] != EventTypes.Member
-            }
             txn.call_after(
                 self._state_group_cache.update,
                 self._state_group_cache.sequence,
                 key=state_group,
-                value=dict(current_non_member_state_ids),
+                value=non_member_state_ids,
             )
 
             return state_group
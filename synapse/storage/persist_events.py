@@ -31,7 +31,13 @@ from synapse.logging.context import PreserveLoggingContext, make_deferred_yielda
 from synapse.metrics.background_process_metrics import run_as_background_process
 from synapse.storage.databases import Databases
 from synapse.storage.databases.main.events import DeltaState
-from synapse.types import Collection, PersistedEventPosition, RoomStreamToken, StateMap
+from synapse.types import (
+    Collection,
+    FrozenStateMap,
+    PersistedEventPosition,
+    RoomStreamToken,
+    StateMap,
+)
 from synapse.util.async_helpers import ObservableDeferred
 from synapse.util.metrics import Measure
 
@@ -68,19 +74,46 @@ stale_forward_extremities_counter = Histogram(
     buckets=(0, 1, 2, 3, 5, 7, 10, 15, 20, 50, 100, 200, 500, "+Inf"),
 )
 
+# The number of events in each batch handed to `_persist_events`. Together with
+# `synapse_storage_events_persisted_events` this gives the throughput of the
+# persistence queue in events/sec.
+persist_batch_events_histogram = Histogram(
+    "synapse_storage_events_persist_batch_events",
+    "Number of events persisted in each batch",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, "+Inf"),
+)
+
+# The number of rooms in each batch handed to `_persist_events`.
+persist_batch_rooms_histogram = Histogram(
+    "synapse_storage_events_persist_batch_rooms",
+    "Number of rooms with events persisted in each batch",
+    buckets=(1, 2, 5, 10, 20, 50, 100, "+Inf"),
+)
+
 
 class _EventPeristenceQueue:
     """Queues up events so that they can be persisted in bulk with only one
     concurrent transaction per room.
+
+    Args:
+        max_batch_events: If non-zero, the queues of all rooms are handled
+            together, so that the events waiting to be persisted for many rooms
+            can be persisted together. This is the maximum number of events to
+            take in one go.
     """
 
     _EventPersistQueueItem = namedtuple(
         "_EventPersistQueueItem", ("events_and_contexts", "backfilled", "deferred")
     )
 
-    def __init__(self):
-        self._event_persist_queues = {}
-        self._currently_persisting_rooms = set()
+    def __init__(self, max_batch_events: int = 0):
+        self._event_persist_queues = {}  # type: Dict[str, deque]
+        self._currently_persisting_rooms = set()  # type: Set[str]
+        self._max_batch_events = max_batch_events
+
+        # Whether the queues are being handled in batches, when cross-room
+        # batching is enabled.
+        self._persisting_batches = False
 
     def add_to_queue(self, room_id, events_and_contexts, backfilled):
         """Add events to the queue, with the given persist_event options.
@@ -128,12 +161,21 @@ class _EventPeristenceQueue:
         value of the function will be given to the deferreds waiting on the item,
         exceptions will be passed to the deferreds as well.
 
+        If cross-room batching is enabled, the queues of all rooms are instead
+        handled by a single loop (see `_handle_queues_in_batches`), and the
+        item passed to the callback may combine items from the queues of
+        several rooms, in which case the result is given to the deferreds of
+        each of those items.
+
         This function should therefore be called whenever anything is added
         to the queue.
 
         If another callback is currently handling the queue then it will not be
         invoked.
         """
+        if self._max_batch_events:
+            self._handle_queues_in_batches(per_item_callback)
+            return
 
         if room_id in self._currently_persisting_rooms:
             return
@@ -161,6 +203,108 @@ class _EventPeristenceQueue:
         # set handle_queue_loop off in the background
         run_as_background_process("persist_events", handle_queue_loop)
 
+    def _handle_queues_in_batches(self, per_item_callback):
+        """Starts handling the queues of all rooms, if not already doing so.
+
+        A single loop persists one batch at a time, so the events queued up for
+        any room while a batch is being persisted are persisted together in the
+        next batch. Each room only has one item in a batch, so there is still at
+        most one concurrent transaction per room. If persisting a batch fails,
+        each of its items is persisted on its own, so that only the items which
+        fail are rejected.
+        """
+        if self._persisting_batches:
+            return
+
+        self._persisting_batches = True
+
+        async def handle_batches_loop():
+            try:
+                while True:
+                    items = self._take_batch()
+                    if not items:
+                        break
+
+                    if len(items) > 1:
+                        batch = self._EventPersistQueueItem(
+                            events_and_contexts=list(
+                                itertools.chain.from_iterable(
+                                    item.events_and_contexts for item in items
+                                )
+                            ),
+                            backfilled=items[0].backfilled,
+                            deferred=None,
+                        )
+
+                        try:
+                            ret = await per_item_callback(batch)
+                        except Exception:
+                            # Don't fail the sends in every room of the batch
+                            # because of a bad event in one of them: persist
+                            # each room's events separately instead.
+                            logger.warning(
+                                "Failed to persist events for %d rooms together,"
+                                " persisting them separately",
+                                len(items),
+                                exc_info=True,
+                            )
+                        else:
+                            with PreserveLoggingContext():
+                                for item in items:
+                                    item.deferred.callback(ret)
+                            continue
+
+                    for item in items:
+                        try:
+                            ret = await per_item_callback(item)
+                        except Exception:
+                            with PreserveLoggingContext():
+                                item.deferred.errback()
+                        else:
+                            with PreserveLoggingContext():
+                                item.deferred.callback(ret)
+            finally:
+                self._persisting_batches = False
+
+        # set handle_batches_loop off in the background
+        run_as_background_process("persist_events", handle_batches_loop)
+
+    def _take_batch(self) -> List["_EventPeristenceQueue._EventPersistQueueItem"]:
+        """Takes the first item from the queues of as many rooms as fit in a
+        batch of `max_batch_events` events.
+
+        Only items with the same `backfilled` setting are combined. The rooms
+        items are taken from are moved to the back of the queue, so that every
+        room gets its turn, and emptied queues are removed.
+
+        Returns:
+            The items to persist together, which is empty if there is nothing
+            left to persist.
+        """
+        items = []  # type: List[_EventPeristenceQueue._EventPersistQueueItem]
+
+        num_events = 0
+        for room_id, queue in list(self._event_persist_queues.items()):
+            if num_events >= self._max_batch_events:
+                break
+
+            item = queue[0]
+            if items and (
+                item.backfilled != items[0].backfilled
+                or num_events + len(item.events_and_contexts) > self._max_batch_events
+            ):
+                continue
+
+            queue.popleft()
+            del self._event_persist_queues[room_id]
+            if queue:
+                self._event_persist_queues[room_id] = queue
+
+            num_events += len(item.events_and_contexts)
+            items.append(item)
+
+        return items
+
     def _get_drainining_queue(self, room_id):
         queue = self._event_persist_queues.setdefault(room_id, deque())
 
@@ -192,7 +336,9 @@ class EventsPersistenceStorage:
         self._clock = hs.get_clock()
         self._instance_name = hs.get_instance_name()
         self.is_mine_id = hs.is_mine_id
-        self._event_persist_queue = _EventPeristenceQueue()
+        self._event_persist_queue = _EventPeristenceQueue(
+            max_batch_events=hs.config.persist_events_batch_size
+        )
         self._state_resolution_handler = hs.get_state_resolution_handler()
 
     async def persist_events(
@@ -254,6 +400,11 @@ class EventsPersistenceStorage:
 
     def _maybe_start_persisting(self, room_id: str):
         async def persisting_queue(item):
+            persist_batch_events_histogram.observe(len(item.events_and_contexts))
+            persist_batch_rooms_histogram.observe(
+                len({event.room_id for event, _ in item.events_and_contexts})
+            )
+
             with Measure(self._clock, "persist_events"):
                 await self._persist_events(
                     item.events_and_contexts, backfilled=item.backfilled
@@ -756,11 +907,9 @@ class EventsPersistenceStorage:
         # users will still be joined when we leave.
         if current_state is None:
             current_state = await self.main_store.get_current_state_ids(room_id)
-            current_state = dict(current_state)
-            for key in delta.to_delete:
-                current_state.pop(key, None)
-
-            current_state.update(delta.to_insert)
+            current_state = FrozenStateMap(current_state).evolve(
+                delta.to_insert, delta.to_delete
+            )
 
         remote_event_ids = [
             event_id
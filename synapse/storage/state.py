@@ -14,13 +14,13 @@
 # limitations under the License.
 
 import logging
-from typing import Awaitable, Dict, Iterable, List, Optional, Set, Tuple, TypeVar
+from typing import Awaitable, Dict, Iterable, List, Optional, Set, Tuple, TypeVar, cast
 
 import attr
 
 from synapse.api.constants import EventTypes
 from synapse.events import EventBase
-from synapse.types import MutableStateMap, StateMap
+from synapse.types import FrozenStateMap, MutableStateMap, StateMap
 
 logger = logging.getLogger(__name__)
 
@@ -243,6 +243,10 @@ class StateFilter:
             The filtered state map
         """
         if self.is_full():
+            if isinstance(state_dict, FrozenStateMap):
+                # Unpack all the event IDs at once, rather than looking up each
+                # key in turn.
+                return dict(cast(StateMap[T], state_dict).items())
             return dict(state_dict)
 
         filtered_state = {}
@@ -498,6 +502,36 @@ class StateGroupStorage:
 
         return {event: event_to_state[event] for event in event_ids}
 
+    async def get_state_ids_for_events_bulk(
+        self, requests: List[Tuple[str, StateFilter]]
+    ) -> List[StateMap[str]]:
+        """
+        Get the state dicts for several events, each with its own filter,
+        containing the event_ids of the state events
+
+        Args:
+            requests: events whose state should be returned, and the state
+                filter used to fetch their state from the database.
+
+        Returns:
+            A dict from (type, state_key) -> event_id for each request
+        """
+        event_to_groups = await self.stores.main._get_state_group_for_events(
+            [event_id for event_id, _ in requests]
+        )
+
+        group_to_states = await self.stores.state._get_state_for_groups_bulk(
+            [
+                ([event_to_groups[event_id]], state_filter)
+                for event_id, state_filter in requests
+            ]
+        )
+
+        return [
+            group_to_state[event_to_groups[event_id]]
+            for (event_id, _), group_to_state in zip(requests, group_to_states)
+        ]
+
     async def get_state_for_event(
         self, event_id: str, state_filter: StateFilter = StateFilter.all()
     ):
@@ -14,14 +14,21 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import abc
+import binascii
+import itertools
 import re
 import string
 import sys
+from bisect import bisect_left
 from collections import namedtuple
+from collections.abc import ItemsView, ValuesView
 from typing import (
     TYPE_CHECKING,
     Any,
     Dict,
+    Iterable,
+    Iterator,
+    List,
     Mapping,
     MutableMapping,
     Optional,
@@ -43,7 +50,7 @@ if TYPE_CHECKING:
 if sys.version_info[:3] >= (3, 6, 0):
     from typing import Collection
 else:
-    from typing import Container, Iterable, Sized
+    from typing import Container, Sized
 
     T_co = TypeVar("T_co", covariant=True)
 
@@ -63,6 +70,329 @@ MutableStateMap = MutableMapping[StateKey, T]
 JsonDict = Dict[str, Any]
 
 
+# The size of a packed event ID in a `FrozenStateMap`. Event IDs in room
+# versions 4 and later are a `$` followed by the unpadded url-safe base64
+# encoding of a 32 byte hash. We decode the 43 characters of base64 plus a
+# trailing "A", which gives 33 bytes and lets us decode and encode the event
+# IDs of a whole map in a single call.
+_PACKED_EVENT_ID_LEN = 33
+
+# The slot used for event IDs which can't be packed, which are instead stored
+# in `FrozenStateMap._other`.
+_UNPACKED_EVENT_ID = b"\0" * _PACKED_EVENT_ID_LEN
+
+_FROM_URLSAFE = bytes.maketrans(b"-_", b"+/")
+_TO_URLSAFE = bytes.maketrans(b"+/", b"-_")
+
+
+def _intern_state_key(key: StateKey) -> StateKey:
+    typ, state_key = key
+    interned_typ = sys.intern(typ)
+    interned_state_key = sys.intern(state_key)
+    if interned_typ is typ and interned_state_key is state_key:
+        return key
+    return (interned_typ, interned_state_key)
+
+
+def _pack_event_id(event_id: str) -> Optional[bytes]:
+    """Pack a single event ID, returning None if it isn't of the form used by
+    room versions 4 and later.
+    """
+    if len(event_id) != 44 or event_id[0] != "$":
+        return None
+
+    packed_event_ids, other = _pack_event_ids([("", "")], [event_id])
+    if other:
+        return None
+    return packed_event_ids
+
+
+def _unpack_event_ids(packed: bytes) -> str:
+    """Turn packed event IDs back into their base64 encoding, 44 characters per
+    event ID, with the last character of each being padding.
+    """
+    encoded = binascii.b2a_base64(packed, newline=False)
+    return encoded.translate(_TO_URLSAFE).decode("ascii")
+
+
+def _pack_event_ids(
+    keys: Iterable[StateKey], event_ids: List[str]
+) -> Tuple[bytes, Optional[Dict[StateKey, str]]]:
+    """Pack a list of event IDs into a single bytes object.
+
+    Returns:
+        The packed event IDs, and a map from state key to event ID for any event
+        IDs which couldn't be packed (or None if all of them could).
+    """
+    # Usually every event ID can be packed, so we first try decoding them all
+    # at once. We check they round trip, as the decoding is lenient and room
+    # version 3 uses the standard base64 alphabet rather than the url-safe one.
+    if all(len(event_id) == 44 and event_id[0] == "$" for event_id in event_ids):
+        encoded = "".join(event_id[1:] + "A" for event_id in event_ids)
+        try:
+            packed = binascii.a2b_base64(
+                encoded.encode("ascii").translate(_FROM_URLSAFE)
+            )
+        except (binascii.Error, UnicodeEncodeError):
+            pass
+        else:
+            if _unpack_event_ids(packed) == encoded:
+                return packed, None
+
+    if len(event_ids) == 1:
+        return _UNPACKED_EVENT_ID, dict(zip(keys, event_ids))
+
+    chunks = []
+    other = {}
+    for key, event_id in zip(keys, event_ids):
+        packed_event_id = _pack_event_id(event_id)
+        if packed_event_id is None:
+            other[key] = event_id
+            packed_event_id = _UNPACKED_EVENT_ID
+        chunks.append(packed_event_id)
+
+    return b"".join(chunks), other or None
+
+
+class FrozenStateMap(Mapping[StateKey, str]):
+    """An immutable map from (type, state_key) to event ID, which uses much less
+    memory than a dict for large rooms.
+
+    The keys are held in a sorted tuple, with their strings interned, and are
+    looked up by bisection. The event IDs are decoded to their hashes and packed
+    into a single bytes object; event IDs in older room versions which can't be
+    packed are kept as strings.
+
+    This can be used anywhere a `StateMap[str]` is accepted. Use `evolve` to
+    get a copy with some changes applied.
+    """
+
+    __slots__ = ["_keys", "_event_ids", "_other"]
+
+    def __init__(self, state: StateMap[str] = {}):
+        if isinstance(state, FrozenStateMap):
+            self._keys = state._keys  # type: Tuple[StateKey, ...]
+            self._event_ids = state._event_ids  # type: bytes
+            self._other = state._other  # type: Optional[Dict[StateKey, str]]
+            return
+
+        items = sorted(state.items())
+        self._keys = tuple(_intern_state_key(key) for key, _ in items)
+        self._event_ids, self._other = _pack_event_ids(
+            self._keys, [event_id for _, event_id in items]
+        )
+
+    def _index(self, key: StateKey) -> int:
+        """Returns the index of the given key, or -1 if it isn't in the map."""
+        keys = self._keys
+        idx = bisect_left(keys, key)
+        if idx < len(keys) and keys[idx] == key:
+            return idx
+        return -1
+
+    def _event_id_at(self, idx: int) -> str:
+        key = self._keys[idx]
+        if self._other and key in self._other:
+            return self._other[key]
+
+        start = idx * _PACKED_EVENT_ID_LEN
+        packed = self._event_ids[start : start + _PACKED_EVENT_ID_LEN]
+        return "$" + _unpack_event_ids(packed)[:-1]
+
+    def __getitem__(self, key: StateKey) -> str:
+        idx = self._index(key)
+        if idx < 0:
+            raise KeyError(key)
+        return self._event_id_at(idx)
+
+    def __contains__(self, key: object) -> bool:
+        try:
+            return self._index(key) >= 0  # type: ignore
+        except TypeError:
+            return False
+
+    def __iter__(self) -> Iterator[StateKey]:
+        return iter(self._keys)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def _event_id_list(self) -> List[str]:
+        """Unpacks all of the event IDs, in the same order as the keys."""
+        encoded = _unpack_event_ids(self._event_ids)
+        step = _PACKED_EVENT_ID_LEN // 3 * 4
+        event_ids = [
+            "$" + encoded[start : start + step - 1]
+            for start in range(0, len(encoded), step)
+        ]
+
+        if self._other:
+            for idx, key in enumerate(self._keys):
+                if key in self._other:
+                    event_ids[idx] = self._other[key]
+
+        return event_ids
+
+    def items(self) -> "_FrozenStateMapItemsView":
+        return _FrozenStateMapItemsView(self)
+
+    def values(self) -> "_FrozenStateMapValuesView":
+        return _FrozenStateMapValuesView(self)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, FrozenStateMap):
+            return (
+                self._keys == other._keys
+                and self._event_ids == other._event_ids
+                and self._other == other._other
+            )
+        return super().__eq__(other)
+
+    def __repr__(self) -> str:
+        return "FrozenStateMap(%r)" % (dict(self.items()),)
+
+    def split_type(self, typ: str) -> Tuple["FrozenStateMap", "FrozenStateMap"]:
+        """Split the map into the entries with the given event type and the rest.
+
+        As the keys are sorted, the entries with the given type are a single run
+        of entries, and so this doesn't need to look at each key.
+        """
+        keys = self._keys
+        start = bisect_left(keys, (typ,))
+        # Every type greater than `typ` sorts after `typ` followed by the
+        # smallest character.
+        end = bisect_left(keys, (typ + "\0",), start)
+
+        matching = self._slice(start, end)
+        rest = self._slice(0, start)._concat(self._slice(end, len(keys)))
+        return matching, rest
+
+    def _slice(self, start: int, end: int) -> "FrozenStateMap":
+        keys = self._keys[start:end]
+        other = None
+        if self._other:
+            other = {key: self._other[key] for key in keys if key in self._other}
+
+        return self._from_parts(
+            keys,
+            self._event_ids[start * _PACKED_EVENT_ID_LEN : end * _PACKED_EVENT_ID_LEN],
+            other,
+        )
+
+    def _concat(self, after: "FrozenStateMap") -> "FrozenStateMap":
+        """Join this map with one whose keys all sort after ours."""
+        other = None
+        if self._other or after._other:
+            other = dict(self._other or {})
+            other.update(after._other or {})
+
+        return self._from_parts(
+            self._keys + after._keys, self._event_ids + after._event_ids, other
+        )
+
+    @staticmethod
+    def _from_parts(
+        keys: Tuple[StateKey, ...],
+        event_ids: bytes,
+        other: Optional[Dict[StateKey, str]],
+    ) -> "FrozenStateMap":
+        result = FrozenStateMap.__new__(FrozenStateMap)
+        result._keys = keys
+        result._event_ids = event_ids
+        result._other = other or None
+        return result
+
+    def evolve(
+        self, changes: StateMap[str], removed: Iterable[StateKey] = ()
+    ) -> "FrozenStateMap":
+        """Returns a copy of this map with the given changes applied.
+
+        This only walks the changed keys, copying the unchanged runs of entries
+        between them wholesale, and so is much cheaper than rebuilding the map
+        when the changes are small.
+
+        Args:
+            changes: The entries to add or replace.
+            removed: The keys to remove. Keys which are also in `changes` are
+                replaced rather than removed.
+        """
+        updated_keys = set(changes)
+        updated_keys.update(removed)
+        if not updated_keys:
+            return self
+
+        keys = self._keys
+        event_ids = self._event_ids
+
+        new_keys = []  # type: List[Tuple[StateKey, ...]]
+        new_event_ids = []  # type: List[bytes]
+        other = {
+            key: event_id
+            for key, event_id in (self._other or {}).items()
+            if key not in updated_keys
+        }
+
+        prev_idx = 0
+        for key in sorted(updated_keys):
+            idx = bisect_left(keys, key, prev_idx)
+
+            # Copy the unchanged entries before this key
+            new_keys.append(keys[prev_idx:idx])
+            new_event_ids.append(
+                event_ids[prev_idx * _PACKED_EVENT_ID_LEN : idx * _PACKED_EVENT_ID_LEN]
+            )
+
+            if idx < len(keys) and keys[idx] == key:
+                # Skip over the existing entry
+                idx += 1
+
+            if key in changes:
+                key = _intern_state_key(key)
+                event_id = changes[key]
+                packed_event_id = _pack_event_id(event_id)
+                if packed_event_id is None:
+                    other[key] = event_id
+                    packed_event_id = _UNPACKED_EVENT_ID
+
+                new_keys.append((key,))
+                new_event_ids.append(packed_event_id)
+
+            prev_idx = idx
+
+        new_keys.append(keys[prev_idx:])
+        new_event_ids.append(event_ids[prev_idx * _PACKED_EVENT_ID_LEN :])
+
+        return self._from_parts(
+            tuple(itertools.chain.from_iterable(new_keys)),
+            b"".join(new_event_ids),
+            other,
+        )
+
+
+class _FrozenStateMapItemsView(ItemsView):
+    """Iterates over the items of a `FrozenStateMap` without looking up each key
+    in turn.
+    """
+
+    __slots__ = ()
+
+    if TYPE_CHECKING:
+        _mapping = None  # type: FrozenStateMap
+
+    def __iter__(self):
+        return zip(self._mapping._keys, self._mapping._event_id_list())
+
+
+class _FrozenStateMapValuesView(ValuesView):
+    __slots__ = ()
+
+    if TYPE_CHECKING:
+        _mapping = None  # type: FrozenStateMap
+
+    def __iter__(self):
+        return iter(self._mapping._event_id_list())
+
+
 class Requester(
     namedtuple(
         "Requester",
@@ -15,6 +15,8 @@
 # limitations under the License.
 
 import logging
+from collections import Counter
+from enum import Enum, auto
 from sys import intern
 from typing import Callable, Dict, Optional
 
@@ -31,8 +33,18 @@ collectors_by_name = {}  # type: Dict
 cache_size = Gauge("synapse_util_caches_cache:size", "", ["name"])
 cache_hits = Gauge("synapse_util_caches_cache:hits", "", ["name"])
 cache_evicted = Gauge("synapse_util_caches_cache:evicted_size", "", ["name"])
+cache_evicted_by_reason = Gauge(
+    "synapse_util_caches_cache_evicted_size_by_reason",
+    "Number of entries evicted from the caches, by why they were evicted",
+    ["name", "reason"],
+)
 cache_total = Gauge("synapse_util_caches_cache:total", "", ["name"])
 cache_max_size = Gauge("synapse_util_caches_cache_max_size", "", ["name"])
+cache_memory_usage = Gauge(
+    "synapse_util_caches_cache_size_bytes",
+    "Estimated memory usage of the caches",
+    ["name"],
+)
 
 response_cache_size = Gauge("synapse_util_caches_response_cache:size", "", ["name"])
 response_cache_hits = Gauge("synapse_util_caches_response_cache:hits", "", ["name"])
@@ -42,6 +54,19 @@ response_cache_evicted = Gauge(
 response_cache_total = Gauge("synapse_util_caches_response_cache:total", "", ["name"])
 
 
+class EvictionReason(Enum):
+    """Why an entry was evicted from a cache."""
+
+    # The cache held more than its maximum number of entries.
+    size = auto()
+
+    # The caches exceeded `caches.max_cache_memory_usage`.
+    memory = auto()
+
+    # The entry hadn't been accessed within the cache's expiry time.
+    time = auto()
+
+
 @attr.s(slots=True)
 class CacheMetric:
 
@@ -53,6 +78,7 @@ class CacheMetric:
     hits = attr.ib(default=0)
     misses = attr.ib(default=0)
     evicted_size = attr.ib(default=0)
+    evicted_size_by_reason = attr.ib(factory=Counter)  # type: Counter[EvictionReason]
 
     def inc_hits(self):
         self.hits += 1
@@ -60,8 +86,9 @@ class CacheMetric:
     def inc_misses(self):
         self.misses += 1
 
-    def inc_evictions(self, size=1):
+    def inc_evictions(self, size=1, reason=EvictionReason.size):
         self.evicted_size += size
+        self.evicted_size_by_reason[reason] += size
 
     def describe(self):
         return []
@@ -79,9 +106,17 @@ class CacheMetric:
                 cache_size.labels(self._cache_name).set(len(self._cache))
                 cache_hits.labels(self._cache_name).set(self.hits)
                 cache_evicted.labels(self._cache_name).set(self.evicted_size)
+                for reason, size in self.evicted_size_by_reason.items():
+                    cache_evicted_by_reason.labels(self._cache_name, reason.name).set(
+                        size
+                    )
                 cache_total.labels(self._cache_name).set(self.hits + self.misses)
                 if getattr(self._cache, "max_size", None):
                     cache_max_size.labels(self._cache_name).set(self._cache.max_size)
+                if getattr(self._cache, "track_memory_usage", False):
+                    cache_memory_usage.labels(self._cache_name).set(
+                        self._cache.memory_usage()
+                    )
             if self._collect_callback:
                 self._collect_callback()
         except Exception as e:
@@ -108,6 +143,9 @@ def register_cache(
         resizable: Whether this cache supports being resized.
         resize_callback: A function which can be called to resize the cache.
 
+    If the cache supports it, its entries also count towards (and are evicted
+    to stay within) `caches.max_cache_memory_usage`.
+
     Returns:
         CacheMetric: an object which provides inc_{hits,misses,evictions} methods
     """
@@ -116,6 +154,9 @@ def register_cache(
             resize_callback = getattr(cache, "set_cache_factor")
         add_resizable_cache(cache_name, resize_callback)
 
+    if hasattr(cache, "track_memory_usage"):
+        cache.track_memory_usage = True
+
     metric = CacheMetric(cache, cache_type, cache_name, collect_callback)
     metric_name = "cache_%s_%s" % (cache_type, cache_name)
     caches_by_name[cache_name] = cache
@@ -98,6 +98,7 @@ class Cache:
         tree: bool = False,
         iterable: bool = False,
         apply_cache_factor_from_config: bool = True,
+        expiry_time_ms: Optional[int] = None,
     ):
         """
         Args:
@@ -109,6 +110,9 @@ class Cache:
                 rather than each cached object
             apply_cache_factor_from_config: Whether cache factors specified in the
                 config file affect `max_entries`
+            expiry_time_ms: If set, entries which haven't been accessed for
+                this long are removed from the cache. Defaults to
+                `caches.expiry_time` from the config file.
 
         Returns:
             Cache
@@ -123,6 +127,7 @@ class Cache:
             size_callback=(lambda d: len(d)) if iterable else None,
             evicted_callback=self._on_evicted,
             apply_cache_factor_from_config=apply_cache_factor_from_config,
+            expiry_time_ms=expiry_time_ms,
         )
 
         self.name = name
@@ -139,8 +144,8 @@ class Cache:
     def max_entries(self):
         return self.cache.max_size
 
-    def _on_evicted(self, evicted_count):
-        self.metrics.inc_evictions(evicted_count)
+    def _on_evicted(self, evicted_count, reason):
+        self.metrics.inc_evictions(evicted_count, reason)
 
     def _metrics_collection_callback(self):
         cache_pending_metric.labels(self.name).set(len(self._pending_deferred_cache))
@@ -371,6 +376,9 @@ class CacheDescriptor(_CacheDescriptorBase):
         num_args (int): number of positional arguments (excluding ``self`` and
             ``cache_context``) to use as cache keys. Defaults to all named
             args of the function.
+        expiry_time_ms (int|None): if set, entries which haven't been accessed
+            for this long are removed from the cache. Defaults to
+            ``caches.expiry_time`` from the config file.
     """
 
     def __init__(
@@ -381,6 +389,7 @@ class CacheDescriptor(_CacheDescriptorBase):
         tree=False,
         cache_context=False,
         iterable=False,
+        expiry_time_ms=None,
     ):
 
         super().__init__(orig, num_args=num_args, cache_context=cache_context)
@@ -388,6 +397,7 @@ class CacheDescriptor(_CacheDescriptorBase):
         self.max_entries = max_entries
         self.tree = tree
         self.iterable = iterable
+        self.expiry_time_ms = expiry_time_ms
 
     def __get__(self, obj, owner):
         cache = Cache(
@@ -396,6 +406,7 @@ class CacheDescriptor(_CacheDescriptorBase):
             keylen=self.num_args,
             tree=self.tree,
             iterable=self.iterable,
+            expiry_time_ms=self.expiry_time_ms,
         )
 
         def get_cache_key_gen(args, kwargs):
@@ -671,6 +682,7 @@ def cached(
     tree: bool = False,
     cache_context: bool = False,
     iterable: bool = False,
+    expiry_time_ms: Optional[int] = None,
 ) -> Callable[[F], _CachedFunction[F]]:
     func = lambda orig: CacheDescriptor(
         orig,
@@ -679,6 +691,7 @@ def cached(
         tree=tree,
         cache_context=cache_context,
         iterable=iterable,
+        expiry_time_ms=expiry_time_ms,
     )
 
     return cast(Callable[[F], _CachedFunction[F]], func)
@@ -18,7 +18,7 @@ from collections import OrderedDict
 
 from synapse.config import cache as cache_config
 from synapse.metrics.background_process_metrics import run_as_background_process
-from synapse.util.caches import register_cache
+from synapse.util.caches import EvictionReason, register_cache
 
 logger = logging.getLogger(__name__)
 
@@ -155,9 +155,9 @@ class ExpiringCache:
         for k in keys_to_delete:
             value = self._cache.pop(k)
             if self.iterable:
-                self.metrics.inc_evictions(len(value.value))
+                self.metrics.inc_evictions(len(value.value), EvictionReason.time)
             else:
-                self.metrics.inc_evictions()
+                self.metrics.inc_evictions(reason=EvictionReason.time)
 
         logger.debug(
             "[%s] _prune_cache before: %d, after len: %d",
@@ -13,13 +13,35 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import logging
+import sys
 import threading
 from functools import wraps
-from typing import Callable, Optional, Type, Union
+from types import FunctionType, MethodType, ModuleType
+from typing import TYPE_CHECKING, Any, Callable, Mapping, Optional, Tuple, Type, Union
+from weakref import WeakSet
+
+from twisted.internet import reactor
 
 from synapse.config import cache as cache_config
+from synapse.metrics.background_process_metrics import run_as_background_process
+from synapse.types import FrozenStateMap
+from synapse.util import Clock
+from synapse.util.caches import EvictionReason
 from synapse.util.caches.treecache import TreeCache
 
+if TYPE_CHECKING:
+    from synapse.server import HomeServer
+
+logger = logging.getLogger(__name__)
+
+# How often we sweep the caches for expired entries.
+_EXPIRY_SWEEP_INTERVAL_MS = 30 * 1000
+
+# The maximum number of entries we expire from a cache before yielding to the
+# reactor, so that sweeping large caches doesn't block everything else.
+_EXPIRY_BATCH_SIZE = 100
+
 
 def enumerate_leaves(node, depth):
     if depth == 0:
@@ -30,8 +52,74 @@ def enumerate_leaves(node, depth):
                 yield m
 
 
+# Types whose size we count, but whose referents we don't walk: either they
+# don't hold references to other objects, or the objects they reference are
+# not owned by the cache entry.
+_ATOMIC_TYPES = (
+    str,
+    bytes,
+    int,
+    float,
+    bool,
+    type,
+    ModuleType,
+    FunctionType,
+    MethodType,
+)
+
+
+def _get_size_of(val: Any) -> int:
+    """Get an approximate size in bytes of the object and everything it
+    references.
+
+    This walks builtin containers and the `__dict__`/`__slots__` of other
+    objects, counting each referenced object once. `FrozenStateMap`s are walked
+    through their slots, so that we count their packed form rather than
+    unpacking every entry.
+    """
+    seen = set()
+    size = 0
+    stack = [val]
+    while stack:
+        obj = stack.pop()
+        if obj is None or id(obj) in seen:
+            continue
+        seen.add(id(obj))
+
+        size += sys.getsizeof(obj)
+
+        if isinstance(obj, _ATOMIC_TYPES):
+            continue
+
+        if isinstance(obj, Mapping) and not isinstance(obj, FrozenStateMap):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        else:
+            obj_dict = getattr(obj, "__dict__", None)
+            if obj_dict is not None:
+                stack.append(obj_dict)
+            for cls in type(obj).__mro__:
+                for slot in getattr(cls, "__slots__", ()):
+                    stack.append(getattr(obj, slot, None))
+
+    return size
+
+
 class _Node:
-    __slots__ = ["prev_node", "next_node", "key", "value", "callbacks"]
+    __slots__ = [
+        "prev_node",
+        "next_node",
+        "key",
+        "value",
+        "callbacks",
+        "memory",
+        "global_prev",
+        "global_next",
+        "evict_from_owner",
+        "last_access_ms",
+    ]
 
     def __init__(self, prev_node, next_node, key, value, callbacks=set()):
         self.prev_node = prev_node
@@ -40,6 +128,150 @@ class _Node:
         self.value = value
         self.callbacks = callbacks
 
+        # The approximate size of the entry in bytes, if the owning cache is
+        # tracking memory usage.
+        self.memory = 0
+
+        # Links in the global list of entries across all caches that are
+        # tracking memory usage, used to enforce the global memory budget.
+        self.global_prev = None  # type: Optional[_Node]
+        self.global_next = None  # type: Optional[_Node]
+
+        # Called to remove the entry from the cache that owns it.
+        self.evict_from_owner = None  # type: Optional[Callable[[_Node], None]]
+
+        # When the entry was last added or retrieved, used to expire entries.
+        self.last_access_ms = 0
+
+
+class _GlobalMemoryBudget:
+    """Tracks the entries of all caches with memory tracking enabled in a single
+    least-recently-used list, so that once the total approximate size of the
+    entries exceeds `caches.max_cache_memory_usage` we can evict the least
+    recently used entries across all caches.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+        self._root = _Node(None, None, None, None)
+        self._root.global_next = self._root
+        self._root.global_prev = self._root
+
+        # The total approximate size in bytes of all entries in the list.
+        self.memory_usage = 0
+
+    def add(self, node: _Node) -> None:
+        with self._lock:
+            self._link_at_front(node)
+            self.memory_usage += node.memory
+
+    def move_to_front(self, node: _Node) -> None:
+        with self._lock:
+            if node.global_next is None:
+                return
+
+            self._unlink(node)
+            self._link_at_front(node)
+
+    def resize(self, node: _Node, new_memory: int) -> None:
+        with self._lock:
+            if node.global_next is not None:
+                self.memory_usage += new_memory - node.memory
+            node.memory = new_memory
+
+    def remove(self, node: _Node) -> None:
+        with self._lock:
+            if node.global_next is None:
+                return
+
+            self._unlink(node)
+            node.global_next = None
+            node.global_prev = None
+            self.memory_usage -= node.memory
+
+    def evict(self) -> None:
+        """Evict least recently used entries until we're within the budget.
+        """
+        max_memory_usage = cache_config.properties.max_cache_memory_usage
+        if max_memory_usage is None:
+            return
+
+        while True:
+            with self._lock:
+                if self.memory_usage <= max_memory_usage:
+                    return
+
+                node = self._root.global_prev
+                if node is self._root:
+                    return
+
+                # We unlink the node here so that we make progress even if it
+                # is concurrently removed from its cache.
+                self._unlink(node)
+                node.global_next = None
+                node.global_prev = None
+                self.memory_usage -= node.memory
+
+            # We must not hold our lock while calling into the owning cache, as
+            # the cache holds its own lock when calling us.
+            if node.evict_from_owner:
+                node.evict_from_owner(node)
+
+    def _link_at_front(self, node: _Node) -> None:
+        prev_node = self._root
+        next_node = prev_node.global_next
+        node.global_prev = prev_node
+        node.global_next = next_node
+        prev_node.global_next = node
+        next_node.global_prev = node
+
+    def _unlink(self, node: _Node) -> None:
+        prev_node = node.global_prev
+        next_node = node.global_next
+        prev_node.global_next = next_node
+        next_node.global_prev = prev_node
+
+
+GLOBAL_MEMORY_BUDGET = _GlobalMemoryBudget()
+
+# All live LruCaches, which get swept for expired entries.
+_ALL_CACHES = WeakSet()  # type: WeakSet[LruCache]
+
+
+def setup_expire_lru_cache_entries(hs: "HomeServer") -> None:
+    """Start a background job that periodically removes entries from the caches
+    which haven't been accessed for longer than their expiry time.
+    """
+    clock = hs.get_clock()
+    clock.looping_call(
+        run_as_background_process,
+        _EXPIRY_SWEEP_INTERVAL_MS,
+        "expire_lru_cache_entries",
+        expire_lru_cache_entries,
+        clock,
+    )
+
+
+async def expire_lru_cache_entries(clock: Clock) -> None:
+    """Remove the expired entries from all caches.
+
+    Entries are removed in small batches, yielding to the reactor in between, so
+    that this doesn't hold up other work when lots of entries expire at once.
+    """
+    evicted = 0
+    for cache in list(_ALL_CACHES):
+        while True:
+            count, done = cache.expire_old_entries(_EXPIRY_BATCH_SIZE)
+            evicted += count
+            if done:
+                break
+
+            await clock.sleep(0)
+
+    if evicted:
+        logger.debug("Expired %d cache entries", evicted)
+
 
 class LruCache:
     """
@@ -59,6 +291,8 @@ class LruCache:
         size_callback: Optional[Callable] = None,
         evicted_callback: Optional[Callable] = None,
         apply_cache_factor_from_config: bool = True,
+        expiry_time_ms: Optional[int] = None,
+        clock: Optional[Clock] = None,
     ):
         """
         Args:
@@ -72,16 +306,32 @@ class LruCache:
 
             size_callback (func(V) -> int | None):
 
-            evicted_callback (func(int)|None):
+            evicted_callback (func(int, EvictionReason)|None):
                 if not None, called on eviction with the size of the evicted
-                entry
+                entry and the reason it was evicted
 
             apply_cache_factor_from_config (bool): If true, `max_size` will be
                 multiplied by a cache factor derived from the homeserver config
+
+            expiry_time_ms: If set, entries which haven't been accessed for
+                this long are removed from the cache. Defaults to
+                `caches.expiry_time` from the homeserver config.
+
+            clock: Used to track when entries were last accessed. Defaults to a
+                clock using the global reactor.
         """
         cache = cache_type()
         self.cache = cache  # Used for introspection.
         self.apply_cache_factor_from_config = apply_cache_factor_from_config
+        self.expiry_time_ms = expiry_time_ms
+
+        if clock is None:
+            clock = Clock(reactor)
+        self._clock = clock
+
+        # Whether we track the approximate size of the entries and add them to
+        # the global memory budget. This is enabled by `register_cache`.
+        self.track_memory_usage = False
 
         # Save the original max size, and apply the default size factor.
         self._original_max_size = max_size
@@ -105,7 +355,13 @@ class LruCache:
                 evicted_len = delete_node(todelete)
                 cache.pop(todelete.key, None)
                 if evicted_callback:
-                    evicted_callback(evicted_len)
+                    evicted_callback(evicted_len, EvictionReason.size)
+
+        def memory_usage_enabled():
+            return (
+                self.track_memory_usage
+                and cache_config.properties.max_cache_memory_usage is not None
+            )
 
         def synchronized(f):
             @wraps(f)
@@ -128,6 +384,8 @@ class LruCache:
 
         self.len = synchronized(cache_len)
 
+        cached_memory_usage = [0]
+
         def add_node(key, value, callbacks=set()):
             prev_node = list_root
             next_node = prev_node.next_node
@@ -135,10 +393,17 @@ class LruCache:
             prev_node.next_node = node
             next_node.prev_node = node
             cache[key] = node
+            node.last_access_ms = clock.time_msec()
 
             if size_callback:
                 cached_cache_len[0] += size_callback(node.value)
 
+            if memory_usage_enabled():
+                node.memory = sys.getsizeof(node) + _get_size_of((key, value))
+                node.evict_from_owner = evict_node
+                cached_memory_usage[0] += node.memory
+                GLOBAL_MEMORY_BUDGET.add(node)
+
         def move_node_to_front(node):
             prev_node = node.prev_node
             next_node = node.next_node
@@ -150,6 +415,10 @@ class LruCache:
             node.next_node = next_node
             prev_node.next_node = node
             next_node.prev_node = node
+            node.last_access_ms = clock.time_msec()
+
+            if node.memory:
+                GLOBAL_MEMORY_BUDGET.move_to_front(node)
 
         def delete_node(node):
             prev_node = node.prev_node
@@ -162,11 +431,62 @@ class LruCache:
                 deleted_len = size_callback(node.value)
                 cached_cache_len[0] -= deleted_len
 
+            if node.memory:
+                cached_memory_usage[0] -= node.memory
+                GLOBAL_MEMORY_BUDGET.remove(node)
+
             for cb in node.callbacks:
                 cb()
             node.callbacks.clear()
             return deleted_len
 
+        @synchronized
+        def evict_node(node):
+            """Evict the given node because we've exceeded the global memory
+            budget.
+            """
+            # The node may have been removed from the cache since it was picked
+            # for eviction.
+            if cache.get(node.key, None) is not node:
+                return
+
+            evicted_len = delete_node(node)
+            cache.pop(node.key, None)
+            if evicted_callback:
+                evicted_callback(evicted_len, EvictionReason.memory)
+
+        @synchronized
+        def expire_old_entries(limit: int) -> Tuple[int, bool]:
+            """Remove up to `limit` entries which haven't been accessed within
+            the expiry time.
+
+            Returns:
+                The number of entries removed, and whether there are no more
+                expired entries.
+            """
+            expiry_time_ms = self.expiry_time_ms
+            if expiry_time_ms is None:
+                expiry_time_ms = cache_config.properties.expiry_time_msec
+            if not expiry_time_ms:
+                return 0, True
+
+            # The list is ordered by last access, so we can stop as soon as we
+            # find an entry which hasn't expired.
+            cutoff = clock.time_msec() - expiry_time_ms
+            evicted = 0
+            while evicted < limit:
+                node = list_root.prev_node
+                if node is list_root or node.last_access_ms > cutoff:
+                    return evicted, True
+
+                evicted_len = delete_node(node)
+                cache.pop(node.key, None)
+                if evicted_callback:
+                    evicted_callback(evicted_len, EvictionReason.time)
+                evicted += 1
+
+            return evicted, False
+
         @synchronized
         def cache_get(key, default=None, callbacks=[]):
             node = cache.get(key, None)
@@ -177,8 +497,16 @@ class LruCache:
             else:
                 return default
 
-        @synchronized
         def cache_set(key, value, callbacks=[]):
+            _cache_set(key, value, callbacks)
+
+            # We do this outside of our lock, as evicting entries for the global
+            # memory budget may require taking the locks of other caches.
+            if memory_usage_enabled():
+                GLOBAL_MEMORY_BUDGET.evict()
+
+        @synchronized
+        def _cache_set(key, value, callbacks=[]):
             node = cache.get(key, None)
             if node is not None:
                 # We sometimes store large objects, e.g. dicts, which cause
@@ -197,6 +525,11 @@ class LruCache:
                     cached_cache_len[0] -= size_callback(node.value)
                     cached_cache_len[0] += size_callback(value)
 
+                if node.memory:
+                    new_memory = sys.getsizeof(node) + _get_size_of((key, value))
+                    cached_memory_usage[0] += new_memory - node.memory
+                    GLOBAL_MEMORY_BUDGET.resize(node, new_memory)
+
                 node.callbacks.update(callbacks)
 
                 move_node_to_front(node)
@@ -206,8 +539,16 @@ class LruCache:
 
             evict()
 
-        @synchronized
         def cache_set_default(key, value):
+            value = _cache_set_default(key, value)
+
+            if memory_usage_enabled():
+                GLOBAL_MEMORY_BUDGET.evict()
+
+            return value
+
+        @synchronized
+        def _cache_set_default(key, value):
             node = cache.get(key, None)
             if node is not None:
                 return node.value
@@ -242,11 +583,14 @@ class LruCache:
             list_root.next_node = list_root
             list_root.prev_node = list_root
             for node in cache.values():
+                if node.memory:
+                    GLOBAL_MEMORY_BUDGET.remove(node)
                 for cb in node.callbacks:
                     cb()
             cache.clear()
             if size_callback:
                 cached_cache_len[0] = 0
+            cached_memory_usage[0] = 0
 
         @synchronized
         def cache_contains(key):
@@ -263,6 +607,10 @@ class LruCache:
         self.len = synchronized(cache_len)
         self.contains = cache_contains
         self.clear = cache_clear
+        self.memory_usage = lambda: cached_memory_usage[0]
+        self.expire_old_entries = expire_old_entries
+
+        _ALL_CACHES.add(self)
 
     def __getitem__(self, key):
         result = self.get(key, self.sentinel)
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import attr
+from sortedcontainers import SortedDict
+
+from synapse.util.caches import register_cache
+from synapse.util.caches.lrucache import LruCache
+
+
+@attr.s(slots=True)
+class MembershipChanges:
+    """The membership changes we know about for a user.
+
+    Attributes:
+        complete_from: We know about every change with a stream ordering after
+            this position.
+        changes: Map from stream ordering to the event ID of the membership
+            change.
+    """
+
+    complete_from = attr.ib(type=int)
+    changes = attr.ib(factory=SortedDict)  # type: SortedDict[int, str]
+
+
+class MembershipChangeCache:
+    """Keeps track of the stream ordering and event ID of every membership
+    change of recently active users, so that the membership changes of a user
+    between two stream positions can be found without going to the database.
+
+    Entries are filled from the database with `start_fill` and `finish_fill`,
+    and are then kept up to date by calling `membership_has_changed` for every
+    new membership event, both when it is persisted and when it is received
+    over replication.
+
+    Only the most recent `max_changes_per_user` changes of each user are
+    kept, as the stream positions syncs ask about are usually recent.
+    """
+
+    def __init__(
+        self, name: str, max_size: int = 10000, max_changes_per_user: int = 100
+    ):
+        self._cache = LruCache(max_size)  # type: LruCache
+        self._max_changes_per_user = max_changes_per_user
+        self.metrics = register_cache("cache", name, self._cache)
+
+        # The fills for each user which are in flight. Any membership changes
+        # while a fill is in flight are added to it, in case the database
+        # query didn't see them.
+        self._pending_fills = {}  # type: Dict[str, List[MembershipChanges]]
+
+    def get_changes(
+        self, user_id: str, from_id: int, to_id: int
+    ) -> Optional[List[Tuple[int, str]]]:
+        """Gets the membership changes of the user with stream orderings in
+        the range (from_id, to_id].
+
+        Returns:
+            A list of (stream ordering, event ID) tuples in stream order, or
+            None if we don't know about all the changes in the range.
+        """
+        entry = self._cache.get(user_id)
+        if entry is None or entry.complete_from > from_id:
+            self.metrics.inc_misses()
+            return None
+
+        self.metrics.inc_hits()
+        return [
+            (stream_ordering, entry.changes[stream_ordering])
+            for stream_ordering in entry.changes.irange(
+                from_id, to_id, inclusive=(False, True)
+            )
+        ]
+
+    def membership_has_changed(
+        self, user_id: str, stream_ordering: int, event_id: str
+    ) -> None:
+        """Records a new membership change for the user."""
+        entry = self._cache.get(user_id)
+        if entry is not None and stream_ordering > entry.complete_from:
+            entry.changes[stream_ordering] = event_id
+            self._trim(entry)
+
+        for fill in self._pending_fills.get(user_id, ()):
+            if stream_ordering > fill.complete_from:
+                fill.changes[stream_ordering] = event_id
+
+    def start_fill(self, user_id: str, from_id: int) -> MembershipChanges:
+        """Called before querying the database for all the membership changes
+        of the user after `from_id`.
+
+        Returns:
+            An object to pass to `finish_fill`, or to `abort_fill` if the query
+            fails.
+        """
+        fill = MembershipChanges(complete_from=from_id)
+        self._pending_fills.setdefault(user_id, []).append(fill)
+        return fill
+
+    def finish_fill(
+        self, user_id: str, fill: MembershipChanges, changes: Iterable[Tuple[int, str]],
+    ) -> None:
+        """Adds the result of querying the database for all the membership
+        changes of the user after the position given to `start_fill`.
+
+        Args:
+            user_id
+            fill: The object returned by `start_fill`.
+            changes: The (stream ordering, event ID) of every change found.
+        """
+        self.abort_fill(user_id, fill)
+
+        fill.changes.update(changes)
+
+        entry = self._cache.get(user_id)
+        if entry is not None:
+            if entry.complete_from <= fill.complete_from:
+                # We already know about everything the fill found.
+                return
+
+            # The fill goes back further, but the existing entry may know
+            # about changes which were too recent for the fill to see.
+            fill.changes.update(entry.changes)
+
+        self._trim(fill)
+        self._cache[user_id] = fill
+
+    def abort_fill(self, user_id: str, fill: MembershipChanges) -> None:
+        """Stops adding new changes to the fill."""
+        fills = self._pending_fills[user_id]
+        fills.remove(fill)
+        if not fills:
+            del self._pending_fills[user_id]
+
+    def _trim(self, entry: MembershipChanges) -> None:
+        """Drops the oldest changes of the entry until it is within
+        `max_changes_per_user`.
+        """
+        while len(entry.changes) > self._max_changes_per_user:
+            entry.complete_from, _ = entry.changes.popitem(0)
@@ -51,6 +51,104 @@ def unfreeze(o):
     return o
 
 
+def _freeze_lazily(o):
+    # Only the types that come out of the JSON decoder need freezing, and
+    # checking for them exactly is cheaper than calling `isinstance`.
+    if type(o) is dict:
+        return ImmutableDict(o)
+
+    if type(o) is list:
+        return tuple([_freeze_lazily(i) for i in o])
+
+    return o
+
+
+def _immutable(self, *args, **kwargs):
+    raise TypeError("'%s' object is immutable" % (type(self).__name__,))
+
+
+class ImmutableDict(dict):
+    """A read-only dict, which is a cheaper alternative to `freeze` for making
+    event dicts immutable.
+
+    Rather than copying the whole structure up front, only the top level is
+    copied, and nested dicts and lists are frozen (as `ImmutableDict`s and
+    tuples respectively) the first time they are looked up, replacing the
+    original value so that it only happens once.
+
+    As it is a `dict`, it can be serialized directly by the JSON encoders
+    (including canonicaljson's) without being copied back into a `dict`.
+    """
+
+    __slots__ = ("_hash", "_values_frozen")
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        if type(value) is dict or type(value) is list:
+            value = _freeze_lazily(value)
+            dict.__setitem__(self, key, value)
+        return value
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    # Defining `__iter__` stops `dict(...)` and `{**...}` from taking a fast
+    # path which would copy the unfrozen values out.
+    def __iter__(self):
+        return dict.__iter__(self)
+
+    def _freeze_values(self) -> None:
+        try:
+            if self._values_frozen:
+                return
+        except AttributeError:
+            pass
+
+        for key, value in dict.items(self):
+            if type(value) is dict or type(value) is list:
+                dict.__setitem__(self, key, _freeze_lazily(value))
+        self._values_frozen = True
+
+    # Once all the values have been frozen, it's safe to hand out the
+    # underlying views.
+    def items(self):
+        self._freeze_values()
+        return dict.items(self)
+
+    def values(self):
+        self._freeze_values()
+        return dict.values(self)
+
+    def copy(self) -> dict:
+        """Returns a mutable shallow copy"""
+        self._freeze_values()
+        return dict(dict.items(self))
+
+    def __hash__(self):
+        try:
+            return self._hash
+        except AttributeError:
+            self._hash = hash(frozenset(self.items()))
+            return self._hash
+
+    def __reduce__(self):
+        return type(self), (dict(dict.items(self)),)
+
+    def __repr__(self):
+        return "<ImmutableDict %s>" % (dict.__repr__(self),)
+
+    __setitem__ = _immutable
+    __delitem__ = _immutable
+    __ior__ = _immutable
+    clear = _immutable
+    pop = _immutable
+    popitem = _immutable
+    setdefault = _immutable
+    update = _immutable
+
+
 def _handle_frozendict(obj):
     """Helper for EventEncoder. Makes frozendicts serializable by returning
     the underlying dict
@@ -1,4 +1,15 @@
-from . import logging, lrucache, lrucache_evict
+from . import (
+    auth_chain_difference,
+    auth_chain_difference_bfs,
+    event_load,
+    event_load_eager,
+    event_serialize,
+    event_serialize_frozen,
+    logging,
+    lrucache,
+    lrucache_evict,
+    push_rule_evaluator,
+)
 
 SUITES = [
     (logging, 1000),
@@ -6,4 +17,11 @@ SUITES = [
     (logging, None),
     (lrucache, None),
     (lrucache_evict, None),
+    (auth_chain_difference, 10),
+    (auth_chain_difference_bfs, 10),
+    (event_load, None),
+    (event_load_eager, None),
+    (event_serialize, None),
+    (event_serialize_frozen, None),
+    (push_rule_evaluator, 10),
 ]
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+from typing import Dict, List, Set, Tuple
+
+from pyperf import perf_counter
+from synmark import make_homeserver
+
+from synapse.storage.databases.main.events import PersistEventsStore
+
+# The number of auth events in the synthetic room.
+NUM_EVENTS = 100000
+
+# The number of distinct users whose membership changes in the room.
+NUM_USERS = 20000
+
+# How often (in events) the power levels get changed.
+POWER_LEVELS_EVERY = 500
+
+# The number of members that differ between the state sets we resolve.
+FORK_SIZE = 200
+
+
+def _build_auth_graph(
+    room_id: str,
+) -> Tuple[Dict[str, List[str]], Dict[str, Tuple[str, str]], List[Set[str]]]:
+    """Build a synthetic auth graph shaped like a large public room: a chain of
+    power levels events, and membership events for many users which each
+    reference the create event, the current power levels, the join rules and
+    the user's previous membership.
+
+    Returns:
+        The map from event ID to auth event IDs, the map from event ID to
+        type/state_key, and a pair of state sets to compare.
+    """
+    rng = random.Random(1234)
+
+    auth_graph = {}  # type: Dict[str, List[str]]
+    types = {}  # type: Dict[str, Tuple[str, str]]
+
+    def add(event_type: str, state_key: str, auth_ids: List[str]) -> str:
+        event_id = "$%d:%s" % (len(auth_graph), room_id)
+        auth_graph[event_id] = auth_ids
+        types[event_id] = (event_type, state_key)
+        return event_id
+
+    create = add("m.room.create", "", [])
+    power_levels = add("m.room.power_levels", "", [create])
+    join_rules = add("m.room.join_rules", "", [create, power_levels])
+
+    memberships = {}  # type: Dict[int, str]
+    while len(auth_graph) < NUM_EVENTS:
+        if len(auth_graph) % POWER_LEVELS_EVERY == 0:
+            power_levels = add(
+                "m.room.power_levels", "", [create, power_levels, join_rules]
+            )
+            continue
+
+        user = rng.randrange(NUM_USERS)
+        auth_ids = [create, power_levels, join_rules]
+        if user in memberships:
+            auth_ids.append(memberships[user])
+        memberships[user] = add("m.room.member", "@u%d:test" % (user,), auth_ids)
+
+    # Fork the current state: one state set sees the latest membership of a
+    # handful of users, the other sees their previous membership.
+    base = set(memberships.values()) | {create, power_levels, join_rules}
+    forked = set(base)
+    for user in rng.sample(list(memberships), FORK_SIZE):
+        prev = [
+            a_id
+            for a_id in auth_graph[memberships[user]]
+            if types[a_id][0] == "m.room.member"
+        ]
+        if prev:
+            forked.discard(memberships[user])
+            forked.add(prev[0])
+
+    return auth_graph, types, [base, forked]
+
+
+async def setup_room(hs, use_chain_cover_index: bool) -> Tuple[str, List[Set[str]]]:
+    """Insert the synthetic auth graph directly into the database.
+    """
+    store = hs.get_datastore()
+    room_id = "!bench:test"
+
+    auth_graph, types, state_sets = _build_auth_graph(room_id)
+
+    def _insert_txn(txn):
+        store.db_pool.simple_insert_txn(
+            txn,
+            table="rooms",
+            values={
+                "room_id": room_id,
+                "creator": "@u0:test",
+                "is_public": True,
+                "room_version": "6",
+                "has_auth_chain_index": use_chain_cover_index,
+            },
+        )
+
+        store.db_pool.simple_insert_many_txn(
+            txn,
+            table="events",
+            values=[
+                {
+                    "event_id": event_id,
+                    "room_id": room_id,
+                    "depth": depth,
+                    "topological_ordering": depth,
+                    "type": types[event_id][0],
+                    "processed": True,
+                    "outlier": False,
+                    "stream_ordering": depth,
+                }
+                for depth, event_id in enumerate(auth_graph, start=1)
+            ],
+        )
+        store.db_pool.simple_insert_many_txn(
+            txn,
+            table="state_events",
+            values=[
+                {
+                    "event_id": event_id,
+                    "room_id": room_id,
+                    "type": event_type,
+                    "state_key": state_key,
+                }
+                for event_id, (event_type, state_key) in types.items()
+            ],
+        )
+        store.db_pool.simple_insert_many_txn(
+            txn,
+            table="event_auth",
+            values=[
+                {"event_id": event_id, "room_id": room_id, "auth_id": auth_id}
+                for event_id, auth_ids in auth_graph.items()
+                for auth_id in auth_ids
+            ],
+        )
+
+        if use_chain_cover_index:
+            PersistEventsStore._add_chain_cover_index(
+                txn,
+                store.db_pool,
+                {event_id: room_id for event_id in auth_graph},
+                types,
+                auth_graph,
+            )
+
+    await store.db_pool.runInteraction("setup_room", _insert_txn)
+
+    return room_id, state_sets
+
+
+async def run(reactor, loops, use_chain_cover_index: bool):
+    hs, _, cleanup = await make_homeserver(reactor)
+    store = hs.get_datastore()
+
+    room_id, state_sets = await setup_room(hs, use_chain_cover_index)
+
+    start = perf_counter()
+
+    for _ in range(loops):
+        await store.get_auth_chain_difference(room_id, state_sets)
+
+    end = perf_counter() - start
+
+    cleanup()
+
+    return end
+
+
+async def main(reactor, loops):
+    """
+    Benchmark `loops` auth chain difference calculations over a synthetic room
+    with `NUM_EVENTS` auth events, using the chain cover index.
+    """
+    return await run(reactor, loops, use_chain_cover_index=True)
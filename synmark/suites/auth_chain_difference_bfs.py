@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from synmark.suites.auth_chain_difference import run
+
+
+async def main(reactor, loops):
+    """
+    Benchmark `loops` auth chain difference calculations over the same synthetic
+    room as `auth_chain_difference`, but walking the `event_auth` graph instead
+    of using the chain cover index.
+    """
+    return await run(reactor, loops, use_chain_cover_index=False)
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from pyperf import perf_counter
+
+from synapse.api.room_versions import RoomVersions
+from synapse.events import (
+    decode_event_json,
+    make_event_from_dict,
+    make_event_with_lazy_content,
+)
+from synapse.util import json_decoder, json_encoder
+
+EVENT = {
+    "event_id": "$event:test",
+    "type": "m.room.message",
+    "sender": "@user:test",
+    "room_id": "!room:test",
+    "origin_server_ts": 1600000000000,
+    "depth": 100,
+    "auth_events": [["$create:test", {}], ["$member:test", {}]],
+    "prev_events": [["$prev:test", {}]],
+    "hashes": {"sha256": "a" * 43},
+    "signatures": {"test": {"ed25519:1": "s" * 86}},
+    "unsigned": {"age_ts": 1600000000000},
+}
+
+# A short message, a long one, and one in a script which is stored escaped.
+EVENT_JSONS = [
+    json_encoder.encode(dict(EVENT, content=content))
+    for content in (
+        {"msgtype": "m.text", "body": "hello"},
+        {
+            "msgtype": "m.text",
+            "body": "hello " * 2000,
+            "format": "org.matrix.custom.html",
+            "formatted_body": "<b>hello</b> " * 2000,
+        },
+        {"msgtype": "m.text", "body": "\u4f60\u597d " * 1000},
+    )
+]
+
+
+async def run(reactor, loops, lazy_content):
+    start = perf_counter()
+
+    for i in range(loops):
+        event_json = EVENT_JSONS[i % len(EVENT_JSONS)]
+        if lazy_content:
+            event_dict, content_json = decode_event_json(event_json)
+            ev = make_event_with_lazy_content(
+                "$event:test", event_dict, content_json, RoomVersions.V1
+            )
+        else:
+            ev = make_event_from_dict(json_decoder.decode(event_json), RoomVersions.V1)
+        ev.event_id
+        ev.type
+        ev.sender
+        ev.is_state()
+        ev.auth_event_ids()
+
+    end = perf_counter() - start
+
+    return end
+
+
+async def main(reactor, loops):
+    """
+    Benchmark building `loops` events from their JSON as stored in the
+    database, as `_get_events_from_db` does, and reading the fields most
+    commonly looked at, but not their content.
+
+    Short events are decoded outright, but the content of the long ones is left
+    as JSON.
+    """
+    return await run(reactor, loops, lazy_content=True)
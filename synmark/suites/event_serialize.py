@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from pyperf import perf_counter
+
+import synapse.events
+from synapse.api.room_versions import RoomVersions
+from synapse.events import make_event_from_dict
+from synapse.events.utils import serialize_event
+from synapse.util import json_decoder, json_encoder
+
+EVENT_JSON = json_encoder.encode(
+    {
+        "type": "m.room.message",
+        "sender": "@user:test",
+        "room_id": "!room:test",
+        "origin_server_ts": 1600000000000,
+        "depth": 100,
+        "auth_events": ["$create", "$power_levels", "$member"],
+        "prev_events": ["$prev"],
+        "hashes": {"sha256": "a" * 43},
+        "signatures": {"test": {"ed25519:1": "s" * 86}},
+        "unsigned": {"age_ts": 1600000000000},
+        "content": {
+            "msgtype": "m.text",
+            "body": "hello " * 200,
+            "format": "org.matrix.custom.html",
+            "formatted_body": "<b>hello</b> " * 200,
+            "m.relates_to": {"m.in_reply_to": {"event_id": "$parent"}},
+        },
+    }
+)
+
+
+async def run(reactor, loops, use_frozen_dicts):
+    orig_use_frozen_dicts = synapse.events.USE_FROZEN_DICTS
+    synapse.events.USE_FROZEN_DICTS = use_frozen_dicts
+
+    try:
+        start = perf_counter()
+
+        for _ in range(loops):
+            event = make_event_from_dict(
+                json_decoder.decode(EVENT_JSON), RoomVersions.V6
+            )
+            event.content.get("m.relates_to", {}).get("m.in_reply_to")
+            json_encoder.encode(serialize_event(event, 1600000001000))
+
+        end = perf_counter() - start
+    finally:
+        synapse.events.USE_FROZEN_DICTS = orig_use_frozen_dicts
+
+    return end
+
+
+async def main(reactor, loops):
+    """
+    Benchmark loading `loops` events from JSON, looking at their content and
+    serializing them for clients, with plain dicts.
+    """
+    return await run(reactor, loops, use_frozen_dicts=False)
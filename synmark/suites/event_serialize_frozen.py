@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from synmark.suites.event_serialize import run
+
+
+async def main(reactor, loops):
+    """
+    Benchmark the same as `event_serialize`, but with `USE_FROZEN_DICTS`, so
+    that the events are made immutable.
+    """
+    return await run(reactor, loops, use_frozen_dicts=True)
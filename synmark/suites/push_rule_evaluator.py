@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from pyperf import perf_counter
+
+from synapse.api.room_versions import RoomVersions
+from synapse.events import make_event_from_dict
+from synapse.push.push_rule_evaluator import PushRuleEvaluatorForEvent
+
+MEMBERS = 10000
+
+# The conditions of the default rules which look at the body of a message.
+CONDITIONS = [
+    {"kind": "contains_display_name"},
+    {"kind": "event_match", "key": "content.body", "pattern_type": "user_localpart"},
+]
+
+
+async def main(reactor, loops):
+    """
+    Benchmark evaluating the display name and user name push rule conditions
+    for every member of a room with `MEMBERS` members, for `loops` messages.
+    """
+    members = [
+        ("@user%i:test" % (i,), "Member Number %i" % (i,)) for i in range(MEMBERS)
+    ]
+    events = [
+        make_event_from_dict(
+            {
+                "event_id": "$event%i" % (i,),
+                "type": "m.room.message",
+                "sender": "@user0:test",
+                "room_id": "!room:test",
+                "content": {
+                    "msgtype": "m.text",
+                    "body": "Hello Member Number %i, have you seen user%i?" % (i, i),
+                },
+            },
+            RoomVersions.V1,
+        )
+        for i in range(loops)
+    ]
+
+    start = perf_counter()
+
+    for event in events:
+        evaluator = PushRuleEvaluatorForEvent(event, MEMBERS, 0, {})
+        for user_id, display_name in members:
+            for condition in CONDITIONS:
+                evaluator.matches(condition, user_id, display_name)
+
+    end = perf_counter() - start
+
+    return end
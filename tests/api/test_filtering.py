@@ -24,7 +24,7 @@ from twisted.internet import defer
 
 from synapse.api.constants import EventContentFields
 from synapse.api.errors import SynapseError
-from synapse.api.filtering import Filter
+from synapse.api.filtering import Filter, FilterCollection
 from synapse.events import make_event_from_dict
 
 from tests import unittest
@@ -469,6 +469,45 @@ class FilteringTestCase(unittest.TestCase):
 
         self.assertEquals(filtered_room_ids, ["!allowed:example.com"])
 
+    def test_might_include_room_event(self):
+        filter_collection = FilterCollection(
+            {
+                "room": {
+                    "not_rooms": ["!excluded:example.com"],
+                    "timeline": {"types": ["m.room.name"]},
+                    "state": {"types": ["m.room.topic"]},
+                }
+            }
+        )
+
+        def might_include(changes_unread_counts=False, **kwargs):
+            kwargs.setdefault("room_id", "!allowed:example.com")
+            kwargs.setdefault("sender", "@foo:bar")
+            return filter_collection.might_include_room_event(
+                MockEvent(**kwargs), changes_unread_counts=changes_unread_counts
+            )
+
+        # Included in the timeline.
+        self.assertTrue(might_include(type="m.room.name", state_key=""))
+        # Included in the state, though not in the timeline.
+        self.assertTrue(might_include(type="m.room.topic", state_key=""))
+        # Included in neither.
+        self.assertFalse(might_include(type="m.room.avatar", state_key=""))
+        self.assertFalse(might_include(type="m.room.topic"))
+        # Only included through the unread counts.
+        self.assertTrue(
+            might_include(type="m.room.message", changes_unread_counts=True)
+        )
+        # Excluded from the sync altogether.
+        self.assertFalse(
+            might_include(
+                type="m.room.name",
+                state_key="",
+                room_id="!excluded:example.com",
+                changes_unread_counts=True,
+            )
+        )
+
     @defer.inlineCallbacks
     def test_add_filter(self):
         user_filter_json = {"room": {"state": {"types": ["m.*"]}}}
@@ -13,8 +13,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from synapse.config._base import Config, RootConfig
-from synapse.config.cache import CacheConfig, add_resizable_cache
+from synapse.config._base import Config, ConfigError, RootConfig
+from synapse.config.cache import CacheConfig, add_resizable_cache, properties
 from synapse.util.caches.lrucache import LruCache
 
 from tests.unittest import TestCase
@@ -169,3 +169,43 @@ class CacheConfigTests(TestCase):
         add_resizable_cache("event_cache", cache_resize_callback=cache.set_cache_factor)
 
         self.assertEqual(cache.max_size, 10240)
+
+    def test_max_cache_memory_usage(self):
+        """The global memory budget is read from the config and is disabled by
+        default.
+        """
+        t = TestConfig()
+        self.addCleanup(t.caches.reset)
+
+        t.read_config({}, config_dir_path="", data_dir_path="")
+        self.assertIsNone(t.caches.max_cache_memory_usage)
+        self.assertIsNone(properties.max_cache_memory_usage)
+
+        config = {"caches": {"max_cache_memory_usage": "2G"}}
+        t.read_config(config, config_dir_path="", data_dir_path="")
+        self.assertEqual(t.caches.max_cache_memory_usage, 2 * 1024 * 1024 * 1024)
+        self.assertEqual(properties.max_cache_memory_usage, 2 * 1024 * 1024 * 1024)
+
+        config = {"caches": {"max_cache_memory_usage": "lots"}}
+        with self.assertRaises(ConfigError):
+            t.read_config(config, config_dir_path="", data_dir_path="")
+
+    def test_expiry_time(self):
+        """The global cache expiry time is read from the config and is disabled by
+        default.
+        """
+        t = TestConfig()
+        self.addCleanup(t.caches.reset)
+
+        t.read_config({}, config_dir_path="", data_dir_path="")
+        self.assertIsNone(t.caches.expiry_time_msec)
+        self.assertIsNone(properties.expiry_time_msec)
+
+        config = {"caches": {"expiry_time": "30m"}}
+        t.read_config(config, config_dir_path="", data_dir_path="")
+        self.assertEqual(t.caches.expiry_time_msec, 30 * 60 * 1000)
+        self.assertEqual(properties.expiry_time_msec, 30 * 60 * 1000)
+
+        config = {"caches": {"expiry_time": "soon"}}
+        with self.assertRaises(ConfigError):
+            t.read_config(config, config_dir_path="", data_dir_path="")
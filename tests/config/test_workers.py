@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from synapse.config._base import ConsistentShardedWorkerHandlingConfig
+
+from tests import unittest
+
+USER_IDS = ["@user%d:test" % (i,) for i in range(1000)]
+
+
+class ConsistentShardedWorkerHandlingConfigTestCase(unittest.TestCase):
+    def test_no_instances(self):
+        config = ConsistentShardedWorkerHandlingConfig([])
+        self.assertEqual(config.get_instance("@user:test"), "master")
+        self.assertTrue(config.should_handle("master", "@user:test"))
+
+    def test_stable(self):
+        config = ConsistentShardedWorkerHandlingConfig(["sync1", "sync2", "sync3"])
+        reordered = ConsistentShardedWorkerHandlingConfig(["sync3", "sync1", "sync2"])
+
+        for user_id in USER_IDS:
+            self.assertEqual(
+                config.get_instance(user_id), reordered.get_instance(user_id)
+            )
+
+        # Users are spread across all the instances.
+        counts = {}
+        for user_id in USER_IDS:
+            instance = config.get_instance(user_id)
+            counts[instance] = counts.get(instance, 0) + 1
+        self.assertEqual(set(counts), {"sync1", "sync2", "sync3"})
+        for count in counts.values():
+            self.assertGreater(count, 250)
+
+    def test_adding_instance(self):
+        config = ConsistentShardedWorkerHandlingConfig(["sync1", "sync2", "sync3"])
+        new_config = ConsistentShardedWorkerHandlingConfig(
+            ["sync1", "sync2", "sync3", "sync4"]
+        )
+
+        # Only users moving to the new instance change instance.
+        moved = 0
+        for user_id in USER_IDS:
+            new_instance = new_config.get_instance(user_id)
+            if new_instance != config.get_instance(user_id):
+                self.assertEqual(new_instance, "sync4")
+                moved += 1
+
+        self.assertGreater(moved, 150)
+        self.assertLess(moved, 350)
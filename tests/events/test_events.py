@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from mock import patch
+
+from synapse.api.room_versions import RoomVersions
+from synapse.events import (
+    decode_event_json,
+    make_event_from_dict,
+    make_event_with_lazy_content,
+)
+from synapse.util import json_decoder, json_encoder
+from synapse.util.frozenutils import ImmutableDict
+
+from tests import unittest
+
+EVENT_DICT = {
+    "type": "m.room.member",
+    "state_key": "@user:test",
+    "sender": "@user:test",
+    "room_id": "!room:test",
+    "origin_server_ts": 1,
+    "depth": 5,
+    "auth_events": ["$auth"],
+    "prev_events": ["$prev"],
+    "hashes": {"sha256": "abc"},
+    "signatures": {"test": {"ed25519:1": "sig"}},
+    "unsigned": {"age_ts": 1},
+}
+CONTENT_JSON = '{"membership":"join","displayname":"User"}'
+
+
+class LazyContentTestCase(unittest.TestCase):
+    def _make_event(self):
+        return make_event_with_lazy_content(
+            event_id="$event_id",
+            event_dict=EVENT_DICT,
+            content_json=CONTENT_JSON,
+            room_version=RoomVersions.V6,
+        )
+
+    def test_content_decoded_on_access(self):
+        event = self._make_event()
+
+        self.assertEqual(event.event_id, "$event_id")
+        self.assertEqual(event.type, "m.room.member")
+        self.assertEqual(event.state_key, "@user:test")
+        self.assertEqual(event.auth_event_ids(), ["$auth"])
+        self.assertTrue(event.is_state())
+        self.assertIn("content", event)
+        self.assertIsNotNone(event._pending_content)
+
+        self.assertEqual(event.membership, "join")
+        self.assertEqual(event.content, {"membership": "join", "displayname": "User"})
+        self.assertIsNone(event._pending_content)
+
+    def test_serialization_includes_content(self):
+        for get in (
+            lambda e: e.get_dict()["content"],
+            lambda e: e.get_pdu_json()["content"],
+            lambda e: e.get("content"),
+            lambda e: e["content"],
+            lambda e: dict(e.items())["content"],
+        ):
+            event = self._make_event()
+            self.assertEqual(get(event), {"membership": "join", "displayname": "User"})
+
+    def test_same_as_eager_event(self):
+        event = self._make_event()
+
+        d = dict(EVENT_DICT)
+        d["content"] = {"membership": "join", "displayname": "User"}
+        eager_event = make_event_from_dict(d, RoomVersions.V6)
+
+        self.assertEqual(event.get_pdu_json(), eager_event.get_pdu_json())
+
+    @patch("synapse.events.USE_FROZEN_DICTS", True)
+    def test_frozen(self):
+        event = self._make_event()
+        self.assertEqual(event.type, "m.room.member")
+
+        self.assertIsInstance(event.content, ImmutableDict)
+        self.assertEqual(event.membership, "join")
+        self.assertIsInstance(event.get_dict()["hashes"], ImmutableDict)
+        self.assertEqual(event.get_pdu_json()["content"]["displayname"], "User")
+
+    @patch("synapse.events.USE_FROZEN_DICTS", True)
+    def test_frozen_eager_event(self):
+        d = dict(EVENT_DICT)
+        d["content"] = {"membership": "join", "displayname": "User"}
+        event = make_event_from_dict(d, RoomVersions.V6)
+
+        self.assertIsInstance(event.content, ImmutableDict)
+        self.assertEqual(event.membership, "join")
+        with patch("synapse.events.USE_FROZEN_DICTS", False):
+            unfrozen_event = make_event_from_dict(d, RoomVersions.V6)
+        self.assertEqual(
+            json_encoder.encode(event.get_pdu_json()),
+            json_encoder.encode(unfrozen_event.get_pdu_json()),
+        )
+        with self.assertRaises(TypeError):
+            event.content["membership"] = "leave"
+
+
+class DecodeEventJsonTestCase(unittest.TestCase):
+    def _encode(self, content, **kwargs):
+        return json_encoder.encode(dict(EVENT_DICT, content=content, **kwargs))
+
+    def test_short_event_decoded(self):
+        content = json_decoder.decode(CONTENT_JSON)
+        event_dict, content_json = decode_event_json(self._encode(content))
+
+        self.assertEqual(event_dict, dict(EVENT_DICT, content=content))
+        self.assertIsNone(content_json)
+
+    def test_long_content_left_as_json(self):
+        for content in (
+            {"body": "x" * 10000},
+            # Non-ASCII characters are escaped, so take longer to decode.
+            {"body": "\u00e9" * 1000},
+            # Brackets and escaped quotes and backslashes in strings are
+            # skipped over.
+            {"body": '}{"]\\' + "x" * 10000, "a": [{"b": "\\\\"}, []], "c": {}},
+        ):
+            event_dict, content_json = decode_event_json(self._encode(content))
+
+            self.assertEqual(event_dict, EVENT_DICT)
+            self.assertEqual(json_decoder.decode(content_json), content)
+
+    def test_nested_content_key(self):
+        """A "content" key which isn't at the top level of the event isn't taken
+        for its content.
+        """
+        content = {"body": "x" * 10000}
+        unsigned = {"content": {"membership": "join"}}
+
+        event_dict, content_json = decode_event_json(
+            '{"unsigned":%s,%s'
+            % (json_encoder.encode(unsigned), self._encode(content)[1:])
+        )
+        if content_json is not None:
+            event_dict["content"] = json_decoder.decode(content_json)
+
+        self.assertEqual(event_dict["content"], content)
+        self.assertEqual(event_dict["unsigned"], EVENT_DICT["unsigned"])
+
+    def test_invalid(self):
+        long_string = '"%s"' % ("x" * 10000,)
+        for event_json in (
+            "",
+            '{"type": "x",}',
+            '{"type": "x"} {}',
+            '{"content": {"body": %s}' % (long_string,),
+            '{"content": {"body": %s}}}' % (long_string,),
+            '{"content": {"body": "%s}}' % ("x" * 10000,),
+        ):
+            with self.assertRaises(ValueError, msg=event_json[:30]):
+                decode_event_json(event_json)
@@ -1,6 +1,8 @@
 from typing import List, Tuple
 
-from mock import Mock
+from mock import Mock, patch
+
+from twisted.internet import defer
 
 from synapse.events import EventBase
 from synapse.federation.sender import PerDestinationQueue, TransactionManager
@@ -322,6 +324,135 @@ class FederationCatchUpTestCases(FederatingHomeserverTestCase):
             event_5.internal_metadata.stream_ordering,
         )
 
+    @override_config({"send_federation": True})
+    def test_catch_up_from_prefetched_batch(self):
+        """
+        Tests that the first batch of PDUs to catch up on can be fetched for
+        several destinations at once and handed to their queues.
+        """
+        per_dest_queue, sent_pdus = self.make_fake_destination_queue()
+        store = self.hs.get_datastore()
+
+        self.register_user("u1", "you the one")
+        u1_token = self.login("u1", "you the one")
+        room_1 = self.helper.create_room_as("u1", tok=u1_token)
+        room_2 = self.helper.create_room_as("u1", tok=u1_token)
+        for room_id in (room_1, room_2):
+            for user_id in ("@user:host2", "@user:host3"):
+                self.get_success(
+                    event_injection.inject_member_event(
+                        self.hs, room_id, user_id, "join"
+                    )
+                )
+
+        event_id_1 = self.helper.send(room_1, "wombats!", tok=u1_token)["event_id"]
+        event_id_2 = self.helper.send(room_2, "rabbits!", tok=u1_token)["event_id"]
+        event_id_3 = self.helper.send(room_1, "Synapse!", tok=u1_token)["event_id"]
+
+        # host2 has received event 1, host3 hasn't received any of them
+        event_1 = self.get_success(store.get_event(event_id_1))
+        event_3 = self.get_success(store.get_event(event_id_3))
+        last_successful = event_1.internal_metadata.stream_ordering - 1
+        self.get_success(
+            store.set_destination_last_successful_stream_ordering(
+                "host2", event_1.internal_metadata.stream_ordering
+            )
+        )
+        self.get_success(
+            store.set_destination_last_successful_stream_ordering(
+                "host3", last_successful
+            )
+        )
+
+        catch_up = self.get_success(
+            store.get_catch_up_room_event_ids_for_destinations(
+                ["host2", "host3", "host4"]
+            )
+        )
+        self.assertEqual(
+            catch_up,
+            {
+                "host2": (
+                    event_1.internal_metadata.stream_ordering,
+                    [event_id_2, event_id_3],
+                ),
+                "host3": (last_successful, [event_id_2, event_id_3]),
+            },
+        )
+
+        # the queue sends the batch it is given, only going to the database
+        # for the next one
+        store.get_catch_up_room_event_ids = Mock(
+            side_effect=store.get_catch_up_room_event_ids
+        )
+        last_successful_stream_ordering, event_ids = catch_up["host2"]
+        pdus = self.get_success(store.get_events_as_list(event_ids))
+        per_dest_queue._prefetched_catch_up = (last_successful_stream_ordering, pdus)
+
+        self.get_success(per_dest_queue._catch_up_transmission_loop())
+
+        self.assertEqual([pdu.event_id for pdu in sent_pdus], [event_id_2, event_id_3])
+        self.assertFalse(per_dest_queue._catching_up)
+        store.get_catch_up_room_event_ids.assert_called_once_with(
+            "host2", event_3.internal_metadata.stream_ordering
+        )
+
+    def test_catch_up_loop_fetches_next_batch_while_sending(self):
+        """
+        Tests that _catch_up_transmission_loop fetches the next batch of PDUs
+        while the previous one is being sent.
+        """
+        transaction_manager = TransactionManager(self.hs)
+        per_dest_queue = PerDestinationQueue(self.hs, transaction_manager, "host2")
+        per_dest_queue._last_successful_stream_ordering = 0
+
+        def make_pdu(stream_ordering):
+            return Mock(
+                room_id="!room:test",
+                internal_metadata=Mock(stream_ordering=stream_ordering),
+            )
+
+        # the batch of PDUs after each stream ordering
+        batches = {0: [make_pdu(1), make_pdu(2)], 2: [make_pdu(3)], 3: []}
+        fetched = []
+
+        async def get_catch_up_pdus(last_successful_stream_ordering):
+            fetched.append(last_successful_stream_ordering)
+            return batches[last_successful_stream_ordering]
+
+        per_dest_queue._get_catch_up_pdus = get_catch_up_pdus
+
+        # transactions which have been sent, and the deferreds to complete them
+        sent = []
+
+        def send_new_transaction(destination, pending_pdus, pending_edus):
+            d = defer.Deferred()
+            sent.append((pending_pdus, d))
+            return d
+
+        transaction_manager.send_new_transaction = send_new_transaction
+
+        d = defer.ensureDeferred(per_dest_queue._catch_up_transmission_loop())
+
+        # the next batch is fetched while the first one is being sent...
+        self.assertEqual(len(sent), 1)
+        self.assertEqual(sent[0][0], batches[0])
+        self.assertEqual(fetched, [0, 2])
+
+        # ... and is sent as soon as the first one succeeds.
+        sent[0][1].callback(True)
+        self.pump()
+        self.assertEqual(len(sent), 2)
+        self.assertEqual(sent[1][0], batches[2])
+        self.assertEqual(fetched, [0, 2, 3])
+
+        sent[1][1].callback(True)
+        self.pump()
+        self.successResultOf(d)
+        self.assertEqual(len(sent), 2)
+        self.assertFalse(per_dest_queue._catching_up)
+        self.assertEqual(per_dest_queue._last_successful_stream_ordering, 3)
+
     @override_config({"send_federation": True})
     def test_catch_up_on_synapse_startup(self):
         """
@@ -398,7 +529,8 @@ class FederationCatchUpTestCases(FederatingHomeserverTestCase):
 
         # ACT: call _wake_destinations_needing_catchup
 
-        # patch wake_destination to just count the destinations instead
+        # patch wake_destination and wake_for_catch_up to just count the
+        # destinations instead
         woken = []
 
         def wake_destination_track(destination):
@@ -406,6 +538,24 @@ class FederationCatchUpTestCases(FederatingHomeserverTestCase):
 
         self.hs.get_federation_sender().wake_destination = wake_destination_track
 
+        def wake_for_catch_up_track(queue, last_successful_stream_ordering, pdus):
+            woken.append(queue._destination)
+
+            # the first batch of PDUs was fetched along with the other
+            # destinations'
+            self.assertEqual(
+                [pdu.content["body"] for pdu in pdus], ["can anyone hear me?"]
+            )
+
+        patcher = patch.object(
+            PerDestinationQueue,
+            "wake_for_catch_up",
+            autospec=True,
+            side_effect=wake_for_catch_up_track,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
         # cancel the pre-existing timer for _wake_destinations_needing_catchup
         # this is because we are calling it manually rather than waiting for it
         # to be called automatically
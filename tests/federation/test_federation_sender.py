@@ -23,10 +23,10 @@ from twisted.internet import defer
 
 from synapse.api.constants import RoomEncryptionAlgorithms
 from synapse.rest import admin
-from synapse.rest.client.v1 import login
+from synapse.rest.client.v1 import login, room
 from synapse.types import JsonDict, ReadReceipt
 
-from tests.test_utils import make_awaitable
+from tests.test_utils import event_injection, make_awaitable
 from tests.unittest import HomeserverTestCase, override_config
 
 
@@ -156,6 +156,89 @@ class FederationSenderReceiptsTestCases(HomeserverTestCase):
         )
 
 
+class FederationSenderRoomEventsTestCases(HomeserverTestCase):
+    servlets = [
+        admin.register_servlets,
+        room.register_servlets,
+        login.register_servlets,
+    ]
+
+    def make_homeserver(self, reactor, clock):
+        return self.setup_test_homeserver(
+            federation_transport_client=Mock(spec=["send_transaction"]),
+        )
+
+    def prepare(self, reactor, clock, hs):
+        # record the destinations that each transaction is sent to
+        self.sent = []
+        hs.get_federation_transport_client().send_transaction.side_effect = (
+            self.record_transaction
+        )
+
+        # spy on the calculation of the servers in the room at each event,
+        # without presence updates getting in the way
+        state_handler = hs.get_state_handler()
+        state_handler.get_current_hosts_in_room = Mock(
+            side_effect=lambda room_id: make_awaitable(set())
+        )
+        self.get_hosts_in_room_at_events = Mock(
+            side_effect=state_handler.get_hosts_in_room_at_events
+        )
+        state_handler.get_hosts_in_room_at_events = self.get_hosts_in_room_at_events
+
+        self.register_user("u1", "you the one")
+        self.token = self.login("u1", "you the one")
+
+    async def record_transaction(self, txn, json_cb):
+        data = json_cb()
+        if data["pdus"]:
+            self.sent.append(txn.destination)
+        return {}
+
+    @override_config({"send_federation": True})
+    def test_skips_local_rooms(self):
+        room_id = self.helper.create_room_as("u1", tok=self.token)
+        self.helper.send(room_id, "wombats!", tok=self.token)
+        self.pump()
+
+        self.get_hosts_in_room_at_events.assert_not_called()
+        self.assertEqual(self.sent, [])
+
+        # once a remote server joins, events are sent to it
+        self.get_success(
+            event_injection.inject_member_event(self.hs, room_id, "@user:host2", "join")
+        )
+        self.helper.send(room_id, "wombats!", tok=self.token)
+        self.pump()
+
+        self.get_hosts_in_room_at_events.assert_called()
+        self.assertIn("host2", self.sent)
+
+    @override_config(
+        {"send_federation": True, "federation_sender_instances": ["master", "other"]}
+    )
+    def test_skips_rooms_with_only_other_shards_destinations(self):
+        # host3 is handled by the other federation sender
+        room_id = self.helper.create_room_as("u1", tok=self.token)
+        self.get_success(
+            event_injection.inject_member_event(self.hs, room_id, "@user:host3", "join")
+        )
+        self.helper.send(room_id, "wombats!", tok=self.token)
+        self.pump()
+
+        self.get_hosts_in_room_at_events.assert_not_called()
+        self.assertEqual(self.sent, [])
+
+        # host2 is handled by this one
+        self.get_success(
+            event_injection.inject_member_event(self.hs, room_id, "@user:host2", "join")
+        )
+        self.helper.send(room_id, "wombats!", tok=self.token)
+        self.pump()
+
+        self.assertEqual(set(self.sent), {"host2"})
+
+
 class FederationSenderDevicesTestCases(HomeserverTestCase):
     servlets = [
         admin.register_servlets,
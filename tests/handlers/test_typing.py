@@ -150,6 +150,11 @@ class TypingNotificationsTestCase(unittest.HomeserverTestCase):
 
         self.datastore.get_users_in_room = get_users_in_room
 
+        def get_current_hosts_in_room(room_id):
+            return defer.succeed({member.domain for member in self.room_members})
+
+        self.datastore.get_current_hosts_in_room = get_current_hosts_in_room
+
         self.datastore.get_user_directory_stream_pos.side_effect = (
             # we deliberately return a non-None stream pos to avoid doing an initial_spam
             lambda: make_awaitable(1)
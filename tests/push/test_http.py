@@ -19,9 +19,10 @@ from twisted.internet.defer import Deferred
 
 import synapse.rest.admin
 from synapse.logging.context import make_deferred_yieldable
+from synapse.push.action_generator import ActionGenerator
 from synapse.rest.client.v1 import login, room
 
-from tests.unittest import HomeserverTestCase
+from tests.unittest import HomeserverTestCase, override_config
 
 
 class HTTPPusherTests(HomeserverTestCase):
@@ -153,6 +154,216 @@ class HTTPPusherTests(HomeserverTestCase):
         self.assertEqual(len(pushers), 1)
         self.assertTrue(pushers[0]["last_stream_ordering"] > last_stream_ordering)
 
+    @override_config({"push": {"defer_actions": True}})
+    def test_sends_http_with_deferred_actions(self):
+        """
+        The HTTP pusher sends pushes for messages whose push actions are computed
+        after they are persisted.
+        """
+        store = self.hs.get_datastore()
+        store.add_push_actions_to_staging = Mock(
+            side_effect=store.add_push_actions_to_staging
+        )
+
+        user_id = self.register_user("user", "pass")
+        access_token = self.login("user", "pass")
+
+        other_user_id = self.register_user("otheruser", "pass")
+        other_access_token = self.login("otheruser", "pass")
+
+        user_tuple = self.get_success(store.get_user_by_access_token(access_token))
+        token_id = user_tuple["token_id"]
+
+        self.get_success(
+            self.hs.get_pusherpool().add_pusher(
+                user_id=user_id,
+                access_token=token_id,
+                kind="http",
+                app_id="m.http",
+                app_display_name="HTTP Push Notifications",
+                device_display_name="pushy push",
+                pushkey="a@example.com",
+                lang=None,
+                data={"url": "example.com"},
+            )
+        )
+
+        room = self.helper.create_room_as(user_id, tok=access_token)
+        self.helper.join(room=room, user=other_user_id, tok=other_access_token)
+        self.helper.send(room, body="Hi!", tok=other_access_token)
+        self.pump()
+
+        # The push actions didn't go through the staging area.
+        store.add_push_actions_to_staging.assert_not_called()
+
+        self.assertEqual(len(self.push_attempts), 1)
+        self.assertEqual(
+            self.push_attempts[0][2]["notification"]["content"]["body"], "Hi!"
+        )
+        self.push_attempts[0][0].callback({})
+        self.pump()
+
+        # The message also counts towards the user's unread notifications.
+        last_event_id = self.helper.send(room, body="Read", tok=access_token)[
+            "event_id"
+        ]
+        counts = self.get_success(
+            store.get_unread_event_push_actions_by_room_for_user(
+                room, user_id, last_event_id
+            )
+        )
+        self.assertEqual(counts["notify_count"], 0)
+
+        self.helper.send(room, body="There!", tok=other_access_token)
+        self.pump()
+        counts = self.get_success(
+            store.get_unread_event_push_actions_by_room_for_user(
+                room, user_id, last_event_id
+            )
+        )
+        self.assertEqual(counts["notify_count"], 1)
+        self.assertEqual(len(self.push_attempts), 2)
+
+    @override_config({"push": {"defer_actions": True}})
+    def test_deferred_actions_computed_after_restart(self):
+        """
+        Push actions which were still to be computed when the server stopped are
+        computed when it starts again.
+        """
+        store = self.hs.get_datastore()
+
+        user_id = self.register_user("user", "pass")
+        access_token = self.login("user", "pass")
+
+        other_user_id = self.register_user("otheruser", "pass")
+        other_access_token = self.login("otheruser", "pass")
+
+        user_tuple = self.get_success(store.get_user_by_access_token(access_token))
+        token_id = user_tuple["token_id"]
+
+        self.get_success(
+            self.hs.get_pusherpool().add_pusher(
+                user_id=user_id,
+                access_token=token_id,
+                kind="http",
+                app_id="m.http",
+                app_display_name="HTTP Push Notifications",
+                device_display_name="pushy push",
+                pushkey="a@example.com",
+                lang=None,
+                data={"url": "example.com"},
+            )
+        )
+
+        room = self.helper.create_room_as(user_id, tok=access_token)
+        self.helper.join(room=room, user=other_user_id, tok=other_access_token)
+        self.pump()
+
+        # The server is stopped before the push actions for the message are
+        # computed.
+        action_generator = self.hs.get_action_generator()
+        action_generator.handle_push_actions_for_persisted_events = Mock()
+        self.helper.send(room, body="Hi!", tok=other_access_token)
+        self.pump()
+        self.assertEqual(len(self.push_attempts), 0)
+
+        # When it starts again, the push actions are computed and the push sent.
+        ActionGenerator(self.hs)
+        self.pump()
+
+        self.assertEqual(len(self.push_attempts), 1)
+        self.assertEqual(
+            self.push_attempts[0][2]["notification"]["content"]["body"], "Hi!"
+        )
+        self.assertEqual(
+            self.get_success(store.get_deferred_push_actions_position()),
+            store.get_room_max_stream_ordering(),
+        )
+
+    @override_config({"push": {"defer_actions": True}})
+    def test_deferred_actions_for_rooms_persisted_out_of_order(self):
+        """
+        A message whose push actions are queued up after those of a later
+        message in another room, as the rooms' events are persisted
+        concurrently, is still pushed.
+        """
+        store = self.hs.get_datastore()
+
+        user_id = self.register_user("user", "pass")
+        access_token = self.login("user", "pass")
+
+        other_user_id = self.register_user("otheruser", "pass")
+        other_access_token = self.login("otheruser", "pass")
+
+        user_tuple = self.get_success(store.get_user_by_access_token(access_token))
+        token_id = user_tuple["token_id"]
+
+        self.get_success(
+            self.hs.get_pusherpool().add_pusher(
+                user_id=user_id,
+                access_token=token_id,
+                kind="http",
+                app_id="m.http",
+                app_display_name="HTTP Push Notifications",
+                device_display_name="pushy push",
+                pushkey="a@example.com",
+                lang=None,
+                data={"url": "example.com"},
+            )
+        )
+
+        room_a = self.helper.create_room_as(user_id, tok=access_token)
+        self.helper.join(room=room_a, user=other_user_id, tok=other_access_token)
+        room_b = self.helper.create_room_as(user_id, tok=access_token)
+        self.helper.join(room=room_b, user=other_user_id, tok=other_access_token)
+        self.pump()
+
+        # Hold up the message in the first room between it being persisted and
+        # its push actions being queued up.
+        persistence = self.hs.get_storage().persistence
+        persist_event = persistence.persist_event
+        held = Deferred()
+
+        async def _persist_event(event, context, **kwargs):
+            result = await persist_event(event, context, **kwargs)
+            if event.room_id == room_a and event.type == "m.room.message":
+                await make_deferred_yieldable(held)
+            return result
+
+        persistence.persist_event = _persist_event
+
+        request, channel = self.make_request(
+            "PUT",
+            "/rooms/%s/send/m.room.message/txn1" % (room_a,),
+            {"msgtype": "m.text", "body": "First"},
+            access_token=other_access_token,
+        )
+        request.render(self.resource)
+        self.pump()
+        self.assertFalse(request.finished)
+
+        # The later message in the other room isn't pushed until the first
+        # message's push actions are stored.
+        self.helper.send(room_b, body="Second", tok=other_access_token)
+        self.pump()
+        self.assertEqual(len(self.push_attempts), 0)
+
+        held.callback(None)
+        self.pump()
+        self.assertTrue(request.finished)
+
+        self.assertEqual(len(self.push_attempts), 1)
+        self.assertEqual(
+            self.push_attempts[0][2]["notification"]["content"]["body"], "First"
+        )
+        self.push_attempts[0][0].callback({})
+        self.pump()
+
+        self.assertEqual(len(self.push_attempts), 2)
+        self.assertEqual(
+            self.push_attempts[1][2]["notification"]["content"]["body"], "Second"
+        )
+
     def test_sends_high_priority_for_encrypted(self):
         """
         The HTTP pusher will send pushes at high priority if they correspond
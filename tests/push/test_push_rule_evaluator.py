@@ -13,6 +13,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import re
+
+from mock import patch
+
 from synapse.api.room_versions import RoomVersions
 from synapse.events import FrozenEvent
 from synapse.push import push_rule_evaluator
@@ -67,6 +71,60 @@ class PushRuleEvaluatorTestCase(unittest.TestCase):
         # A display name with spaces should work fine.
         self.assertTrue(evaluator.matches(condition, "@user:test", "foo bar"))
 
+    def test_display_name_case_and_boundaries(self):
+        """Display names are matched ignoring case, and only as whole words."""
+        evaluator = self._get_evaluator({"body": "Hi @Bob, and İnci! ßeta"})
+
+        condition = {
+            "kind": "contains_display_name",
+        }
+
+        for display_name, expected in (
+            ("bob", True),
+            ("@bob", True),
+            ("bob,", True),
+            ("hi @bob", True),
+            ("b", False),
+            ("and i", False),
+            ("İnci", True),
+            ("ßeta", True),
+            ("SSeta", False),
+        ):
+            self.assertEqual(
+                evaluator.matches(condition, "@user:test", display_name),
+                expected,
+                display_name,
+            )
+
+    def test_word_matcher(self):
+        """The word matcher agrees with the regexes it replaces."""
+        text = "Hello, World! it's @alice:test (ALICE) ſam_Σίσυφος 100%"
+        matcher = push_rule_evaluator._WordMatcher(text)
+
+        for word in (
+            "hello",
+            "hello,",
+            "world!",
+            "orld",
+            "it",
+            "it's",
+            "s",
+            "@alice:test",
+            "alice",
+            "test",
+            "(alice)",
+            "sam",
+            "sam_σίσυφος",
+            "ΣΊΣΥΦΟΣ",
+            "100",
+            "100%",
+        ):
+            r = re.compile(
+                push_rule_evaluator._re_word_boundary(re.escape(word)),
+                flags=re.IGNORECASE,
+            )
+            self.assertEqual(matcher.contains(word), bool(r.search(text)), word)
+
     def test_no_body(self):
         """Not having a body shouldn't break the evaluator."""
         evaluator = self._get_evaluator({})
@@ -86,6 +144,42 @@ class PushRuleEvaluatorTestCase(unittest.TestCase):
             evaluator = self._get_evaluator({"body": body})
             self.assertFalse(evaluator.matches(condition, "@user:test", "foo"))
 
+    def test_shared_conditions(self):
+        """Conditions which don't depend on the user are only tested once."""
+        evaluator = self._get_evaluator({"body": "foo bar baz"})
+
+        with patch.object(
+            evaluator, "_matches", side_effect=evaluator._matches
+        ) as mock_matches:
+            condition = {"kind": "event_match", "key": "content.body", "pattern": "foo"}
+            self.assertTrue(evaluator.matches(condition, "@user1:test", "User 1"))
+            self.assertTrue(evaluator.matches(condition, "@user2:test", "User 2"))
+            self.assertEqual(mock_matches.call_count, 1)
+
+            # Equal conditions share the result.
+            condition = dict(condition)
+            self.assertTrue(evaluator.matches(condition, "@user3:test", "User 3"))
+            self.assertEqual(mock_matches.call_count, 1)
+
+            # Conditions on the user are tested for each user.
+            mock_matches.reset_mock()
+            condition = {
+                "kind": "event_match",
+                "key": "sender",
+                "pattern_type": "user_id",
+            }
+            self.assertTrue(evaluator.matches(condition, "@user:test", "User"))
+            self.assertFalse(evaluator.matches(condition, "@user2:test", "User 2"))
+            self.assertEqual(mock_matches.call_count, 2)
+
+            # ... and so are display names, unless they are the same.
+            mock_matches.reset_mock()
+            condition = {"kind": "contains_display_name"}
+            self.assertTrue(evaluator.matches(condition, "@user1:test", "foo"))
+            self.assertFalse(evaluator.matches(condition, "@user2:test", "ba"))
+            self.assertTrue(evaluator.matches(condition, "@user3:test", "foo"))
+            self.assertEqual(mock_matches.call_count, 2)
+
     def test_tweaks_for_actions(self):
         """
         This tests the behaviour of tweaks_for_actions.
@@ -540,6 +540,7 @@ class DeleteRoomTestCase(unittest.HomeserverTestCase):
             "event_search",
             "events",
             "group_rooms",
+            "initial_sync_snapshot_rooms",
             "public_room_list_stream",
             "receipts_graph",
             "receipts_linearized",
@@ -642,6 +643,7 @@ class PurgeRoomTestCase(unittest.HomeserverTestCase):
             "event_search",
             "events",
             "group_rooms",
+            "initial_sync_snapshot_rooms",
             "public_room_list_stream",
             "receipts_graph",
             "receipts_linearized",
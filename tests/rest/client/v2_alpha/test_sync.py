@@ -13,12 +13,20 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import itertools
 import json
+import urllib.parse
+
+from mock import Mock, patch
+
+from twisted.internet import defer
 
 import synapse.rest.admin
 from synapse.api.constants import EventContentFields, EventTypes, RelationTypes
+from synapse.logging.context import make_deferred_yieldable
 from synapse.rest.client.v1 import login, room
 from synapse.rest.client.v2_alpha import read_marker, sync
+from synapse.types import PersistedEventPosition, RoomStreamToken
 
 from tests import unittest
 from tests.server import TimedOutException
@@ -460,6 +468,39 @@ class UnreadMessagesTestCase(unittest.HomeserverTestCase):
         )
         self._check_unread_count(5)
 
+    def test_unread_counts_for_several_rooms(self):
+        """Tests that the counts for all the rooms in a sync are fetched together
+        and added to the per-room cache.
+        """
+        room_id2 = self.helper.create_room_as(self.user_id, tok=self.tok)
+        for room_id in (self.room_id, room_id2):
+            self.helper.join(room=room_id, user=self.user2, tok=self.tok2)
+
+        self.helper.send(self.room_id, "hello", tok=self.tok2)
+        for _ in range(2):
+            self.helper.send(room_id2, "hello", tok=self.tok2)
+
+        store = self.hs.get_datastore()
+        cache = store.get_unread_event_push_actions_by_room_for_user.cache
+        cache.invalidate_all()
+
+        request, channel = self.make_request("GET", "/sync", access_token=self.tok)
+        self.render(request)
+        self.assertEqual(channel.code, 200, channel.json_body)
+
+        for room_id, expected_count in ((self.room_id, 1), (room_id2, 2)):
+            room_entry = channel.json_body["rooms"]["join"][room_id]
+            self.assertEqual(
+                room_entry["org.matrix.msc2654.unread_count"], expected_count
+            )
+            self.assertEqual(
+                room_entry["unread_notifications"]["notification_count"],
+                expected_count,
+            )
+
+            counts = cache.get((room_id, self.user_id, None))
+            self.assertEqual(counts["unread_count"], expected_count)
+
     def _check_unread_count(self, expected_count: True):
         """Syncs and compares the unread count with the expected value."""
 
@@ -477,3 +518,623 @@ class UnreadMessagesTestCase(unittest.HomeserverTestCase):
 
         # Store the next batch for the next request.
         self.next_batch = channel.json_body["next_batch"]
+
+
+class StateDeltaTestCase(unittest.HomeserverTestCase):
+    servlets = [
+        synapse.rest.admin.register_servlets,
+        login.register_servlets,
+        room.register_servlets,
+        sync.register_servlets,
+    ]
+
+    def prepare(self, reactor, clock, hs):
+        self.state_storage = hs.get_storage().state
+
+        self.user_id = self.register_user("kermit", "monkey")
+        self.tok = self.login("kermit", "monkey")
+
+    def _sync(self, url):
+        request, channel = self.make_request("GET", url, access_token=self.tok)
+        self.render(request)
+        self.assertEqual(channel.code, 200, channel.result)
+        return channel.json_body
+
+    def test_gappy_sync_in_several_rooms(self):
+        room_ids = [
+            self.helper.create_room_as(self.user_id, tok=self.tok) for _ in range(3)
+        ]
+
+        sync_filter = urllib.parse.quote(
+            json.dumps({"room": {"timeline": {"limit": 2}}})
+        )
+        body = self._sync("/sync?filter=%s" % (sync_filter,))
+
+        for room_id in room_ids:
+            self.helper.send_state(
+                room_id, EventTypes.Name, {"name": room_id}, tok=self.tok
+            )
+            for _ in range(3):
+                self.helper.send(room_id, "hello", tok=self.tok)
+
+        get_state_ids_for_events_bulk = Mock(
+            side_effect=self.state_storage.get_state_ids_for_events_bulk
+        )
+        self.state_storage.get_state_ids_for_events_bulk = get_state_ids_for_events_bulk
+
+        body = self._sync(
+            "/sync?filter=%s&since=%s" % (sync_filter, body["next_batch"])
+        )
+
+        # The state for all the rooms is fetched together.
+        self.assertEqual(get_state_ids_for_events_bulk.call_count, 1)
+
+        self.assertCountEqual(body["rooms"]["join"], room_ids)
+        for room_id in room_ids:
+            room_entry = body["rooms"]["join"][room_id]
+            self.assertTrue(room_entry["timeline"]["limited"])
+            name_events = [
+                event
+                for event in room_entry["state"]["events"]
+                if event["type"] == EventTypes.Name
+            ]
+            self.assertEqual(len(name_events), 1)
+            self.assertEqual(name_events[0]["content"]["name"], room_id)
+
+
+class NotifierWakeupsTestCase(unittest.HomeserverTestCase):
+    servlets = [
+        synapse.rest.admin.register_servlets,
+        login.register_servlets,
+        room.register_servlets,
+        sync.register_servlets,
+    ]
+
+    def default_config(self):
+        config = super().default_config()
+        config["notifier_wakeups"] = {"filter_events": True, "coalesce_window": 1000}
+        return config
+
+    def prepare(self, reactor, clock, hs):
+        self.sync_handler = hs.get_sync_handler()
+
+        self.user_id = self.register_user("kermit", "monkey")
+        self.tok = self.login("kermit", "monkey")
+        self.room_id = self.helper.create_room_as(self.user_id, tok=self.tok)
+
+    def _start_sync(self, sync_filter):
+        sync_filter = urllib.parse.quote(json.dumps(sync_filter))
+
+        request, channel = self.make_request(
+            "GET", "/sync?filter=%s" % (sync_filter,), access_token=self.tok
+        )
+        self.render(request)
+        self.assertEqual(channel.code, 200, channel.result)
+
+        request, channel = self.make_request(
+            "GET",
+            "/sync?timeout=10000&filter=%s&since=%s"
+            % (sync_filter, channel.json_body["next_batch"]),
+            access_token=self.tok,
+        )
+        request.render(self.resource)
+        self.pump()
+        self.assertFalse(request.finished)
+        return request, channel
+
+    def test_filtered_wakeups(self):
+        current_sync_for_user = Mock(
+            side_effect=self.sync_handler.current_sync_for_user
+        )
+        self.sync_handler.current_sync_for_user = current_sync_for_user
+
+        request, channel = self._start_sync(
+            {"room": {"timeline": {"types": [EventTypes.Name]}}}
+        )
+        current_sync_for_user.reset_mock()
+
+        # A message doesn't wake the sync up, as its filter excludes it.
+        self.helper.send(self.room_id, "hello", tok=self.tok)
+        self.reactor.advance(1)
+        self.assertFalse(request.finished)
+        current_sync_for_user.assert_not_called()
+
+        # A change to the room name does.
+        self.helper.send_state(
+            self.room_id, EventTypes.Name, {"name": "test"}, tok=self.tok
+        )
+        self.reactor.advance(1)
+        self.assertTrue(request.finished)
+        self.assertEqual(channel.code, 200, channel.result)
+        timeline = channel.json_body["rooms"]["join"][self.room_id]["timeline"]
+        self.assertEqual(
+            [event["type"] for event in timeline["events"]], [EventTypes.Name]
+        )
+
+    def test_wakeups_for_state_and_unread_counts(self):
+        user2 = self.register_user("kermit2", "monkey")
+        tok2 = self.login("kermit2", "monkey")
+        self.helper.join(self.room_id, user2, tok=tok2)
+
+        current_sync_for_user = Mock(
+            side_effect=self.sync_handler.current_sync_for_user
+        )
+        self.sync_handler.current_sync_for_user = current_sync_for_user
+
+        request, channel = self._start_sync(
+            {
+                "room": {
+                    "timeline": {"types": [EventTypes.Name]},
+                    "state": {"types": [EventTypes.Topic]},
+                }
+            }
+        )
+        current_sync_for_user.reset_mock()
+
+        # A message from another user changes the unread counts, so wakes the
+        # sync up.
+        self.helper.send(self.room_id, "hello", tok=tok2)
+        self.reactor.advance(1)
+        current_sync_for_user.assert_called_once()
+        current_sync_for_user.reset_mock()
+
+        # So does a change to the state the filter includes.
+        self.helper.send_state(
+            self.room_id, EventTypes.Topic, {"topic": "test"}, tok=self.tok
+        )
+        self.reactor.advance(1)
+        current_sync_for_user.assert_called_once()
+        current_sync_for_user.reset_mock()
+
+        # But not a change to state it doesn't.
+        self.helper.send_state(
+            self.room_id, EventTypes.JoinRules, {"join_rule": "public"}, tok=self.tok
+        )
+        self.reactor.advance(1)
+        current_sync_for_user.assert_not_called()
+
+    def test_coalesced_wakeups(self):
+        request, channel = self._start_sync({})
+
+        self.helper.send(self.room_id, "hello", tok=self.tok)
+        self.helper.send(self.room_id, "hello again", tok=self.tok)
+        self.assertFalse(request.finished)
+
+        # Both messages are in the response once the listener is woken up.
+        self.reactor.advance(1)
+        self.assertTrue(request.finished)
+        timeline = channel.json_body["rooms"]["join"][self.room_id]["timeline"]
+        self.assertEqual(
+            [event["content"]["body"] for event in timeline["events"]],
+            ["hello", "hello again"],
+        )
+
+
+class DeferredPushActionsSyncTestCase(unittest.HomeserverTestCase):
+    servlets = [
+        synapse.rest.admin.register_servlets,
+        login.register_servlets,
+        room.register_servlets,
+        sync.register_servlets,
+    ]
+
+    def default_config(self):
+        config = super().default_config()
+        config["push"] = {"defer_actions": True}
+        return config
+
+    def prepare(self, reactor, clock, hs):
+        self.user_id = self.register_user("kermit", "monkey")
+        self.tok = self.login("kermit", "monkey")
+        self.room_id = self.helper.create_room_as(self.user_id, tok=self.tok)
+
+        self.user2 = self.register_user("kermit2", "monkey")
+        self.tok2 = self.login("kermit2", "monkey")
+        self.helper.join(self.room_id, self.user2, tok=self.tok2)
+        self.pump()
+
+        # Hold up storing the push actions until we say so.
+        self.action_deferreds = []
+        evaluator = hs.get_action_generator().bulk_evaluator
+        action_for_persisted_event_by_user = (
+            evaluator.action_for_persisted_event_by_user
+        )
+
+        async def _action_for_persisted_event_by_user(event, context):
+            d = defer.Deferred()
+            self.action_deferreds.append(d)
+            await make_deferred_yieldable(d)
+            await action_for_persisted_event_by_user(event, context)
+
+        evaluator.action_for_persisted_event_by_user = (
+            _action_for_persisted_event_by_user
+        )
+
+    def test_sync_waits_for_push_actions(self):
+        request, channel = self.make_request("GET", "/sync", access_token=self.tok)
+        self.render(request)
+        self.assertEqual(channel.code, 200, channel.result)
+
+        request, channel = self.make_request(
+            "GET",
+            "/sync?timeout=10000&since=%s" % (channel.json_body["next_batch"],),
+            access_token=self.tok,
+        )
+        request.render(self.resource)
+        self.pump()
+
+        # The message isn't sent down the sync until its push actions are
+        # stored.
+        self.helper.send(self.room_id, "hello", tok=self.tok2)
+        self.pump()
+        self.assertFalse(request.finished)
+
+        for d in self.action_deferreds:
+            d.callback(None)
+        self.pump()
+
+        self.assertTrue(request.finished)
+        self.assertEqual(channel.code, 200, channel.result)
+        room_entry = channel.json_body["rooms"]["join"][self.room_id]
+        timeline = room_entry["timeline"]["events"]
+        self.assertEqual(
+            [event["content"].get("body") for event in timeline], ["hello"]
+        )
+        self.assertEqual(room_entry["unread_notifications"]["notification_count"], 1)
+
+
+class ShardedSyncTestCase(unittest.HomeserverTestCase):
+    servlets = [
+        synapse.rest.admin.register_servlets,
+        login.register_servlets,
+        room.register_servlets,
+        sync.register_servlets,
+    ]
+
+    def default_config(self):
+        config = super().default_config()
+        config["sync_instances"] = ["sync1", "sync2"]
+        return config
+
+    def prepare(self, reactor, clock, hs):
+        self.notifier = hs.get_notifier()
+
+        self.user_id = self.register_user("kermit", "monkey")
+        self.tok = self.login("kermit", "monkey")
+        self.room_id = self.helper.create_room_as(self.user_id, tok=self.tok)
+
+    def test_drop_user_stream(self):
+        """Once a long-poll finishes, we stop tracking users who are handled
+        by other sync workers.
+        """
+        request, channel = self.make_request("GET", "/sync", access_token=self.tok)
+        self.render(request)
+        self.assertEqual(channel.code, 200, channel.result)
+
+        request, channel = self.make_request(
+            "GET",
+            "/sync?timeout=10000&since=%s" % (channel.json_body["next_batch"],),
+            access_token=self.tok,
+        )
+        request.render(self.resource)
+        self.pump()
+        self.assertFalse(request.finished)
+
+        self.assertTrue(
+            self.notifier.is_listening_for_room_event(
+                self.room_id, EventTypes.Message, None
+            )
+        )
+        self.assertTrue(
+            self.notifier.is_listening_for_room_event(
+                "!other:test", EventTypes.Member, self.user_id
+            )
+        )
+
+        self.helper.send(self.room_id, "hello", tok=self.tok)
+        self.pump()
+        self.assertTrue(request.finished)
+        self.assertEqual(channel.code, 200, channel.result)
+
+        self.assertNotIn(self.user_id, self.notifier.user_to_user_stream)
+        self.assertFalse(
+            self.notifier.is_listening_for_room_event(
+                self.room_id, EventTypes.Message, None
+            )
+        )
+        self.assertFalse(
+            self.notifier.is_listening_for_room_event(
+                "!other:test", EventTypes.Member, self.user_id
+            )
+        )
+
+    def test_skipped_event_notifies_pending_events(self):
+        """Skipping a new event as no one is listening for it still notifies the
+        events which were waiting for it to be persisted.
+        """
+        store = self.hs.get_datastore()
+        event_id = self.helper.send(self.room_id, "hello", tok=self.tok)["event_id"]
+        event = self.get_success(store.get_event(event_id))
+
+        on_new_event = Mock(side_effect=self.notifier.on_new_event)
+        self.notifier.on_new_event = on_new_event
+
+        # An event persisted by another instance ahead of an event still being
+        # persisted is held back.
+        max_token = store.get_room_max_token()
+        self.notifier.on_new_room_event(
+            event,
+            PersistedEventPosition("persister2", max_token.stream + 2),
+            max_token,
+        )
+        on_new_event.assert_not_called()
+
+        # It is notified once the earlier event is, even if that's skipped.
+        self.notifier.on_skipped_room_event(RoomStreamToken(None, max_token.stream + 2))
+        on_new_event.assert_called_once()
+        self.assertEqual(on_new_event.call_args[0][0], "room_key")
+        self.assertEqual(self.notifier.pending_new_room_events, [])
+
+
+class StreamedInitialSyncTestCase(unittest.HomeserverTestCase):
+    servlets = [
+        synapse.rest.admin.register_servlets,
+        login.register_servlets,
+        room.register_servlets,
+        sync.register_servlets,
+    ]
+
+    def default_config(self):
+        config = super().default_config()
+        config["stream_initial_sync_responses"] = True
+        return config
+
+    def prepare(self, reactor, clock, hs):
+        self.user_id = self.register_user("kermit", "monkey")
+        self.tok = self.login("kermit", "monkey")
+
+        self.user2 = self.register_user("kermit2", "monkey")
+        self.tok2 = self.login("kermit2", "monkey")
+
+    def _sync(self, url="/sync"):
+        request, channel = self.make_request("GET", url, access_token=self.tok)
+        self.render(request)
+        self.assertEqual(channel.code, 200, channel.result)
+        return channel.json_body
+
+    def test_no_rooms(self):
+        body = self._sync()
+
+        self.assertEqual(body["rooms"], {"join": {}, "invite": {}, "leave": {}})
+        self.assertIn("next_batch", body)
+        self.assertIn("account_data", body)
+
+    def test_error_after_streaming_started(self):
+        self.helper.create_room_as(self.user_id, tok=self.tok)
+
+        request, channel = self.make_request("GET", "/sync", access_token=self.tok)
+        channel.abortConnection = Mock()
+        with patch.object(
+            sync.SyncRestServlet, "encode_response", side_effect=Exception("boom")
+        ):
+            # The room had already been sent, so rather than sending an error
+            # the connection is closed, without finishing the request.
+            self.assertRaises(TimedOutException, self.render, request)
+
+        self.assertEqual(channel.code, 200)
+        self.assertTrue(channel.result["body"].startswith(b'{"rooms":{"join":{'))
+        self.assertNotIn(b"Internal server error", channel.result["body"])
+        channel.abortConnection.assert_called_once_with()
+
+    def test_rooms(self):
+        joined_room_ids = [
+            self.helper.create_room_as(self.user_id, tok=self.tok) for _ in range(3)
+        ]
+        self.helper.send(joined_room_ids[0], "hello", tok=self.tok)
+
+        left_room_id = self.helper.create_room_as(self.user_id, tok=self.tok)
+        self.helper.leave(left_room_id, self.user_id, tok=self.tok)
+
+        invited_room_id = self.helper.create_room_as(self.user2, tok=self.tok2)
+        self.helper.invite(invited_room_id, self.user2, self.user_id, tok=self.tok2)
+
+        body = self._sync(
+            "/sync?filter=%s"
+            % urllib.parse.quote(json.dumps({"room": {"include_leave": True}}))
+        )
+
+        self.assertCountEqual(body["rooms"]["join"], joined_room_ids)
+        timeline = body["rooms"]["join"][joined_room_ids[0]]["timeline"]["events"]
+        self.assertEqual(timeline[-1]["content"]["body"], "hello")
+        self.assertIn("unread_notifications", body["rooms"]["join"][joined_room_ids[0]])
+
+        self.assertEqual(list(body["rooms"]["invite"]), [invited_room_id])
+        self.assertEqual(list(body["rooms"]["leave"]), [left_room_id])
+
+        # An incremental sync from the token works as usual.
+        self.helper.send(joined_room_ids[1], "hello again", tok=self.tok)
+        body = self._sync("/sync?since=%s" % (body["next_batch"],))
+        self.assertEqual(list(body["rooms"]["join"]), [joined_room_ids[1]])
+
+
+class InitialSyncSnapshotsTestCase(unittest.HomeserverTestCase):
+    servlets = [
+        synapse.rest.admin.register_servlets,
+        login.register_servlets,
+        room.register_servlets,
+        sync.register_servlets,
+    ]
+
+    def default_config(self):
+        config = super().default_config()
+        config["initial_sync_snapshots"] = {"enabled": True, "min_rooms": 2}
+        return config
+
+    def prepare(self, reactor, clock, hs):
+        self.store = hs.get_datastore()
+
+        self.user_id = self.register_user("kermit", "monkey")
+        self.tok = self.login("kermit", "monkey")
+
+    def _sync(self, filter=None):
+        path = "/sync"
+        if filter is not None:
+            path += "?filter=" + urllib.parse.quote(json.dumps(filter))
+        request, channel = self.make_request("GET", path, access_token=self.tok)
+        self.render(request)
+        self.assertEqual(channel.code, 200, channel.result)
+
+        # Ages depend on when the events are serialized.
+        body = channel.json_body
+        for room_entry in body["rooms"]["join"].values():
+            for event in itertools.chain(
+                room_entry["timeline"]["events"], room_entry["state"]["events"]
+            ):
+                event["unsigned"].pop("age", None)
+
+        return body
+
+    def _get_rooms_in_snapshot(self):
+        rows = self.get_success(
+            self.store.db_pool.simple_select_list(
+                "initial_sync_snapshot_rooms",
+                {"user_id": self.user_id},
+                ("room_id", "entry"),
+            )
+        )
+        return {row["room_id"]: json.loads(row["entry"]) for row in rows}
+
+    def test_snapshot_reused(self):
+        room_ids = [
+            self.helper.create_room_as(self.user_id, tok=self.tok) for _ in range(3)
+        ]
+        self.helper.send(room_ids[0], "hello", tok=self.tok)
+
+        body = self._sync()
+        self.assertCountEqual(self._get_rooms_in_snapshot(), room_ids)
+
+        # A second initial sync gives the same rooms.
+        body2 = self._sync()
+        self.assertEqual(body2["rooms"], body["rooms"])
+
+        # New events in a room are picked up.
+        self.helper.send(room_ids[1], "hello again", tok=self.tok)
+        body3 = self._sync()
+        timeline = body3["rooms"]["join"][room_ids[1]]["timeline"]["events"]
+        self.assertEqual(timeline[-1]["content"]["body"], "hello again")
+        self.assertEqual(
+            body3["rooms"]["join"][room_ids[2]], body["rooms"]["join"][room_ids[2]]
+        )
+
+        snapshot_rooms = self._get_rooms_in_snapshot()
+        self.assertEqual(
+            snapshot_rooms[room_ids[1]]["timeline"][-1], timeline[-1]["event_id"]
+        )
+
+    def test_no_snapshot_for_few_rooms(self):
+        self.helper.create_room_as(self.user_id, tok=self.tok)
+        self._sync()
+
+        rows = self.get_success(
+            self.store.db_pool.simple_select_list(
+                "initial_sync_snapshots", {"user_id": self.user_id}, ("ts",)
+            )
+        )
+        self.assertEqual(rows, [])
+
+    def test_snapshot_rooms_purged(self):
+        room_ids = [
+            self.helper.create_room_as(self.user_id, tok=self.tok) for _ in range(2)
+        ]
+        self._sync()
+        self.assertCountEqual(self._get_rooms_in_snapshot(), room_ids)
+
+        self.helper.leave(room_ids[0], self.user_id, tok=self.tok)
+        self.get_success(self.hs.get_storage().purge_events.purge_room(room_ids[0]))
+        self.assertCountEqual(self._get_rooms_in_snapshot(), room_ids[1:])
+
+    def test_snapshots_deleted_on_deactivation(self):
+        for _ in range(2):
+            self.helper.create_room_as(self.user_id, tok=self.tok)
+        self._sync()
+        self.assertEqual(len(self._get_rooms_in_snapshot()), 2)
+
+        self.get_success(
+            self.hs.get_deactivate_account_handler().deactivate_account(
+                self.user_id, False
+            )
+        )
+
+        self.assertEqual(self._get_rooms_in_snapshot(), {})
+        rows = self.get_success(
+            self.store.db_pool.simple_select_list(
+                "initial_sync_snapshots", {"user_id": self.user_id}, ("ts",)
+            )
+        )
+        self.assertEqual(rows, [])
+
+    def test_snapshot_timeline_filtered(self):
+        other_user_id = self.register_user("other", "pass")
+        other_tok = self.login("other", "pass")
+
+        # A message sent before we joined the room, which we can see as the
+        # history is shared.
+        room_id = self.helper.create_room_as(other_user_id, tok=other_tok)
+        self.helper.send(room_id, "secret", tok=other_tok)
+        self.helper.join(room_id, self.user_id, tok=self.tok)
+        self.helper.create_room_as(self.user_id, tok=self.tok)
+
+        def get_message(body):
+            events = body["rooms"]["join"][room_id]["timeline"]["events"]
+            (message,) = [e for e in events if e["type"] == "m.room.message"]
+            return message
+
+        body = self._sync()
+        self.assertEqual(get_message(body)["content"]["body"], "secret")
+        self.assertIn(room_id, self._get_rooms_in_snapshot())
+
+        # Once the sender is erased, the message is pruned even though there
+        # have been no new events in the room.
+        self.get_success(self.store.mark_user_erased(other_user_id))
+        body = self._sync()
+        self.assertEqual(get_message(body)["content"], {})
+
+    def test_snapshot_lazy_loaded_members_cached(self):
+        other_user_id = self.register_user("other", "pass")
+        other_tok = self.login("other", "pass")
+
+        room_ids = [
+            self.helper.create_room_as(self.user_id, tok=self.tok) for _ in range(2)
+        ]
+        for room_id in room_ids:
+            self.helper.join(room_id, other_user_id, tok=other_tok)
+            self.helper.send(room_id, "hello", tok=other_tok)
+
+        filter = {"room": {"state": {"lazy_load_members": True}}}
+        self._sync(filter)
+        self.assertCountEqual(self._get_rooms_in_snapshot(), room_ids)
+
+        user = self.get_success(self.store.get_user_by_access_token(self.tok))
+        cache = self.hs.get_sync_handler().get_lazy_loaded_members_cache(
+            (self.user_id, user["device_id"])
+        )
+        cache.clear()
+        cache.set("@stale:test", "$stale")
+
+        # An initial sync served entirely from the snapshot clears the cache
+        # and fills it with the members it sent.
+        body = self._sync(filter)
+        self.assertIsNone(cache.get("@stale:test"))
+
+        sent_member_event_ids = [
+            event["event_id"]
+            for room_id in room_ids
+            for event in itertools.chain(
+                body["rooms"]["join"][room_id]["timeline"]["events"],
+                body["rooms"]["join"][room_id]["state"]["events"],
+            )
+            if event["type"] == EventTypes.Member
+            and event["state_key"] == other_user_id
+        ]
+        self.assertEqual(len(sent_member_event_ids), 2)
+        self.assertIn(cache.get(other_user_id), sent_member_event_ids)
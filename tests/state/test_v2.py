@@ -14,6 +14,7 @@
 # limitations under the License.
 
 import itertools
+import pickle
 from typing import List
 
 import attr
@@ -24,6 +25,7 @@ from synapse.api.constants import EventTypes, JoinRules, Membership
 from synapse.api.room_versions import RoomVersions
 from synapse.event_auth import auth_types_for_event
 from synapse.events import make_event_from_dict
+from synapse.state.pool import StateResolutionPool
 from synapse.state.v2 import lexicographical_topological_sort, resolve_events_with_store
 from synapse.types import EventID
 
@@ -161,6 +163,10 @@ INITIAL_EDGES = ["START", "IMZ", "IMC", "IMB", "IJR", "IPOWER", "IMA", "CREATE"]
 
 
 class StateTestCase(unittest.TestCase):
+    def get_pool(self):
+        """Returns the pool to pass to `resolve_events_with_store`, if any"""
+        return None
+
     def test_ban_vs_pl(self):
         events = [
             FakeEvent(
@@ -431,6 +437,7 @@ class StateTestCase(unittest.TestCase):
                     [state_at_event[n] for n in prev_events],
                     event_map=event_map,
                     state_res_store=TestStateResolutionStore(event_map),
+                    pool=self.get_pool(),
                 )
 
                 state_before = self.successResultOf(defer.ensureDeferred(state_d))
@@ -472,6 +479,119 @@ class StateTestCase(unittest.TestCase):
         self.assertEqual(expected_state, end_state)
 
 
+class FakeReactor:
+    def callFromThread(self, f, *args):
+        f(*args)
+
+
+class FakeProcessPool:
+    """Runs functions synchronously, but pickles the arguments and results as
+    multiprocessing would.
+    """
+
+    def __init__(self):
+        # The events sent with each call
+        self.sent_events = []
+
+    def apply_async(self, func, args, callback, error_callback):
+        args = pickle.loads(pickle.dumps(args))
+        self.sent_events.append(args[4])
+        try:
+            res = func(*args)
+        except Exception as e:
+            error_callback(e)
+        else:
+            # All the events needed should have been sent, so there is no need
+            # to fall back to resolving on the reactor.
+            assert res is not None, "State resolution in the pool fell back"
+            callback(pickle.loads(pickle.dumps(res)))
+
+
+class PooledStateTestCase(StateTestCase):
+    """Runs the state tests with the conflicted state resolved by a
+    `StateResolutionPool`.
+    """
+
+    def get_pool(self):
+        pool = StateResolutionPool(FakeReactor(), 1, min_conflicted_events=0)
+        pool._pool = FakeProcessPool()
+        return pool
+
+    def test_sends_needed_events_with_metadata(self):
+        create = FakeEvent(
+            id="CREATE",
+            sender=ALICE,
+            type=EventTypes.Create,
+            state_key="",
+            content={"creator": ALICE},
+        ).to_event([], [])
+        member = FakeEvent(
+            id="IMA",
+            sender=ALICE,
+            type=EventTypes.Member,
+            state_key=ALICE,
+            content=MEMBERSHIP_CONTENT_JOIN,
+        ).to_event(["CREATE"], ["CREATE"])
+        power = FakeEvent(
+            id="IPOWER",
+            sender=ALICE,
+            type=EventTypes.PowerLevels,
+            state_key="",
+            content={"users": {ALICE: 100}},
+        ).to_event(["CREATE", "IMA"], ["IMA"])
+        auth_events = ["CREATE", "IMA", "IPOWER"]
+        topic_1 = FakeEvent(
+            id="T1",
+            sender=ALICE,
+            type=EventTypes.Topic,
+            state_key="",
+            content={"topic": "1"},
+        ).to_event(auth_events, ["IPOWER"])
+        topic_2 = FakeEvent(
+            id="T2",
+            sender=ALICE,
+            type=EventTypes.Topic,
+            state_key="",
+            content={"topic": "2"},
+        ).to_event(auth_events, ["IPOWER"])
+        message = FakeEvent(
+            id="M", sender=ALICE, type=EventTypes.Message, state_key=None, content={},
+        ).to_event(auth_events, ["IPOWER"])
+        topic_1.internal_metadata.outlier = True
+
+        event_map = {
+            event.event_id: event
+            for event in (create, member, power, topic_1, topic_2, message)
+        }
+        state = {
+            (EventTypes.Create, ""): "CREATE",
+            (EventTypes.Member, ALICE): "IMA",
+            (EventTypes.PowerLevels, ""): "IPOWER",
+        }
+
+        pool = self.get_pool()
+        state_d = resolve_events_with_store(
+            FakeClock(),
+            ROOM_ID,
+            RoomVersions.V2.identifier,
+            [
+                {**state, (EventTypes.Topic, ""): "T1"},
+                {**state, (EventTypes.Topic, ""): "T2"},
+            ],
+            event_map=event_map,
+            state_res_store=TestStateResolutionStore(event_map),
+            pool=pool,
+        )
+        resolved_state = self.successResultOf(defer.ensureDeferred(state_d))
+        self.assertEqual(resolved_state[(EventTypes.Topic, "")], "T2")
+
+        # The message isn't needed, and the outlier flag is kept.
+        (sent_events,) = pool._pool.sent_events
+        metadata = {event_id: m for event_id, _, m, _ in sent_events}
+        self.assertEqual(set(metadata), {"CREATE", "IMA", "IPOWER", "T1", "T2"})
+        self.assertTrue(metadata["T1"]["outlier"])
+
+
 class LexicographicalTestCase(unittest.TestCase):
     def test_simple(self):
         graph = {"l": {"o"}, "m": {"n", "o"}, "n": {"o"}, "o": set(), "p": {"o"}}
@@ -647,7 +767,7 @@ class TestStateResolutionStore:
 
         return list(result)
 
-    def get_auth_chain_difference(self, auth_sets):
+    def get_auth_chain_difference(self, room_id, auth_sets):
         chains = [frozenset(self._get_auth_chain(a)) for a in auth_sets]
 
         common = set(chains[0]).intersection(*chains[1:])
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import itertools
+from typing import List, Set
+
+import synapse.rest.admin
+from synapse.api.constants import EventTypes
+from synapse.rest.client.v1 import login, room
+from synapse.storage.databases.main.events import _LinkMap
+
+from tests.unittest import HomeserverTestCase, TestCase
+
+
+class LinkMapTestCase(TestCase):
+    def test_simple(self):
+        """Basic tests for the LinkMap.
+        """
+        link_map = _LinkMap()
+
+        link_map.add_link((1, 1), (2, 1), new=False)
+        self.assertCountEqual(link_map.get_links_between(1, 2), [(1, 1)])
+        self.assertCountEqual(link_map.get_links_from((1, 1)), [(2, 1)])
+        self.assertCountEqual(link_map.get_additions(), [])
+        self.assertTrue(link_map.exists_path_from((1, 5), (2, 1)))
+        self.assertFalse(link_map.exists_path_from((1, 5), (2, 2)))
+        self.assertTrue(link_map.exists_path_from((1, 5), (1, 1)))
+        self.assertFalse(link_map.exists_path_from((1, 1), (1, 5)))
+
+        # Attempting to add a redundant link is ignored.
+        self.assertFalse(link_map.add_link((1, 4), (2, 1)))
+        self.assertCountEqual(link_map.get_links_between(1, 2), [(1, 1)])
+
+        # Adding new non-redundant links works
+        self.assertTrue(link_map.add_link((1, 3), (2, 3)))
+        self.assertCountEqual(link_map.get_links_between(1, 2), [(1, 1), (3, 3)])
+
+        self.assertTrue(link_map.add_link((2, 5), (1, 3)))
+        self.assertCountEqual(link_map.get_links_between(2, 1), [(5, 3)])
+        self.assertCountEqual(link_map.get_links_between(1, 2), [(1, 1), (3, 3)])
+
+        self.assertCountEqual(link_map.get_additions(), [(1, 3, 2, 3), (2, 5, 1, 3)])
+
+
+class EventChainStoreTestCase(HomeserverTestCase):
+    servlets = [
+        synapse.rest.admin.register_servlets_for_client_rest_resource,
+        room.register_servlets,
+        login.register_servlets,
+    ]
+
+    def prepare(self, reactor, clock, hs):
+        self.store = hs.get_datastore()
+
+        self.user_id = self.register_user("foo", "pass")
+        self.token = self.login("foo", "pass")
+
+        self.other_user_id = self.register_user("bar", "pass")
+        self.other_token = self.login("bar", "pass")
+
+        self.room_id = self.helper.create_room_as(self.user_id, tok=self.token)
+        self.helper.join(self.room_id, self.other_user_id, tok=self.other_token)
+
+        # Build up a bit of history so that we have multiple chains with more
+        # than one event in them.
+        for i in range(3):
+            self.helper.send_state(
+                self.room_id,
+                EventTypes.Topic,
+                {"topic": "topic %d" % (i,)},
+                tok=self.token,
+            )
+            self.helper.send_state(
+                self.room_id,
+                EventTypes.PowerLevels,
+                {"users": {self.user_id: 100, self.other_user_id: 50 + i}},
+                tok=self.token,
+            )
+            self.helper.send_state(
+                self.room_id,
+                EventTypes.Name,
+                {"name": "name %d" % (i,)},
+                tok=self.token,
+            )
+
+        self.helper.leave(self.room_id, self.other_user_id, tok=self.other_token)
+
+    def _get_state_event_ids(self) -> List[str]:
+        return self.get_success(
+            self.store.db_pool.simple_select_onecol(
+                table="state_events",
+                keyvalues={"room_id": self.room_id},
+                retcol="event_id",
+            )
+        )
+
+    def _assert_index_matches_graph_walk(self, event_ids: List[str]):
+        """Check that the chain cover queries agree with walking the auth graph.
+        """
+        for event_id in event_ids:
+            expected = self.get_success(
+                self.store.db_pool.runInteraction(
+                    "test", self.store._get_auth_chain_ids_txn, [event_id], False,
+                )
+            )
+            actual = self.get_success(
+                self.store.db_pool.runInteraction(
+                    "test",
+                    self.store._get_auth_chain_ids_using_cover_index_txn,
+                    self.room_id,
+                    [event_id],
+                    False,
+                )
+            )
+            self.assertCountEqual(actual, expected, event_id)
+
+        for a, b, c in itertools.combinations(event_ids[:8], 3):
+            state_sets = [{a}, {b, c}]  # type: List[Set[str]]
+            expected = self.get_success(
+                self.store.db_pool.runInteraction(
+                    "test", self.store._get_auth_chain_difference_txn, state_sets,
+                )
+            )
+            actual = self.get_success(
+                self.store.db_pool.runInteraction(
+                    "test",
+                    self.store._get_auth_chain_difference_using_cover_index_txn,
+                    self.room_id,
+                    state_sets,
+                )
+            )
+            self.assertSetEqual(actual, expected)
+
+    def test_new_room_is_indexed(self):
+        """Rooms created locally get a chain cover index as events are persisted.
+        """
+        room = self.get_success(self.store.get_room(self.room_id))
+        self.assertTrue(room["has_auth_chain_index"])
+
+        event_ids = self._get_state_event_ids()
+        chains = self.get_success(
+            self.store.db_pool.simple_select_many_batch(
+                table="event_auth_chains",
+                column="event_id",
+                iterable=event_ids,
+                retcols=("event_id", "chain_id", "sequence_number"),
+            )
+        )
+        self.assertCountEqual([row["event_id"] for row in chains], event_ids)
+
+        # Events with the same type/state_key should generally share a chain.
+        chain_ids = {row["chain_id"] for row in chains}
+        self.assertLess(len(chain_ids), len(event_ids))
+
+        self._assert_index_matches_graph_walk(event_ids)
+
+    def test_background_update(self):
+        """The background update rebuilds the index for rooms that lack one.
+        """
+        event_ids = self._get_state_event_ids()
+
+        # Wipe the index and pretend the room predates it.
+        def _wipe_txn(txn):
+            txn.execute("DELETE FROM event_auth_chains")
+            txn.execute("DELETE FROM event_auth_chain_links")
+            txn.execute("UPDATE rooms SET has_auth_chain_index = ?", (False,))
+
+        self.get_success(self.store.db_pool.runInteraction("wipe", _wipe_txn))
+
+        room = self.get_success(self.store.get_room(self.room_id))
+        self.assertFalse(room["has_auth_chain_index"])
+
+        self.store.db_pool.updates._all_done = False
+        self.get_success(
+            self.store.db_pool.simple_insert(
+                "background_updates",
+                {"update_name": "chain_cover", "progress_json": "{}"},
+            )
+        )
+
+        while not self.get_success(
+            self.store.db_pool.updates.has_completed_background_updates()
+        ):
+            self.get_success(
+                self.store.db_pool.updates.do_next_background_update(100), by=0.1
+            )
+
+        room = self.get_success(self.store.get_room(self.room_id))
+        self.assertTrue(room["has_auth_chain_index"])
+
+        self._assert_index_matches_graph_walk(event_ids)
@@ -153,6 +153,246 @@ class EventPushActionsStoreTestCase(tests.unittest.TestCase):
         yield _rotate(10)
         yield _assert_counts(1, 1)
 
+    @defer.inlineCallbacks
+    def test_running_counts(self):
+        room_id = "!foo:example.com"
+        user_id = "@user1235:example.com"
+
+        @defer.inlineCallbacks
+        def _assert_counts(stream, noitf_count, highlight_count):
+            """Checks the running counts match a count of the push actions"""
+            expected = {
+                "notify_count": noitf_count,
+                "unread_count": 0,
+                "highlight_count": highlight_count,
+            }
+
+            counts = yield defer.ensureDeferred(
+                self.store.db_pool.runInteraction(
+                    "",
+                    self.store._get_unread_counts_by_pos_txn,
+                    room_id,
+                    user_id,
+                    stream,
+                )
+            )
+            self.assertEquals(counts, expected)
+
+            counts = yield defer.ensureDeferred(
+                self.store.db_pool.runInteraction(
+                    "",
+                    self.store._get_unread_counts_for_rooms_txn,
+                    user_id,
+                    {room_id: "$test%i:example.com" % (stream,)},
+                )
+            )
+            self.assertEquals(counts, {room_id: expected})
+
+            row = yield defer.ensureDeferred(
+                self.store.db_pool.simple_select_one(
+                    table="event_push_counts",
+                    keyvalues={"room_id": room_id, "user_id": user_id},
+                    retcols=("stream_ordering", "notif_count", "highlight_count"),
+                )
+            )
+            self.assertEquals(
+                row,
+                {
+                    "stream_ordering": stream,
+                    "notif_count": noitf_count,
+                    "highlight_count": highlight_count,
+                },
+            )
+
+        @defer.inlineCallbacks
+        def _inject_event(stream):
+            event_id = "$test%i:example.com" % (stream,)
+            yield defer.ensureDeferred(
+                self.store.db_pool.simple_insert(
+                    table="events",
+                    values={
+                        "stream_ordering": stream,
+                        "topological_ordering": stream,
+                        "event_id": event_id,
+                        "type": "m.room.message",
+                        "room_id": room_id,
+                        "processed": True,
+                        "outlier": False,
+                        "depth": stream,
+                    },
+                )
+            )
+            return event_id
+
+        @defer.inlineCallbacks
+        def _inject_actions(stream, action):
+            event = Mock()
+            event.room_id = room_id
+            event.event_id = yield _inject_event(stream)
+            event.internal_metadata.stream_ordering = stream
+            event.depth = stream
+
+            yield defer.ensureDeferred(
+                self.store.add_push_actions_to_staging(
+                    event.event_id, {user_id: action}, False,
+                )
+            )
+            yield defer.ensureDeferred(
+                self.store.db_pool.runInteraction(
+                    "",
+                    self.persist_events_store._set_push_actions_for_event_and_users_txn,
+                    [(event, None)],
+                    [(event, None)],
+                )
+            )
+
+        def _mark_read(stream):
+            return defer.ensureDeferred(
+                self.store.db_pool.runInteraction(
+                    "",
+                    self.store._remove_old_push_actions_before_txn,
+                    room_id,
+                    user_id,
+                    stream,
+                )
+            )
+
+        def _redact(stream):
+            return defer.ensureDeferred(
+                self.store.db_pool.runInteraction(
+                    "",
+                    self.persist_events_store._remove_push_actions_for_event_id_txn,
+                    room_id,
+                    "$test%i:example.com" % (stream,),
+                )
+            )
+
+        # The user's counts start from their join until they send a receipt.
+        join_event_id = yield _inject_event(0)
+        yield defer.ensureDeferred(
+            self.store.db_pool.simple_insert(
+                table="local_current_membership",
+                values={
+                    "room_id": room_id,
+                    "user_id": user_id,
+                    "event_id": join_event_id,
+                    "membership": "join",
+                },
+            )
+        )
+
+        # Reading the counts doesn't start running counts...
+        counts = yield defer.ensureDeferred(
+            self.store.get_unread_event_push_actions_by_room_for_user(
+                room_id, user_id, None
+            )
+        )
+        self.assertEquals(
+            counts, {"notify_count": 0, "unread_count": 0, "highlight_count": 0}
+        )
+        row = yield defer.ensureDeferred(
+            self.store.db_pool.simple_select_one(
+                table="event_push_counts",
+                keyvalues={"room_id": room_id, "user_id": user_id},
+                retcols=("stream_ordering",),
+                allow_none=True,
+            )
+        )
+        self.assertIsNone(row)
+
+        # ... but adding push actions for the user does.
+        yield _inject_actions(1, PlAIN_NOTIF)
+        yield _assert_counts(0, 1, 0)
+
+        # New actions are added to the running counts.
+        yield _inject_actions(2, PlAIN_NOTIF)
+        yield _inject_actions(3, HIGHLIGHT)
+        yield _assert_counts(0, 3, 1)
+
+        # Receipts restart them.
+        yield _mark_read(2)
+        yield _assert_counts(2, 1, 1)
+
+        # Redacting an event which has been read doesn't change them, but
+        # redacting one which hasn't does.
+        yield _inject_actions(4, PlAIN_NOTIF)
+        yield _redact(1)
+        yield _assert_counts(2, 2, 1)
+        yield _redact(3)
+        yield _assert_counts(2, 1, 0)
+
+    @defer.inlineCallbacks
+    def test_running_counts_started_for_several_events(self):
+        """Running counts started while persisting several events with push
+        actions for the user count each event once.
+        """
+        room_id = "!foo:example.com"
+        user_id = "@user1235:example.com"
+
+        events = []
+        for stream in range(3):
+            event = Mock()
+            event.room_id = room_id
+            event.event_id = "$test%i:example.com" % (stream,)
+            event.internal_metadata.stream_ordering = stream
+            event.depth = stream
+            events.append((event, None))
+
+            yield defer.ensureDeferred(
+                self.store.db_pool.simple_insert(
+                    table="events",
+                    values={
+                        "stream_ordering": stream,
+                        "topological_ordering": stream,
+                        "event_id": event.event_id,
+                        "type": "m.room.message",
+                        "room_id": room_id,
+                        "processed": True,
+                        "outlier": False,
+                        "depth": stream,
+                    },
+                )
+            )
+
+        # The user joined with the first event.
+        yield defer.ensureDeferred(
+            self.store.db_pool.simple_insert(
+                table="local_current_membership",
+                values={
+                    "room_id": room_id,
+                    "user_id": user_id,
+                    "event_id": "$test0:example.com",
+                    "membership": "join",
+                },
+            )
+        )
+
+        for event, _ in events[1:]:
+            yield defer.ensureDeferred(
+                self.store.add_push_actions_to_staging(
+                    event.event_id, {user_id: PlAIN_NOTIF}, False,
+                )
+            )
+        yield defer.ensureDeferred(
+            self.store.db_pool.runInteraction(
+                "",
+                self.persist_events_store._set_push_actions_for_event_and_users_txn,
+                events[1:],
+                events[1:],
+            )
+        )
+
+        row = yield defer.ensureDeferred(
+            self.store.db_pool.simple_select_one(
+                table="event_push_counts",
+                keyvalues={"room_id": room_id, "user_id": user_id},
+                retcols=("stream_ordering", "notif_count", "highlight_count"),
+            )
+        )
+        self.assertEquals(
+            row, {"stream_ordering": 0, "notif_count": 2, "highlight_count": 0}
+        )
+
     @defer.inlineCallbacks
     def test_find_first_stream_ordering_after_ts(self):
         def add_event(so, ts):
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from mock import Mock
+
+from twisted.internet import defer
+
+from synapse.logging.context import make_deferred_yieldable
+from synapse.storage.persist_events import _EventPeristenceQueue
+
+from tests import unittest
+
+
+class EventPersistenceQueueTestCase(unittest.TestCase):
+    def setUp(self):
+        # The batches passed to the callback, and the deferreds to complete them
+        self.batches = []
+        self.batch_deferreds = []
+
+    def _callback(self, item):
+        self.batches.append((item.events_and_contexts, item.backfilled))
+        d = defer.Deferred()
+        self.batch_deferreds.append(d)
+        return d
+
+    def _add(self, queue, room_id, events, backfilled=False):
+        d = queue.add_to_queue(
+            room_id, [(e, None) for e in events], backfilled=backfilled
+        )
+        queue.handle_queue(room_id, self._callback)
+        return d
+
+    def test_no_cross_room_batching(self):
+        queue = _EventPeristenceQueue()
+
+        d1 = self._add(queue, "!a:test", ["a1"])
+        d2 = self._add(queue, "!b:test", ["b1"])
+
+        # Each room is persisted separately.
+        self.assertEqual(
+            self.batches, [([("a1", None)], False), ([("b1", None)], False)]
+        )
+
+        self.batch_deferreds[0].callback("ret")
+        self.assertEqual(self.successResultOf(d1), "ret")
+        self.assertNoResult(d2)
+
+    def test_cross_room_batching(self):
+        queue = _EventPeristenceQueue(max_batch_events=10)
+
+        d1 = self._add(queue, "!a:test", ["a1"])
+        self.assertEqual(self.batches, [([("a1", None)], False)])
+
+        # Queue up more events while the first batch is being persisted.
+        d2 = self._add(queue, "!c:test", ["c1"])
+        d3 = self._add(queue, "!a:test", ["a2"])
+        d4 = self._add(queue, "!b:test", ["b1"])
+        d5 = self._add(queue, "!c:test", ["c2"])
+        self.assertEqual(len(self.batches), 1)
+
+        # Once the first batch completes, everything queued up in the meantime
+        # is persisted together.
+        self.batch_deferreds[0].callback("ret1")
+        self.assertEqual(self.successResultOf(d1), "ret1")
+        self.assertEqual(
+            self.batches[1],
+            ([("c1", None), ("c2", None), ("a2", None), ("b1", None)], False),
+        )
+
+        self.batch_deferreds[1].callback("ret2")
+        for d in (d2, d3, d4, d5):
+            self.assertEqual(self.successResultOf(d), "ret2")
+
+        # The emptied queues have been removed.
+        self.assertEqual(len(self.batches), 2)
+        self.assertEqual(queue._event_persist_queues, {})
+
+    def test_batch_combines_queues(self):
+        queue = _EventPeristenceQueue(max_batch_events=3)
+
+        # Queue up events without starting to handle the queues, as happens
+        # when a single call persists events for several rooms.
+        d1 = queue.add_to_queue("!a:test", [("a1", None)], backfilled=False)
+        d2 = queue.add_to_queue("!b:test", [("b1", None)], backfilled=False)
+        d3 = queue.add_to_queue("!c:test", [("c1", None)], backfilled=True)
+        d4 = queue.add_to_queue(
+            "!d:test", [("d1", None), ("d2", None)], backfilled=False
+        )
+        d5 = queue.add_to_queue("!e:test", [("e1", None)], backfilled=False)
+        d6 = queue.add_to_queue("!a:test", [("a2", None)], backfilled=True)
+
+        for room_id in ("!a:test", "!b:test", "!c:test", "!d:test", "!e:test"):
+            queue.handle_queue(room_id, self._callback)
+
+        # A, B and E fit in one batch, C is backfilled and D is too big.
+        self.assertEqual(
+            self.batches, [([("a1", None), ("b1", None), ("e1", None)], False)]
+        )
+
+        self.batch_deferreds[0].callback("ret")
+        for d in (d1, d2, d5):
+            self.assertEqual(self.successResultOf(d), "ret")
+        self.assertNoResult(d3)
+        self.assertNoResult(d4)
+        self.assertNoResult(d6)
+
+        # The backfilled events for A and C are persisted together, and then D.
+        self.assertEqual(self.batches[1], ([("c1", None), ("a2", None)], True))
+        self.batch_deferreds[1].callback("ret")
+        self.assertEqual(self.batches[2], ([("d1", None), ("d2", None)], False))
+        self.batch_deferreds[2].callback("ret")
+        for d in (d3, d4, d6):
+            self.assertEqual(self.successResultOf(d), "ret")
+        self.assertEqual(len(self.batches), 3)
+
+    def test_batch_failure(self):
+        queue = _EventPeristenceQueue(max_batch_events=3)
+
+        d1 = queue.add_to_queue("!a:test", [("a1", None)], backfilled=False)
+        d2 = queue.add_to_queue("!b:test", [("b1", None)], backfilled=False)
+        queue.handle_queue("!a:test", self._callback)
+        self.assertEqual(len(self.batches), 1)
+
+        # When the batch fails, each room's events are persisted on their own...
+        self.batch_deferreds[0].errback(Exception("boom"))
+        self.assertEqual(self.batches[1], ([("a1", None)], False))
+        self.batch_deferreds[1].errback(Exception("boom"))
+        self.assertEqual(self.batches[2], ([("b1", None)], False))
+        self.batch_deferreds[2].callback("ret")
+
+        # ... so only the rooms whose events still fail get the error.
+        self.failureResultOf(d1, Exception)
+        self.assertEqual(self.successResultOf(d2), "ret")
+
+        # ... and the queues can be handled again.
+        self._add(queue, "!b:test", ["b2"])
+        self.assertEqual(self.batches[-1], ([("b2", None)], False))
+
+
+class PersistEventsBatchingTestCase(unittest.HomeserverTestCase):
+    def prepare(self, reactor, clock, hs):
+        self.persistence = hs.get_storage().persistence
+
+        # The batches passed to _persist_events, and the deferreds to complete
+        # them
+        self.batches = []
+        self.batch_deferreds = []
+
+        def _persist_events(events_and_contexts, backfilled=False):
+            self.batches.append([e.event_id for e, _ in events_and_contexts])
+            d = defer.Deferred()
+            self.batch_deferreds.append(d)
+            return make_deferred_yieldable(d)
+
+        self.persistence._persist_events = _persist_events
+
+    def _persist_event(self, room_id, event_id):
+        event = Mock(room_id=room_id, event_id=event_id)
+        return defer.ensureDeferred(self.persistence.persist_event(event, Mock()))
+
+    @unittest.override_config({"persist_events_batch_size": 10})
+    def test_persist_event_batches_rooms(self):
+        d1 = self._persist_event("!a:test", "$a1")
+        self.assertEqual(self.batches, [["$a1"]])
+
+        # Events persisted by separate calls while the first batch is being
+        # written are persisted together.
+        d2 = self._persist_event("!b:test", "$b1")
+        d3 = self._persist_event("!c:test", "$c1")
+        d4 = self._persist_event("!a:test", "$a2")
+        self.assertEqual(len(self.batches), 1)
+
+        self.batch_deferreds[0].callback(None)
+        self.successResultOf(d1)
+        self.assertEqual(self.batches[1], ["$b1", "$c1", "$a2"])
+
+        self.batch_deferreds[1].callback(None)
+        for d in (d2, d3, d4):
+            self.successResultOf(d)
+
+        self.assertEqual(len(self.batches), 2)
+        queue = self.persistence._event_persist_queue
+        self.assertEqual(queue._event_persist_queues, {})
+
+    def test_persist_event_without_batching(self):
+        d1 = self._persist_event("!a:test", "$a1")
+        d2 = self._persist_event("!b:test", "$b1")
+        d3 = self._persist_event("!a:test", "$a2")
+
+        # Each room is persisted separately.
+        self.assertEqual(self.batches, [["$a1"], ["$b1"]])
+
+        self.batch_deferreds[0].callback(None)
+        self.successResultOf(d1)
+        self.assertEqual(self.batches[2], ["$a2"])
+
+        self.batch_deferreds[1].callback(None)
+        self.batch_deferreds[2].callback(None)
+        self.successResultOf(d2)
+        self.successResultOf(d3)
+        queue = self.persistence._event_persist_queue
+        self.assertEqual(queue._event_persist_queues, {})
@@ -23,6 +23,7 @@ from twisted.internet import defer
 
 from synapse.api.constants import EventTypes, Membership
 from synapse.api.room_versions import RoomVersions
+from synapse.storage.databases.main.events_worker import _EventJsonCacheEntry
 from synapse.types import RoomID, UserID
 
 from tests import unittest
@@ -442,3 +443,56 @@ class RedactionTestCase(unittest.HomeserverTestCase):
         self.get_success(
             self.store.get_event(redaction_event.event_id, allow_none=True)
         )
+
+
+class JsonEventCacheRedactionTestCase(RedactionTestCase):
+    """Runs the redaction tests with the events held in the event cache as JSON."""
+
+    def make_homeserver(self, reactor, clock):
+        config = self.default_config()
+        config["redaction_retention_period"] = "30d"
+        config["event_cache_json"] = True
+        config["event_cache_size"] = 100
+        return self.setup_test_homeserver(
+            resource_for_federation=Mock(), http_client=None, config=config
+        )
+
+    def test_json_cache_entries(self):
+        self.get_success(
+            self.inject_room_member(self.room1, self.u_alice, Membership.JOIN)
+        )
+        msg_event = self.get_success(self.inject_message(self.room1, self.u_alice, "t"))
+
+        # The event is cached as JSON when it's persisted and when it's fetched
+        # from the database.
+        for _ in range(2):
+            event = self.get_success(self.store.get_event(msg_event.event_id))
+
+            entry = self.store._get_event_cache.get((msg_event.event_id,))
+            self.assertIsInstance(entry, _EventJsonCacheEntry)
+
+            self.assertEqual(
+                event.get_pdu_json(), json.loads(json.dumps(msg_event.get_pdu_json()))
+            )
+            self.assertEqual(
+                event.internal_metadata.stream_ordering,
+                msg_event.internal_metadata.stream_ordering,
+            )
+
+            self.store._get_event_cache.invalidate_all()
+
+        # Each read gets a new event object.
+        event2 = self.get_success(self.store.get_event(msg_event.event_id))
+        self.assertIsNot(event, event2)
+
+        # Once redacted, the event object is cached instead.
+        self.get_success(
+            self.inject_redaction(self.room1, msg_event.event_id, self.u_alice, "r")
+        )
+        event = self.get_success(self.store.get_event(msg_event.event_id))
+        self.assertEqual(event.content, {})
+
+        self.store._get_event_cache.invalidate_all()
+        self.get_success(self.store.get_event(msg_event.event_id))
+        entry = self.store._get_event_cache.get((msg_event.event_id,))
+        self.assertNotIsInstance(entry, _EventJsonCacheEntry)
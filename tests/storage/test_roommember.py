@@ -170,6 +170,66 @@ class RoomMemberStoreTestCase(unittest.HomeserverTestCase):
         )
         self.assertEqual(users.keys(), {self.u_alice, self.u_bob})
 
+    def _get_room_joined_hosts(self, room_id):
+        rows = self.get_success(
+            self.store.db_pool.simple_select_list(
+                table="room_joined_hosts",
+                keyvalues={"room_id": room_id},
+                retcols=("host", "member_count"),
+            )
+        )
+        return {row["host"]: row["member_count"] for row in rows}
+
+    def test_current_hosts_in_room(self):
+        self.store._room_joined_hosts_up_to_date = True
+
+        room = self.helper.create_room_as(self.u_alice, tok=self.t_alice)
+        self.inject_room_member(room, self.u_bob, Membership.JOIN)
+        self.inject_room_member(room, self.u_charlie.to_string(), Membership.JOIN)
+
+        self.assertEqual(self._get_room_joined_hosts(room), {"test": 2, "elsewhere": 1})
+        hosts = self.get_success(self.store.get_current_hosts_in_room(room))
+        self.assertEqual(hosts, {"test", "elsewhere"})
+
+        # Bob leaving doesn't change the servers in the room, but Charlie
+        # leaving does.
+        self.inject_room_member(room, self.u_bob, Membership.LEAVE)
+        self.assertEqual(self._get_room_joined_hosts(room), {"test": 1, "elsewhere": 1})
+
+        self.inject_room_member(room, self.u_charlie.to_string(), Membership.LEAVE)
+        self.assertEqual(self._get_room_joined_hosts(room), {"test": 1})
+        hosts = self.get_success(self.store.get_current_hosts_in_room(room))
+        self.assertEqual(hosts, {"test"})
+
+    def test_room_joined_hosts_background_update(self):
+        room = self.helper.create_room_as(self.u_alice, tok=self.t_alice)
+        self.inject_room_member(room, self.u_bob, Membership.JOIN)
+        self.inject_room_member(room, self.u_charlie.to_string(), Membership.JOIN)
+
+        # Clear out the table and fill it in again with the background update.
+        self.get_success(
+            self.store.db_pool.simple_delete(
+                table="room_joined_hosts", keyvalues={"room_id": room}, desc="clear"
+            )
+        )
+        self.get_success(
+            self.store.db_pool.simple_upsert(
+                table="background_updates",
+                keyvalues={"update_name": "room_joined_hosts"},
+                values={"progress_json": "{}"},
+            )
+        )
+        self.store.db_pool.updates._all_done = False
+
+        while not self.get_success(
+            self.store.db_pool.updates.has_completed_background_updates()
+        ):
+            self.get_success(
+                self.store.db_pool.updates.do_next_background_update(100), by=0.1
+            )
+
+        self.assertEqual(self._get_room_joined_hosts(room), {"test": 2, "elsewhere": 1})
+
 
 class CurrentStateMembershipUpdateTestCase(unittest.HomeserverTestCase):
     def prepare(self, reactor, clock, homeserver):
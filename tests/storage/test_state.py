@@ -118,6 +118,54 @@ class StateStoreTestCase(tests.unittest.TestCase):
 
         self.assertEqual({ev.event_id for ev in state_list}, {e1.event_id, e2.event_id})
 
+    @defer.inlineCallbacks
+    def test_get_state_ids_for_events_bulk(self):
+        e1 = yield self.inject_state_event(
+            self.room, self.u_alice, EventTypes.Create, "", {}
+        )
+        e2 = yield self.inject_state_event(
+            self.room, self.u_alice, EventTypes.Name, "", {"name": "test room"}
+        )
+        e3 = yield self.inject_state_event(
+            self.room,
+            self.u_alice,
+            EventTypes.Member,
+            self.u_alice.to_string(),
+            {"membership": Membership.JOIN},
+        )
+
+        # The same event can be requested with different filters.
+        state_maps = yield defer.ensureDeferred(
+            self.storage.state.get_state_ids_for_events_bulk(
+                [
+                    (e2.event_id, StateFilter.all()),
+                    (e3.event_id, StateFilter.all()),
+                    (e3.event_id, StateFilter.from_types([(EventTypes.Name, "")])),
+                    (e3.event_id, StateFilter.from_lazy_load_member_list([])),
+                ]
+            )
+        )
+
+        self.assertEqual(
+            state_maps,
+            [
+                {
+                    (EventTypes.Create, ""): e1.event_id,
+                    (EventTypes.Name, ""): e2.event_id,
+                },
+                {
+                    (EventTypes.Create, ""): e1.event_id,
+                    (EventTypes.Name, ""): e2.event_id,
+                    (EventTypes.Member, self.u_alice.to_string()): e3.event_id,
+                },
+                {(EventTypes.Name, ""): e2.event_id},
+                {
+                    (EventTypes.Create, ""): e1.event_id,
+                    (EventTypes.Name, ""): e2.event_id,
+                },
+            ],
+        )
+
     @defer.inlineCallbacks
     def test_get_state_for_event(self):
 
@@ -19,7 +19,12 @@ from twisted.web.resource import Resource
 
 from synapse.api.errors import Codes, RedirectException, SynapseError
 from synapse.config.server import parse_listener_def
-from synapse.http.server import DirectServeHtmlResource, JsonResource, OptionsResource
+from synapse.http.server import (
+    DirectServeHtmlResource,
+    JsonResource,
+    JsonStreamWriter,
+    OptionsResource,
+)
 from synapse.http.site import SynapseSite
 from synapse.logging.context import make_deferred_yieldable
 from synapse.util import Clock
@@ -180,6 +185,49 @@ class JsonResourceTests(unittest.TestCase):
         self.assertNotIn("body", channel.result)
 
 
+class JsonStreamWriterTests(unittest.TestCase):
+    def setUp(self):
+        self.reactor = ThreadedMemoryReactorClock()
+        self.hs_clock = Clock(self.reactor)
+        self.homeserver = setup_test_homeserver(
+            self.addCleanup, http_client=None, clock=self.hs_clock, reactor=self.reactor
+        )
+
+    def test_backpressure(self):
+        """
+        Writes wait while the producer is paused.
+        """
+        written = []
+
+        async def _callback(request, **kwargs):
+            writer = JsonStreamWriter(request, 200)
+            writer.pauseProducing()
+
+            await writer.write(b'{"a":')
+            written.append(1)
+            await writer.write(b"1}")
+            written.append(2)
+            writer.finish()
+
+        res = JsonResource(self.homeserver)
+        res.register_paths(
+            "GET", [re.compile("^/_matrix/foo$")], _callback, "test_servlet"
+        )
+
+        request, channel = make_request(self.reactor, b"GET", b"/_matrix/foo")
+        request.render(res)
+        self.reactor.advance(0)
+
+        self.assertEqual(channel.result["code"], b"200")
+        self.assertEqual(channel.result["body"], b'{"a":')
+        self.assertEqual(written, [])
+
+        channel._producer.resumeProducing()
+        self.assertEqual(written, [1, 2])
+        self.assertTrue(request.finished)
+        self.assertEqual(channel.json_body, {"a": 1})
+
+
 class OptionsResourceTests(unittest.TestCase):
     def setUp(self):
         self.reactor = ThreadedMemoryReactorClock()
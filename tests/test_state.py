@@ -717,3 +717,70 @@ class StateTestCase(unittest.TestCase):
 
         result = yield defer.ensureDeferred(self.state.compute_event_context(event))
         return result
+
+
+class IncrementalStateResolutionTestCase(unittest.TestCase):
+    def setUp(self):
+        hs = Mock(spec_set=["config", "get_clock"])
+        hs.config = default_config("tesths", True)
+        hs.config.incremental_state_resolution = True
+        hs.get_clock.return_value = MockClock()
+
+        self.handler = StateResolutionHandler(hs)
+
+        # Record the state sets we're asked to resolve, and resolve them by
+        # taking the first event ID for each key.
+        self.resolved_state_sets = []
+
+        async def resolve_events_with_store(
+            room_id, room_version, state_sets, event_map, state_res_store
+        ):
+            self.resolved_state_sets.append(state_sets)
+            new_state = {}
+            for state_set in state_sets:
+                for key, event_id in state_set.items():
+                    new_state.setdefault(key, event_id)
+            return new_state
+
+        self.handler.resolve_events_with_store = resolve_events_with_store
+
+    def _resolve(self, state_groups_ids):
+        return self.successResultOf(
+            defer.ensureDeferred(
+                self.handler.resolve_state_groups(
+                    "!room:test",
+                    RoomVersions.V6.identifier,
+                    state_groups_ids,
+                    None,
+                    None,
+                )
+            )
+        )
+
+    def test_incremental(self):
+        group_a = {("m.room.create", ""): "$create", ("m.room.name", ""): "$name_a"}
+        group_b = {("m.room.create", ""): "$create", ("m.room.name", ""): "$name_b"}
+        group_c = {("m.room.create", ""): "$create", ("m.room.topic", ""): "$topic"}
+
+        resolved_ab = self._resolve({1: group_a, 2: group_b})
+        self.assertEqual(self.resolved_state_sets[-1], [group_a, group_b])
+
+        # Resolving all three groups starts from the resolution of the first two.
+        resolved_abc = self._resolve({1: group_a, 2: group_b, 3: group_c})
+        self.assertEqual(self.resolved_state_sets[-1], [resolved_ab.state, group_c])
+        self.assertEqual(
+            dict(resolved_abc.state),
+            {
+                ("m.room.create", ""): "$create",
+                ("m.room.name", ""): "$name_a",
+                ("m.room.topic", ""): "$topic",
+            },
+        )
+
+    def test_no_resolved_subset(self):
+        group_a = {("m.room.name", ""): "$name_a"}
+        group_b = {("m.room.name", ""): "$name_b"}
+        group_c = {("m.room.topic", ""): "$topic"}
+
+        self._resolve({1: group_a, 2: group_b, 3: group_c})
+        self.assertEqual(self.resolved_state_sets[-1], [group_a, group_b, group_c])
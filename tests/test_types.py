@@ -14,7 +14,13 @@
 # limitations under the License.
 
 from synapse.api.errors import SynapseError
-from synapse.types import GroupID, RoomAlias, UserID, map_username_to_mxid_localpart
+from synapse.types import (
+    FrozenStateMap,
+    GroupID,
+    RoomAlias,
+    UserID,
+    map_username_to_mxid_localpart,
+)
 
 from tests import unittest
 
@@ -103,3 +109,78 @@ class MapUsernameTestCase(unittest.TestCase):
         self.assertEqual(
             map_username_to_mxid_localpart("têst".encode("utf-8")), "t=c3=aast"
         )
+
+
+class FrozenStateMapTestCase(unittest.TestCase):
+    STATE = {
+        ("m.room.create", ""): "$Bm5N2Gx1sgVcBQvd5RFbuQX4H8YjxLvjHUrbcmNmSuQ",
+        (
+            "m.room.member",
+            "@alice:test",
+        ): "$nnNtC5y6rzCUv-GoA_0-ucYjdKiiyM4Rw9WUSdqf8I4",
+        ("m.room.member", "@bob:test"): "$yhQ9s0Qw5GJaAaJvS8Oq_1OVHbk3CuTWo0yq2GXxYiU",
+        # Event IDs from room versions 1 and 2, and the standard base64 event
+        # IDs of room version 3, can't be packed.
+        ("m.room.name", ""): "$abcdef:test",
+        ("m.room.topic", ""): "$V8bM+mCzhlxWYpIyWWCF/RDoU7Ubnfv3HqyqiRJmHj8",
+        # These are valid base64, and line up if joined together.
+        ("m.room.avatar", ""): "$" + "a" * 42,
+        ("m.room.canonical_alias", ""): "$" + "a" * 44,
+    }
+
+    def test_mapping(self):
+        state = FrozenStateMap(self.STATE)
+
+        self.assertEqual(len(state), len(self.STATE))
+        self.assertEqual(dict(state), self.STATE)
+        self.assertEqual(dict(state.items()), self.STATE)
+        self.assertCountEqual(state.values(), self.STATE.values())
+        self.assertEqual(state, self.STATE)
+        self.assertEqual(state, FrozenStateMap(dict(self.STATE)))
+
+        for key, event_id in self.STATE.items():
+            self.assertIn(key, state)
+            self.assertEqual(state[key], event_id)
+
+        self.assertNotIn(("m.room.member", "@carol:test"), state)
+        self.assertIsNone(state.get(("m.room.member", "@carol:test")))
+        self.assertNotIn("m.room.create", state)
+
+    def test_evolve(self):
+        state = FrozenStateMap(self.STATE)
+
+        changes = {
+            (
+                "m.room.member",
+                "@bob:test",
+            ): "$ZGXaW7XtRe5BzbbLtcYkl69s3IHvmwt0xHxTLDkqJVA",
+            ("m.room.member", "@carol:test"): "$carol:test",
+            ("m.room.power_levels", ""): "$9W8Rhk2UqTXyNt4OXfqCijKCJAkjdfy7ZRPhrD1Tbls",
+        }
+        removed = [("m.room.name", ""), ("m.room.member", "@dave:test")]
+        new_state = state.evolve(changes, removed)
+
+        expected = dict(self.STATE)
+        del expected[("m.room.name", "")]
+        expected.update(changes)
+        self.assertEqual(dict(new_state.items()), expected)
+        self.assertEqual(new_state, FrozenStateMap(expected))
+
+        # The original is unchanged.
+        self.assertEqual(dict(state.items()), self.STATE)
+
+        self.assertIs(state.evolve({}), state)
+
+    def test_split_type(self):
+        state = FrozenStateMap(self.STATE)
+
+        members, others = state.split_type("m.room.member")
+
+        self.assertEqual(
+            dict(members.items()),
+            {k: v for k, v in self.STATE.items() if k[0] == "m.room.member"},
+        )
+        self.assertEqual(
+            dict(others.items()),
+            {k: v for k, v in self.STATE.items() if k[0] != "m.room.member"},
+        )
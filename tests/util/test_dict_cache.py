@@ -14,6 +14,7 @@
 # limitations under the License.
 
 
+from synapse.types import FrozenStateMap
 from synapse.util.caches.dictionary_cache import DictionaryCache
 
 from tests import unittest
@@ -89,3 +90,30 @@ class DictCacheTestCase(unittest.TestCase):
             },
             c.value,
         )
+
+    def test_immutable_value(self):
+        key = "test_immutable_value"
+
+        seq = self.cache.sequence
+        test_value = FrozenStateMap({("m.room.create", ""): "$create:test"})
+        self.cache.update(seq, key, test_value)
+
+        c = self.cache.get(key)
+        self.assertTrue(c.full)
+        self.assertEqual({("m.room.create", ""): "$create:test"}, c.value)
+
+        # Later partial updates are merged into a copy of the value.
+        seq = self.cache.sequence
+        self.cache.update(
+            seq,
+            key,
+            {("m.room.name", ""): "$name:test"},
+            fetched_keys={("m.room.name", "")},
+        )
+
+        c = self.cache.get(key)
+        self.assertEqual(
+            {("m.room.create", ""): "$create:test", ("m.room.name", ""): "$name:test"},
+            c.value,
+        )
+        self.assertEqual(dict(test_value), {("m.room.create", ""): "$create:test"})
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pickle
+
+from canonicaljson import encode_canonical_json
+
+from synapse.util import json_encoder
+from synapse.util.frozenutils import ImmutableDict, freeze, unfreeze
+
+from tests import unittest
+
+
+class ImmutableDictTestCase(unittest.TestCase):
+    def setUp(self):
+        self.raw = {"a": {"b": [1, {"c": 2}]}, "d": "e"}
+        self.frozen = ImmutableDict(self.raw)
+
+    def test_nested_values_frozen(self):
+        self.assertIsInstance(self.frozen["a"], ImmutableDict)
+        self.assertIsInstance(self.frozen["a"]["b"], tuple)
+        self.assertIsInstance(self.frozen["a"]["b"][1], ImmutableDict)
+        self.assertIs(self.frozen["a"], self.frozen["a"])
+
+        for value in (
+            self.frozen.get("a"),
+            dict(self.frozen)["a"],
+            dict(self.frozen.items())["a"],
+            list(self.frozen.values())[0],
+            self.frozen.copy()["a"],
+        ):
+            self.assertIsInstance(value, ImmutableDict)
+
+        # The frozen values are the same as `freeze` would give.
+        self.assertEqual(self.frozen, freeze(self.raw))
+        self.assertEqual(unfreeze(self.frozen), self.raw)
+
+    def test_immutable(self):
+        for mutate in (
+            lambda: self.frozen.__setitem__("d", "f"),
+            lambda: self.frozen.__delitem__("d"),
+            lambda: self.frozen.pop("d"),
+            lambda: self.frozen.update({"d": "f"}),
+            lambda: self.frozen.setdefault("f", "g"),
+            lambda: self.frozen.clear(),
+            lambda: self.frozen["a"].__setitem__("b", []),
+        ):
+            with self.assertRaises(TypeError):
+                mutate()
+
+        # The original isn't touched.
+        self.assertEqual(self.raw, {"a": {"b": [1, {"c": 2}]}, "d": "e"})
+
+    def test_serialize(self):
+        # Look up a nested value first, so that a mix of frozen and unfrozen
+        # values get serialized.
+        self.frozen["a"]
+
+        self.assertEqual(
+            json_encoder.encode(self.frozen), json_encoder.encode(self.raw)
+        )
+        self.assertEqual(
+            encode_canonical_json(self.frozen), encode_canonical_json(self.raw)
+        )
+        self.assertEqual(pickle.loads(pickle.dumps(self.frozen)), self.frozen)
+
+    def test_hash(self):
+        self.assertEqual(hash(self.frozen), hash(ImmutableDict(self.raw)))
+        self.assertIn(ImmutableDict(self.raw), {self.frozen})
@@ -16,7 +16,14 @@
 
 from mock import Mock
 
-from synapse.util.caches.lrucache import LruCache
+from synapse.config import cache as cache_config
+from synapse.util.caches import EvictionReason, register_cache
+from synapse.util.caches.lrucache import (
+    GLOBAL_MEMORY_BUDGET,
+    LruCache,
+    _get_size_of,
+    expire_lru_cache_entries,
+)
 from synapse.util.caches.treecache import TreeCache
 
 from .. import unittest
@@ -255,3 +262,166 @@ class LruCacheSizedTestCase(unittest.HomeserverTestCase):
         self.assertEquals(cache["key3"], [3])
         self.assertEquals(cache["key4"], [4])
         self.assertEquals(cache["key5"], [5, 6])
+
+
+class LruCacheMemoryTestCase(unittest.TestCase):
+    def setUp(self):
+        cache_config.properties.max_cache_memory_usage = 10 * 1024 * 1024
+
+    def tearDown(self):
+        cache_config.properties.max_cache_memory_usage = None
+
+    def _make_cache(self, name, max_size=100, **kwargs):
+        cache = LruCache(max_size, **kwargs)
+        register_cache("cache", name, cache, resizable=False)
+        self.addCleanup(cache.clear)
+        return cache
+
+    def test_get_size_of(self):
+        small = _get_size_of({"a": "b"})
+        large = _get_size_of({str(i): str(i) * 100 for i in range(100)})
+        self.assertGreater(large, 100 * 100)
+        self.assertGreater(large, small)
+
+        # Objects referenced more than once are only counted once.
+        value = "x" * 1000
+        self.assertLess(_get_size_of([value, value]), 2 * len(value))
+
+    def test_memory_usage(self):
+        cache = self._make_cache("test_memory_usage")
+
+        cache["key1"] = "x" * 1000
+        usage = cache.memory_usage()
+        self.assertGreater(usage, 1000)
+
+        # Replacing a value updates the size of the entry.
+        cache["key1"] = "x" * 2000
+        self.assertGreater(cache.memory_usage(), usage + 900)
+
+        cache["key2"] = "y" * 1000
+        cache.pop("key1")
+        self.assertGreater(cache.memory_usage(), 1000)
+        self.assertLess(cache.memory_usage(), 2000)
+
+        cache.clear()
+        self.assertEquals(cache.memory_usage(), 0)
+
+    def test_unregistered_cache_is_not_tracked(self):
+        cache = LruCache(100)
+        cache["key"] = "x" * 1000
+        self.assertEquals(cache.memory_usage(), 0)
+
+    def test_evict_across_caches(self):
+        """Entries are evicted from whichever cache holds the least recently
+        used entries once the global budget is exceeded.
+        """
+        cache_config.properties.max_cache_memory_usage = (
+            GLOBAL_MEMORY_BUDGET.memory_usage + 10000
+        )
+        m = Mock()
+        cache1 = self._make_cache("test_evict_1", evicted_callback=m)
+        cache2 = self._make_cache("test_evict_2")
+
+        cache1["key1"] = "x" * 4000
+        cache2["key1"] = "y" * 4000
+
+        # Touch the entry in the first cache, so that the second cache holds
+        # the least recently used entry.
+        self.assertIsNotNone(cache1.get("key1"))
+
+        cache1["key2"] = "z" * 4000
+
+        self.assertIsNone(cache2.get("key1"))
+        self.assertIsNotNone(cache1.get("key1"))
+        self.assertIsNotNone(cache1.get("key2"))
+        self.assertEquals(cache2.memory_usage(), 0)
+        m.assert_not_called()
+
+        # Adding more to the second cache pushes out the first cache's least
+        # recently used entry.
+        cache2["key2"] = "w" * 4000
+        self.assertIsNone(cache1.get("key1"))
+        self.assertIsNotNone(cache1.get("key2"))
+        self.assertIsNotNone(cache2.get("key2"))
+        m.assert_called_once_with(1, EvictionReason.memory)
+
+    def test_evict_clears_callbacks(self):
+        cache_config.properties.max_cache_memory_usage = (
+            GLOBAL_MEMORY_BUDGET.memory_usage + 5000
+        )
+        cache = self._make_cache("test_evict_callbacks")
+
+        m = Mock()
+        cache.set("key1", "x" * 4000, callbacks=[m])
+        cache.set("key2", "y" * 4000)
+
+        self.assertIsNone(cache.get("key1"))
+        self.assertEquals(m.call_count, 1)
+
+
+class LruCacheExpiryTestCase(unittest.HomeserverTestCase):
+    def tearDown(self):
+        cache_config.properties.expiry_time_msec = None
+
+    def test_expire_old_entries(self):
+        m = Mock()
+        cache = LruCache(
+            100, expiry_time_ms=60 * 1000, clock=self.clock, evicted_callback=m
+        )
+
+        cache["key1"] = 1
+        cache["key2"] = 2
+        self.reactor.advance(50)
+
+        # Accessing an entry resets its age.
+        self.assertEquals(cache.get("key1"), 1)
+        self.reactor.advance(20)
+
+        self.assertEquals(cache.expire_old_entries(10), (1, True))
+        self.assertEquals(cache.get("key2"), None)
+        self.assertEquals(cache.get("key1"), 1)
+        m.assert_called_once_with(1, EvictionReason.time)
+
+        self.reactor.advance(61)
+        self.assertEquals(cache.expire_old_entries(10), (1, True))
+        self.assertEquals(len(cache), 0)
+
+    def test_expire_in_batches(self):
+        cache = LruCache(100, expiry_time_ms=1000, clock=self.clock)
+        for i in range(5):
+            cache[i] = i
+
+        self.reactor.advance(2)
+
+        self.assertEquals(cache.expire_old_entries(2), (2, False))
+        self.assertEquals(cache.expire_old_entries(2), (2, False))
+        self.assertEquals(cache.expire_old_entries(2), (1, True))
+        self.assertEquals(len(cache), 0)
+
+    def test_global_expiry_time(self):
+        """Caches without their own expiry time use the one from the config.
+        """
+        cache = LruCache(100, clock=self.clock)
+        cache["key"] = 1
+        self.reactor.advance(120)
+
+        self.assertEquals(cache.expire_old_entries(10), (0, True))
+        self.assertEquals(cache.get("key"), 1)
+
+        cache_config.properties.expiry_time_msec = 60 * 1000
+        self.reactor.advance(120)
+        self.assertEquals(cache.expire_old_entries(10), (1, True))
+        self.assertEquals(cache.get("key"), None)
+
+    def test_sweep(self):
+        cache1 = LruCache(1000, expiry_time_ms=1000, clock=self.clock)
+        cache2 = LruCache(1000, expiry_time_ms=5000, clock=self.clock)
+        for i in range(250):
+            cache1[i] = i
+            cache2[i] = i
+
+        self.reactor.advance(2)
+        self.get_success(expire_lru_cache_entries(self.clock))
+
+        self.assertEquals(len(cache1), 0)
+        self.assertEquals(len(cache2), 250)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from synapse.util.caches.membership_change_cache import MembershipChangeCache
+
+from tests import unittest
+
+
+class MembershipChangeCacheTestCase(unittest.TestCase):
+    def test_unknown_user(self):
+        cache = MembershipChangeCache("test")
+        cache.membership_has_changed("@user:test", 5, "$5")
+        self.assertIsNone(cache.get_changes("@user:test", 1, 10))
+
+    def test_fill(self):
+        cache = MembershipChangeCache("test")
+
+        fill = cache.start_fill("@user:test", 2)
+        cache.finish_fill("@user:test", fill, [(3, "$3"), (5, "$5")])
+
+        self.assertEqual(cache.get_changes("@user:test", 2, 10), [(3, "$3"), (5, "$5")])
+        self.assertEqual(cache.get_changes("@user:test", 3, 5), [(5, "$5")])
+        self.assertEqual(cache.get_changes("@user:test", 2, 4), [(3, "$3")])
+
+        # We don't know about changes before the fill.
+        self.assertIsNone(cache.get_changes("@user:test", 1, 10))
+
+        # New changes are added to the entry.
+        cache.membership_has_changed("@user:test", 7, "$7")
+        self.assertEqual(cache.get_changes("@user:test", 5, 10), [(7, "$7")])
+
+    def test_change_during_fill(self):
+        """Changes while the database is being queried are not lost."""
+        cache = MembershipChangeCache("test")
+
+        fill = cache.start_fill("@user:test", 2)
+        cache.membership_has_changed("@user:test", 4, "$4")
+        cache.finish_fill("@user:test", fill, [(3, "$3")])
+
+        self.assertEqual(cache.get_changes("@user:test", 2, 10), [(3, "$3"), (4, "$4")])
+
+    def test_abort_fill(self):
+        cache = MembershipChangeCache("test")
+
+        fill = cache.start_fill("@user:test", 2)
+        cache.abort_fill("@user:test", fill)
+        cache.membership_has_changed("@user:test", 4, "$4")
+
+        self.assertIsNone(cache.get_changes("@user:test", 2, 10))
+
+    def test_earlier_fill(self):
+        """A fill from an earlier position extends the existing entry."""
+        cache = MembershipChangeCache("test")
+
+        fill = cache.start_fill("@user:test", 5)
+        cache.finish_fill("@user:test", fill, [(6, "$6")])
+
+        fill = cache.start_fill("@user:test", 1)
+        cache.membership_has_changed("@user:test", 8, "$8")
+        cache.finish_fill("@user:test", fill, [(3, "$3")])
+
+        self.assertEqual(
+            cache.get_changes("@user:test", 1, 10), [(3, "$3"), (6, "$6"), (8, "$8")]
+        )
+
+    def test_trim(self):
+        """Only the most recent changes of a user are kept."""
+        cache = MembershipChangeCache("test", max_changes_per_user=2)
+
+        fill = cache.start_fill("@user:test", 1)
+        cache.finish_fill("@user:test", fill, [(2, "$2"), (3, "$3"), (4, "$4")])
+
+        self.assertIsNone(cache.get_changes("@user:test", 1, 10))
+        self.assertEqual(cache.get_changes("@user:test", 2, 10), [(3, "$3"), (4, "$4")])
+
+        cache.membership_has_changed("@user:test", 5, "$5")
+        self.assertIsNone(cache.get_changes("@user:test", 2, 10))
+        self.assertEqual(cache.get_changes("@user:test", 3, 10), [(4, "$4"), (5, "$5")])